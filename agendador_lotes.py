@@ -0,0 +1,189 @@
+"""
+Agendador de Micro-Lotes - Classificação de Grãos
+
+Agrupa requisições de inferência que chegam dentro de uma janela curta
+(ou até atingir o tamanho máximo de lote) e classifica todas em UMA
+chamada vetorizada (prever_lote). Cada requisição recebe seu resultado
+de volta por um Future, sem mudar a API de /esp32/result.
+
+Uma única thread de trabalho executa o modelo, então as requisições
+concorrentes não disputam o GIL com chamadas pequenas e repetidas.
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+FAIXAS_TAMANHO_LOTE = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class AgendadorInferencia:
+    """
+    Fila de inferência com janela de agrupamento
+
+    funcao_lote: recebe lista de N espectros e retorna lista de N resultados
+    janela_ms:   tempo máximo que a primeira requisição espera por companhia
+    max_lote:    tamanho máximo do lote (dispara antes da janela)
+    observar_espera: função opcional chamada com a espera na fila (s) de
+                 cada requisição (ex.: histograma de /metrics)
+    """
+
+    def __init__(self, funcao_lote, janela_ms=5, max_lote=32, amostras_espera=1000, observar_espera=None):
+        self.funcao_lote = funcao_lote
+        self.janela = janela_ms / 1000.0
+        self.max_lote = max_lote
+        self.observar_espera = observar_espera
+
+        self._fila = queue.Queue()
+        self._thread_pid = None
+        self._thread_lock = threading.Lock()
+
+        # Contadores
+        self._stats_lock = threading.Lock()
+        self.lotes = 0
+        self.amostras = 0
+        self.falhas_lote = 0
+        self.tamanhos = {faixa: 0 for faixa in FAIXAS_TAMANHO_LOTE}
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self._esperas = deque(maxlen=amostras_espera)
+
+    # ---------------- API ----------------
+
+    def submeter(self, espectro):
+        """Enfileira um espectro (18 bandas) e retorna Future com o resultado"""
+        self._garantir_thread()
+        futuro = Future()
+        self._fila.put((espectro, futuro, time.perf_counter()))
+        return futuro
+
+    def classificar(self, espectro, timeout=30):
+        """Atalho síncrono: submete e aguarda o resultado"""
+        return self.submeter(espectro).result(timeout=timeout)
+
+    def estatisticas(self):
+        """Contadores de tamanho de lote e tempo de espera na fila"""
+        with self._stats_lock:
+            esperas = sorted(self._esperas)
+            lotes = self.lotes
+
+            def percentil(p):
+                if not esperas:
+                    return 0.0
+                return esperas[min(len(esperas) - 1, int(p * len(esperas)))]
+
+            return {
+                'janela_ms': self.janela * 1000,
+                'max_lote': self.max_lote,
+                'lotes': lotes,
+                'amostras': self.amostras,
+                'falhas_lote': self.falhas_lote,
+                'tamanho_medio_lote': round(self.amostras / lotes, 2) if lotes else 0,
+                'distribuicao_tamanho_lote': {f'<={k}': v for k, v in self.tamanhos.items()},
+                'fila_atual': self._fila.qsize(),
+                'espera_fila_ms': {
+                    'media': round(self.espera_total / self.amostras * 1000, 3) if self.amostras else 0,
+                    'p50': round(percentil(0.50) * 1000, 3),
+                    'p99': round(percentil(0.99) * 1000, 3),
+                    'max': round(self.espera_max * 1000, 3),
+                },
+            }
+
+    # ---------------- Trabalho ----------------
+
+    def _garantir_thread(self):
+        # Uma thread por processo: após fork (workers) a do pai não existe
+        if self._thread_pid == os.getpid():
+            return
+        with self._thread_lock:
+            if self._thread_pid != os.getpid():
+                self._fila = queue.Queue()
+                threading.Thread(target=self._loop, name='agendador-inferencia', daemon=True).start()
+                self._thread_pid = os.getpid()
+
+    def _loop(self):
+        while True:
+            primeiro = self._fila.get()
+            lote = [primeiro]
+            prazo = primeiro[2] + self.janela
+
+            while len(lote) < self.max_lote:
+                restante = prazo - time.perf_counter()
+                try:
+                    if restante <= 0:
+                        lote.append(self._fila.get_nowait())
+                    else:
+                        lote.append(self._fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+
+            try:
+                self._executar(lote)
+            except Exception as e:
+                # Nada pode matar a thread: as requisições seguintes
+                # ficariam presas até o timeout do Future
+                logger.error("❌ Erro no agendador com lote de %d: %s", len(lote), e, exc_info=True)
+                self._falhar(lote, e)
+
+    def _executar(self, lote):
+        inicio = time.perf_counter()
+        try:
+            self._registrar(lote, inicio)
+        except Exception as e:
+            # Contadores/métrica de espera não impedem a classificação
+            logger.warning("⚠️ Falha ao registrar lote de %d: %s", len(lote), e)
+
+        espectros = [item[0] for item in lote]
+        try:
+            resultados = self.funcao_lote(espectros)
+            if len(resultados) != len(lote):
+                raise RuntimeError(f"funcao_lote retornou {len(resultados)} resultados para {len(lote)} espectros")
+        except Exception as e:
+            # Um espectro inválido não deve derrubar o lote inteiro:
+            # reprocessa individualmente para isolar o erro
+            logger.warning("⚠️ Falha no lote de %s (%s); reprocessando individualmente", len(lote), e)
+            with self._stats_lock:
+                self.falhas_lote += 1
+            for espectro, futuro, _ in lote:
+                try:
+                    futuro.set_result(self.funcao_lote([espectro])[0])
+                except Exception as erro:
+                    futuro.set_exception(erro)
+            return
+
+        for (_, futuro, _), resultado in zip(lote, resultados):
+            futuro.set_result(resultado)
+
+    @staticmethod
+    def _falhar(lote, erro):
+        """Conclui com erro os Futures do lote que ainda não têm resultado"""
+        for _, futuro, _ in lote:
+            if not futuro.done():
+                futuro.set_exception(erro)
+
+    def _registrar(self, lote, inicio):
+        if self.observar_espera is not None:
+            for _, _, t0 in lote:
+                self.observar_espera(inicio - t0)
+        with self._stats_lock:
+            self.lotes += 1
+            self.amostras += len(lote)
+            for faixa in FAIXAS_TAMANHO_LOTE:
+                if len(lote) <= faixa:
+                    self.tamanhos[faixa] += 1
+                    break
+            else:
+                self.tamanhos[FAIXAS_TAMANHO_LOTE[-1]] += 1
+            for _, _, t0 in lote:
+                espera = inicio - t0
+                self.espera_total += espera
+                self.espera_max = max(self.espera_max, espera)
+                self._esperas.append(espera)
@@ -0,0 +1,270 @@
+"""
+Armazenamento Persistente de Análises - Classificação de Grãos
+
+Histórico em SQLite (modo WAL), substituindo o deque de 100 entradas:
+
+- Sobrevive a reinícios e guarda meses de análises
+- Índices por timestamp, device_id, espécie e status
+- Escrita em lote numa thread própria: a requisição só enfileira
+- Leituras concorrentes (WAL) com paginação por cursor (id decrescente)
+- Total de análises mantido por gatilhos (sem COUNT(*) a cada /status)
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS analises (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    device_id TEXT,
+    especie TEXT,
+    status TEXT,
+    confianca REAL,
+    dados TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_analises_timestamp ON analises (timestamp);
+CREATE INDEX IF NOT EXISTS idx_analises_device ON analises (device_id, id);
+CREATE INDEX IF NOT EXISTS idx_analises_especie ON analises (especie, id);
+CREATE INDEX IF NOT EXISTS idx_analises_status ON analises (status, id);
+CREATE TABLE IF NOT EXISTS contagem_analises (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total INTEGER NOT NULL
+);
+"""
+
+# Total corrente: atualizado na mesma transação do INSERT do escritor e do
+# DELETE da retenção, válido para todos os processos que usam o arquivo
+GATILHOS_CONTAGEM = (
+    """CREATE TRIGGER IF NOT EXISTS analises_inseridas AFTER INSERT ON analises
+       BEGIN UPDATE contagem_analises SET total = total + 1 WHERE id = 1; END""",
+    """CREATE TRIGGER IF NOT EXISTS analises_removidas AFTER DELETE ON analises
+       BEGIN UPDATE contagem_analises SET total = total - 1 WHERE id = 1; END""",
+)
+
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 1000
+
+
+class ArmazenamentoAnalises:
+    """
+    Histórico persistente de análises
+
+    caminho:       arquivo SQLite
+    max_lote:      máximo de análises por transação
+    intervalo_ms:  tempo máximo que uma análise espera pelo commit
+    """
+
+    def __init__(self, caminho, max_lote=500, intervalo_ms=50):
+        self.caminho = caminho
+        self.max_lote = max_lote
+        self.intervalo = intervalo_ms / 1000.0
+
+        self._fila = queue.Queue()
+        self._local = threading.local()
+        self._pid = None
+        self._pid_lock = threading.Lock()
+        self.gravadas = 0
+        self.commits = 0
+
+        conn = self._conexao()
+        conn.executescript(ESQUEMA)
+        self._iniciar_contagem(conn)
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _iniciar_contagem(conn):
+        """
+        Semeia o total com um único COUNT(*) (banco novo ou anterior aos
+        gatilhos) e cria os gatilhos na mesma transação: nenhuma gravação
+        de outro processo fica de fora ou é contada duas vezes
+        """
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM contagem_analises WHERE id = 1').fetchone() is None:
+                conn.execute('INSERT INTO contagem_analises (id, total) SELECT 1, COUNT(*) FROM analises')
+            for gatilho in GATILHOS_CONTAGEM:
+                conn.execute(gatilho)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _garantir_processo(self):
+        """
+        Fila e thread de escrita próprias do processo atual. Threads não
+        sobrevivem a fork: cada worker inicia a sua no primeiro uso.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._pid_lock:
+            if self._pid != os.getpid():
+                self._fila = queue.Queue()
+                threading.Thread(target=self._loop_escrita, name='armazenamento', daemon=True).start()
+                self._pid = os.getpid()
+
+    # ---------------- Conexões ----------------
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.caminho, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _conexao(self):
+        """Uma conexão por thread e por processo (leituras concorrentes no WAL)"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.conn = self._conectar()
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    # ---------------- Escrita ----------------
+
+    def adicionar(self, resultado):
+        """Enfileira uma análise para gravação (não bloqueia)"""
+        self._garantir_processo()
+        self._fila.put(resultado)
+
+    def adicionar_varios(self, resultados):
+        self._garantir_processo()
+        for resultado in resultados:
+            self._fila.put(resultado)
+
+    def flush(self, timeout=5.0):
+        """Aguarda a gravação de tudo que já foi enfileirado"""
+        if self._pid != os.getpid():
+            return
+        limite = time.monotonic() + timeout
+        while self._fila.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.005)
+
+    def _loop_escrita(self):
+        conn = self._conectar()
+        while True:
+            lote = [self._fila.get()]
+            prazo = time.monotonic() + self.intervalo
+            while len(lote) < self.max_lote:
+                restante = prazo - time.monotonic()
+                try:
+                    lote.append(self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                linhas = [
+                    (r.get('timestamp'), r.get('device_id'), r.get('especie'), r.get('status'),
+                     r.get('confianca'), json.dumps(r, ensure_ascii=False, default=str))
+                    for r in lote
+                ]
+                with conn:
+                    conn.executemany(
+                        'INSERT INTO analises (timestamp, device_id, especie, status, confianca, dados) '
+                        'VALUES (?, ?, ?, ?, ?, ?)', linhas)
+                self.gravadas += len(lote)
+                self.commits += 1
+            except Exception as e:
+                logger.error("❌ Erro ao gravar %s análises: %s", len(lote), e)
+            finally:
+                for _ in lote:
+                    self._fila.task_done()
+
+    # ---------------- Leitura ----------------
+
+    @staticmethod
+    def _filtros(device_id=None, especie=None, status=None, desde=None, ate=None, cursor=None):
+        condicoes, parametros = [], []
+        for coluna, valor in (('device_id', device_id), ('especie', especie), ('status', status)):
+            if valor:
+                condicoes.append(f'{coluna} = ?')
+                parametros.append(valor)
+        if desde:
+            condicoes.append('timestamp >= ?')
+            parametros.append(desde)
+        if ate:
+            condicoes.append('timestamp <= ?')
+            parametros.append(ate)
+        if cursor:
+            condicoes.append('id < ?')
+            parametros.append(int(cursor))
+        where = ('WHERE ' + ' AND '.join(condicoes)) if condicoes else ''
+        return where, parametros
+
+    def consultar(self, limite=LIMITE_PADRAO, **filtros):
+        """
+        Análises mais recentes primeiro, com filtros opcionais
+        (device_id, especie, status, desde, ate) e paginação por cursor.
+
+        Retorna (analises, proximo_cursor); proximo_cursor é None na última página.
+        """
+        limite = max(1, min(int(limite), LIMITE_MAXIMO))
+        where, parametros = self._filtros(**filtros)
+        linhas = self._conexao().execute(
+            f'SELECT id, dados FROM analises {where} ORDER BY id DESC LIMIT ?',
+            parametros + [limite + 1]
+        ).fetchall()
+
+        proximo = linhas[limite - 1][0] if len(linhas) > limite else None
+        return [json.loads(dados) for _, dados in linhas[:limite]], proximo
+
+    def ultimo_id(self):
+        """Maior id gravado (0 se vazio); marca um snapshot do histórico"""
+        return self._conexao().execute('SELECT COALESCE(MAX(id), 0) FROM analises').fetchone()[0]
+
+    def iterar(self, tamanho_bloco=1000, ate_id=None, **filtros):
+        """
+        Percorre as análises (mais antigas primeiro) em blocos, sem carregar tudo.
+
+        ate_id limita a leitura a um snapshot: análises gravadas depois do
+        início da exportação não entram, mesmo que a leitura demore.
+        """
+        where, parametros = self._filtros(**filtros)
+        conn = self._conexao()
+        ultimo_id = 0
+        while True:
+            cond = f'{where} AND id > ?' if where else 'WHERE id > ?'
+            params = parametros + [ultimo_id]
+            if ate_id is not None:
+                cond += ' AND id <= ?'
+                params.append(ate_id)
+            linhas = conn.execute(
+                f'SELECT id, dados FROM analises {cond} ORDER BY id LIMIT ?',
+                params + [tamanho_bloco]
+            ).fetchall()
+            if not linhas:
+                return
+            for _, dados in linhas:
+                yield json.loads(dados)
+            ultimo_id = linhas[-1][0]
+
+    def contar(self):
+        """Total de análises gravadas (lido da contagem mantida pelos gatilhos)"""
+        return self._conexao().execute('SELECT total FROM contagem_analises WHERE id = 1').fetchone()[0]
+
+    def remover_antigos(self, dias):
+        """Remove análises mais antigas que a retenção configurada"""
+        limite = (datetime.now() - timedelta(days=dias)).isoformat()
+        conn = self._conexao()
+        with conn:
+            removidas = conn.execute('DELETE FROM analises WHERE timestamp < ?', (limite,)).rowcount
+        return removidas
+
+    def estatisticas(self):
+        return {
+            'arquivo': self.caminho,
+            'analises': self.contar(),
+            'pendentes': self._fila.qsize(),
+            'gravadas_sessao': self.gravadas,
+            'commits_sessao': self.commits,
+        }
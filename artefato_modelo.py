@@ -0,0 +1,193 @@
+"""
+Artefato Compilado do Modelo - Classificação de Grãos
+
+Converte o modelo_completo_sem_485nm.pkl (objetos sklearn, joblib) num
+arquivo binário de arrays NumPy que o servidor carrega sem importar
+sklearn, pandas ou joblib, e que não depende da versão do sklearn.
+
+Formato (versão 1):
+- 8 bytes mágicos 'GRAOMOD\\0' + uint32 (little-endian) com o tamanho do cabeçalho
+- cabeçalho JSON: versão do formato, SHA-256 do payload, origem (.pkl,
+  versão do sklearn, data), metadados (classes, colunas...) e a tabela
+  de arrays (dtype, forma, deslocamento)
+- payload: arrays brutos alinhados em 64 bytes, lidos via mmap
+
+Uso (compilar):
+python artefato_modelo.py [modelo.pkl] [saida.bin]
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from datetime import datetime
+
+import numpy as np
+
+MAGICO = b'GRAOMOD\x00'
+VERSAO_FORMATO = 1
+ALINHAMENTO = 64
+ARTEFATO_PADRAO = 'modelo_compilado_sem_485nm.bin'
+MODELO_PKL_PADRAO = 'modelo_completo_sem_485nm.pkl'
+
+
+def _alinhar(n):
+    return (n + ALINHAMENTO - 1) // ALINHAMENTO * ALINHAMENTO
+
+
+def sha256_arquivo(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+# ==================== ESCRITA ====================
+
+def salvar_artefato(caminho, parametros, origem=None):
+    """
+    Grava os parâmetros compilados (compilar_parametros) no formato binário.
+    A escrita é atômica (arquivo temporário + rename).
+    """
+    arrays, metadados = {}, {}
+    for nome, valor in parametros.items():
+        if isinstance(valor, np.ndarray):
+            arrays[nome] = np.ascontiguousarray(valor)
+        else:
+            metadados[nome] = valor
+
+    tabela, partes, posicao = {}, [], 0
+    for nome, array in arrays.items():
+        inicio = _alinhar(posicao)
+        partes.append(b'\x00' * (inicio - posicao))
+        partes.append(array.tobytes())
+        tabela[nome] = {'dtype': array.dtype.str, 'forma': list(array.shape), 'deslocamento': inicio}
+        posicao = inicio + array.nbytes
+    payload = b''.join(partes)
+
+    cabecalho = json.dumps({
+        'versao_formato': VERSAO_FORMATO,
+        'sha256': hashlib.sha256(payload).hexdigest(),
+        'origem': origem or {},
+        'metadados': metadados,
+        'arrays': tabela,
+    }, ensure_ascii=False).encode('utf-8')
+
+    prefixo = MAGICO + struct.pack('<I', len(cabecalho)) + cabecalho
+    prefixo += b'\x00' * (_alinhar(len(prefixo)) - len(prefixo))
+
+    temporario = caminho + '.tmp'
+    with open(temporario, 'wb') as f:
+        f.write(prefixo)
+        f.write(payload)
+    os.replace(temporario, caminho)
+    return len(prefixo) + len(payload)
+
+
+# ==================== LEITURA ====================
+
+def ler_cabecalho(caminho):
+    """Lê e valida só o cabeçalho (sem mapear os arrays)"""
+    with open(caminho, 'rb') as f:
+        cabecalho, _ = _ler_cabecalho(f.read(len(MAGICO) + 4), f)
+    return cabecalho
+
+
+def _ler_cabecalho(inicio, f):
+    if len(inicio) < len(MAGICO) + 4 or inicio[:len(MAGICO)] != MAGICO:
+        raise ValueError("Arquivo não é um artefato de modelo compilado")
+    tamanho = struct.unpack('<I', inicio[len(MAGICO):])[0]
+    cabecalho = json.loads(f.read(tamanho).decode('utf-8'))
+    if cabecalho.get('versao_formato') != VERSAO_FORMATO:
+        raise ValueError(f"Versão de artefato não suportada: {cabecalho.get('versao_formato')} "
+                         f"(esperado {VERSAO_FORMATO})")
+    return cabecalho, _alinhar(len(MAGICO) + 4 + tamanho)
+
+
+def carregar_artefato(caminho, verificar=True):
+    """
+    Mapeia o artefato em memória e retorna (parametros, cabecalho).
+
+    Os arrays são visões somente-leitura sobre o mmap (sem cópia).
+    verificar=True confere o SHA-256 do payload antes de usar.
+    """
+    with open(caminho, 'rb') as f:
+        cabecalho, inicio_payload = _ler_cabecalho(f.read(len(MAGICO) + 4), f)
+        mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if verificar:
+        with memoryview(mapa) as visao:
+            digest = hashlib.sha256(visao[inicio_payload:]).hexdigest()
+        if digest != cabecalho['sha256']:
+            raise ValueError(f"Checksum inválido no artefato {caminho}")
+
+    parametros = dict(cabecalho['metadados'])
+    for nome, info in cabecalho['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        forma = tuple(info['forma'])
+        parametros[nome] = np.frombuffer(
+            mapa, dtype=dtype, count=int(np.prod(forma)),
+            offset=inicio_payload + info['deslocamento']
+        ).reshape(forma)
+    return parametros, cabecalho
+
+
+# ==================== COMPILAÇÃO ====================
+
+def compilar(caminho_pkl=MODELO_PKL_PADRAO, caminho_saida=ARTEFATO_PADRAO):
+    """Carrega o .pkl (requer sklearn/joblib) e grava o artefato compilado"""
+    import joblib
+    import sklearn
+    from motor_inferencia import compilar_parametros
+
+    modelos = joblib.load(caminho_pkl)
+    origem = {
+        'arquivo_pkl': os.path.basename(caminho_pkl),
+        'sha256_pkl': sha256_arquivo(caminho_pkl),
+        'versao_sklearn': sklearn.__version__,
+        'compilado_em': datetime.now().isoformat(),
+    }
+    tamanho = salvar_artefato(caminho_saida, compilar_parametros(modelos), origem)
+    return modelos, tamanho
+
+
+def main():
+    import argparse
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description='Compila o modelo .pkl num artefato de arrays NumPy '
+                                                 'e confere a paridade com o sklearn')
+    parser.add_argument('caminho_pkl', nargs='?', default=MODELO_PKL_PADRAO, help='modelo de entrada (.pkl)')
+    parser.add_argument('caminho_saida', nargs='?', default=ARTEFATO_PADRAO, help='artefato de saída (.bin)')
+    args = parser.parse_args()
+    caminho_pkl, caminho_saida = args.caminho_pkl, args.caminho_saida
+
+    print(f"📦 Compilando {caminho_pkl} -> {caminho_saida}")
+    modelos, tamanho = compilar(caminho_pkl, caminho_saida)
+    print(f"✅ Artefato gravado: {tamanho} bytes")
+
+    inicio = time.perf_counter()
+    parametros, cabecalho = carregar_artefato(caminho_saida)
+    print(f"⏱️ Carga do artefato (com checksum): {(time.perf_counter() - inicio) * 1000:.2f} ms")
+
+    # Paridade: motor carregado do artefato vs caminho sklearn original
+    from motor_inferencia import MotorInferencia, verificar_paridade
+
+    rng = np.random.default_rng(0)
+    X = np.abs(rng.normal(1.0, 0.3, size=(500, len(parametros['bandas_cols']))))
+    resultado = verificar_paridade(modelos, X, motor=MotorInferencia(parametros))
+    for chave, valor in resultado.items():
+        print(f"   {chave}: {valor}")
+    ok = (resultado['especie_igual'] == 1.0 and resultado['max_diff_prob'] < 1e-9
+          and resultado['max_diff_svm_score'] < 1e-12)
+    print("✅ Paridade OK" if ok else "❌ Paridade FALHOU")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+"""
+Benchmark do Servidor de Inferência - Classificação de Grãos
+
+Reproduz a tabela de coleta (48 espectros de 18 bandas) e perturbações
+sintéticas dela (ruído multiplicativo com semente fixa) por:
+
+- motor_amostra:           prever_amostra(), uma amostra por chamada
+- motor_lote:              prever_lote() em lotes de --lote amostras
+- http_result:             POST /esp32/result sequencial (sem micro-lote)
+- http_result_binario:     idem, com o corpo binário de formato_espectro.py
+- http_result_micro_lote:  POST /esp32/result com --threads clientes
+                           concorrentes e micro-lotes ativos
+- http_result_batch:       POST /esp32/result_batch com --lote amostras
+
+Para cada cenário: vazão (amostras/s), latência p50/p95/p99 por chamada,
+pico de alocação (tracemalloc, numa passada separada) e pico de RSS.
+Cada cenário roda --rodadas vezes, em rodadas intercaladas entre os
+cenários, e as métricas de tempo são a mediana das rodadas (uma rodada
+isolada varia dezenas de %). O resultado é
+gravado em JSON; com --base, compara com uma execução anterior e termina
+com código 1 se alguma métrica piorar além de --limite na mediana e na
+melhor rodada.
+
+Uso:
+python benchmark.py --saida atual.json
+python benchmark.py --saida nova.json --base atual.json --limite 0.15
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from formato_espectro import codificar_espectro, TIPO_ESPECTRO_BINARIO
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+ARQUIVO_DADOS = os.path.join(DIRETORIO, 'tabela_coleta_dados_espectrais_4_amostras.csv')
+COLUNAS_BANDAS = [f'band_{nm}' for nm in (410, 435, 460, 485, 510, 535, 560, 585, 610,
+                                          645, 680, 705, 730, 760, 810, 860, 900, 940)]
+
+# Métricas comparadas com --base: (chave, maior é melhor)
+METRICAS_REGRESSAO = (('vazao_amostras_s', True), ('p50_ms', False), ('p95_ms', False))
+
+# Métricas de tempo agregadas pela mediana das rodadas
+METRICAS_RODADAS = ('vazao_amostras_s', 'p50_ms', 'p95_ms', 'p99_ms', 'media_ms')
+
+SEMENTE = 0
+
+
+# ==================== DADOS ====================
+
+def carregar_espectros(caminho=ARQUIVO_DADOS, perturbacoes=20, ruido=0.02, semente=SEMENTE):
+    """
+    Espectros de 18 bandas da tabela de coleta + 'perturbacoes' cópias
+    de cada um com ruído multiplicativo N(1, ruido)
+    """
+    with open(caminho, newline='') as f:
+        base = np.array([[float(linha[c]) for c in COLUNAS_BANDAS] for linha in csv.DictReader(f)])
+    rng = np.random.default_rng(semente)
+    copias = [base * rng.normal(1.0, ruido, size=base.shape) for _ in range(perturbacoes)]
+    return np.vstack([base] + copias)
+
+
+# ==================== MEDIÇÃO ====================
+
+def pico_rss_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB; macOS em bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentis(latencias):
+    ms = np.asarray(latencias) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(ms, 99)), 4),
+        'media_ms': round(float(ms.mean()), 4),
+    }
+
+
+def medir_alocacao(operacao, chamadas):
+    """Pico de memória alocada (tracemalloc) e memória retida após 'chamadas'"""
+    tracemalloc.start()
+    antes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    for i in range(chamadas):
+        operacao(i)
+    atual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'pico_alocacao_kb': round((pico - antes) / 1024, 1),
+        'retido_kb': round((atual - antes) / 1024, 1),
+    }
+
+
+def executar_cenario(operacao, chamadas, amostras_por_chamada, aquecimento, chamadas_alocacao):
+    """Executa operacao(i) 'chamadas' vezes, uma de cada vez"""
+    for i in range(aquecimento):
+        operacao(i)
+
+    latencias = []
+    inicio = time.perf_counter()
+    for i in range(chamadas):
+        t0 = time.perf_counter()
+        operacao(i)
+        latencias.append(time.perf_counter() - t0)
+    total = time.perf_counter() - inicio
+
+    resultado = {
+        'chamadas': chamadas,
+        'amostras_por_chamada': amostras_por_chamada,
+        'vazao_amostras_s': round(chamadas * amostras_por_chamada / total, 1),
+        **percentis(latencias),
+        'pico_rss_mb': pico_rss_mb(),
+    }
+    if chamadas_alocacao:
+        resultado.update(medir_alocacao(operacao, chamadas_alocacao))
+    return resultado
+
+
+def executar_concorrente(operacao, chamadas, threads, aquecimento):
+    """'threads' clientes dividindo 'chamadas' requisições"""
+    for i in range(aquecimento):
+        operacao(i)
+
+    latencias = [[] for _ in range(threads)]
+
+    def cliente(k):
+        for i in range(k, chamadas, threads):
+            t0 = time.perf_counter()
+            operacao(i)
+            latencias[k].append(time.perf_counter() - t0)
+
+    trabalhadores = [threading.Thread(target=cliente, args=(k,)) for k in range(threads)]
+    inicio = time.perf_counter()
+    for t in trabalhadores:
+        t.start()
+    for t in trabalhadores:
+        t.join()
+    total = time.perf_counter() - inicio
+
+    resultado = {
+        'chamadas': chamadas,
+        'amostras_por_chamada': 1,
+        'threads': threads,
+        'vazao_amostras_s': round(chamadas / total, 1),
+        **percentis([x for lista in latencias for x in lista]),
+        'pico_rss_mb': pico_rss_mb(),
+    }
+    return resultado
+
+
+def agregar_rodadas(nome, execucoes):
+    """
+    Junta as rodadas de um cenário: métricas de tempo pela mediana,
+    'dispersao' = intervalo interquartil / mediana de cada uma e 'rodadas_valores'
+    com os valores de cada rodada. Alocação e RSS vêm da primeira rodada.
+    """
+    resultado = dict(execucoes[0])
+    resultado['rodadas'] = len(execucoes)
+    resultado['dispersao'] = {}
+    resultado['rodadas_valores'] = {}
+    for chave in METRICAS_RODADAS:
+        valores = [execucao[chave] for execucao in execucoes]
+        mediana = float(np.median(valores))
+        resultado[chave] = round(mediana, 4)
+        q1, q3 = np.percentile(valores, [25, 75])
+        resultado['dispersao'][chave] = round(float(q3 - q1) / mediana, 4) if mediana else 0.0
+        resultado['rodadas_valores'][chave] = valores
+    print(f"   {nome}: {resultado['vazao_amostras_s']:.0f} amostras/s, "
+          f"p50={resultado['p50_ms']:.3f} ms, p99={resultado['p99_ms']:.3f} ms "
+          f"(mediana de {len(execucoes)}, dispersão da vazão {resultado['dispersao']['vazao_amostras_s']:.0%})")
+    return resultado
+
+
+# ==================== CENÁRIOS ====================
+
+def preparar_servidor(diretorio, cache=False):
+    """Importa o servidor com banco temporário e logs só em arquivo"""
+    os.environ['BANCO_ANALISES'] = os.path.join(diretorio, 'benchmark.db')
+    os.environ.pop('ESTADO_COMPARTILHADO', None)
+    os.environ['CACHE_RESULTADOS'] = '1' if cache else '0'
+
+    import servidor_flask
+    from log_estruturado import configurar_logging
+
+    # Modelo ao lado deste arquivo, qualquer que seja o diretório atual
+    servidor_flask.MODELO_PKL = os.path.join(DIRETORIO, servidor_flask.MODELO_PKL)
+    servidor_flask.MODELO_COMPILADO = os.path.join(DIRETORIO, servidor_flask.MODELO_COMPILADO)
+    configurar_logging(arquivo=os.path.join(diretorio, 'benchmark.log'), console=False)
+    servidor_flask.carregar_modelo()
+    return servidor_flask
+
+
+def rodar(args):
+    espectros = carregar_espectros(args.dados, args.perturbacoes)
+    n = len(espectros)
+    listas = espectros.tolist()
+    print(f"📊 {n} espectros ({args.perturbacoes} perturbações por linha da tabela)")
+
+    diretorio = tempfile.mkdtemp(prefix='benchmark_graos_')
+    servidor = preparar_servidor(diretorio, cache=args.cache)
+    cliente = servidor.app.test_client()
+    lote = args.lote
+    n_lotes = max(1, n // lote)
+
+    def amostra(i):
+        servidor.prever_amostra(listas[i % n])
+
+    def lote_motor(i):
+        j = (i % n_lotes) * lote
+        servidor.prever_lote(espectros[j:j + lote])
+
+    def post_result(i):
+        resposta = cliente.post('/esp32/result', json={'device_id': f'bench{i % 8}', 'spectrum': listas[i % n]})
+        if resposta.status_code != 200:
+            raise RuntimeError(f"/esp32/result respondeu {resposta.status_code}: {resposta.get_data(as_text=True)}")
+
+    corpos_binarios = [codificar_espectro(f'bench{i % 8}', s) for i, s in enumerate(espectros)]
+
+    def post_result_binario(i):
+        resposta = cliente.post('/esp32/result', data=corpos_binarios[i % n], content_type=TIPO_ESPECTRO_BINARIO)
+        if resposta.status_code != 200:
+            raise RuntimeError(f"/esp32/result (binário) respondeu {resposta.status_code}")
+
+    def post_batch(i):
+        j = (i % n_lotes) * lote
+        amostras = [{'device_id': 'bench', 'spectrum': s} for s in listas[j:j + lote]]
+        resposta = cliente.post('/esp32/result_batch', json={'amostras': amostras})
+        if resposta.status_code != 200:
+            raise RuntimeError(f"/esp32/result_batch respondeu {resposta.status_code}")
+
+    repeticoes = args.repeticoes
+    aquecimento = min(50, n)
+    alocacao = min(200, n)
+    medicoes = {}
+
+    def sequencial(nome, operacao, chamadas, amostras_por_chamada, aquecimento, chamadas_alocacao, micro_lote=False):
+        def medir(rodada):
+            servidor.MICRO_LOTE_ATIVO = micro_lote
+            # Alocação (tracemalloc) só na primeira rodada
+            return executar_cenario(operacao, chamadas, amostras_por_chamada, aquecimento,
+                                    chamadas_alocacao if rodada == 0 else 0)
+        medicoes[nome] = medir
+
+    def concorrente(nome, operacao, chamadas, threads, aquecimento):
+        def medir(rodada):
+            servidor.MICRO_LOTE_ATIVO = True
+            return executar_concorrente(operacao, chamadas, threads, aquecimento)
+        medicoes[nome] = medir
+
+    sequencial('motor_amostra', amostra, n * repeticoes, 1, aquecimento, alocacao)
+    sequencial('motor_lote', lote_motor, n_lotes * repeticoes, lote, min(5, n_lotes), min(20, n_lotes))
+    sequencial('http_result', post_result, n * repeticoes, 1, aquecimento, alocacao)
+    sequencial('http_result_binario', post_result_binario, n * repeticoes, 1, aquecimento, alocacao)
+    concorrente('http_result_micro_lote', post_result, n * repeticoes, args.threads, aquecimento)
+    sequencial('http_result_batch', post_batch, n_lotes * repeticoes, lote, min(5, n_lotes), min(20, n_lotes))
+
+    # Rodadas intercaladas entre os cenários: uma variação lenta da máquina
+    # (frequência, vizinhos) se espalha por todos em vez de cair num só
+    micro_lote_original = servidor.MICRO_LOTE_ATIVO
+    execucoes = {nome: [] for nome in medicoes}
+    for rodada in range(args.rodadas):
+        print(f"⏱️ Rodada {rodada + 1}/{args.rodadas}")
+        for nome, medir in medicoes.items():
+            execucoes[nome].append(medir(rodada))
+    servidor.MICRO_LOTE_ATIVO = micro_lote_original
+
+    print("⏱️ Cenários (mediana das rodadas):")
+    cenarios = {nome: agregar_rodadas(nome, lista) for nome, lista in execucoes.items()}
+
+    servidor.armazenamento.flush()
+    return {
+        'meta': metadados(args, servidor, n),
+        'cenarios': cenarios,
+    }
+
+
+def metadados(args, servidor, n):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, cwd=DIRETORIO,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    motor = servidor.motor
+    return {
+        'data': datetime.now().isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'espectros': n,
+        'perturbacoes': args.perturbacoes,
+        'repeticoes': args.repeticoes,
+        'rodadas': args.rodadas,
+        'lote': args.lote,
+        'threads': args.threads,
+        'cache': args.cache,
+        'versao_modelo': motor.versao,
+        'modo_anomalia': motor.modo_anomalia,
+        'origem_modelo': motor.origem,
+    }
+
+
+# ==================== COMPARAÇÃO ====================
+
+def comparar(atual, base, limite):
+    """
+    Lista de regressões (cenário, métrica, base, atual, variação) acima do
+    limite. Uma métrica regride só se a mediana das rodadas E a rodada mais
+    favorável pioram além do limite em relação à mediana da base: uma
+    rodada rápida basta para descartar ruído da máquina.
+    """
+    regressoes = []
+    print(f"📈 Comparação com a base ({base['meta'].get('commit')}, limite {limite:.0%}):")
+    for nome, metricas in atual['cenarios'].items():
+        referencia = base['cenarios'].get(nome)
+        if referencia is None:
+            continue
+        for chave, maior_melhor in METRICAS_REGRESSAO:
+            if chave not in metricas or not referencia.get(chave):
+                continue
+            variacao = metricas[chave] / referencia[chave] - 1
+            piora = -variacao if maior_melhor else variacao
+            valores = metricas.get('rodadas_valores', {}).get(chave, [metricas[chave]])
+            melhor = max(valores) if maior_melhor else min(valores)
+            piora_melhor = (1 - melhor / referencia[chave]) if maior_melhor else (melhor / referencia[chave] - 1)
+            piora = min(piora, piora_melhor)
+            marcador = "❌" if piora > limite else "✅"
+            print(f"   {marcador} {nome}.{chave}: {referencia[chave]} -> {metricas[chave]} ({variacao:+.1%})")
+            dispersao = metricas.get('dispersao', {}).get(chave, 0)
+            if dispersao > limite:
+                print(f"      ⚠️ dispersão entre rodadas de {dispersao:.0%}: aumente --rodadas ou --repeticoes")
+            if piora > limite:
+                regressoes.append((nome, chave, referencia[chave], metricas[chave], round(variacao, 4)))
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do servidor de inferência de grãos')
+    parser.add_argument('--dados', default=ARQUIVO_DADOS)
+    parser.add_argument('--perturbacoes', type=int, default=20, help='cópias com ruído por espectro')
+    parser.add_argument('--repeticoes', type=int, default=1, help='passadas sobre o conjunto por rodada')
+    parser.add_argument('--rodadas', type=int, default=5, help='rodadas por cenário (métricas pela mediana)')
+    parser.add_argument('--lote', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=8, help='clientes no cenário com micro-lote')
+    parser.add_argument('--cache', action='store_true', help='ativa CACHE_RESULTADOS')
+    parser.add_argument('--saida', default='benchmark_resultado.json')
+    parser.add_argument('--base', help='JSON de uma execução anterior para comparar')
+    parser.add_argument('--limite', type=float, default=0.10, help='piora relativa tolerada (0.10 = 10%%)')
+    args = parser.parse_args()
+    if args.rodadas < 1:
+        parser.error('--rodadas deve ser pelo menos 1')
+
+    resultado = rodar(args)
+
+    regressoes = []
+    if args.base:
+        with open(args.base, encoding='utf-8') as f:
+            regressoes = comparar(resultado, json.load(f), args.limite)
+        resultado['comparacao'] = {
+            'base': args.base,
+            'limite': args.limite,
+            'regressoes': [dict(zip(('cenario', 'metrica', 'base', 'atual', 'variacao'), r)) for r in regressoes],
+        }
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"💾 Resultado gravado em {args.saida}")
+
+    if regressoes:
+        print(f"❌ {len(regressoes)} regressão(ões) acima de {args.limite:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Cache de Resultados por Espectro - Classificação de Grãos
+
+Operadores repetem a medição da mesma amostra e o firmware limita os
+valores calibrados a [0, 1]: muitos espectros quase idênticos chegam ao
+modelo. O cache guarda a classificação por espectro quantizado:
+
+- Chave: 17 bandas arredondadas para múltiplos de 'tolerancia' + versão
+  do modelo (um modelo novo nunca reaproveita resultados do anterior)
+- Remoção LRU ao atingir 'capacidade' e expiração por TTL
+- Contadores de acertos/faltas/remoções para /status
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def copiar_resultado(resultado):
+    """Cópia do resultado com os dicionários internos também copiados"""
+    return {k: (dict(v) if isinstance(v, dict) else v) for k, v in resultado.items()}
+
+
+class CacheResultados:
+    """
+    Cache LRU/TTL de resultados de classificação
+
+    capacidade:  máximo de espectros guardados
+    tolerancia:  passo de quantização das bandas (mesma unidade do espectro)
+    ttl_s:       tempo de vida de cada entrada
+    """
+
+    def __init__(self, capacidade=10000, tolerancia=1e-4, ttl_s=3600):
+        self.capacidade = capacidade
+        self.tolerancia = tolerancia
+        self.ttl = ttl_s
+
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+        self.removidas_lru = 0
+        self.expiradas = 0
+        self.invalidacoes = 0
+
+    def chaves(self, bandas_17, versao):
+        """
+        Uma chave por linha de (N, 17); None para espectros com valores
+        não finitos (nunca entram no cache)
+        """
+        X = np.atleast_2d(np.asarray(bandas_17, dtype=np.float64))
+        finitos = np.all(np.isfinite(X), axis=1)
+        quantizado = np.zeros(X.shape, dtype=np.int64)
+        quantizado[finitos] = np.round(X[finitos] / self.tolerancia)
+        return [(versao, linha.tobytes()) if ok else None for linha, ok in zip(quantizado, finitos)]
+
+    def obter(self, chave):
+        """Resultado guardado (cópia) ou None"""
+        if chave is None:
+            return None
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is None:
+                self.faltas += 1
+                return None
+            expira, resultado = entrada
+            if expira < agora:
+                del self._entradas[chave]
+                self.expiradas += 1
+                self.faltas += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self.acertos += 1
+        return copiar_resultado(resultado)
+
+    def guardar(self, chave, resultado):
+        if chave is None:
+            return
+        resultado = copiar_resultado(resultado)
+        resultado.pop('timestamp', None)
+        resultado.pop('device_id', None)
+        with self._lock:
+            self._entradas[chave] = (time.monotonic() + self.ttl, resultado)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.capacidade:
+                self._entradas.popitem(last=False)
+                self.removidas_lru += 1
+
+    def limpar(self):
+        """Descarta tudo (recarga do modelo)"""
+        with self._lock:
+            self._entradas.clear()
+            self.invalidacoes += 1
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                'entradas': len(self._entradas),
+                'capacidade': self.capacidade,
+                'tolerancia': self.tolerancia,
+                'ttl_s': self.ttl,
+                'acertos': self.acertos,
+                'faltas': self.faltas,
+                'taxa_acerto': round(self.acertos / consultas, 4) if consultas else 0,
+                'removidas_lru': self.removidas_lru,
+                'expiradas': self.expiradas,
+                'invalidacoes': self.invalidacoes,
+            }
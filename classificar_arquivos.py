@@ -0,0 +1,336 @@
+"""
+Classificação em Lote de Arquivos Espectrais - Classificação de Grãos
+
+Reclassifica arquivos CSV no esquema de
+tabela_coleta_dados_espectrais_4_amostras.csv (band_410 ... band_940)
+sem passar pelo servidor, com o mesmo pipeline de prever_amostra:
+remove r485 -> MotorInferencia.prever -> regras de anomalia
+(regras_anomalia.py), com o mesmo modelo (artefato compilado ou .pkl).
+
+- Leitura em blocos de --bloco linhas (pandas chunksize): a memória não
+  depende do tamanho dos arquivos (.csv ou .csv.gz)
+- Blocos distribuídos num pool de processos, com no máximo
+  EM_VOO_POR_PROCESSO blocos por processo aguardando; os resultados são
+  gravados na ordem da entrada
+- Saída em fluxo (exportacao.py), formato pela extensão de --saida:
+  .csv, .csv.gz, .npz (colunar, um grupo de arrays por bloco) ou
+  .arrow (Arrow IPC stream, requer pyarrow). Em CSV cada bloco é
+  formatado (e comprimido) no próprio processo do pool
+
+Colunas de saída: arquivo (com mais de uma entrada), linha, as colunas da
+entrada que não são bandas (sample, grain, ...), especie, confianca,
+status, prob_<espécie>, I1_NDVI ... I4_Slope_Alt, svm_score,
+svm_detectou, mad_violacoes, mad_detectou e confianca_baixa, com o mesmo
+arredondamento da API. Linhas com bandas ausentes ou não numéricas saem
+com status INVALIDO. Todas as entradas precisam ter as mesmas colunas.
+
+Uso:
+    python classificar_arquivos.py campanha_2023.csv -o reclassificado.csv
+    python classificar_arquivos.py 'campanhas/*.csv.gz' -o reclassificado.npz --processos 4
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from artefato_modelo import carregar_artefato, sha256_arquivo, ARTEFATO_PADRAO
+from motor_inferencia import MotorInferencia, BANDA_485_IDX
+from regras_anomalia import aplicar_regras_anomalia
+import exportacao
+
+MODELO_PKL = 'modelo_completo_sem_485nm.pkl'
+
+BANDAS = ['band_410', 'band_435', 'band_460', 'band_485', 'band_510', 'band_535',
+          'band_560', 'band_585', 'band_610', 'band_645', 'band_680', 'band_705',
+          'band_730', 'band_760', 'band_810', 'band_860', 'band_900', 'band_940']
+
+TAMANHO_BLOCO_PADRAO = 20000
+EM_VOO_POR_PROCESSO = 2
+INTERVALO_PROGRESSO_S = 10
+
+EXTENSOES = [('.csv.gz', 'csv.gz'), ('.csv', 'csv'), ('.npz', 'npz'), ('.arrow', 'arrow')]
+FORMATOS_TEXTO = ('csv', 'csv.gz')
+
+# Motor do processo (carregado uma vez por processo do pool)
+_motor = None
+
+
+# ==================== MODELO ====================
+
+def carregar_motor(caminho_pkl=MODELO_PKL, caminho_artefato=ARTEFATO_PADRAO, modo_anomalia='exata'):
+    """
+    Mesmo modelo que o servidor carregaria: artefato compilado se existir
+    e tiver sido gerado do .pkl atual, senão o .pkl via joblib
+    """
+    if os.path.exists(caminho_artefato):
+        parametros, cabecalho = carregar_artefato(caminho_artefato)
+        origem = cabecalho.get('origem', {})
+        if not os.path.exists(caminho_pkl) or origem.get('sha256_pkl') == sha256_arquivo(caminho_pkl):
+            return MotorInferencia(parametros, versao=origem.get('sha256_pkl', cabecalho['sha256'])[:12],
+                                   origem=caminho_artefato, modo_anomalia=modo_anomalia)
+
+    import joblib  # importa sklearn ao desserializar: só neste caminho
+    return MotorInferencia.do_modelo(joblib.load(caminho_pkl), versao=sha256_arquivo(caminho_pkl)[:12],
+                                     origem=caminho_pkl, modo_anomalia=modo_anomalia)
+
+
+def _iniciar_processo(caminho_pkl, caminho_artefato, modo_anomalia):
+    """Inicializador do pool; com fork o motor do processo principal é herdado"""
+    global _motor
+    if _motor is None:
+        _motor = carregar_motor(caminho_pkl, caminho_artefato, modo_anomalia)
+
+
+# ==================== CLASSIFICAÇÃO ====================
+
+def _arredondar(valores, casas):
+    """
+    np.round com o resultado de round() do Python (usado em
+    montar_resultado) nos valores próximos de um empate, onde os dois
+    podem divergir na última casa
+    """
+    arredondado = np.round(valores, casas)
+    escalado = valores * 10.0 ** casas
+    empates = np.flatnonzero(np.abs(escalado - np.floor(escalado) - 0.5) < 1e-6)
+    for i in empates:
+        arredondado[i] = round(float(valores[i]), casas)
+    return arredondado
+
+
+def classificar_bloco(bandas_18, modelo=None):
+    """
+    Colunas de resultado ({coluna: array}) de uma matriz (N, 18).
+    Linhas com algum valor não finito não são classificadas (INVALIDO).
+    """
+    modelo = modelo if modelo is not None else _motor
+    n = len(bandas_18)
+    validas = np.all(np.isfinite(bandas_18), axis=1)
+
+    colunas = {
+        'especie': np.full(n, '', dtype=f'U{max(len(str(c)) for c in modelo.classes)}'),
+        'confianca': np.full(n, np.nan),
+        'status': np.full(n, 'INVALIDO'),
+    }
+    for classe in modelo.classes:
+        colunas[f'prob_{classe}'] = np.full(n, np.nan)
+    for nome in modelo.indices_cols:
+        colunas[nome] = np.full(n, np.nan)
+    colunas['svm_score'] = np.full(n, np.nan)
+    colunas['svm_detectou'] = np.zeros(n, dtype=np.bool_)
+    colunas['mad_violacoes'] = np.zeros(n, dtype=np.int16)
+    colunas['mad_detectou'] = np.zeros(n, dtype=np.bool_)
+    colunas['confianca_baixa'] = np.zeros(n, dtype=np.bool_)
+    if not validas.any():
+        return colunas
+
+    saida = aplicar_regras_anomalia(modelo.prever(np.delete(bandas_18[validas], BANDA_485_IDX, axis=1)))
+
+    # Mesmo arredondamento de montar_resultado (servidor_flask.py)
+    colunas['especie'][validas] = saida['especie']
+    colunas['confianca'][validas] = _arredondar(saida['confianca'] * 100, 1)
+    colunas['status'][validas] = saida['status']
+    for k, classe in enumerate(modelo.classes):
+        colunas[f'prob_{classe}'][validas] = _arredondar(saida['probabilidades'][:, k] * 100, 1)
+    for k, nome in enumerate(modelo.indices_cols):
+        colunas[nome][validas] = _arredondar(saida['indices'][:, k], 4)
+    colunas['svm_score'][validas] = _arredondar(saida['svm_score'], 4)
+    colunas['svm_detectou'][validas] = saida['anomalia_svm']
+    colunas['mad_violacoes'][validas] = saida['mad_violacoes']
+    colunas['mad_detectou'][validas] = saida['anomalia_mad']
+    colunas['confianca_baixa'][validas] = saida['confianca_baixa']
+    return colunas
+
+
+# ==================== LEITURA EM BLOCOS ====================
+
+def colunas_extras(arquivos):
+    """
+    Colunas que não são bandas, iguais em todas as entradas (ordem da
+    primeira): a saída tem um único cabeçalho/esquema. ValueError se
+    faltar banda ou se os arquivos divergirem.
+    """
+    extras = None
+    for caminho in arquivos:
+        colunas = list(pd.read_csv(caminho, nrows=0).columns)
+        faltando = [b for b in BANDAS if b not in colunas]
+        if faltando:
+            raise ValueError(f"{caminho}: colunas ausentes {faltando}")
+        atuais = [c for c in colunas if c not in BANDAS]
+        if extras is None:
+            extras, primeiro = atuais, caminho
+        elif set(atuais) != set(extras):
+            raise ValueError(f"{caminho}: colunas {sorted(atuais)} diferentes das de {primeiro} "
+                             f"{sorted(extras)}")
+    return extras or []
+
+
+def ler_blocos(arquivos, tamanho_bloco=TAMANHO_BLOCO_PADRAO):
+    """
+    Gera (colunas da entrada, bandas (N, 18)) bloco a bloco. As colunas
+    que não são bandas são lidas como texto (esquema estável entre blocos).
+    """
+    incluir_arquivo = len(arquivos) > 1
+    extras = colunas_extras(arquivos)
+    for caminho in arquivos:
+        linha = 1
+        leitor = pd.read_csv(caminho, chunksize=tamanho_bloco, dtype={c: str for c in extras},
+                             keep_default_na=False, na_values={b: [''] for b in BANDAS})
+        for bloco in leitor:
+            n = len(bloco)
+            bandas = np.column_stack([pd.to_numeric(bloco[b], errors='coerce').to_numpy(np.float64)
+                                      for b in BANDAS])
+            entrada = {}
+            if incluir_arquivo:
+                entrada['arquivo'] = np.full(n, os.path.basename(caminho))
+            entrada['linha'] = np.arange(linha, linha + n, dtype=np.int64)
+            for c in extras:
+                entrada[c] = bloco[c].to_numpy(dtype=str)
+            linha += n
+            yield entrada, bandas
+
+
+def processar_bloco(entrada, bandas, formato, primeiro=False):
+    """
+    Classifica um bloco e já o serializa quando a saída é CSV: a
+    formatação e o gzip são a maior parte do custo e ficam no processo
+    do pool. Retorna (resumo, bytes do CSV ou colunas para npz/arrow).
+    """
+    colunas = {**entrada, **classificar_bloco(bandas)}
+    resumo = {
+        'linhas': len(bandas),
+        'anormais': int(np.sum(colunas['status'] == 'ANORMAL')),
+        'invalidas': int(np.sum(colunas['status'] == 'INVALIDO')),
+    }
+    if formato in FORMATOS_TEXTO:
+        # Cada bloco .csv.gz é um membro gzip completo; concatenados
+        # formam um .gz válido (gzip, zcat e pandas leem todos)
+        return resumo, b''.join(exportacao.gerar_csv_colunas(
+            [colunas], comprimir=formato == 'csv.gz', cabecalho=primeiro))
+    return resumo, colunas
+
+
+def classificar_arquivos(arquivos, formato, tamanho_bloco=TAMANHO_BLOCO_PADRAO, processos=1, opcoes_motor=()):
+    """
+    Gera (resumo, bloco processado) na ordem da entrada. Com processos > 1
+    os blocos vão para um ProcessPoolExecutor, com no máximo
+    processos * EM_VOO_POR_PROCESSO blocos pendentes (memória limitada).
+    """
+    blocos = ler_blocos(arquivos, tamanho_bloco)
+    if processos <= 1:
+        _iniciar_processo(*opcoes_motor)
+        for n, (entrada, bandas) in enumerate(blocos):
+            yield processar_bloco(entrada, bandas, formato, n == 0)
+        return
+
+    with ProcessPoolExecutor(processos, initializer=_iniciar_processo, initargs=opcoes_motor) as pool:
+        pendentes = deque()
+        for n, (entrada, bandas) in enumerate(blocos):
+            pendentes.append(pool.submit(processar_bloco, entrada, bandas, formato, n == 0))
+            if len(pendentes) >= processos * EM_VOO_POR_PROCESSO:
+                yield pendentes.popleft().result()
+        while pendentes:
+            yield pendentes.popleft().result()
+
+
+def gravar(formato, blocos, destino):
+    """Escreve os blocos processados em destino (arquivo binário)"""
+    if formato in FORMATOS_TEXTO:
+        for dados in blocos:
+            destino.write(dados)
+        return
+    for dados in exportacao.gerar_colunas(formato, blocos):
+        destino.write(dados)
+
+
+# ==================== EXECUÇÃO ====================
+
+def formato_da_saida(caminho):
+    for extensao, formato in EXTENSOES:
+        if caminho.endswith(extensao):
+            return formato
+    raise ValueError(f"Extensão de saída não suportada: {caminho} (use .csv, .csv.gz, .npz ou .arrow)")
+
+
+def expandir_entradas(padroes):
+    arquivos = []
+    for padrao in padroes:
+        encontrados = sorted(glob.glob(padrao))
+        if not encontrados:
+            raise FileNotFoundError(f"Nenhum arquivo para {padrao}")
+        arquivos.extend(encontrados)
+    return arquivos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Classificação em lote de arquivos espectrais (band_410 ... band_940)')
+    parser.add_argument('entradas', nargs='+', help='arquivos .csv/.csv.gz (aceita padrões glob)')
+    parser.add_argument('-o', '--saida', required=True, help='arquivo de saída (.csv, .csv.gz, .npz ou .arrow)')
+    parser.add_argument('--bloco', type=int, default=TAMANHO_BLOCO_PADRAO, help='linhas por bloco')
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--modelo', default=MODELO_PKL)
+    parser.add_argument('--artefato', default=os.environ.get('MODELO_COMPILADO', ARTEFATO_PADRAO))
+    parser.add_argument('--anomalia', default=os.environ.get('ANOMALIA_MODO', 'exata'),
+                        help="One-Class SVM: 'exata', 'nystrom' ou 'rff'")
+    args = parser.parse_args()
+
+    try:
+        arquivos = expandir_entradas(args.entradas)
+        colunas_extras(arquivos)
+        formato = formato_da_saida(args.saida)
+        if formato == 'arrow' and not exportacao.arrow_disponivel():
+            raise ValueError("Saída .arrow requer pyarrow (pip install pyarrow)")
+    except (ValueError, FileNotFoundError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(2)
+
+    # Carregado aqui para falhar cedo; com fork os processos herdam o motor
+    opcoes_motor = (args.modelo, args.artefato, args.anomalia)
+    _iniciar_processo(*opcoes_motor)
+    print(f"📦 Modelo {_motor.versao} ({_motor.origem}, anomalia {_motor.modo_anomalia})")
+    print(f"🚀 {len(arquivos)} arquivo(s), blocos de {args.bloco} linhas, {args.processos} processo(s)")
+
+    contagem = {'linhas': 0, 'invalidas': 0, 'anormais': 0}
+    inicio = time.perf_counter()
+    ultimo_progresso = inicio
+
+    def contar(resultados):
+        nonlocal ultimo_progresso
+        for resumo, bloco in resultados:
+            for chave in contagem:
+                contagem[chave] += resumo[chave]
+            agora = time.perf_counter()
+            if agora - ultimo_progresso >= INTERVALO_PROGRESSO_S:
+                ultimo_progresso = agora
+                print(f"⏳ {contagem['linhas']} linhas ({contagem['linhas'] / (agora - inicio):.0f}/s)")
+            yield bloco
+
+    parcial = args.saida + '.parcial'
+    try:
+        blocos = contar(classificar_arquivos(arquivos, formato, args.bloco, args.processos, opcoes_motor))
+        with open(parcial, 'wb') as destino:
+            gravar(formato, blocos, destino)
+        os.replace(parcial, args.saida)
+    except (ValueError, OSError) as e:
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    duracao = time.perf_counter() - inicio
+    print(f"✅ {contagem['linhas']} linhas em {duracao:.1f} s "
+          f"({contagem['linhas'] / max(duracao, 1e-9):.0f}/s): "
+          f"{contagem['anormais']} ANORMAL, {contagem['invalidas']} INVALIDO")
+    print(f"💾 Resultado gravado em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
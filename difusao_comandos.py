@@ -0,0 +1,104 @@
+"""
+Difusão de Comandos para a Frota - Classificação de Grãos
+
+Um único pedido dispara a análise em todos os dispositivos ativos (ou
+num grupo marcado com tags) e os resultados são coletados num relatório:
+
+- Difusão: um comando por dispositivo, enfileirado de uma vez nas filas
+  de estado_compartilhado.py (sem thread por dispositivo). Cada comando
+  leva o broadcast_id e tem como TTL o prazo da difusão
+- Conclusão: o resultado volta pelo command_id em /esp32/result, como
+  qualquer comando; a difusão só guarda {device_id: command_id}
+- Relatório: distribuição de espécies e status, nº de anomalias,
+  confiança média e dispositivos atrasados (sem resultado no prazo)
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import secrets
+from collections import Counter
+from datetime import datetime
+
+DIFUSAO_PRAZO_PADRAO_S = 60
+
+# Campos do resultado guardados no comando (o suficiente para o relatório)
+CAMPOS_RESUMO = ('especie', 'confianca', 'status', 'timestamp')
+
+
+def normalizar_tags(tags):
+    """Lista ordenada e sem repetição; aceita lista ou texto separado por vírgulas"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return sorted({str(tag).strip() for tag in tags if str(tag).strip()})
+
+
+def selecionar_dispositivos(dispositivos, tags):
+    """IDs dos dispositivos que têm todas as tags pedidas (sem tags: todos)"""
+    pedidas = set(tags)
+    return sorted(info['id'] for info in dispositivos if pedidas <= set(info.get('tags') or ()))
+
+
+def resumir_resultado(resultado):
+    return {campo: resultado.get(campo) for campo in CAMPOS_RESUMO}
+
+
+def nova_difusao(tags, prazo_s, agora):
+    return {
+        'broadcast_id': secrets.token_hex(8),
+        'tags': list(tags),
+        'criado_em': agora,
+        'prazo': agora + prazo_s,
+        'comandos': {},
+        'rejeitados': [],
+    }
+
+
+def relatorio(difusao, comandos, agora):
+    """
+    Relatório agregado da difusão
+
+    comandos: {command_id: registro do comando} (registro público do estado)
+    estado:   'completo' (todos responderam), 'prazo_esgotado' ou 'em_andamento'
+    """
+    resultados = {}
+    atrasados = []
+    for device_id, command_id in sorted(difusao['comandos'].items()):
+        registro = comandos.get(command_id)
+        if registro is not None and registro['estado'] == 'concluido':
+            resultados[device_id] = registro.get('resultado') or {}
+        else:
+            atrasados.append({
+                'device_id': device_id,
+                'command_id': command_id,
+                'estado': registro['estado'] if registro is not None else 'desconhecido',
+                'entregas': registro['entregas'] if registro is not None else 0,
+            })
+
+    if not atrasados:
+        situacao = 'completo'
+    elif agora >= difusao['prazo']:
+        situacao = 'prazo_esgotado'
+    else:
+        situacao = 'em_andamento'
+
+    status = Counter(r.get('status') for r in resultados.values() if r.get('status'))
+    confiancas = [r['confianca'] for r in resultados.values() if r.get('confianca') is not None]
+
+    return {
+        'broadcast_id': difusao['broadcast_id'],
+        'estado': situacao,
+        'tags': difusao['tags'],
+        'criado_em': datetime.fromtimestamp(difusao['criado_em']).isoformat(),
+        'prazo': datetime.fromtimestamp(difusao['prazo']).isoformat(),
+        'dispositivos': len(difusao['comandos']),
+        'concluidos': len(resultados),
+        'especies': dict(Counter(r.get('especie') for r in resultados.values() if r.get('especie'))),
+        'status': dict(status),
+        'anomalias': status.get('ANORMAL', 0),
+        'confianca_media': round(sum(confiancas) / len(confiancas), 2) if confiancas else None,
+        'atrasados': atrasados,
+        'rejeitados': difusao['rejeitados'],
+        'resultados': resultados,
+    }
@@ -0,0 +1,1018 @@
+"""
+Estado Compartilhado entre Workers - Classificação de Grãos
+
+Dispositivos conectados, filas de comandos, última análise e pedidos
+de recarga do modelo, com duas implementações de mesma interface:
+
+- EstadoMemoria: dicionários do processo (servidor único, padrão)
+- EstadoSQLite:  banco SQLite local (WAL) compartilhado por todos os
+  workers do mesmo host (gunicorn com vários processos). Um comando
+  enfileirado num worker é entregue ao long-poll estacionado em outro.
+
+Registro de dispositivos sem varreduras O(n) no caminho quente:
+contagem de ativos, dispositivo ativo mais recente e expiração saem de
+estruturas ordenadas (heap de prazos / ordem de last_seen na memória,
+índices por last_seen no SQLite).
+
+Comandos: fila limitada por dispositivo (prioridade, depois ordem de
+chegada), cada um com command_id, TTL e ciclo de vida
+pendente -> entregue -> concluido | expirado. O dispositivo devolve o
+command_id em /esp32/result; sem resultado em COMANDO_TIMEOUT_ACK_S o
+comando volta para a fila (até COMANDO_MAX_ENTREGAS entregas). Prazos
+num heap (memória) ou índice parcial (SQLite), sem varrer a fila.
+Difusões (um comando por dispositivo da frota, difusao_comandos.py)
+ficam guardadas aqui para que qualquer worker monte o relatório, e as
+sessões de varredura (sessao_varredura.py) para que leituras da mesma
+sessão possam ser atendidas por workers diferentes.
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import heapq
+import itertools
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta
+
+# Long-poll no SQLite: intervalo entre consultas por um comando que pode
+# ter sido enfileirado por outro processo (no mesmo processo o Event
+# local acorda a espera imediatamente)
+INTERVALO_ESPERA_COMANDO_S = 0.1
+
+# Dispositivo ativo: visto há menos de timeout_ativo_s ou parado em long-poll
+TIMEOUT_ATIVO_PADRAO_S = 10
+
+# Versão do esquema SQLite (PRAGMA user_version). O estado é transitório:
+# tabelas de versões anteriores são recriadas em vez de migradas
+VERSAO_ESQUEMA = 4
+
+# Filas de comandos: máximo de comandos em aberto (pendentes + entregues
+# sem resultado) por dispositivo, TTL padrão na fila, espera pelo
+# resultado após a entrega, nº máximo de entregas e por quanto tempo
+# comandos finalizados continuam consultáveis (GET /command/<id>)
+MAX_COMANDOS_DISPOSITIVO = 16
+COMANDO_TTL_PADRAO_S = 60
+COMANDO_TIMEOUT_ACK_S = 60
+COMANDO_MAX_ENTREGAS = 3
+COMANDO_RETENCAO_S = 3600
+
+CAMPOS_COMANDO = ('command_id', 'device_id', 'comando', 'prioridade', 'ttl_s', 'estado',
+                  'criado_em', 'prazo', 'entregue_em', 'finalizado_em', 'entregas', 'resultado')
+
+# Consultas IN (...) em blocos abaixo do limite de parâmetros do SQLite
+BLOCO_CONSULTA = 500
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS dispositivos (
+    device_id TEXT PRIMARY KEY,
+    dados TEXT NOT NULL,
+    last_seen REAL NOT NULL,
+    aguardando INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_dispositivos_visto ON dispositivos (last_seen);
+CREATE INDEX IF NOT EXISTS idx_dispositivos_aguardando ON dispositivos (last_seen) WHERE aguardando = 1;
+CREATE TABLE IF NOT EXISTS comandos (
+    command_id TEXT PRIMARY KEY,
+    device_id TEXT NOT NULL,
+    comando TEXT NOT NULL,
+    prioridade INTEGER NOT NULL DEFAULT 0,
+    ttl_s REAL NOT NULL,
+    estado TEXT NOT NULL,
+    criado_em REAL NOT NULL,
+    prazo REAL,
+    entregue_em REAL,
+    finalizado_em REAL,
+    entregas INTEGER NOT NULL DEFAULT 0,
+    resultado TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_comandos_fila ON comandos (device_id, prioridade DESC, criado_em)
+    WHERE estado = 'pendente';
+CREATE INDEX IF NOT EXISTS idx_comandos_abertos ON comandos (device_id) WHERE estado IN ('pendente', 'entregue');
+CREATE INDEX IF NOT EXISTS idx_comandos_prazo ON comandos (prazo) WHERE estado IN ('pendente', 'entregue');
+CREATE INDEX IF NOT EXISTS idx_comandos_finalizados ON comandos (finalizado_em)
+    WHERE estado IN ('concluido', 'expirado');
+CREATE TABLE IF NOT EXISTS difusoes (
+    broadcast_id TEXT PRIMARY KEY,
+    dados TEXT NOT NULL,
+    prazo REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_difusoes_prazo ON difusoes (prazo);
+CREATE TABLE IF NOT EXISTS sessoes (
+    session_id TEXT PRIMARY KEY,
+    dados TEXT NOT NULL,
+    prazo REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessoes_prazo ON sessoes (prazo);
+CREATE TABLE IF NOT EXISTS marcadores (
+    chave TEXT PRIMARY KEY,
+    versao INTEGER NOT NULL,
+    pid INTEGER,
+    valor TEXT
+);
+"""
+
+
+def _serializar_dispositivo(info):
+    dados = dict(info)
+    dados['last_seen'] = info['last_seen'].isoformat()
+    return json.dumps(dados, ensure_ascii=False)
+
+
+def _desserializar_dispositivo(texto):
+    info = json.loads(texto)
+    info['last_seen'] = datetime.fromisoformat(info['last_seen'])
+    return info
+
+
+def _ativo(info, agora, timeout_s):
+    return info.get('aguardando_comando', False) or (agora - info['last_seen']).total_seconds() < timeout_s
+
+
+def _mudanca_visivel(anterior, info, estava_ativo):
+    """Novo dispositivo, status/IP/tags diferentes ou volta a ficar ativo"""
+    return (anterior is None or not estava_ativo
+            or any(anterior.get(campo) != info.get(campo) for campo in ('status', 'ip', 'tags')))
+
+
+class FilaComandosCheia(RuntimeError):
+    """Dispositivo já tem MAX_COMANDOS_DISPOSITIVO comandos em aberto"""
+
+
+def _novo_comando(device_id, comando, prioridade, ttl_s, agora):
+    return {
+        'command_id': secrets.token_hex(8),
+        'device_id': device_id,
+        'comando': dict(comando),
+        'prioridade': int(prioridade),
+        'ttl_s': float(ttl_s),
+        'estado': 'pendente',
+        'criado_em': agora,
+        'prazo': agora + ttl_s,
+        'entregue_em': None,
+        'finalizado_em': None,
+        'entregas': 0,
+        'resultado': None,
+    }
+
+
+def _instante(valor):
+    return datetime.fromtimestamp(valor).isoformat() if valor is not None else None
+
+
+def _registro_publico(registro):
+    """
+    Registro do comando com instantes em ISO. prazo: fim do TTL
+    (pendente) ou da espera pelo resultado (entregue)
+    """
+    publico = {campo: registro[campo] for campo in CAMPOS_COMANDO}
+    for campo in ('criado_em', 'prazo', 'entregue_em', 'finalizado_em'):
+        publico[campo] = _instante(publico[campo])
+    publico['comando'] = dict(registro['comando'])
+    if publico['resultado'] is not None:
+        publico['resultado'] = dict(publico['resultado'])
+    return publico
+
+
+def _carga_comando(command_id, comando):
+    """Corpo enviado ao dispositivo: o comando + o command_id a devolver"""
+    return {**comando, 'command_id': command_id}
+
+
+def _conclusao(registro, duplicado, agora):
+    return {
+        **_registro_publico(registro),
+        'duplicado': duplicado,
+        'latencia_s': round(agora - registro['criado_em'], 6),
+    }
+
+
+# ==================== MEMÓRIA (PROCESSO ÚNICO) ====================
+
+class EstadoMemoria:
+    """
+    Estado no próprio processo (comportamento original do servidor)
+
+    Dispositivos num OrderedDict em ordem de last_seen (cada atualização
+    vai para o fim) + conjunto de ativos. A saída do conjunto de ativos é
+    agendada num heap de prazos (last_seen + timeout), processado de forma
+    preguiçosa a cada leitura: custo O(log n) por transição, sem varrer
+    todos os dispositivos.
+
+    Comandos: um heap (-prioridade, sequência) por dispositivo e um heap
+    global de prazos (TTL / espera pelo resultado). Entradas que ficaram
+    para trás (comando entregue, concluído ou com prazo novo) são
+    descartadas ao sair do heap.
+    """
+
+    compartilhado = False
+
+    def __init__(self, timeout_ativo_s=TIMEOUT_ATIVO_PADRAO_S, max_comandos=MAX_COMANDOS_DISPOSITIVO):
+        self.timeout_ativo = timedelta(seconds=timeout_ativo_s)
+        self.max_comandos = max_comandos
+        self._lock = threading.Lock()
+        self._dispositivos = OrderedDict()
+        self._ativos = set()
+        self._prazos = []
+        self._versao_dispositivos = 0
+        self._comandos = {}
+        self._filas = {}
+        self._abertos = {}
+        self._prazos_comandos = []
+        self._finalizados = deque()
+        self._difusoes = {}
+        self._prazos_difusoes = []
+        self._sessoes = {}
+        self._prazos_sessoes = []
+        self._sequencia = itertools.count()
+        self._eventos = {}
+        self._ouvintes = []
+        self._ultima_analise = None
+        self._versao_analise = 0
+        self._versao_recarga = 0
+
+    # ---------------- Dispositivos ----------------
+
+    def _processar_prazos(self, agora):
+        """Retira do conjunto de ativos os dispositivos cujo prazo venceu"""
+        prazos = self._prazos
+        while prazos and prazos[0][0] <= agora:
+            prazo, device_id = heapq.heappop(prazos)
+            info = self._dispositivos.get(device_id)
+            # Entradas antigas (dispositivo atualizado depois) são ignoradas
+            if (info is None or info.get('aguardando_comando', False)
+                    or info['last_seen'] + self.timeout_ativo != prazo):
+                continue
+            if device_id in self._ativos:
+                self._ativos.discard(device_id)
+                self._versao_dispositivos += 1
+
+        # Compacta quando as entradas antigas dominam o heap
+        if len(prazos) > 2 * len(self._dispositivos) + 1024:
+            self._prazos = [(info['last_seen'] + self.timeout_ativo, d)
+                            for d, info in self._dispositivos.items()
+                            if d in self._ativos and not info.get('aguardando_comando', False)]
+            heapq.heapify(self._prazos)
+
+    def atualizar_dispositivo(self, device_id, info):
+        """
+        Grava o registro do dispositivo. Retorna True se a mudança é
+        visível no dashboard (novo, status/IP diferente ou voltou a ficar ativo).
+        """
+        with self._lock:
+            self._processar_prazos(datetime.now())
+            anterior = self._dispositivos.get(device_id)
+            estava_ativo = device_id in self._ativos
+            self._dispositivos[device_id] = dict(info)
+            self._dispositivos.move_to_end(device_id)
+            self._ativos.add(device_id)
+            if not info.get('aguardando_comando', False):
+                heapq.heappush(self._prazos, (info['last_seen'] + self.timeout_ativo, device_id))
+            mudou = _mudanca_visivel(anterior, info, estava_ativo)
+            if mudou:
+                self._versao_dispositivos += 1
+        return mudou
+
+    def dispositivos(self):
+        """Cópia de {device_id: info}"""
+        with self._lock:
+            return {d: dict(info) for d, info in self._dispositivos.items()}
+
+    def contagem_ativos(self):
+        with self._lock:
+            self._processar_prazos(datetime.now())
+            return len(self._ativos)
+
+    def dispositivos_ativos(self):
+        """Registros dos dispositivos ativos (conjunto mantido pelos prazos)"""
+        with self._lock:
+            self._processar_prazos(datetime.now())
+            return [dict(self._dispositivos[d]) for d in self._ativos]
+
+    def dispositivo_recente_ativo(self):
+        """Registro do dispositivo ativo visto por último (ou None)"""
+        with self._lock:
+            self._processar_prazos(datetime.now())
+            for device_id in reversed(self._dispositivos):
+                if device_id in self._ativos:
+                    return dict(self._dispositivos[device_id])
+        return None
+
+    def versao_dispositivos(self):
+        """Muda sempre que a lista visível muda (inclusive por expiração)"""
+        with self._lock:
+            self._processar_prazos(datetime.now())
+            return self._versao_dispositivos
+
+    def expirar_dispositivos(self, idade_max_s):
+        """
+        Remove dispositivos inativos não vistos há mais de idade_max_s.
+        Percorre só o início da ordem de last_seen (os mais antigos).
+        """
+        agora = datetime.now()
+        limite = agora - timedelta(seconds=idade_max_s)
+        removidos = []
+        with self._lock:
+            self._processar_prazos(agora)
+            for device_id, info in self._dispositivos.items():
+                if info['last_seen'] >= limite:
+                    break
+                if device_id not in self._ativos:
+                    removidos.append(device_id)
+            for device_id in removidos:
+                del self._dispositivos[device_id]
+                self._eventos.pop(device_id, None)
+            if removidos:
+                self._versao_dispositivos += 1
+        return removidos
+
+    def remover_dispositivo(self, device_id):
+        with self._lock:
+            if self._dispositivos.pop(device_id, None) is not None:
+                self._versao_dispositivos += 1
+            self._ativos.discard(device_id)
+            self._eventos.pop(device_id, None)
+
+    # ---------------- Comandos ----------------
+
+    def _agendar_prazo(self, registro):
+        heapq.heappush(self._prazos_comandos, (registro['prazo'], next(self._sequencia), registro['command_id']))
+
+    def _finalizar(self, registro, estado, agora):
+        registro['estado'] = estado
+        registro['finalizado_em'] = agora
+        registro['prazo'] = None
+        self._finalizados.append((agora, registro['command_id']))
+        device_id = registro['device_id']
+        self._abertos[device_id] -= 1
+        if not self._abertos[device_id]:
+            del self._abertos[device_id]
+
+    def _processar_prazos_comandos(self, agora):
+        """
+        Vence TTLs e esperas por resultado; descarta finalizados fora da
+        retenção e sessões de varredura vencidas. Retorna (nº de expirados,
+        dispositivos com comando devolvido à fila)
+        """
+        expirados, devolvidos = 0, set()
+        prazos = self._prazos_comandos
+        while prazos and prazos[0][0] <= agora:
+            prazo, _, command_id = heapq.heappop(prazos)
+            registro = self._comandos.get(command_id)
+            if registro is None or registro['prazo'] != prazo:
+                continue
+            if registro['estado'] == 'entregue' and registro['entregas'] < COMANDO_MAX_ENTREGAS:
+                # Sem resultado: volta para a fila na posição original
+                registro['estado'] = 'pendente'
+                registro['prazo'] = agora + registro['ttl_s']
+                self._agendar_prazo(registro)
+                heapq.heappush(self._filas.setdefault(registro['device_id'], []),
+                               (-registro['prioridade'], registro['sequencia'], command_id))
+                devolvidos.add(registro['device_id'])
+            else:
+                self._finalizar(registro, 'expirado', agora)
+                expirados += 1
+
+        limite = agora - COMANDO_RETENCAO_S
+        while self._finalizados and self._finalizados[0][0] < limite:
+            _, command_id = self._finalizados.popleft()
+            self._comandos.pop(command_id, None)
+        while self._prazos_difusoes and self._prazos_difusoes[0][0] < limite:
+            self._difusoes.pop(heapq.heappop(self._prazos_difusoes)[1], None)
+        # Sessões renovam o prazo a cada leitura: a entrada do heap só vale
+        # se ainda for o prazo atual da sessão
+        while self._prazos_sessoes and self._prazos_sessoes[0][0] < agora:
+            prazo, session_id = heapq.heappop(self._prazos_sessoes)
+            sessao = self._sessoes.get(session_id)
+            if sessao is not None and sessao['prazo'] == prazo:
+                del self._sessoes[session_id]
+        return expirados, devolvidos
+
+    def adicionar_ouvinte(self, funcao):
+        """
+        funcao(device_ids) é chamada quando esses dispositivos ganham um
+        comando para entregar (long-poll fora de threads, ex.: asyncio)
+        """
+        self._ouvintes.append(funcao)
+
+    def remover_ouvinte(self, funcao):
+        """Desfaz adicionar_ouvinte (ex.: servidor asyncio encerrado)"""
+        if funcao in self._ouvintes:
+            self._ouvintes.remove(funcao)
+
+    def _acordar(self, dispositivos):
+        dispositivos = list(dispositivos)
+        if not dispositivos:
+            return
+        for device_id in dispositivos:
+            evento = self._eventos.get(device_id)
+            if evento is not None:
+                evento.set()
+        for ouvinte in self._ouvintes:
+            ouvinte(dispositivos)
+
+    def enfileirar_comandos(self, pedidos):
+        """
+        Enfileira vários comandos de uma vez e acorda os long-polls.
+        pedidos: [(device_id, comando, prioridade, ttl_s)]. Retorna
+        (registros, rejeitados): rejeitados são os device_ids que já
+        tinham max_comandos em aberto.
+        """
+        agora = time.time()
+        registros, rejeitados = [], []
+        with self._lock:
+            for device_id, comando, prioridade, ttl_s in pedidos:
+                if self._abertos.get(device_id, 0) >= self.max_comandos:
+                    rejeitados.append(device_id)
+                    continue
+                registro = _novo_comando(device_id, comando, prioridade, ttl_s, agora)
+                registro['sequencia'] = next(self._sequencia)
+                self._comandos[registro['command_id']] = registro
+                self._abertos[device_id] = self._abertos.get(device_id, 0) + 1
+                heapq.heappush(self._filas.setdefault(device_id, []),
+                               (-registro['prioridade'], registro['sequencia'], registro['command_id']))
+                self._agendar_prazo(registro)
+                registros.append(_registro_publico(registro))
+            self._acordar([registro['device_id'] for registro in registros])
+        return registros, rejeitados
+
+    def enfileirar_comando(self, device_id, comando, prioridade=0, ttl_s=COMANDO_TTL_PADRAO_S):
+        """
+        Coloca o comando na fila do dispositivo e acorda o long-poll.
+        Retorna o registro (com command_id); FilaComandosCheia se o
+        dispositivo já tem max_comandos em aberto.
+        """
+        registros, _ = self.enfileirar_comandos([(device_id, comando, prioridade, ttl_s)])
+        if not registros:
+            raise FilaComandosCheia(f'{device_id} já tem {self.max_comandos} comandos em aberto')
+        return registros[0]
+
+    def _retirar(self, device_id, agora):
+        """
+        Entrega o pendente de maior prioridade (o mais antigo entre iguais).
+        TTL vencido não é entregue; expirar_comandos() o finaliza.
+        """
+        fila = self._filas.get(device_id)
+        while fila:
+            _, _, command_id = heapq.heappop(fila)
+            registro = self._comandos.get(command_id)
+            if registro is None or registro['estado'] != 'pendente' or registro['prazo'] <= agora:
+                continue
+            registro['estado'] = 'entregue'
+            registro['entregue_em'] = agora
+            registro['entregas'] += 1
+            registro['prazo'] = agora + COMANDO_TIMEOUT_ACK_S
+            self._agendar_prazo(registro)
+            return _carga_comando(command_id, registro['comando'])
+        self._filas.pop(device_id, None)
+        return None
+
+    def retirar_comando(self, device_id, espera_s=0):
+        """
+        Entrega o próximo comando do dispositivo, aguardando até espera_s
+        segundos por um novo comando (long-poll). Retorna None se não houver.
+        """
+        with self._lock:
+            comando = self._retirar(device_id, time.time())
+            if comando is not None or espera_s <= 0:
+                return comando
+            evento = self._eventos.setdefault(device_id, threading.Event())
+            evento.clear()
+
+        # enfileirar_comando() chama set() depois de gravar o comando,
+        # então não há janela entre a verificação acima e a espera
+        evento.wait(espera_s)
+
+        with self._lock:
+            return self._retirar(device_id, time.time())
+
+    def concluir_comando(self, command_id, device_id=None, resultado=None):
+        """
+        Marca o comando como concluído ao chegar o resultado (resumo
+        guardado no registro). Retorna o registro + latencia_s (criação ->
+        resultado) e 'duplicado' (já estava concluído), ou None se o
+        comando não existe / é de outro dispositivo
+        """
+        agora = time.time()
+        with self._lock:
+            registro = self._comandos.get(command_id)
+            if registro is None or (device_id is not None and registro['device_id'] != device_id):
+                return None
+            duplicado = registro['estado'] == 'concluido'
+            if not duplicado:
+                registro['resultado'] = resultado
+                # Resultado tardio (devolvido à fila ou expirado) também conta:
+                # o trabalho foi feito e não deve ser repetido
+                if registro['estado'] == 'expirado':
+                    registro['estado'] = 'concluido'
+                    registro['finalizado_em'] = agora
+                else:
+                    self._finalizar(registro, 'concluido', agora)
+            return _conclusao(registro, duplicado, agora)
+
+    def comando(self, command_id):
+        with self._lock:
+            registro = self._comandos.get(command_id)
+            return _registro_publico(registro) if registro is not None else None
+
+    def comandos(self, command_ids):
+        """{command_id: registro} dos comandos encontrados"""
+        with self._lock:
+            return {c: _registro_publico(self._comandos[c]) for c in command_ids if c in self._comandos}
+
+    def registrar_difusao(self, difusao):
+        with self._lock:
+            self._difusoes[difusao['broadcast_id']] = json.loads(json.dumps(difusao))
+            heapq.heappush(self._prazos_difusoes, (difusao['prazo'], difusao['broadcast_id']))
+
+    def difusao(self, broadcast_id):
+        with self._lock:
+            difusao = self._difusoes.get(broadcast_id)
+            return json.loads(json.dumps(difusao)) if difusao is not None else None
+
+    def registrar_sessao(self, sessao):
+        with self._lock:
+            self._sessoes[sessao['session_id']] = json.loads(json.dumps(sessao))
+            heapq.heappush(self._prazos_sessoes, (sessao['prazo'], sessao['session_id']))
+
+    def sessao(self, session_id):
+        with self._lock:
+            sessao = self._sessoes.get(session_id)
+            return json.loads(json.dumps(sessao)) if sessao is not None else None
+
+    def atualizar_sessao(self, sessao):
+        """
+        Grava a sessão só se ninguém a gravou desde a leitura (mesma
+        'versao'); incrementa a versão. Retorna False se a cópia está velha
+        ou a sessão expirou.
+        """
+        with self._lock:
+            atual = self._sessoes.get(sessao['session_id'])
+            if atual is None or atual.get('versao', 0) != sessao.get('versao', 0):
+                return False
+            sessao['versao'] = sessao.get('versao', 0) + 1
+            self._sessoes[sessao['session_id']] = json.loads(json.dumps(sessao))
+            heapq.heappush(self._prazos_sessoes, (sessao['prazo'], sessao['session_id']))
+            return True
+
+    def expirar_comandos(self):
+        """Processa os prazos vencidos; retorna o nº de comandos expirados"""
+        with self._lock:
+            expirados, devolvidos = self._processar_prazos_comandos(time.time())
+            self._acordar(devolvidos)
+        return expirados
+
+    # ---------------- Última análise / recarga ----------------
+
+    def definir_ultima_analise(self, resultado):
+        with self._lock:
+            self._ultima_analise = resultado
+            self._versao_analise += 1
+
+    def ultima_analise(self):
+        with self._lock:
+            return self._ultima_analise
+
+    def solicitar_recarga(self):
+        """Registra pedido de recarga do modelo; retorna o novo número do pedido"""
+        with self._lock:
+            self._versao_recarga += 1
+            return self._versao_recarga
+
+    def marcadores(self):
+        """
+        Contadores de mudança lidos pelo monitor de cada worker:
+        {'analise': (versao, pid), 'recarga': versao}
+        """
+        with self._lock:
+            return {'analise': (self._versao_analise, os.getpid()), 'recarga': self._versao_recarga}
+
+    def estatisticas(self):
+        with self._lock:
+            self._processar_prazos(datetime.now())
+            return {
+                'backend': 'memoria',
+                'dispositivos': len(self._dispositivos),
+                'dispositivos_ativos': len(self._ativos),
+                'comandos': dict(Counter(r['estado'] for r in self._comandos.values())),
+            }
+
+
+# ==================== SQLITE (VÁRIOS WORKERS) ====================
+
+class EstadoSQLite:
+    """
+    Estado num banco SQLite local compartilhado pelos processos do host.
+
+    Cada processo/thread usa sua própria conexão (recriada após fork).
+    Entregar um comando é um único UPDATE ... RETURNING sobre o pendente
+    de maior prioridade: só um worker o entrega.
+    """
+
+    compartilhado = True
+
+    def __init__(self, caminho, timeout_ativo_s=TIMEOUT_ATIVO_PADRAO_S,
+                 intervalo_espera_s=INTERVALO_ESPERA_COMANDO_S, max_comandos=MAX_COMANDOS_DISPOSITIVO):
+        self.caminho = caminho
+        self.timeout_ativo = timeout_ativo_s
+        self.max_comandos = max_comandos
+        self.intervalo_espera = intervalo_espera_s
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._eventos = {}
+        self._ouvintes = []
+        self._pid = os.getpid()
+
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('PRAGMA user_version').fetchone()[0] < VERSAO_ESQUEMA:
+                conn.execute('DROP TABLE IF EXISTS dispositivos')
+                conn.execute('DROP TABLE IF EXISTS comandos')
+                conn.execute('DROP TABLE IF EXISTS difusoes')
+                conn.execute('DROP TABLE IF EXISTS sessoes')
+            for comando in ESQUEMA.split(';'):
+                if comando.strip():
+                    conn.execute(comando)
+            conn.execute(f'PRAGMA user_version = {VERSAO_ESQUEMA}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _conexao(self):
+        """Uma conexão por thread e por processo (conexões não sobrevivem a fork)"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.caminho, isolation_level=None, check_same_thread=False, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def _eventos_processo(self):
+        # Events do processo pai não servem no filho
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._eventos = {}
+        return self._eventos
+
+    # ---------------- Dispositivos ----------------
+
+    def atualizar_dispositivo(self, device_id, info):
+        """
+        Grava o registro do dispositivo. Retorna True se a mudança é
+        visível no dashboard (novo, status/IP diferente ou voltou a ficar ativo).
+        """
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            linha = conn.execute('SELECT dados FROM dispositivos WHERE device_id = ?', (device_id,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO dispositivos (device_id, dados, last_seen, aguardando) '
+                         'VALUES (?, ?, ?, ?)',
+                         (device_id, _serializar_dispositivo(info), info['last_seen'].timestamp(),
+                          int(info.get('aguardando_comando', False))))
+            anterior = _desserializar_dispositivo(linha[0]) if linha else None
+            mudou = _mudanca_visivel(anterior, info, anterior is not None and
+                                     _ativo(anterior, datetime.now(), self.timeout_ativo))
+            if mudou:
+                self._incrementar('dispositivos')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return mudou
+
+    def dispositivos(self):
+        linhas = self._conexao().execute('SELECT device_id, dados FROM dispositivos').fetchall()
+        return {device_id: _desserializar_dispositivo(dados) for device_id, dados in linhas}
+
+    def _limite_ativo(self):
+        return time.time() - self.timeout_ativo
+
+    def contagem_ativos(self):
+        # Duas faixas de índice em vez de um OR (que forçaria varredura)
+        conn = self._conexao()
+        limite = self._limite_ativo()
+        recentes = conn.execute('SELECT COUNT(*) FROM dispositivos WHERE last_seen > ?', (limite,)).fetchone()[0]
+        parados = conn.execute('SELECT COUNT(*) FROM dispositivos WHERE aguardando = 1 AND last_seen <= ?',
+                               (limite,)).fetchone()[0]
+        return recentes + parados
+
+    def dispositivos_ativos(self):
+        """Registros dos dispositivos ativos (mesmas faixas de índice da contagem)"""
+        conn = self._conexao()
+        limite = self._limite_ativo()
+        linhas = conn.execute('SELECT dados FROM dispositivos WHERE last_seen > ?', (limite,)).fetchall()
+        linhas += conn.execute('SELECT dados FROM dispositivos WHERE aguardando = 1 AND last_seen <= ?',
+                               (limite,)).fetchall()
+        return [_desserializar_dispositivo(linha[0]) for linha in linhas]
+
+    def dispositivo_recente_ativo(self):
+        """Registro do dispositivo ativo visto por último (ou None)"""
+        conn = self._conexao()
+        linha = conn.execute('SELECT dados FROM dispositivos WHERE last_seen > ? ORDER BY last_seen DESC LIMIT 1',
+                             (self._limite_ativo(),)).fetchone()
+        if linha is None:
+            linha = conn.execute('SELECT dados FROM dispositivos WHERE aguardando = 1 '
+                                 'ORDER BY last_seen DESC LIMIT 1').fetchone()
+        return _desserializar_dispositivo(linha[0]) if linha else None
+
+    def versao_dispositivos(self):
+        """
+        Muda sempre que a lista visível muda: contador gravado pelas
+        atualizações de qualquer worker + nº de ativos (expiração por tempo)
+        """
+        linha = self._conexao().execute("SELECT versao FROM marcadores WHERE chave = 'dispositivos'").fetchone()
+        return (linha[0] if linha else 0, self.contagem_ativos())
+
+    def expirar_dispositivos(self, idade_max_s):
+        """Remove dispositivos inativos não vistos há mais de idade_max_s (índice por last_seen)"""
+        conn = self._conexao()
+        removidos = [linha[0] for linha in conn.execute(
+            'DELETE FROM dispositivos WHERE last_seen < ? AND aguardando = 0 RETURNING device_id',
+            (time.time() - idade_max_s,)).fetchall()]
+        if removidos:
+            self._incrementar('dispositivos')
+            with self._lock:
+                eventos = self._eventos_processo()
+                for device_id in removidos:
+                    eventos.pop(device_id, None)
+        return removidos
+
+    def remover_dispositivo(self, device_id):
+        self._conexao().execute('DELETE FROM dispositivos WHERE device_id = ?', (device_id,))
+        self._incrementar('dispositivos')
+        with self._lock:
+            self._eventos_processo().pop(device_id, None)
+
+    # ---------------- Comandos ----------------
+
+    def _transacao(self, funcao, *args):
+        conn = self._conexao()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            resultado = funcao(conn, *args)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return resultado
+
+    def adicionar_ouvinte(self, funcao):
+        """
+        funcao(device_ids) é chamada quando um comando para esses
+        dispositivos é enfileirado por este processo. Comandos de outros
+        workers só são vistos consultando o banco (intervalo_espera).
+        """
+        self._ouvintes.append(funcao)
+
+    def remover_ouvinte(self, funcao):
+        """Desfaz adicionar_ouvinte (ex.: servidor asyncio encerrado)"""
+        if funcao in self._ouvintes:
+            self._ouvintes.remove(funcao)
+
+    def _acordar(self, dispositivos):
+        dispositivos = list(dispositivos)
+        if not dispositivos:
+            return
+        with self._lock:
+            eventos = [self._eventos_processo().get(d) for d in dispositivos]
+        for evento in eventos:
+            if evento is not None:
+                evento.set()
+        for ouvinte in self._ouvintes:
+            ouvinte(dispositivos)
+
+    def _inserir_comando(self, conn, registro):
+        """Grava o comando; False se o dispositivo já tem max_comandos em aberto"""
+        agora = registro['criado_em']
+        # Pendentes com TTL vencido ainda não processado não ocupam a fila
+        abertos = conn.execute(
+            "SELECT COUNT(*) FROM comandos WHERE device_id = ? AND estado IN ('pendente', 'entregue') "
+            "AND (estado = 'entregue' OR prazo > ?)", (registro['device_id'], agora)).fetchone()[0]
+        if abertos >= self.max_comandos:
+            return False
+        valores = dict(registro, comando=json.dumps(registro['comando'], ensure_ascii=False))
+        conn.execute(f'INSERT INTO comandos ({", ".join(CAMPOS_COMANDO)}) '
+                     f'VALUES ({", ".join("?" * len(CAMPOS_COMANDO))})',
+                     [valores[campo] for campo in CAMPOS_COMANDO])
+        return True
+
+    def enfileirar_comandos(self, pedidos):
+        """
+        Enfileira vários comandos numa única transação; acorda na hora os
+        long-polls deste processo. pedidos: [(device_id, comando,
+        prioridade, ttl_s)]. Retorna (registros, rejeitados): rejeitados
+        são os device_ids que já tinham max_comandos em aberto.
+        """
+        agora = time.time()
+        novos = [_novo_comando(d, comando, prioridade, ttl_s, agora) for d, comando, prioridade, ttl_s in pedidos]
+        aceitos = self._transacao(lambda conn: [self._inserir_comando(conn, registro) for registro in novos])
+        registros = [_registro_publico(r) for r, aceito in zip(novos, aceitos) if aceito]
+        self._acordar([registro['device_id'] for registro in registros])
+        return registros, [r['device_id'] for r, aceito in zip(novos, aceitos) if not aceito]
+
+    def enfileirar_comando(self, device_id, comando, prioridade=0, ttl_s=COMANDO_TTL_PADRAO_S):
+        """
+        Coloca o comando na fila do dispositivo; acorda na hora um long-poll
+        deste processo. Retorna o registro (com command_id);
+        FilaComandosCheia se o dispositivo já tem max_comandos em aberto.
+        """
+        registros, _ = self.enfileirar_comandos([(device_id, comando, prioridade, ttl_s)])
+        if not registros:
+            raise FilaComandosCheia(f'{device_id} já tem {self.max_comandos} comandos em aberto')
+        return registros[0]
+
+    def _retirar(self, device_id):
+        agora = time.time()
+        linha = self._conexao().execute(
+            "UPDATE comandos SET estado = 'entregue', entregue_em = ?, prazo = ?, entregas = entregas + 1 "
+            "WHERE command_id = (SELECT command_id FROM comandos WHERE device_id = ? AND estado = 'pendente' "
+            "AND prazo > ? ORDER BY prioridade DESC, criado_em LIMIT 1) RETURNING command_id, comando",
+            (agora, agora + COMANDO_TIMEOUT_ACK_S, device_id, agora)).fetchone()
+        return _carga_comando(linha[0], json.loads(linha[1])) if linha else None
+
+    def retirar_comando(self, device_id, espera_s=0):
+        """
+        Entrega o próximo comando do dispositivo, aguardando até espera_s
+        segundos (long-poll). Consulta o banco a cada intervalo_espera para
+        ver comandos enfileirados por outros workers.
+        """
+        comando = self._retirar(device_id)
+        if comando is not None or espera_s <= 0:
+            return comando
+
+        with self._lock:
+            evento = self._eventos_processo().setdefault(device_id, threading.Event())
+        limite = time.monotonic() + espera_s
+        while True:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return None
+            evento.clear()
+            comando = self._retirar(device_id)
+            if comando is not None:
+                return comando
+            evento.wait(min(self.intervalo_espera, restante))
+
+    def _linha_comando(self, linha):
+        registro = dict(zip(CAMPOS_COMANDO, linha))
+        registro['comando'] = json.loads(registro['comando'])
+        if registro['resultado'] is not None:
+            registro['resultado'] = json.loads(registro['resultado'])
+        return registro
+
+    def _ler_comando(self, conn, command_id):
+        linha = conn.execute(f'SELECT {", ".join(CAMPOS_COMANDO)} FROM comandos WHERE command_id = ?',
+                             (command_id,)).fetchone()
+        return self._linha_comando(linha) if linha is not None else None
+
+    def _concluir(self, conn, command_id, device_id, resultado):
+        agora = time.time()
+        registro = self._ler_comando(conn, command_id)
+        if registro is None or (device_id is not None and registro['device_id'] != device_id):
+            return None
+        duplicado = registro['estado'] == 'concluido'
+        if not duplicado:
+            registro.update(estado='concluido', finalizado_em=agora, prazo=None, resultado=resultado)
+            conn.execute("UPDATE comandos SET estado = 'concluido', finalizado_em = ?, prazo = NULL, resultado = ? "
+                         "WHERE command_id = ?",
+                         (agora, json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                          command_id))
+        return _conclusao(registro, duplicado, agora)
+
+    def concluir_comando(self, command_id, device_id=None, resultado=None):
+        """
+        Marca o comando como concluído ao chegar o resultado (resumo
+        guardado no registro). Retorna o registro + latencia_s (criação ->
+        resultado) e 'duplicado' (já estava concluído), ou None se o
+        comando não existe / é de outro dispositivo
+        """
+        return self._transacao(self._concluir, command_id, device_id, resultado)
+
+    def comando(self, command_id):
+        registro = self._ler_comando(self._conexao(), command_id)
+        return _registro_publico(registro) if registro is not None else None
+
+    def comandos(self, command_ids):
+        """{command_id: registro} dos comandos encontrados (consultas em blocos pela chave)"""
+        conn = self._conexao()
+        command_ids = list(command_ids)
+        registros = {}
+        for i in range(0, len(command_ids), BLOCO_CONSULTA):
+            bloco = command_ids[i:i + BLOCO_CONSULTA]
+            for linha in conn.execute(f'SELECT {", ".join(CAMPOS_COMANDO)} FROM comandos '
+                                      f'WHERE command_id IN ({", ".join("?" * len(bloco))})', bloco):
+                registro = self._linha_comando(linha)
+                registros[registro['command_id']] = _registro_publico(registro)
+        return registros
+
+    def registrar_difusao(self, difusao):
+        self._conexao().execute('INSERT OR REPLACE INTO difusoes (broadcast_id, dados, prazo) VALUES (?, ?, ?)',
+                                (difusao['broadcast_id'], json.dumps(difusao, ensure_ascii=False),
+                                 difusao['prazo']))
+
+    def difusao(self, broadcast_id):
+        linha = self._conexao().execute('SELECT dados FROM difusoes WHERE broadcast_id = ?',
+                                        (broadcast_id,)).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def registrar_sessao(self, sessao):
+        self._conexao().execute('INSERT OR REPLACE INTO sessoes (session_id, dados, prazo) VALUES (?, ?, ?)',
+                                (sessao['session_id'], json.dumps(sessao, ensure_ascii=False), sessao['prazo']))
+
+    def sessao(self, session_id):
+        linha = self._conexao().execute('SELECT dados FROM sessoes WHERE session_id = ?',
+                                        (session_id,)).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def _atualizar_sessao(self, conn, sessao):
+        linha = conn.execute('SELECT dados FROM sessoes WHERE session_id = ?', (sessao['session_id'],)).fetchone()
+        if linha is None or json.loads(linha[0]).get('versao', 0) != sessao.get('versao', 0):
+            return False
+        sessao['versao'] = sessao.get('versao', 0) + 1
+        conn.execute('UPDATE sessoes SET dados = ?, prazo = ? WHERE session_id = ?',
+                     (json.dumps(sessao, ensure_ascii=False), sessao['prazo'], sessao['session_id']))
+        return True
+
+    def atualizar_sessao(self, sessao):
+        """Grava a sessão se a versão lida ainda é a do banco (BEGIN IMMEDIATE); ver EstadoMemoria"""
+        return self._transacao(self._atualizar_sessao, sessao)
+
+    def _processar_prazos_comandos(self, conn):
+        agora = time.time()
+        expirados = conn.execute(
+            "UPDATE comandos SET estado = 'expirado', finalizado_em = ?, prazo = NULL "
+            "WHERE estado IN ('pendente', 'entregue') AND prazo <= ? "
+            "AND (estado = 'pendente' OR entregas >= ?) RETURNING command_id",
+            (agora, agora, COMANDO_MAX_ENTREGAS)).fetchall()
+        # Entregues sem resultado voltam para a fila (mesma posição: criado_em)
+        devolvidos = conn.execute(
+            "UPDATE comandos SET estado = 'pendente', prazo = ? + ttl_s "
+            "WHERE estado IN ('pendente', 'entregue') AND prazo <= ? AND estado = 'entregue' "
+            "RETURNING device_id", (agora, agora)).fetchall()
+        conn.execute("DELETE FROM comandos WHERE estado IN ('concluido', 'expirado') AND finalizado_em < ?",
+                     (agora - COMANDO_RETENCAO_S,))
+        conn.execute('DELETE FROM difusoes WHERE prazo < ?', (agora - COMANDO_RETENCAO_S,))
+        conn.execute('DELETE FROM sessoes WHERE prazo < ?', (agora,))
+        return len(expirados), {linha[0] for linha in devolvidos}
+
+    def expirar_comandos(self):
+        """Processa os prazos vencidos (índice por prazo); retorna o nº de comandos expirados"""
+        expirados, devolvidos = self._transacao(self._processar_prazos_comandos)
+        self._acordar(devolvidos)
+        return expirados
+
+    # ---------------- Última análise / recarga ----------------
+
+    def _incrementar(self, chave, valor=None):
+        linha = self._conexao().execute(
+            'INSERT INTO marcadores (chave, versao, pid, valor) VALUES (?, 1, ?, ?) '
+            'ON CONFLICT (chave) DO UPDATE SET versao = versao + 1, pid = excluded.pid, valor = excluded.valor '
+            'RETURNING versao', (chave, os.getpid(), valor)).fetchone()
+        return linha[0]
+
+    def definir_ultima_analise(self, resultado):
+        self._incrementar('analise', json.dumps(resultado, ensure_ascii=False, default=str))
+
+    def ultima_analise(self):
+        linha = self._conexao().execute("SELECT valor FROM marcadores WHERE chave = 'analise'").fetchone()
+        return json.loads(linha[0]) if linha and linha[0] else None
+
+    def solicitar_recarga(self):
+        """Registra pedido de recarga do modelo; retorna o novo número do pedido"""
+        return self._incrementar('recarga')
+
+    def marcadores(self):
+        """
+        Contadores de mudança lidos pelo monitor de cada worker:
+        {'analise': (versao, pid), 'recarga': versao}
+        """
+        linhas = {chave: (versao, pid) for chave, versao, pid in
+                  self._conexao().execute('SELECT chave, versao, pid FROM marcadores')}
+        return {
+            'analise': linhas.get('analise', (0, None)),
+            'recarga': linhas.get('recarga', (0, None))[0],
+        }
+
+    def estatisticas(self):
+        conn = self._conexao()
+        return {
+            'backend': 'sqlite',
+            'arquivo': self.caminho,
+            'dispositivos': conn.execute('SELECT COUNT(*) FROM dispositivos').fetchone()[0],
+            'dispositivos_ativos': self.contagem_ativos(),
+            'comandos': dict(conn.execute('SELECT estado, COUNT(*) FROM comandos GROUP BY estado').fetchall()),
+        }
+
+
+def criar_estado(caminho=None, timeout_ativo_s=TIMEOUT_ATIVO_PADRAO_S):
+    """EstadoSQLite se houver caminho configurado; senão EstadoMemoria"""
+    if caminho:
+        return EstadoSQLite(caminho, timeout_ativo_s)
+    return EstadoMemoria(timeout_ativo_s)
@@ -0,0 +1,127 @@
+"""
+Barramento de Eventos (Server-Sent Events) - Classificação de Grãos
+
+Publica mudanças do servidor (dispositivos, status do modelo, novas
+análises) para os dashboards conectados em /events, substituindo o
+polling de /status, /devices e /last_analysis.
+
+- Cada cliente tem um buffer limitado: cliente lento perde os eventos
+  mais antigos em vez de segurar memória ou bloquear quem publica
+- Eventos de "snapshot" (dispositivos, status) são coalescidos: só o
+  mais recente de cada tipo fica no buffer
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import json
+import threading
+from collections import deque
+
+EVENTOS_COALESCENTES = ('dispositivos', 'status')
+
+
+def formatar_evento(tipo, payload):
+    """Evento no formato text/event-stream (payload já serializado)"""
+    return f"event: {tipo}\ndata: {payload}\n\n"
+
+
+class Assinante:
+    """
+    Buffer limitado de eventos de um cliente SSE
+
+    ao_publicar: função opcional chamada a cada evento novo (ex.: acordar
+    um fluxo asyncio, que não pode esperar na Condition)
+    """
+
+    def __init__(self, max_eventos):
+        self._eventos = deque(maxlen=max_eventos)
+        self._cond = threading.Condition()
+        self.descartados = 0
+        self.ao_publicar = None
+
+    def publicar(self, tipo, payload):
+        with self._cond:
+            if tipo in EVENTOS_COALESCENTES:
+                for item in list(self._eventos):
+                    if item[0] == tipo:
+                        self._eventos.remove(item)
+            if len(self._eventos) == self._eventos.maxlen:
+                self.descartados += 1
+            self._eventos.append((tipo, payload))
+            self._cond.notify()
+        if self.ao_publicar is not None:
+            self.ao_publicar()
+
+    def proximo(self, timeout):
+        """Próximo evento (tipo, payload) ou None se expirar o tempo"""
+        with self._cond:
+            if not self._eventos:
+                self._cond.wait(timeout)
+            if self._eventos:
+                return self._eventos.popleft()
+            return None
+
+
+class BarramentoEventos:
+    """Distribui eventos para todos os assinantes conectados"""
+
+    def __init__(self, max_eventos_cliente=100):
+        self.max_eventos_cliente = max_eventos_cliente
+        self._assinantes = set()
+        self._lock = threading.Lock()
+        self.publicados = 0
+
+    def assinar(self):
+        assinante = Assinante(self.max_eventos_cliente)
+        with self._lock:
+            self._assinantes.add(assinante)
+        return assinante
+
+    def cancelar(self, assinante):
+        with self._lock:
+            self._assinantes.discard(assinante)
+
+    def tem_assinantes(self):
+        with self._lock:
+            return bool(self._assinantes)
+
+    def publicar(self, tipo, dados):
+        """Serializa uma vez e entrega a todos os assinantes"""
+        with self._lock:
+            assinantes = list(self._assinantes)
+            self.publicados += 1
+        if not assinantes:
+            return
+        payload = json.dumps(dados, ensure_ascii=False, default=str)
+        for assinante in assinantes:
+            assinante.publicar(tipo, payload)
+
+    def estatisticas(self):
+        with self._lock:
+            assinantes = list(self._assinantes)
+        return {
+            'clientes': len(assinantes),
+            'eventos_publicados': self.publicados,
+            'eventos_descartados': sum(a.descartados for a in assinantes),
+        }
+
+    def fluxo(self, assinante, eventos_iniciais=(), heartbeat_s=15):
+        """
+        Gerador no formato text/event-stream.
+
+        Envia primeiro os snapshots iniciais e depois os eventos publicados;
+        um comentário de heartbeat mantém a conexão viva e permite detectar
+        clientes desconectados. O assinante é removido ao fechar o fluxo.
+        """
+        try:
+            yield "retry: 3000\n\n"
+            for tipo, dados in eventos_iniciais:
+                yield formatar_evento(tipo, json.dumps(dados, ensure_ascii=False, default=str))
+            while True:
+                evento = assinante.proximo(heartbeat_s)
+                if evento is None:
+                    yield ": ping\n\n"
+                    continue
+                yield formatar_evento(*evento)
+        finally:
+            self.cancelar(assinante)
@@ -0,0 +1,238 @@
+"""
+Exportação em Fluxo do Histórico - Classificação de Grãos
+
+Geradores que transformam um iterador de análises em bytes prontos para
+uma resposta HTTP em streaming, bloco a bloco (memória constante). As
+variantes *_colunas recebem blocos já colunares ({coluna: array}), como
+os da classificação em lote (classificar_arquivos.py):
+
+- 'csv'     : CSV com as mesmas colunas da exportação original
+- 'csv.gz'  : o mesmo CSV comprimido em gzip
+- 'npz'     : arquivo NumPy (.npz) colunar; cada bloco vira um grupo de
+              arrays '<bloco>/<coluna>' (estilo row groups do Parquet)
+- 'arrow'   : Arrow IPC stream, um RecordBatch por bloco (requer pyarrow)
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import csv
+import io
+import zipfile
+import zlib
+
+import numpy as np
+
+# (cabeçalho CSV, nome da coluna binária, extrator, dtype NumPy; str = texto)
+COLUNAS = [
+    ('Timestamp', 'timestamp', lambda a: a.get('timestamp', ''), str),
+    ('Device ID', 'device_id', lambda a: a.get('device_id', ''), str),
+    ('Espécie', 'especie', lambda a: a.get('especie', ''), str),
+    ('Confiança %', 'confianca', lambda a: a.get('confianca', ''), np.float64),
+    ('Status', 'status', lambda a: a.get('status', ''), str),
+    ('I1_NDVI', 'I1_NDVI', lambda a: a.get('indices', {}).get('I1_NDVI', ''), np.float64),
+    ('I2_Water', 'I2_Water', lambda a: a.get('indices', {}).get('I2_Water', ''), np.float64),
+    ('I3_Lipid', 'I3_Lipid', lambda a: a.get('indices', {}).get('I3_Lipid', ''), np.float64),
+    ('I4_Slope_Alt', 'I4_Slope_Alt', lambda a: a.get('indices', {}).get('I4_Slope_Alt', ''), np.float64),
+    ('SVM Score', 'svm_score', lambda a: a.get('detalhes_anomalia', {}).get('svm_score', ''), np.float64),
+    ('SVM Anomalia', 'svm_detectou', lambda a: a.get('detalhes_anomalia', {}).get('svm_detectou', ''), np.bool_),
+    ('MAD Violações', 'mad_violacoes', lambda a: a.get('detalhes_anomalia', {}).get('mad_violacoes', ''), np.int16),
+    ('MAD Anomalia', 'mad_detectou', lambda a: a.get('detalhes_anomalia', {}).get('mad_detectou', ''), np.bool_),
+    ('Confiança Baixa', 'confianca_baixa', lambda a: a.get('detalhes_anomalia', {}).get('confianca_baixa', ''), np.bool_),
+]
+
+FORMATOS = {
+    'csv': ('text/csv', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'npz': ('application/octet-stream', 'npz'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+
+
+def _blocos(analises, tamanho):
+    bloco = []
+    for analise in analises:
+        bloco.append(analise)
+        if len(bloco) >= tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def _valor_numerico(valor, dtype):
+    if valor == '' or valor is None:
+        return np.nan if dtype == np.float64 else 0
+    return valor
+
+
+# ==================== CSV ====================
+
+def gerar_csv(analises, comprimir=False, tamanho_bloco=500):
+    """CSV em blocos; com comprimir=True o fluxo sai em gzip"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drenar():
+        dados = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(dados) if compressor else dados
+
+    writer.writerow([c[0] for c in COLUNAS])
+    for bloco in _blocos(analises, tamanho_bloco):
+        for analise in bloco:
+            writer.writerow([c[2](analise) for c in COLUNAS])
+        dados = drenar()
+        if dados:
+            yield dados
+
+    dados = drenar()
+    if compressor:
+        dados += compressor.flush()
+    if dados:
+        yield dados
+
+
+def gerar_csv_colunas(blocos, comprimir=False, cabecalho=True):
+    """
+    CSV a partir de blocos já colunares ({coluna: array}); o cabeçalho
+    vem das chaves do primeiro bloco. Com comprimir=True a saída é um
+    membro gzip completo, que pode ser concatenado a outros (RFC 1952).
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    nomes = None
+
+    for colunas in blocos:
+        if nomes is None:
+            nomes = list(colunas)
+            if cabecalho:
+                writer.writerow(nomes)
+        writer.writerows(zip(*(colunas[nome].tolist() for nome in nomes)))
+        dados = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        if compressor:
+            dados = compressor.compress(dados)
+        if dados:
+            yield dados
+
+    if compressor:
+        yield compressor.flush()
+
+
+# ==================== NPZ (colunar) ====================
+
+class _SaidaFluxo:
+    """
+    Arquivo só-escrita não posicionável (o zipfile passa a usar data
+    descriptors); os bytes escritos são drenados a cada bloco
+    """
+
+    closed = False
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def drenar(self):
+        dados = b''.join(self.partes)
+        self.partes = []
+        return dados
+
+
+def _colunas_bloco(bloco):
+    colunas = {}
+    for _, nome, extrator, dtype in COLUNAS:
+        valores = [extrator(a) for a in bloco]
+        if dtype is str:
+            colunas[nome] = np.array([str(v) for v in valores], dtype='U')
+        else:
+            colunas[nome] = np.array([_valor_numerico(v, dtype) for v in valores], dtype=dtype)
+    return colunas
+
+
+def gerar_npz(analises, tamanho_bloco=5000):
+    """
+    Arquivo .npz em fluxo. np.load() retorna arrays 'bloco_00000/confianca',
+    'bloco_00000/especie', ...; concatenar os blocos reconstrói cada coluna.
+    """
+    return gerar_npz_colunas(_colunas_bloco(b) for b in _blocos(analises, tamanho_bloco))
+
+
+def gerar_npz_colunas(blocos):
+    """.npz em fluxo a partir de blocos já colunares ({coluna: array})"""
+    saida = _SaidaFluxo()
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_STORED) as arquivo:
+        for n, colunas in enumerate(blocos):
+            for nome, array in colunas.items():
+                with arquivo.open(f'bloco_{n:05d}/{nome}.npy', 'w', force_zip64=True) as destino:
+                    np.lib.format.write_array(destino, array, allow_pickle=False)
+            yield saida.drenar()
+    yield saida.drenar()
+
+
+# ==================== ARROW ====================
+
+def arrow_disponivel():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def gerar_arrow(analises, tamanho_bloco=5000):
+    """Arrow IPC stream: esquema + um RecordBatch por bloco"""
+    return gerar_arrow_colunas(_colunas_bloco(b) for b in _blocos(analises, tamanho_bloco))
+
+
+def gerar_arrow_colunas(blocos):
+    """Arrow IPC stream a partir de blocos já colunares ({coluna: array})"""
+    import pyarrow as pa
+
+    saida = _SaidaFluxo()
+    escritor = None
+    for colunas in blocos:
+        lote = pa.RecordBatch.from_pydict(colunas)
+        if escritor is None:
+            escritor = pa.ipc.new_stream(saida, lote.schema)
+        escritor.write_batch(lote)
+        yield saida.drenar()
+    if escritor is not None:
+        escritor.close()
+        yield saida.drenar()
+
+
+def gerar(formato, analises):
+    """Seleciona o gerador pelo nome do formato"""
+    if formato == 'csv':
+        return gerar_csv(analises)
+    if formato == 'csv.gz':
+        return gerar_csv(analises, comprimir=True)
+    if formato == 'npz':
+        return gerar_npz(analises)
+    if formato == 'arrow':
+        return gerar_arrow(analises)
+    raise ValueError(f"Formato desconhecido: {formato}")
+
+
+def gerar_colunas(formato, blocos):
+    """Como gerar(), para blocos já colunares ({coluna: array})"""
+    if formato == 'csv':
+        return gerar_csv_colunas(blocos)
+    if formato == 'csv.gz':
+        return gerar_csv_colunas(blocos, comprimir=True)
+    if formato == 'npz':
+        return gerar_npz_colunas(blocos)
+    if formato == 'arrow':
+        return gerar_arrow_colunas(blocos)
+    raise ValueError(f"Formato desconhecido: {formato}")
@@ -0,0 +1,73 @@
+"""
+Formato Binário de Espectro - Classificação de Grãos
+
+Alternativa compacta ao JSON de /esp32/result (Content-Type
+application/vnd.graos.espectro). O ESP32 escreve os floats direto do
+buffer calibrado, sem montar um documento JSON, e o servidor lê as
+bandas como uma visão NumPy sobre o próprio corpo (sem cópia).
+
+Layout (little-endian):
+
+    0  2s  magia 'ES'
+    2  B   versão (VERSAO_FORMATO)
+    3  B   n_bandas
+    4  B   bytes do device_id
+    5  B   bytes do command_id (0: sem comando)
+    6  H   reservado (0)
+    8      n_bandas x float32    (alinhados em 4 bytes)
+    ..     device_id (UTF-8), command_id (ASCII)
+
+Com 18 bandas, device_id de 12 e command_id de 16 caracteres são 108
+bytes, contra ~450 do JSON equivalente.
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import struct
+
+import numpy as np
+
+TIPO_ESPECTRO_BINARIO = 'application/vnd.graos.espectro'
+MAGIA = b'ES'
+VERSAO_FORMATO = 1
+
+CABECALHO = struct.Struct('<2sBBBBH')
+TIPO_BANDA = np.dtype('<f4')
+
+
+def codificar_espectro(device_id, espectro, command_id=None):
+    """Corpo binário (bytes) para /esp32/result"""
+    device = device_id.encode('utf-8')
+    comando = (command_id or '').encode('ascii')
+    bandas = np.asarray(espectro, dtype=TIPO_BANDA)
+    if bandas.ndim != 1 or len(bandas) > 255 or len(device) > 255 or len(comando) > 255:
+        raise ValueError("Espectro ou identificadores grandes demais para o formato binário")
+    cabecalho = CABECALHO.pack(MAGIA, VERSAO_FORMATO, len(bandas), len(device), len(comando), 0)
+    return cabecalho + bandas.tobytes() + device + comando
+
+
+def decodificar_espectro(corpo):
+    """
+    (device_id, command_id ou None, espectro) de um corpo binário
+
+    espectro é uma visão float32 somente leitura sobre 'corpo' (sem
+    cópia). ValueError se o corpo não segue o formato.
+    """
+    if len(corpo) < CABECALHO.size:
+        raise ValueError(f"Corpo binário curto: {len(corpo)} bytes")
+    magia, versao, n_bandas, n_device, n_comando, _ = CABECALHO.unpack_from(corpo)
+    if magia != MAGIA:
+        raise ValueError("Corpo binário sem a assinatura 'ES'")
+    if versao != VERSAO_FORMATO:
+        raise ValueError(f"Versão do formato binário não suportada: {versao}")
+
+    inicio_ids = CABECALHO.size + n_bandas * TIPO_BANDA.itemsize
+    if len(corpo) != inicio_ids + n_device + n_comando:
+        raise ValueError(f"Corpo binário com {len(corpo)} bytes "
+                         f"(esperado: {inicio_ids + n_device + n_comando})")
+
+    espectro = np.frombuffer(corpo, dtype=TIPO_BANDA, count=n_bandas, offset=CABECALHO.size)
+    ids = bytes(memoryview(corpo)[inicio_ids:])
+    device_id = ids[:n_device].decode('utf-8')
+    command_id = ids[n_device:].decode('ascii') or None
+    return device_id, command_id, espectro
@@ -0,0 +1,43 @@
+"""
+Configuração gunicorn - Servidor de Inferência para Classificação de Grãos
+
+Uso (Linux, produção):
+gunicorn -c gunicorn.conf.py "servidor_flask:criar_app()"
+
+- preload_app: o modelo é carregado uma vez no mestre; os workers o
+  herdam por copy-on-write (o artefato compilado é ainda um mmap)
+- Dispositivos, comandos e última análise ficam em SQLite compartilhado
+  (ESTADO_COMPARTILHADO), então qualquer worker atende qualquer ESP32
+- gthread: long-poll e SSE ocupam uma thread cada enquanto esperam
+
+Variáveis: WORKERS (padrão: nº de CPUs), THREADS (padrão 32), BIND
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import gc
+import multiprocessing
+import os
+
+os.environ.setdefault('ESTADO_COMPARTILHADO', 'estado_servidor.db')
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', '32'))
+preload_app = True
+
+# Heartbeat do worker: acima do long-poll máximo (LONG_POLL_MAX_S = 30)
+timeout = 60
+graceful_timeout = 35
+
+
+def pre_fork(server, worker):
+    # Objetos já criados (modelo, app) saem do GC: as páginas continuam
+    # compartilhadas entre os workers em vez de serem copiadas pela coleta
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    import servidor_flask
+    servidor_flask.iniciar_servicos()
@@ -29,6 +29,17 @@ const char* password = "sua_senha";
 const char* serverUrl = "http://seu_ip_do_servidor_flask:5000";
 const char* pollEndpoint = "/esp32/poll";
 const char* resultEndpoint = "/esp32/result";
+const char* scanEndpoint = "/esp32/scan";
+
+// Grupos do dispositivo para análises em lote (/command/broadcast),
+// separados por vírgula. Ex.: "silo1,recepcao". Vazio: sem grupo
+const char* deviceTags = "";
+
+// Resultado em formato binário (108 bytes contra ~450 do JSON, sem montar
+// documento). false: JSON, para servidores sem suporte ao formato
+const bool USE_BINARY_RESULT = true;
+#define BINARY_CONTENT_TYPE "application/vnd.graos.espectro"
+#define BINARY_FORMAT_VERSION 1
 
 // Sensor AS7265X
 AS7265X sensor;
@@ -68,11 +79,29 @@ enum SystemState {
 SystemState currentState = STATE_WAITING;
 
 const int WARMUP_TIME = 5000;  // MESMO DA COLETA
+
+// Sessão de varredura: leituras repetidas da mesma amostra até o servidor
+// decidir (amostras claras param em 2-3 leituras, ambíguas recebem mais).
+// O aquecimento é mais curto porque a média das leituras substitui a
+// leitura única. false: uma leitura após WARMUP_TIME (/esp32/result)
+const bool USE_SCAN_SESSION = true;
+const int SESSION_WARMUP_TIME = 2000;
+const int SESSION_MAX_SCANS = 10;  // limite local; o servidor informa o seu
 String deviceId = "";
 
+// Comando em execução: o servidor recebe o command_id de volta junto
+// com o resultado (vazio em análises iniciadas localmente)
+String currentCommandId = "";
+
+// Máximo de leituras da sessão em curso (menor entre o local e o do servidor)
+int sessionMaxScans = SESSION_MAX_SCANS;
+
 // Dados espectrais calibrados (DECLARAR AQUI!)
 float spectralData[18];
 
+// Buffer do corpo binário: cabeçalho + 18 floats + IDs (até 64 bytes)
+uint8_t binaryBody[8 + sizeof(spectralData) + 64];
+
 // Resultado da análise
 String lastEspecie = "";
 float lastConfianca = 0;
@@ -82,6 +111,11 @@ String lastStatus = "";
 unsigned long lastPoll = 0;
 const unsigned long POLL_INTERVAL = 2000;
 
+// Long-poll: em espera, o servidor segura o poll até chegar um comando
+// (ou LONG_POLL_WAIT_S) e informa em "poll_ms" quando consultar de novo
+const int LONG_POLL_WAIT_S = 25;
+unsigned long nextPollDelay = POLL_INTERVAL;
+
 // ==================== SETUP ====================
 
 void setup() {
@@ -149,7 +183,7 @@ void setup() {
 
 void loop() {
   // Verificar comandos do servidor periodicamente
-  if (millis() - lastPoll > POLL_INTERVAL) {
+  if (millis() - lastPoll >= nextPollDelay) {
     checkForCommands();
     lastPoll = millis();
   }
@@ -191,6 +225,16 @@ void checkForCommands() {
   requestDoc["device_id"] = deviceId;
   requestDoc["status"] = getStateString();
   requestDoc["ip"] = WiFi.localIP().toString();
+  if (strlen(deviceTags) > 0) {
+    requestDoc["tags"] = deviceTags;
+  }
+
+  // Só estaciona no servidor quando está ocioso
+  bool longPoll = (currentState == STATE_WAITING);
+  if (longPoll) {
+    requestDoc["wait"] = LONG_POLL_WAIT_S;
+    http.setTimeout((LONG_POLL_WAIT_S + 5) * 1000);
+  }
   
   String requestBody;
   serializeJson(requestDoc, requestBody);
@@ -203,33 +247,73 @@ void checkForCommands() {
     DynamicJsonDocument responseDoc(1024);
     deserializeJson(responseDoc, response);
     
+    // Servidor indica quando reconectar (0 = imediatamente após long-poll)
+    nextPollDelay = responseDoc.containsKey("poll_ms")
+                      ? responseDoc["poll_ms"].as<unsigned long>()
+                      : POLL_INTERVAL;
+    
     if (responseDoc.containsKey("command")) {
       String command = responseDoc["command"];
       
       if (command == "analyze") {
         Serial.println("📋 Comando recebido: Analisar grão");
+        currentCommandId = responseDoc.containsKey("command_id")
+                             ? responseDoc["command_id"].as<String>()
+                             : String("");
         currentState = STATE_COLLECTING;
       }
     }
+  } else {
+    // Falha/timeout: volta ao intervalo padrão para não martelar o servidor
+    nextPollDelay = POLL_INTERVAL;
   }
   
   http.end();
 }
 
-void sendResultsToServer() {
-  if (WiFi.status() != WL_CONNECTED) {
-    currentState = STATE_DISPLAYING;
-    return;
+// Corpo binário (formato_espectro.py no servidor), little-endian:
+// 'E' 'S', versão, nº de bandas, tamanho do device_id, tamanho do
+// command_id, 2 bytes reservados, 18 float32 e os dois IDs.
+// Retorna o tamanho, ou 0 se não couber (o envio cai para JSON)
+size_t encodeSpectrumBinary(uint8_t* buffer, size_t capacity) {
+  size_t deviceLen = deviceId.length();
+  size_t commandLen = currentCommandId.length();
+  size_t total = 8 + sizeof(spectralData) + deviceLen + commandLen;
+  if (deviceLen > 255 || commandLen > 255 || total > capacity) {
+    return 0;
   }
   
-  Serial.println("📤 Enviando espectro ao servidor...");
+  buffer[0] = 'E';
+  buffer[1] = 'S';
+  buffer[2] = BINARY_FORMAT_VERSION;
+  buffer[3] = 18;
+  buffer[4] = (uint8_t) deviceLen;
+  buffer[5] = (uint8_t) commandLen;
+  buffer[6] = 0;
+  buffer[7] = 0;
+  // ESP32 é little-endian: os floats seguem como estão na memória
+  memcpy(buffer + 8, spectralData, sizeof(spectralData));
+  memcpy(buffer + 8 + sizeof(spectralData), deviceId.c_str(), deviceLen);
+  memcpy(buffer + 8 + sizeof(spectralData) + deviceLen, currentCommandId.c_str(), commandLen);
+  return total;
+}
+
+// Envia spectralData (binário ou JSON) na requisição já aberta em 'http'
+int postSpectrum(HTTPClient& http) {
+  size_t binarySize = USE_BINARY_RESULT ? encodeSpectrumBinary(binaryBody, sizeof(binaryBody)) : 0;
+  if (binarySize > 0) {
+    http.addHeader("Content-Type", BINARY_CONTENT_TYPE);
+    Serial.printf("📦 Espectro binário enviado: %u bytes\n", (unsigned) binarySize);
+    return http.POST(binaryBody, binarySize);
+  }
   
-  HTTPClient http;
-  http.begin(String(serverUrl) + String(resultEndpoint));
   http.addHeader("Content-Type", "application/json");
   
   DynamicJsonDocument doc(2048);
   doc["device_id"] = deviceId;
+  if (currentCommandId.length() > 0) {
+    doc["command_id"] = currentCommandId;
+  }
   
   // CRIAR ARRAY COM VALORES DE REFLECTÂNCIA (0-1)
   JsonArray spectrum = doc.createNestedArray("spectrum");
@@ -243,7 +327,21 @@ void sendResultsToServer() {
   Serial.println("📋 JSON enviado:");
   Serial.println(requestBody);
   
-  int httpResponseCode = http.POST(requestBody);
+  return http.POST(requestBody);
+}
+
+void sendResultsToServer() {
+  if (WiFi.status() != WL_CONNECTED) {
+    currentState = STATE_DISPLAYING;
+    return;
+  }
+  
+  Serial.println("📤 Enviando espectro ao servidor...");
+  
+  HTTPClient http;
+  http.begin(String(serverUrl) + String(resultEndpoint));
+  
+  int httpResponseCode = postSpectrum(http);
   
   if (httpResponseCode == 200) {
     String response = http.getString();
@@ -266,6 +364,8 @@ void sendResultsToServer() {
     currentState = STATE_DISPLAYING;
   }
   
+  // Sem resposta o servidor reentrega o comando (mesmo command_id)
+  currentCommandId = "";
   http.end();
 }
 
@@ -280,9 +380,27 @@ void collectSpectralData() {
   sensor.enableBulb(AS7265x_LED_IR);
   sensor.enableBulb(AS7265x_LED_UV);
   
-  Serial.println("⏳ Aquecendo LEDs...");
-  delay(WARMUP_TIME);  // 5000ms (MESMO DA COLETA)
+  String sessionId = USE_SCAN_SESSION ? openScanSession() : String("");
+  if (sessionId.length() > 0) {
+    Serial.println("⏳ Aquecendo LEDs (sessão de varredura)...");
+    delay(SESSION_WARMUP_TIME);
+    runScanSession(sessionId);
+    currentState = STATE_DISPLAYING;
+  } else {
+    Serial.println("⏳ Aquecendo LEDs...");
+    delay(WARMUP_TIME);  // 5000ms (MESMO DA COLETA)
+    measureSpectrum();
+    currentState = STATE_PROCESSING;
+  }
   
+  // Desabilitar LEDs
+  sensor.disableBulb(AS7265x_LED_WHITE);
+  sensor.disableBulb(AS7265x_LED_IR);
+  sensor.disableBulb(AS7265x_LED_UV);
+}
+
+// Uma leitura calibrada em spectralData (LEDs já ligados e aquecidos)
+void measureSpectrum() {
   Serial.println("📡 Coletando dados espectrais...");
   sensor.takeMeasurements();
   
@@ -301,16 +419,81 @@ void collectSpectralData() {
     }
   }
   
-  // Desabilitar LEDs
-  sensor.disableBulb(AS7265x_LED_WHITE);
-  sensor.disableBulb(AS7265x_LED_IR);
-  sensor.disableBulb(AS7265x_LED_UV);
-  
   Serial.println("✓ Medição concluída!");
   Serial.printf("  r680=%.6f, r810=%.6f, r940=%.6f\n", 
                 spectralData[10], spectralData[14], spectralData[17]);
+}
+
+// ==================== SESSÃO DE VARREDURA ====================
+
+// Abre a sessão no servidor; vazio se falhar (cai para a leitura única)
+String openScanSession() {
+  if (WiFi.status() != WL_CONNECTED) return "";
+  
+  HTTPClient http;
+  http.begin(String(serverUrl) + String(scanEndpoint));
+  http.addHeader("Content-Type", "application/json");
+  
+  DynamicJsonDocument requestDoc(256);
+  requestDoc["device_id"] = deviceId;
+  if (currentCommandId.length() > 0) {
+    requestDoc["command_id"] = currentCommandId;
+  }
+  String requestBody;
+  serializeJson(requestDoc, requestBody);
+  
+  String sessionId = "";
+  if (http.POST(requestBody) == 200) {
+    DynamicJsonDocument responseDoc(512);
+    deserializeJson(responseDoc, http.getString());
+    sessionId = responseDoc["session_id"] | "";
+    sessionMaxScans = min(SESSION_MAX_SCANS, responseDoc["varreduras_max"] | SESSION_MAX_SCANS);
+    Serial.printf("🔁 Sessão de varredura %s aberta\n", sessionId.c_str());
+  } else {
+    Serial.println("⚠️ Sessão de varredura indisponível: leitura única");
+  }
+  http.end();
+  return sessionId;
+}
+
+// Envia leituras até o servidor encerrar a sessão ("varredura.concluida");
+// a cada resposta o display mostra a classificação parcial
+void runScanSession(const String& sessionId) {
+  for (int scan = 1; scan <= sessionMaxScans; scan++) {
+    measureSpectrum();
+    
+    HTTPClient http;
+    http.begin(String(serverUrl) + String(scanEndpoint) + "/" + sessionId);
+    int httpResponseCode = postSpectrum(http);
+    
+    if (httpResponseCode != 200) {
+      Serial.printf("❌ Erro no envio da leitura %d: %d\n", scan, httpResponseCode);
+      lastEspecie = "ERRO";
+      lastStatus = "ERRO_CONEXAO";
+      lastConfianca = 0;
+      http.end();
+      break;
+    }
+    
+    DynamicJsonDocument responseDoc(2048);
+    deserializeJson(responseDoc, http.getString());
+    http.end();
+    
+    lastEspecie = responseDoc["especie"].as<String>();
+    lastConfianca = responseDoc["confianca"];
+    lastStatus = responseDoc["status"].as<String>();
+    bool done = responseDoc["varredura"]["concluida"] | false;
+    
+    Serial.printf("🔁 Leitura %d: %s (%.1f%%) %s\n", scan, lastEspecie.c_str(), lastConfianca, lastStatus.c_str());
+    displayMessage("Leitura " + String(scan), lastEspecie);
+    if (done) {
+      Serial.printf("✓ Sessão concluída (%s)\n", responseDoc["varredura"]["motivo"].as<const char*>());
+      break;
+    }
+  }
   
-  currentState = STATE_PROCESSING;
+  // O resultado final já foi gravado pelo servidor (com o command_id da sessão)
+  currentCommandId = "";
 }
 
 // ORDEM DAS BANDAS - IDÊNTICA AO CÓDIGO DE COLETA
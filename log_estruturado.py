@@ -0,0 +1,107 @@
+"""
+Logging Assíncrono e Estruturado - Classificação de Grãos
+
+- QueueHandler no caminho da requisição: só enfileira o LogRecord
+- QueueListener em thread de fundo: formata e escreve (console/arquivo)
+- Formatação preguiçosa: mensagens em estilo %, montadas apenas na
+  thread de fundo e só se o nível estiver habilitado
+- Formato 'json': uma linha JSON por registro (campos extras em 'dados')
+- Processos filhos (fork de workers) reiniciam a thread do listener
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime
+
+FORMATO_TEXTO = '%(asctime)s - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro; extra={'dados': {...}} vira campos do objeto"""
+
+    def format(self, record):
+        registro = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        dados = getattr(record, 'dados', None)
+        if dados:
+            registro.update(dados)
+        if record.exc_text:
+            registro['exc'] = record.exc_text
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+
+class QueueHandlerAdiado(logging.handlers.QueueHandler):
+    """
+    QueueHandler que NÃO formata a mensagem na thread da requisição.
+
+    O QueueHandler padrão chama format() em prepare(); aqui apenas o
+    traceback (que referencia frames vivos) é convertido em texto antes
+    de enfileirar. msg % args fica para a thread do QueueListener.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configurar_logging(nivel=logging.INFO, formato='texto', arquivo=None, console=True):
+    """
+    Configura o logger raiz com fila + listener em segundo plano.
+
+    formato: 'texto' (formato original) ou 'json' (JSON lines)
+    arquivo: caminho opcional para gravar também em arquivo
+    console: False grava só no arquivo (ex.: benchmark.py)
+    """
+    global _listener
+
+    formatador = FormatadorJSON() if formato == 'json' else logging.Formatter(FORMATO_TEXTO)
+    destinos = [logging.StreamHandler()] if console else []
+    if arquivo:
+        destinos.append(logging.FileHandler(arquivo, encoding='utf-8'))
+    for destino in destinos:
+        destino.setFormatter(formatador)
+
+    if _listener is not None:
+        _listener.stop()
+
+    fila = queue.SimpleQueue()
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(QueueHandlerAdiado(fila))
+    raiz.setLevel(nivel)
+
+    _listener = logging.handlers.QueueListener(fila, *destinos, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def _parar_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _reiniciar_listener_apos_fork():
+    # Workers (fork) herdam a fila mas não a thread do listener
+    if _listener is not None:
+        _listener._thread = None
+        _listener.start()
+
+
+atexit.register(_parar_listener)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_listener_apos_fork)
@@ -0,0 +1,193 @@
+"""
+Métricas no Formato Prometheus - Classificação de Grãos
+
+Contadores, histogramas e medidores mínimos (sem dependências) para o
+endpoint /metrics, no formato texto de exposição do Prometheus 0.0.4:
+
+- Contador:   valor acumulado por combinação de rótulos
+- Histograma: faixas cumulativas (le), soma e contagem por rótulo;
+              quantil() estima percentis por interpolação nas faixas
+- Medidor:    valor lido de uma função no momento da coleta
+
+Cada processo tem seus próprios valores (um worker gunicorn = um alvo).
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import bisect
+import threading
+
+# Faixas de latência em segundos: de 10 µs (uma etapa do motor) a 2,5 s
+LIMITES_LATENCIA_S = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+# Faixas para o tempo comando -> resultado (inclui a espera na fila do
+# dispositivo e a leitura do sensor): de 100 ms a 5 min
+LIMITES_COMANDO_S = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+TIPO_CONTEUDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _rotulos(nomes, valores, extra=None):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+# ==================== TIPOS ====================
+
+class Contador:
+    tipo = 'counter'
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *valores_rotulos, valor=1):
+        with self._lock:
+            self._valores[valores_rotulos] = self._valores.get(valores_rotulos, 0) + valor
+
+    def valores(self):
+        with self._lock:
+            return dict(self._valores)
+
+    def linhas(self):
+        for chave, valor in sorted(self.valores().items()):
+            yield f'{self.nome}{_rotulos(self.rotulos, chave)} {_numero(valor)}'
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_LATENCIA_S):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.limites = tuple(limites)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *valores_rotulos):
+        faixa = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(valores_rotulos)
+            if serie is None:
+                serie = self._series[valores_rotulos] = [[0] * (len(self.limites) + 1), 0.0, 0]
+            serie[0][faixa] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def _copiar(self):
+        with self._lock:
+            return {chave: (list(contagens), soma, total) for chave, (contagens, soma, total) in self._series.items()}
+
+    def quantil(self, p, *valores_rotulos):
+        """Percentil estimado (interpolação linear dentro da faixa), ou None"""
+        serie = self._copiar().get(valores_rotulos)
+        if serie is None or serie[2] == 0:
+            return None
+        contagens, _, total = serie
+        alvo = p * total
+        acumulado = 0
+        for i, contagem in enumerate(contagens):
+            if contagem and acumulado + contagem >= alvo:
+                inferior = self.limites[i - 1] if i > 0 else 0.0
+                if i == len(self.limites):
+                    return inferior
+                return inferior + (self.limites[i] - inferior) * (alvo - acumulado) / contagem
+            acumulado += contagem
+        return self.limites[-1]
+
+    def resumo(self, escala=1000, casas=3):
+        """{rótulo: {'n', 'media', 'p50', 'p90', 'p99'}} na escala pedida (ms)"""
+        resumo = {}
+        for chave, (_, soma, total) in sorted(self._copiar().items()):
+            if not total:
+                continue
+            resumo['/'.join(chave) or self.nome] = {
+                'n': total,
+                'media': round(soma / total * escala, casas),
+                **{f'p{int(p * 100)}': round(self.quantil(p, *chave) * escala, casas) for p in (0.5, 0.9, 0.99)},
+            }
+        return resumo
+
+    def linhas(self):
+        for chave, (contagens, soma, total) in sorted(self._copiar().items()):
+            acumulado = 0
+            for limite, contagem in zip(self.limites + (float('inf'),), contagens):
+                acumulado += contagem
+                le = 'le="' + _numero(limite) + '"'
+                yield f'{self.nome}_bucket{_rotulos(self.rotulos, chave, le)} {acumulado}'
+            yield f'{self.nome}_sum{_rotulos(self.rotulos, chave)} {_numero(soma)}'
+            yield f'{self.nome}_count{_rotulos(self.rotulos, chave)} {total}'
+
+
+class Medidor:
+    """
+    Valor lido na coleta. funcao retorna um número ou, com rótulos,
+    um dicionário {tupla de valores: número}. tipo='counter' para
+    contadores mantidos por outro componente (ex.: acertos do cache).
+    """
+
+    def __init__(self, nome, ajuda, funcao, rotulos=(), tipo='gauge'):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+        self.rotulos = tuple(rotulos)
+        self.tipo = tipo
+
+    def linhas(self):
+        valor = self.funcao()
+        if valor is None:
+            return
+        if not self.rotulos:
+            yield f'{self.nome} {_numero(valor)}'
+            return
+        for chave, v in sorted(valor.items()):
+            yield f'{self.nome}{_rotulos(self.rotulos, chave)} {_numero(v)}'
+
+
+# ==================== REGISTRO ====================
+
+class RegistroMetricas:
+    """Conjunto de métricas de um processo, renderizado para /metrics"""
+
+    def __init__(self):
+        self._metricas = []
+
+    def registrar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self.registrar(Contador(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), limites=LIMITES_LATENCIA_S):
+        return self.registrar(Histograma(nome, ajuda, rotulos, limites))
+
+    def medidor(self, nome, ajuda, funcao, rotulos=(), tipo='gauge'):
+        return self.registrar(Medidor(nome, ajuda, funcao, rotulos, tipo))
+
+    def renderizar(self):
+        linhas = []
+        for metrica in self._metricas:
+            linhas.append(f'# HELP {metrica.nome} {metrica.ajuda}')
+            linhas.append(f'# TYPE {metrica.nome} {metrica.tipo}')
+            linhas.extend(metrica.linhas())
+        return '\n'.join(linhas) + '\n'
@@ -0,0 +1,584 @@
+"""
+Motor de Inferência Compilado - Classificação de Grãos
+
+Dobra as etapas lineares do pipeline de produção em matrizes NumPy fixas,
+montadas uma única vez a partir do dicionário do modelo:
+
+- scaler_bandas -> PCA (6 componentes) -> scaler_final -> SVM linear
+  viram UMA multiplicação matricial sobre [17 bandas | 4 índices]
+- Probabilidades reproduzem o libsvm (Platt + acoplamento par-a-par)
+- One-Class SVM (RBF) e regra MAD avaliados por lote em NumPy puro,
+  a partir dos vetores de suporte (um grupo por espécie)
+
+Evita a criação de DataFrames e as validações do sklearn a cada amostra.
+A saída é equivalente à do caminho sklearn original. O motor depende só
+de NumPy: sklearn é necessário apenas para compilar (compilar_parametros).
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import threading
+import time
+import numpy as np
+
+N_COMPONENTES_PCA = 6
+BANDA_485_IDX = 3
+MIN_PROB_LIBSVM = 1e-7
+
+# One-Class SVM: 'exata' (todos os vetores de suporte) ou aproximações
+# de custo fixo, independente do nº de vetores de suporte:
+# 'nystrom' (m pontos de referência) e 'rff' (random Fourier features)
+MODOS_ANOMALIA = ('exata', 'nystrom', 'rff')
+NYSTROM_PONTOS_PADRAO = 64
+RFF_DIMENSAO_PADRAO = 2048
+SEMENTE_APROXIMACAO = 42
+
+# Acima deste nº de vetores de suporte o modo exato usa forma matricial
+# (diferenças ~1e-16 em relação ao libsvm) em vez da soma sequencial
+LIMIAR_SV_MATRICIAL = 32
+
+
+# Etapas cronometradas por prever(tempos=...)
+ETAPAS_MOTOR = ('indices', 'pca_svm', 'probabilidades', 'ocsvm', 'mad')
+
+
+def marcar_etapa(tempos, nome, inicio):
+    """Grava em tempos[nome] o tempo desde inicio; retorna o instante atual"""
+    agora = time.perf_counter()
+    if tempos is not None:
+        tempos[nome] = agora - inicio
+    return agora
+
+
+# ==================== ÍNDICES ESPECTRAIS ====================
+
+def calcular_indices_novos(df):
+    """
+    Índices espectrais SEM usar banda 485nm
+    Alinhados com modelo de produção
+
+    Aceita DataFrame ou dicionário de colunas NumPy (motor compilado).
+    """
+    df = df.copy()
+    df['I1_NDVI'] = (df['r810'] - df['r680']) / (df['r810'] + df['r680'] + 1e-10)
+    df['I2_Water'] = df['r940'] / (df['r760'] + 1e-10)
+    df['I3_Lipid'] = df['r860'] / (df['r680'] + 1e-10)
+    df['I4_Slope_Alt'] = (df['r645'] - df['r535']) / 110.0
+    return df
+
+
+# ==================== FUNÇÕES AUXILIARES ====================
+
+def _parametros_scaler(scaler, n):
+    """Retorna (média, escala) de um StandardScaler, tratando with_mean/with_std"""
+    media = scaler.mean_ if getattr(scaler, 'mean_', None) is not None else np.zeros(n)
+    escala = scaler.scale_ if getattr(scaler, 'scale_', None) is not None else np.ones(n)
+    return np.asarray(media, dtype=np.float64), np.asarray(escala, dtype=np.float64)
+
+
+def _acoplamento_par_a_par(r):
+    """
+    Acoplamento par-a-par do libsvm (multiclass_probability), vetorizado
+    sobre o lote: r tem forma (N, k, k) com r[:, i, j] = P(i | i ou j).
+    Cada amostra para de iterar quando atinge o critério do libsvm.
+    """
+    n, k, _ = r.shape
+    Q = -r.transpose(0, 2, 1) * r
+    diag = np.einsum('nji,nji->ni', r, r) - np.einsum('nii,nii->ni', r, r)
+    idx = np.arange(k)
+    Q[:, idx, idx] = diag
+
+    p = np.full((n, k), 1.0 / k)
+    eps = 0.005 / k
+    ativas = np.ones(n, dtype=bool)
+
+    for _ in range(max(100, k)):
+        Qp = np.einsum('ntj,nj->nt', Q, p)
+        pQp = np.einsum('nt,nt->n', p, Qp)
+        erro = np.max(np.abs(Qp - pQp[:, None]), axis=1)
+        ativas &= erro >= eps
+        if not ativas.any():
+            break
+
+        a = np.flatnonzero(ativas)
+        Qa, pa, Qpa, pQpa = Q[a], p[a], Qp[a], pQp[a]
+        for t in range(k):
+            qtt = Qa[:, t, t]
+            diff = (-Qpa[:, t] + pQpa) / qtt
+            pa[:, t] += diff
+            pQpa = (pQpa + diff * (diff * qtt + 2 * Qpa[:, t])) / (1 + diff) / (1 + diff)
+            Qpa = (Qpa + diff[:, None] * Qa[:, t, :]) / (1 + diff)[:, None]
+            pa /= (1 + diff)[:, None]
+        p[a] = pa
+
+    return p
+
+
+# ==================== COMPILAÇÃO ====================
+
+def compilar_parametros(modelos, n_componentes=N_COMPONENTES_PCA):
+    """
+    Extrai do dicionário do modelo (objetos sklearn) apenas arrays NumPy
+    e metadados simples. É o único ponto que toca os objetos sklearn:
+    o resultado alimenta MotorInferencia e o artefato compilado.
+    """
+    svm = modelos['modelo_especies']
+    pca = modelos['pca']
+    bandas_cols = list(modelos['bandas_cols'])
+    indices_cols = list(modelos['indices_cols'])
+    classes = [str(c) for c in svm.classes_]
+
+    if getattr(svm, 'kernel', 'linear') != 'linear':
+        raise ValueError(f"Motor compilado requer SVM linear (kernel={svm.kernel})")
+    if getattr(pca, 'whiten', False):
+        raise ValueError("Motor compilado não suporta PCA com whiten=True")
+
+    nb, ni = len(bandas_cols), len(indices_cols)
+    media_b, escala_b = _parametros_scaler(modelos['scaler_bandas'], nb)
+    media_i, escala_i = _parametros_scaler(modelos['scaler_indices'], ni)
+    media_f, escala_f = _parametros_scaler(modelos['scaler_final'], ni + n_componentes)
+
+    # PCA sobre bandas padronizadas: pcs = x @ W_pca + b_pca
+    componentes = np.asarray(pca.components_[:n_componentes], dtype=np.float64)
+    W_pca = componentes.T / escala_b[:, None]
+    b_pca = -(media_b / escala_b + pca.mean_) @ componentes.T
+
+    # SVM sobre [índices | pcs] padronizados: dec = f @ W_f + b_f
+    coef = np.asarray(svm.coef_, dtype=np.float64)
+    W_f = (coef / escala_f).T
+    b_f = np.asarray(svm.intercept_, dtype=np.float64) - (media_f / escala_f) @ coef.T
+    W_f_ind, W_f_pca = W_f[:ni], W_f[ni:]
+
+    # Matriz única sobre z = [bandas | índices] -> decisão SVM
+    W = np.empty((nb + ni, coef.shape[0]))
+    W[:nb] = W_pca @ W_f_pca
+    W[nb:] = W_f_ind
+
+    # One-Class SVM (RBF) por espécie: vetores de suporte empilhados na
+    # ordem de classes; ocsvm_inicio[c]:ocsvm_inicio[c+1] delimita a espécie c
+    vetores, coeficientes, inicio, intercepto, gamma, nu = [], [], [0], [], [], []
+    for c in classes:
+        detector = modelos['detectores_anomalia'][c]
+        if detector.kernel != 'rbf':
+            raise ValueError(f"Motor compilado requer One-Class SVM RBF (kernel={detector.kernel})")
+        vetores.append(np.asarray(detector.support_vectors_, dtype=np.float64))
+        coeficientes.append(np.asarray(detector.dual_coef_, dtype=np.float64).ravel())
+        inicio.append(inicio[-1] + len(detector.support_vectors_))
+        intercepto.append(float(detector.intercept_[0]))
+        gamma.append(float(detector._gamma))
+        nu.append(float(detector.nu))
+
+    limiares = modelos['limiares_mad']
+    return {
+        'classes': classes,
+        'bandas_cols': bandas_cols,
+        'indices_cols': indices_cols,
+        'n_componentes': n_componentes,
+        'variancia_explicada_pca': float(np.sum(pca.explained_variance_ratio_)),
+        'W': np.ascontiguousarray(W),
+        'b': b_pca @ W_f_pca + b_f,
+        'media_indices': media_i,
+        'escala_indices': escala_i,
+        'probA': np.asarray(getattr(svm, 'probA_', []), dtype=np.float64),
+        'probB': np.asarray(getattr(svm, 'probB_', []), dtype=np.float64),
+        'ocsvm_vetores': np.concatenate(vetores).reshape(-1, ni),
+        'ocsvm_coef': np.concatenate(coeficientes),
+        'ocsvm_inicio': np.array(inicio, dtype=np.int64),
+        'ocsvm_intercepto': np.array(intercepto),
+        'ocsvm_gamma': np.array(gamma),
+        'ocsvm_nu': nu,
+        'mad_medianas': np.array([limiares[c]['medians'] for c in classes], dtype=np.float64),
+        'mad_limiares': np.array([limiares[c]['mads'] for c in classes], dtype=np.float64),
+    }
+
+
+# ==================== APROXIMAÇÃO DO KERNEL RBF ====================
+
+def _kmeans_ponderado(X, pesos, m, rng, iteracoes=25):
+    """k-means (Lloyd) com pesos |α|: pontos de referência do Nyström"""
+    centros = X[rng.choice(len(X), m, replace=False)].copy()
+    for _ in range(iteracoes):
+        rotulo = np.argmin(((X[:, None, :] - centros) ** 2).sum(axis=2), axis=1)
+        for j in range(m):
+            membro = rotulo == j
+            if membro.any():
+                centros[j] = np.average(X[membro], axis=0, weights=pesos[membro] + 1e-12)
+    return centros
+
+
+def _recursos_nystrom(vetores, coef, inicio, gamma, n_pontos, semente=SEMENTE_APROXIMACAO):
+    """
+    Nyström por espécie: K(x, sv) ≈ k_m(x)ᵀ K_mm⁺ k_m(sv), com m pontos de
+    referência. O score vira k_m(x)·β - ρ, β = K_mm⁺ K_m,sv α: custo O(m·d).
+
+    Se a espécie tem até m vetores de suporte, eles próprios são os
+    pontos de referência e β = α (resultado exato). Espécies com menos
+    pontos são completadas com peso zero (arrays empilháveis).
+    """
+    rng = np.random.default_rng(semente)
+    k, d = len(gamma), vetores.shape[1]
+    pontos = np.zeros((k, n_pontos, d))
+    pesos = np.zeros((k, n_pontos))
+    for c in range(k):
+        sv = vetores[inicio[c]:inicio[c + 1]]
+        alfa = coef[inicio[c]:inicio[c + 1]]
+        if len(sv) <= n_pontos:
+            pontos[c, :len(sv)] = sv
+            pesos[c, :len(sv)] = alfa
+            continue
+        referencia = _kmeans_ponderado(sv, np.abs(alfa), n_pontos, rng)
+        K_mm = np.exp(-gamma[c] * ((referencia[:, None, :] - referencia) ** 2).sum(axis=2))
+        K_msv = np.exp(-gamma[c] * ((referencia[:, None, :] - sv) ** 2).sum(axis=2))
+        pontos[c] = referencia
+        pesos[c] = np.linalg.pinv(K_mm, rcond=1e-10) @ (K_msv @ alfa)
+    return pontos, pesos
+
+
+def _recursos_rff(vetores, coef, inicio, gamma, dimensao, semente=SEMENTE_APROXIMACAO):
+    """
+    Random Fourier features por espécie (Rahimi & Recht):
+    exp(-γ||x - y||²) ≈ z(x)·z(y), z(x) = √(2/D)·cos(Ωx + β),
+    Ω ~ N(0, 2γI), β ~ U(0, 2π). A soma sobre os vetores de suporte
+    colapsa em um vetor de pesos w = Σ αᵢ z(svᵢ), então o score fica
+    z(x)·w - ρ: custo O(D·d), independente do nº de vetores de suporte.
+    """
+    rng = np.random.default_rng(semente)
+    k, d = len(gamma), vetores.shape[1]
+    omega = np.empty((k, dimensao, d))
+    fase = np.empty((k, dimensao))
+    pesos = np.empty((k, dimensao))
+    escala = np.sqrt(2.0 / dimensao)
+    for c in range(k):
+        omega[c] = rng.normal(0.0, np.sqrt(2.0 * gamma[c]), size=(dimensao, d))
+        fase[c] = rng.uniform(0.0, 2.0 * np.pi, size=dimensao)
+        sv = vetores[inicio[c]:inicio[c + 1]]
+        pesos[c] = coef[inicio[c]:inicio[c + 1]] @ (escala * np.cos(sv @ omega[c].T + fase[c]))
+    return omega, fase, pesos * escala
+
+
+def _kernel_rbf(X, Y, gamma):
+    """exp(-γ||x - y||²) para todos os pares, forma (len(X), len(Y))"""
+    diff = X[:, None, :] - Y
+    return np.exp(-gamma * np.einsum('nmf,nmf->nm', diff, diff))
+
+
+# ==================== MOTOR COMPILADO ====================
+
+class MotorInferencia:
+    """
+    Pipeline de inferência pré-compilado. Recebe os parâmetros de
+    compilar_parametros (ou de um artefato carregado de disco); use
+    MotorInferencia.do_modelo() a partir do dicionário do .pkl.
+
+    Funciona como snapshot imutável do modelo (arrays somente-leitura,
+    identificado por versao): trocar de modelo é trocar de instância.
+
+    Entrada: matriz (N, 17) de bandas já sem r485, na ordem de bandas_cols.
+    """
+
+    def __init__(self, parametros, versao=None, origem=None, modo_anomalia='exata',
+                 pontos_nystrom=NYSTROM_PONTOS_PADRAO, dimensao_rff=RFF_DIMENSAO_PADRAO):
+        if modo_anomalia not in MODOS_ANOMALIA:
+            raise ValueError(f"Modo de anomalia inválido: {modo_anomalia} (use {MODOS_ANOMALIA})")
+        self.versao = versao
+        self.origem = origem
+        self.modo_anomalia = modo_anomalia
+        self.bandas_cols = list(parametros['bandas_cols'])
+        self.indices_cols = list(parametros['indices_cols'])
+        self.classes = np.asarray(parametros['classes'])
+        self.n_bandas = len(self.bandas_cols)
+        self.n_indices = len(self.indices_cols)
+        self.n_componentes = int(parametros['n_componentes'])
+        self.variancia_explicada_pca = float(parametros['variancia_explicada_pca'])
+
+        self.W = parametros['W']
+        self.b = parametros['b']
+        self.n_pares = self.W.shape[1]
+
+        # scaler_indices aplicado como no sklearn ((x - média) / escala):
+        # a regra MAD compara desvios contra MADs nulos, então os índices
+        # padronizados precisam ser bit a bit iguais aos do caminho original
+        self.media_indices = parametros['media_indices']
+        self.escala_indices = parametros['escala_indices']
+
+        # Pares um-contra-um na ordem do libsvm (i < j)
+        k = len(self.classes)
+        pares = [(i, j) for i in range(k) for j in range(i + 1, k)]
+        self.par_i = np.array([p[0] for p in pares], dtype=np.intp)
+        self.par_j = np.array([p[1] for p in pares], dtype=np.intp)
+        self.probA = parametros['probA']
+        self.probB = parametros['probB']
+        self.tem_probabilidade = self.probA.size == self.n_pares
+
+        # Detecção de anomalia: One-Class SVM por espécie + limiares MAD
+        # empilhados na ordem de classes (indexáveis por classe_idx)
+        self.ocsvm_vetores = parametros['ocsvm_vetores']
+        self.ocsvm_coef = parametros['ocsvm_coef']
+        self.ocsvm_inicio = parametros['ocsvm_inicio']
+        self.ocsvm_intercepto = parametros['ocsvm_intercepto']
+        self.ocsvm_gamma = parametros['ocsvm_gamma']
+        # Só descritivo (/config); ausente em artefatos compilados antes dele
+        self.ocsvm_nu = [float(v) for v in parametros.get('ocsvm_nu', [])]
+        self.mad_medianas = parametros['mad_medianas']
+        self.mad_limiares = parametros['mad_limiares']
+
+        if modo_anomalia == 'nystrom':
+            self.nystrom_pontos, self.nystrom_pesos = _recursos_nystrom(
+                self.ocsvm_vetores, self.ocsvm_coef, self.ocsvm_inicio, self.ocsvm_gamma, pontos_nystrom)
+        elif modo_anomalia == 'rff':
+            self.rff_omega, self.rff_fase, self.rff_pesos = _recursos_rff(
+                self.ocsvm_vetores, self.ocsvm_coef, self.ocsvm_inicio, self.ocsvm_gamma, dimensao_rff)
+
+        for valor in vars(self).values():
+            if isinstance(valor, np.ndarray):
+                valor.setflags(write=False)
+
+        self._local = threading.local()
+
+    @classmethod
+    def do_modelo(cls, modelos, n_componentes=N_COMPONENTES_PCA, **opcoes):
+        """Compila direto do dicionário do modelo (.pkl carregado)"""
+        return cls(compilar_parametros(modelos, n_componentes), **opcoes)
+
+    def _buffer(self, n):
+        """Buffer z = [bandas | índices] reutilizado por thread"""
+        buf = getattr(self._local, 'z', None)
+        if buf is None or buf.shape[0] < n:
+            buf = np.empty((max(n, 1), self.n_bandas + self.n_indices))
+            self._local.z = buf
+        return buf[:n]
+
+    def _indices(self, z):
+        """Preenche z[:, 17:] com os índices espectrais (calcular_indices_novos)"""
+        colunas = {nome: z[:, i] for i, nome in enumerate(self.bandas_cols)}
+        colunas = calcular_indices_novos(colunas)
+        for i, nome in enumerate(self.indices_cols):
+            z[:, self.n_bandas + i] = colunas[nome]
+
+    def _votos(self, dec):
+        """Votação um-contra-um do libsvm (empate -> menor índice)"""
+        n = dec.shape[0]
+        k = len(self.classes)
+        votos = np.zeros((n, k), dtype=np.intp)
+        vence_i = dec > 0
+        for p in range(self.n_pares):
+            votos[vence_i[:, p], self.par_i[p]] += 1
+            votos[~vence_i[:, p], self.par_j[p]] += 1
+        return np.argmax(votos, axis=1)
+
+    def _score_ocsvm(self, c, X):
+        """
+        decision_function do One-Class SVM da espécie c, calculada uma
+        única vez por amostra (predict sai do sinal do mesmo score)
+        """
+        gamma = self.ocsvm_gamma[c]
+        if self.modo_anomalia == 'rff':
+            projecao = X @ self.rff_omega[c].T
+            projecao += self.rff_fase[c]
+            return np.cos(projecao) @ self.rff_pesos[c] + self.ocsvm_intercepto[c]
+        if self.modo_anomalia == 'nystrom':
+            return _kernel_rbf(X, self.nystrom_pontos[c], gamma) @ self.nystrom_pesos[c] + self.ocsvm_intercepto[c]
+
+        inicio, fim = self.ocsvm_inicio[c], self.ocsvm_inicio[c + 1]
+        if fim - inicio > LIMIAR_SV_MATRICIAL:
+            sv = self.ocsvm_vetores[inicio:fim]
+            return _kernel_rbf(X, sv, gamma) @ self.ocsvm_coef[inicio:fim] + self.ocsvm_intercepto[c]
+
+        # Como no libsvm: soma sequencial de coef * exp(-gamma * ||x - sv||²)
+        # menos rho (mesma ordem de operações, resultado idêntico ao sklearn)
+        score = np.zeros(len(X))
+        for m in range(inicio, fim):
+            d = X - self.ocsvm_vetores[m]
+            dist = d[:, 0] * d[:, 0]
+            for f in range(1, d.shape[1]):
+                dist += d[:, f] * d[:, f]
+            score += self.ocsvm_coef[m] * np.exp(-gamma * dist)
+        return score + self.ocsvm_intercepto[c]
+
+    def _ocsvm(self, classe_idx, indices_scaled):
+        """
+        One-Class SVM da espécie predita, para o lote inteiro. Cada
+        detector roda uma vez sobre todas as amostras da sua espécie;
+        a decisão (predict) sai do sinal do mesmo score, como no libsvm.
+        """
+        score = np.empty(len(classe_idx))
+        for c in np.flatnonzero(np.bincount(classe_idx)):
+            mascara = classe_idx == c
+            score[mascara] = self._score_ocsvm(c, indices_scaled[mascara])
+        return score, np.where(score > 0, 1, -1)
+
+    def _mad(self, classe_idx, indices_scaled):
+        """Regra MAD: desvios à mediana da espécie predita vs limiares"""
+        desvios = np.abs(indices_scaled - self.mad_medianas[classe_idx])
+        limiares = self.mad_limiares[classe_idx]
+        violacoes = np.sum(desvios > limiares, axis=1)
+        return desvios, limiares, violacoes
+
+    def _probabilidades(self, dec):
+        """Platt scaling por par + acoplamento par-a-par (predict_proba)"""
+        n = dec.shape[0]
+        k = len(self.classes)
+        fApB = dec * self.probA + self.probB
+        with np.errstate(over='ignore'):
+            sig = np.where(fApB >= 0,
+                           np.exp(-np.abs(fApB)) / (1.0 + np.exp(-np.abs(fApB))),
+                           1.0 / (1.0 + np.exp(-np.abs(fApB))))
+        sig = np.clip(sig, MIN_PROB_LIBSVM, 1 - MIN_PROB_LIBSVM)
+
+        r = np.zeros((n, k, k))
+        r[:, self.par_i, self.par_j] = sig
+        r[:, self.par_j, self.par_i] = 1 - sig
+        return _acoplamento_par_a_par(r)
+
+    def prever(self, bandas_17, tempos=None):
+        """
+        Executa o pipeline compilado sobre uma matriz (N, 17).
+
+        tempos: dicionário opcional que recebe a duração (s) de cada
+        etapa de ETAPAS_MOTOR. 'pca_svm' é a multiplicação única que
+        substitui scaler -> PCA -> scaler -> SVM linear.
+
+        Retorna dicionário com arrays:
+        - 'classe_idx' (N,), 'especie' (N,), 'probabilidades' (N, k)
+        - 'indices' (N, 4), 'indices_scaled' (N, 4), 'decisao' (N, n_pares)
+        - 'svm_score' (N,), 'svm_decisao' (N,) do One-Class SVM
+        - 'mad_desvios' (N, 4), 'mad_limiares' (N, 4), 'mad_violacoes' (N,)
+        """
+        X = np.asarray(bandas_17, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_bandas:
+            raise ValueError(f"Erro: {X.shape[1]} bandas, modelo espera {self.n_bandas}")
+
+        t = time.perf_counter()
+        n = X.shape[0]
+        z = self._buffer(n)
+        z[:, :self.n_bandas] = X
+        self._indices(z)
+        indices = z[:, self.n_bandas:].copy()
+        indices_scaled = (indices - self.media_indices) / self.escala_indices
+        t = marcar_etapa(tempos, 'indices', t)
+
+        dec = z @ self.W
+        dec += self.b
+        classe_idx = self._votos(dec)
+        t = marcar_etapa(tempos, 'pca_svm', t)
+
+        if self.tem_probabilidade:
+            prob = self._probabilidades(dec)
+        else:
+            prob = np.eye(len(self.classes))[classe_idx]
+        t = marcar_etapa(tempos, 'probabilidades', t)
+
+        score, decisao = self._ocsvm(classe_idx, indices_scaled)
+        t = marcar_etapa(tempos, 'ocsvm', t)
+
+        desvios, limiares, violacoes = self._mad(classe_idx, indices_scaled)
+        marcar_etapa(tempos, 'mad', t)
+
+        return {
+            'classe_idx': classe_idx,
+            'especie': self.classes[classe_idx],
+            'probabilidades': prob,
+            'indices': indices,
+            'indices_scaled': indices_scaled,
+            'decisao': dec,
+            'svm_score': score,
+            'svm_decisao': decisao,
+            'mad_desvios': desvios,
+            'mad_limiares': limiares,
+            'mad_violacoes': violacoes,
+        }
+
+
+# ==================== VERIFICAÇÃO DE PARIDADE ====================
+
+def verificar_paridade(modelos, bandas_17, motor=None):
+    """
+    Compara o motor compilado com o caminho sklearn original
+    (DataFrame -> scalers -> PCA -> SVM) sobre uma matriz (N, 17).
+
+    Retorna dicionário com concordância de espécie e maiores diferenças.
+    """
+    import pandas as pd
+
+    motor = motor or MotorInferencia.do_modelo(modelos)
+    X = np.asarray(bandas_17, dtype=np.float64)
+
+    df = calcular_indices_novos(pd.DataFrame(X, columns=modelos['bandas_cols']))
+    indices = df[modelos['indices_cols']].values
+    pcs = modelos['pca'].transform(modelos['scaler_bandas'].transform(X))
+    X_final = modelos['scaler_final'].transform(np.hstack([indices, pcs[:, :N_COMPONENTES_PCA]]))
+
+    saida = motor.prever(X)
+    classe_idx = saida['classe_idx']
+    score_sklearn = np.array([
+        modelos['detectores_anomalia'][motor.classes[c]].decision_function(linha.reshape(1, -1))[0]
+        for c, linha in zip(classe_idx, saida['indices_scaled'])
+    ])
+    return {
+        'amostras': len(X),
+        'especie_igual': float(np.mean(modelos['modelo_especies'].predict(X_final) == saida['especie'])),
+        'max_diff_prob': float(np.max(np.abs(
+            modelos['modelo_especies'].predict_proba(X_final) - saida['probabilidades']))),
+        'max_diff_indices': float(np.max(np.abs(indices - saida['indices']))),
+        'max_diff_indices_scaled': float(np.max(np.abs(
+            modelos['scaler_indices'].transform(indices) - saida['indices_scaled']))),
+        'max_diff_svm_score': float(np.max(np.abs(score_sklearn - saida['svm_score']))),
+    }
+
+
+def medir_concordancia(motor_exato, motor_aproximado, bandas_17):
+    """
+    Concordância do One-Class SVM aproximado com o exato sobre (N, 17):
+    fração de decisões (inlier/outlier) iguais e diferença dos scores
+    """
+    exato = motor_exato.prever(bandas_17)
+    aproximado = motor_aproximado.prever(bandas_17)
+    diff = np.abs(exato['svm_score'] - aproximado['svm_score'])
+    return {
+        'amostras': len(diff),
+        'outliers_exato': int(np.sum(exato['svm_decisao'] == -1)),
+        'concordancia_decisao': float(np.mean(exato['svm_decisao'] == aproximado['svm_decisao'])),
+        'max_diff_score': float(diff.max()),
+        'media_diff_score': float(diff.mean()),
+    }
+
+
+if __name__ == '__main__':
+    import csv
+    import sys
+    import joblib
+
+    caminho_modelo = sys.argv[1] if len(sys.argv) > 1 else 'modelo_completo_sem_485nm.pkl'
+    caminho_csv = sys.argv[2] if len(sys.argv) > 2 else 'tabela_coleta_dados_espectrais_4_amostras.csv'
+
+    with open(caminho_csv, newline='') as f:
+        leitor = csv.DictReader(f)
+        colunas = [c for c in leitor.fieldnames if c.startswith('band_')]
+        espectros = np.array([[float(linha[c]) for c in colunas] for linha in leitor])
+
+    modelos = joblib.load(caminho_modelo)
+    bandas_17 = np.delete(espectros, BANDA_485_IDX, axis=1)
+    resultado = verificar_paridade(modelos, bandas_17)
+    for chave, valor in resultado.items():
+        print(f"{chave}: {valor}")
+    ok = (resultado['especie_igual'] == 1.0 and resultado['max_diff_prob'] < 1e-9
+          and resultado['max_diff_svm_score'] < 1e-12)
+    print("✅ Paridade OK" if ok else "❌ Paridade FALHOU")
+
+    # One-Class SVM aproximado vs exato: dataset original e o mesmo dataset
+    # com ruído multiplicativo de 5% (20 cópias)
+    exato = MotorInferencia.do_modelo(modelos)
+    ruido = bandas_17 * np.random.default_rng(0).normal(1.0, 0.05, size=(20,) + bandas_17.shape)
+    conjuntos = (('csv', bandas_17), ('csv+ruído', ruido.reshape(-1, bandas_17.shape[1])))
+    variantes = [('nystrom', {'pontos_nystrom': m}) for m in (NYSTROM_PONTOS_PADRAO, 2, 1)]
+    variantes += [('rff', {'dimensao_rff': d}) for d in (RFF_DIMENSAO_PADRAO, 256)]
+    for modo, opcoes in variantes:
+        aproximado = MotorInferencia.do_modelo(modelos, modo_anomalia=modo, **opcoes)
+        for nome, X in conjuntos:
+            c = medir_concordancia(exato, aproximado, X)
+            print(f"{modo} {opcoes} {nome}: concordância {c['concordancia_decisao']:.2%} "
+                  f"({c['amostras']} amostras, {c['outliers_exato']} outliers), "
+                  f"|Δscore| médio {c['media_diff_score']:.2e} máx {c['max_diff_score']:.2e}")
+    sys.exit(0 if ok else 1)
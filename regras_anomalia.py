@@ -0,0 +1,56 @@
+"""
+Regras de Decisão sobre a Saída do Motor - Classificação de Grãos
+
+Status NORMAL/ANORMAL a partir da saída de MotorInferencia.prever(),
+compartilhado pelo servidor (servidor_flask.py) e pela classificação
+em lote de arquivos (classificar_arquivos.py):
+
+- Lógica AND: One-Class SVM E regra MAD devem concordar
+- Violações MAD >= VIOLACOES_MAD_MINIMAS (ajustado de 3 para 2)
+- Confiança < LIMIAR_CONFIANCA força ANORMAL (misturas/contaminações)
+
+descrever_regras() monta o texto das regras a partir dos mesmos
+parâmetros (respostas de /status e /config, logs do servidor).
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import numpy as np
+
+VIOLACOES_MAD_MINIMAS = 2
+LIMIAR_CONFIANCA = 0.60
+
+
+def aplicar_regras_anomalia(saida, violacoes_minimas=VIOLACOES_MAD_MINIMAS, limiar_confianca=LIMIAR_CONFIANCA):
+    """
+    Regras de decisão sobre a saída do motor (vetorizado, N amostras)
+
+    - Lógica AND: One-Class SVM E regra MAD devem concordar
+    - Violações MAD >= violacoes_minimas
+    - Confiança < limiar_confianca força status ANORMAL (misturas/contaminações)
+
+    Os limiares só mudam na varredura de hiperparâmetros
+    (varredura_hiperparametros.py); o servidor usa os padrões.
+    """
+    confianca = np.max(saida['probabilidades'], axis=1)
+    anomalia_svm = saida['svm_decisao'] == -1
+    anomalia_mad = saida['mad_violacoes'] >= violacoes_minimas
+    confianca_baixa = confianca < limiar_confianca
+    anormal = (anomalia_svm & anomalia_mad) | confianca_baixa
+
+    saida['confianca'] = confianca
+    saida['anomalia_svm'] = anomalia_svm
+    saida['anomalia_mad'] = anomalia_mad
+    saida['confianca_baixa'] = confianca_baixa
+    saida['status'] = np.where(anormal, 'ANORMAL', 'NORMAL')
+    return saida
+
+
+def descrever_regras(violacoes_minimas=VIOLACOES_MAD_MINIMAS, limiar_confianca=LIMIAR_CONFIANCA):
+    """Textos das regras com os limiares em uso: {'logica', 'mad', 'confianca'}"""
+    confianca = f'{limiar_confianca * 100:g}%'
+    return {
+        'logica': f'AND + alerta confiança < {confianca}',
+        'mad': f'Violações MAD >= {violacoes_minimas}',
+        'confianca': f'Confiança < {confianca}',
+    }
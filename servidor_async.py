@@ -0,0 +1,509 @@
+"""
+Servidor Assíncrono (asyncio) - Classificação de Grãos
+
+Modo de serviço para frotas grandes: cada ESP32 estacionado em long-poll
+(ou dashboard em /events) custa uma corrotina no event loop, e não uma
+thread do servidor WSGI.
+
+- /esp32/poll e /events: nativos no event loop. O long-poll é acordado
+  pelo ouvinte do estado quando um comando é enfileirado neste processo
+  (com estado SQLite, comandos de outros processos são vistos consultando
+  o banco a cada INTERVALO_ESPERA_SQLITE_S)
+- /esp32/result: corpo (JSON ou binário) e cache no loop; a inferência
+  vai para o agendador de micro-lotes (uma thread) ou para um pool
+  limitado de threads, com no máximo INFERENCIAS_MAX_PENDENTES
+  requisições aguardando
+- Demais rotas (/command/*, /history, /status, /export, /metrics, ...):
+  o próprio app Flask, via ponte WSGI num pool limitado de threads, com
+  as mesmas respostas do modo síncrono
+- Chamadas que podem bloquear (estado SQLite) rodam num pool pequeno
+  e próprio, fora do pool da ponte WSGI: um /export ou /history lento
+  não atrasa poll e result; com estado em memória são diretas (só um
+  lock curto)
+
+HTTP/1.1 mínimo sobre asyncio.start_server, sem dependências: keep-alive,
+corpo por Content-Length (sem chunked na requisição) e respostas em fluxo
+encerradas com o fim da conexão. Entrada malformada (linha de requisição,
+Content-Length, excesso de cabeçalhos, chunked) vira 4xx e fecha a conexão;
+casos cobertos em tests/test_servidor_async.py.
+
+Uso: BIND=0.0.0.0:5000 python servidor_async.py
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+
+import servidor_flask as base
+from eventos_sse import formatar_evento
+
+logger = logging.getLogger(__name__)
+
+# ==================== CONFIGURAÇÃO ====================
+
+BIND = os.environ.get('BIND', '0.0.0.0:5000')
+
+# Pool para a ponte WSGI e chamadas bloqueantes; pool do estado SQLite
+# (poll, result, events); pool de inferência usado só sem micro-lote
+# (MICRO_LOTE=1 usa a thread do agendador)
+THREADS_BLOQUEANTES = int(os.environ.get('ASYNC_THREADS', '32'))
+THREADS_ESTADO = int(os.environ.get('ASYNC_THREADS_ESTADO', '4'))
+THREADS_INFERENCIA = int(os.environ.get('ASYNC_THREADS_INFERENCIA', '2'))
+INFERENCIAS_MAX_PENDENTES = 256
+
+# Long-poll com estado SQLite: comandos enfileirados por outros processos
+# só aparecem no banco (os deste processo acordam na hora)
+INTERVALO_ESPERA_SQLITE_S = 1.0
+
+MAX_CORPO_BYTES = 4 * 1024 * 1024
+MAX_CABECALHOS = 100
+ESPERA_OCIOSA_S = 75
+SSE_HEARTBEAT_S = 15
+
+
+# ==================== HTTP ====================
+
+class ErroHTTP(Exception):
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class Requisicao:
+    __slots__ = ('metodo', 'caminho', 'consulta', 'versao', 'cabecalhos', 'corpo', 'ip')
+
+    def __init__(self, metodo, alvo, versao, cabecalhos, corpo, ip):
+        self.metodo = metodo
+        self.caminho, _, self.consulta = alvo.partition('?')
+        self.versao = versao
+        self.cabecalhos = cabecalhos
+        self.corpo = corpo
+        self.ip = ip
+
+    def json(self):
+        return json.loads(self.corpo) if self.corpo else None
+
+    @property
+    def tipo_conteudo(self):
+        return self.cabecalhos.get('content-type', '').partition(';')[0].strip().lower()
+
+    @property
+    def manter_conexao(self):
+        conexao = self.cabecalhos.get('connection', '').lower()
+        if self.versao == 'HTTP/1.0':
+            return conexao == 'keep-alive'
+        return conexao != 'close'
+
+
+async def _ler_linha(leitor, status, mensagem):
+    """readline() com linha acima do limite do leitor virando ErroHTTP"""
+    try:
+        return await leitor.readline()
+    except ValueError:  # LimitOverrunError embrulhado pelo readline
+        raise ErroHTTP(status, mensagem)
+
+
+def _tamanho_corpo(cabecalhos):
+    """Content-Length validado: só dígitos ASCII (sem sinal), 0 se ausente"""
+    valor = cabecalhos.get('content-length', '').strip()
+    if not valor:
+        return 0
+    if not (valor.isascii() and valor.isdigit()):
+        raise ErroHTTP(400, f'Content-Length inválido: {valor[:32]!r}')
+    tamanho = int(valor)
+    if tamanho > MAX_CORPO_BYTES:
+        raise ErroHTTP(413, f'Corpo excede {MAX_CORPO_BYTES} bytes')
+    return tamanho
+
+
+async def ler_requisicao(leitor, escritor, ip):
+    """
+    Próxima requisição da conexão, ou None se o cliente fechou.
+    Entrada malformada levanta ErroHTTP (respondida e a conexão fechada).
+    """
+    linha = await _ler_linha(leitor, 414, 'Linha de requisição longa demais')
+    if not linha.strip():
+        return None
+    partes = linha.decode('latin-1').rstrip('\r\n').split(' ')
+    if len(partes) != 3 or not partes[0].isalpha() or not partes[2].startswith('HTTP/1.'):
+        raise ErroHTTP(400, 'Linha de requisição inválida')
+    metodo, alvo, versao = partes
+
+    cabecalhos = {}
+    while True:
+        linha = await _ler_linha(leitor, 431, 'Cabeçalho longo demais')
+        if linha in (b'\r\n', b'\n', b''):
+            break
+        if len(cabecalhos) >= MAX_CABECALHOS:
+            raise ErroHTTP(431, 'Cabeçalhos demais')
+        nome, separador, valor = linha.decode('latin-1').partition(':')
+        nome = nome.strip().lower()
+        if not separador or not nome:
+            raise ErroHTTP(400, 'Cabeçalho inválido')
+        cabecalhos[nome] = f'{cabecalhos[nome]}, {valor.strip()}' if nome in cabecalhos else valor.strip()
+
+    if 'chunked' in cabecalhos.get('transfer-encoding', '').lower():
+        raise ErroHTTP(411, 'Corpo chunked não suportado: envie Content-Length')
+    tamanho = _tamanho_corpo(cabecalhos)
+    if tamanho and cabecalhos.get('expect', '').lower() == '100-continue':
+        escritor.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+    corpo = await leitor.readexactly(tamanho) if tamanho else b''
+    return Requisicao(metodo, alvo, versao, cabecalhos, corpo, ip)
+
+
+def cabecalho_resposta(status, cabecalhos):
+    if isinstance(status, int):
+        status = f'{status} {HTTPStatus(status).phrase}'
+    linhas = [f'HTTP/1.1 {status}'] + [f'{nome}: {valor}' for nome, valor in cabecalhos]
+    return ('\r\n'.join(linhas) + '\r\n\r\n').encode('latin-1')
+
+
+# ==================== SERVIDOR ====================
+
+class ServidorAssincrono:
+    """
+    Rotas nativas (poll, result, events) no event loop + ponte WSGI para
+    o restante do app Flask
+    """
+
+    def __init__(self, threads_bloqueantes=THREADS_BLOQUEANTES, threads_inferencia=THREADS_INFERENCIA,
+                 max_pendentes=INFERENCIAS_MAX_PENDENTES, threads_estado=THREADS_ESTADO):
+        self.bloqueantes = ThreadPoolExecutor(threads_bloqueantes, thread_name_prefix='async-bloqueante')
+        self.consultas_estado = ThreadPoolExecutor(threads_estado, thread_name_prefix='async-estado')
+        self.inferencia = ThreadPoolExecutor(threads_inferencia, thread_name_prefix='async-inferencia')
+        self.max_pendentes = max_pendentes
+        self.endereco = ('0.0.0.0', 5000)
+        self.conexoes = 0
+        self.estacionados = 0
+        self.requisicoes = 0
+        self._loop = None
+        self._inferencias = None
+        self._esperas = {}
+        self.rotas = {
+            ('POST', '/esp32/poll'): self.esp32_poll,
+            ('POST', '/esp32/result'): self.esp32_result,
+            ('GET', '/events'): self.eventos,
+        }
+
+    async def iniciar(self, host, porta):
+        self._loop = asyncio.get_running_loop()
+        self._inferencias = asyncio.Semaphore(self.max_pendentes)
+        self.endereco = (host, porta)
+        base.estado.adicionar_ouvinte(self._ouvinte)
+        base.metricas.medidor('graos_conexoes_abertas', 'Conexões HTTP abertas (modo asyncio)',
+                              lambda: self.conexoes)
+        base.metricas.medidor('graos_long_poll_estacionados', 'Dispositivos aguardando comando (modo asyncio)',
+                              lambda: self.estacionados)
+        return await asyncio.start_server(self._atender, host, porta, backlog=4096)
+
+    def encerrar(self):
+        """Solta o ouvinte do estado (o loop vai fechar) e os pools de threads"""
+        base.estado.remover_ouvinte(self._ouvinte)
+        self.bloqueantes.shutdown(wait=False)
+        self.consultas_estado.shutdown(wait=False)
+        self.inferencia.shutdown(wait=False)
+
+    # ---------------- Execução fora do loop ----------------
+
+    async def bloqueante(self, funcao, *args):
+        return await self._loop.run_in_executor(self.bloqueantes, funcao, *args)
+
+    async def estado_io(self, funcao, *args):
+        """
+        Funções que tocam o estado: diretas em memória; com SQLite no pool
+        do estado, que não disputa threads com a ponte WSGI
+        """
+        if base.estado.compartilhado:
+            return await self._loop.run_in_executor(self.consultas_estado, funcao, *args)
+        return funcao(*args)
+
+    # ---------------- Conexões ----------------
+
+    async def _atender(self, leitor, escritor):
+        endereco = escritor.get_extra_info('peername')
+        ip = endereco[0] if endereco else ''
+        self.conexoes += 1
+        try:
+            while True:
+                try:
+                    req = await asyncio.wait_for(ler_requisicao(leitor, escritor, ip), ESPERA_OCIOSA_S)
+                except ErroHTTP as e:
+                    await self.responder_json(escritor, None, e.status, {'error': str(e)})
+                    break
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                if req is None:
+                    break
+                self.requisicoes += 1
+                rota = self.rotas.get((req.metodo, req.caminho), self.wsgi)
+                if not await rota(req, escritor) or not req.manter_conexao:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        except Exception as e:
+            # Falha fora dos handlers (que já respondem 500): a conexão
+            # recebe um 500 e o erro vai para o log, não para o loop
+            logger.error("❌ Erro inesperado na conexão de %s: %s", ip, e, exc_info=True)
+            try:
+                await self.responder_json(escritor, None, 500, {'error': 'Erro interno do servidor'})
+            except (ConnectionError, OSError):
+                pass
+        finally:
+            self.conexoes -= 1
+            escritor.close()
+
+    async def responder_json(self, escritor, req, status, corpo):
+        """Mesmo JSON do jsonify do Flask; retorna se a conexão continua aberta"""
+        dados = (base.app.json.dumps(corpo, separators=(',', ':')) + '\n').encode()
+        manter = req is not None and req.manter_conexao
+        escritor.write(cabecalho_resposta(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', len(dados)),
+            ('Access-Control-Allow-Origin', '*'),
+            ('Connection', 'keep-alive' if manter else 'close'),
+        ]) + dados)
+        await escritor.drain()
+        return manter
+
+    # ---------------- ESP32 ----------------
+
+    def _ouvinte(self, dispositivos):
+        # Chamado pelo estado em qualquer thread
+        self._loop.call_soon_threadsafe(self._acordar, dispositivos)
+
+    def _acordar(self, dispositivos):
+        for device_id in dispositivos:
+            for evento in self._esperas.get(device_id, ()):
+                evento.set()
+
+    async def retirar_comando(self, device_id, espera_s):
+        """Long-poll sem thread: espera o ouvinte do estado (ou o prazo)"""
+        estado = base.estado
+        comando = await self.estado_io(estado.retirar_comando, device_id, 0)
+        if comando is not None or espera_s <= 0:
+            return comando
+
+        evento = asyncio.Event()
+        self._esperas.setdefault(device_id, set()).add(evento)
+        self.estacionados += 1
+        limite = self._loop.time() + espera_s
+        try:
+            while True:
+                restante = limite - self._loop.time()
+                if restante <= 0:
+                    return None
+                # Limpa antes de consultar: um comando que chegue depois
+                # da consulta encontra o evento ligado
+                evento.clear()
+                comando = await self.estado_io(estado.retirar_comando, device_id, 0)
+                if comando is not None:
+                    return comando
+                if estado.compartilhado:
+                    restante = min(restante, INTERVALO_ESPERA_SQLITE_S)
+                try:
+                    await asyncio.wait_for(evento.wait(), restante)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.estacionados -= 1
+            esperas = self._esperas[device_id]
+            esperas.discard(evento)
+            if not esperas:
+                del self._esperas[device_id]
+
+    async def esp32_poll(self, req, escritor):
+        try:
+            device_id, device_info, espera_s = await self.estado_io(base.registrar_poll, req.json(), req.ip)
+            comando = await self.retirar_comando(device_id, espera_s)
+            corpo = await self.estado_io(base.resposta_poll, device_id, device_info, espera_s, comando)
+            status = 200
+        except base.EntradaInvalida as e:
+            logger.warning("⚠️ /esp32/poll: %s", e)
+            corpo, status = {'error': str(e)}, 400
+        except Exception as e:
+            logger.error("Erro em /esp32/poll: %s", e)
+            corpo, status = {'error': str(e)}, 500
+        return await self.responder_json(escritor, req, status, corpo)
+
+    async def classificar(self, spectrum):
+        """Inferência fora do loop, com no máximo max_pendentes aguardando"""
+        async with self._inferencias:
+            if base.MICRO_LOTE_ATIVO:
+                resultado = base.resultado_em_cache(spectrum)
+                if resultado is None:
+                    resultado = await asyncio.wrap_future(base.agendador.submeter(spectrum))
+                return resultado
+            return await self._loop.run_in_executor(self.inferencia, base.prever_amostra, spectrum)
+
+    async def esp32_result(self, req, escritor):
+        try:
+            inicio = time.perf_counter()
+            data, device_id, spectrum = base.ler_corpo_resultado(req.tipo_conteudo, req.corpo, req.json)
+            resultado = await self.classificar(spectrum)
+            corpo = await self.estado_io(base.finalizar_resultado, data, device_id, resultado, inicio)
+            status = 200
+        except base.EntradaInvalida as e:
+            logger.warning("⚠️ /esp32/result: %s", e)
+            corpo, status = {'error': str(e), 'status': 'ERRO'}, 400
+        except Exception as e:
+            base.metrica_erros.incrementar('/esp32/result')
+            logger.error("❌ Erro em /esp32/result: %s", e, exc_info=True)
+            corpo, status = {'error': str(e), 'status': 'ERRO'}, 500
+        return await self.responder_json(escritor, req, status, corpo)
+
+    # ---------------- Dashboard (SSE) ----------------
+
+    async def eventos(self, req, escritor):
+        """/events sem thread por cliente: o barramento acorda o fluxo"""
+        assinante = base.eventos.assinar()
+        sinal = asyncio.Event()
+        assinante.ao_publicar = lambda: self._loop.call_soon_threadsafe(sinal.set)
+        try:
+            iniciais = await self.estado_io(base.eventos_iniciais)
+            escritor.write(cabecalho_resposta(200, [
+                ('Content-Type', 'text/event-stream; charset=utf-8'),
+                ('Cache-Control', 'no-cache'),
+                ('X-Accel-Buffering', 'no'),
+                ('Access-Control-Allow-Origin', '*'),
+                ('Connection', 'close'),
+            ]))
+            escritor.write(b'retry: 3000\n\n')
+            for tipo, dados in iniciais:
+                escritor.write(formatar_evento(tipo, json.dumps(dados, ensure_ascii=False, default=str)).encode())
+            await escritor.drain()
+
+            while True:
+                sinal.clear()
+                evento = assinante.proximo(0)
+                if evento is not None:
+                    escritor.write(formatar_evento(*evento).encode())
+                else:
+                    try:
+                        await asyncio.wait_for(sinal.wait(), SSE_HEARTBEAT_S)
+                        continue
+                    except asyncio.TimeoutError:
+                        escritor.write(b': ping\n\n')
+                await escritor.drain()
+        finally:
+            base.eventos.cancelar(assinante)
+
+    # ---------------- Ponte WSGI ----------------
+
+    def _ambiente(self, req):
+        environ = {
+            'REQUEST_METHOD': req.metodo,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(req.caminho, 'latin-1'),
+            'QUERY_STRING': req.consulta,
+            'SERVER_NAME': self.endereco[0],
+            'SERVER_PORT': str(self.endereco[1]),
+            'SERVER_PROTOCOL': req.versao,
+            'REMOTE_ADDR': req.ip,
+            'CONTENT_LENGTH': str(len(req.corpo)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(req.corpo),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for nome, valor in req.cabecalhos.items():
+            if nome == 'content-type':
+                environ['CONTENT_TYPE'] = valor
+            elif nome != 'content-length':
+                environ['HTTP_' + nome.upper().replace('-', '_')] = valor
+        return environ
+
+    def _chamar_wsgi(self, req):
+        """
+        Executa o app Flask (numa thread do pool). Resposta com tamanho
+        conhecido volta inteira; em fluxo (/export) volta o iterador
+        """
+        inicio = {}
+
+        def start_response(status, cabecalhos, exc_info=None):
+            inicio['status'], inicio['cabecalhos'] = status, cabecalhos
+
+        corpo = base.app(self._ambiente(req), start_response)
+        if any(nome.lower() == 'content-length' for nome, _ in inicio['cabecalhos']):
+            try:
+                return inicio['status'], inicio['cabecalhos'], [b''.join(corpo)]
+            finally:
+                if hasattr(corpo, 'close'):
+                    corpo.close()
+        return inicio['status'], inicio['cabecalhos'], corpo
+
+    async def wsgi(self, req, escritor):
+        status, cabecalhos, corpo = await self.bloqueante(self._chamar_wsgi, req)
+        em_fluxo = not isinstance(corpo, list)
+        manter = not em_fluxo and req.manter_conexao
+        cabecalhos = [(n, v) for n, v in cabecalhos if n.lower() != 'connection']
+        cabecalhos.append(('Connection', 'keep-alive' if manter else 'close'))
+        escritor.write(cabecalho_resposta(status, cabecalhos))
+        if not em_fluxo:
+            escritor.write(corpo[0])
+            await escritor.drain()
+            return manter
+
+        iterador = iter(corpo)
+        try:
+            while True:
+                bloco = await self.bloqueante(next, iterador, None)
+                if bloco is None:
+                    break
+                if bloco:
+                    escritor.write(bloco)
+                    await escritor.drain()
+        finally:
+            if hasattr(corpo, 'close'):
+                await self.bloqueante(corpo.close)
+        return False
+
+
+async def servir(host, porta):
+    servidor = ServidorAssincrono()
+    tcp = await servidor.iniciar(host, porta)
+    logger.info("🌐 Servidor asyncio em http://%s:%s (%d threads bloqueantes, %d do estado, micro-lote %s)",
+                host, porta, THREADS_BLOQUEANTES, THREADS_ESTADO, 'ativo' if base.MICRO_LOTE_ATIVO else 'inativo')
+    try:
+        async with tcp:
+            await tcp.serve_forever()
+    finally:
+        servidor.encerrar()
+
+
+# ==================== MAIN ====================
+
+if __name__ == '__main__':
+    logger.info("=" * 60)
+    logger.info("🌾 CLASSIFICADOR DE GRÃOS - SERVIDOR ASSÍNCRONO (asyncio)")
+    logger.info("=" * 60)
+
+    if not base.carregar_modelo():
+        logger.error("⚠️ Servidor iniciará SEM modelo!")
+    if base.estado.compartilhado:
+        logger.warning("⚠️ Estado SQLite: comandos de outros processos são vistos a cada "
+                       f"{INTERVALO_ESPERA_SQLITE_S} s")
+
+    base.iniciar_servicos()
+
+    # kill -HUP <pid> recarrega o modelo a quente (mesmo que POST /model/reload)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda *_: base.iniciar_recarga())
+
+    host, _, porta = BIND.rpartition(':')
+    try:
+        asyncio.run(servir(host or '0.0.0.0', int(porta)))
+    except KeyboardInterrupt:
+        logger.info("👋 Servidor encerrado")
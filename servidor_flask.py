@@ -16,7 +16,8 @@ CORREÇÕES DESTA VERSÃO:
 - Mantém baixa taxa de falsos positivos com lógica AND
 
 Instalação:
-pip install flask flask-cors numpy pandas joblib scikit-learn
+pip install flask flask-cors numpy
+(pandas, joblib e scikit-learn só para compilar o artefato ou usar o .pkl)
 
 Uso:
 python app_um_modelo_corrigido.py
@@ -25,22 +26,47 @@ Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
 
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import numpy as np
-import pandas as pd
-import joblib
 import logging
 from datetime import datetime
-from collections import deque
 import threading
 import time
+import math
+import os
+import signal
+
+from motor_inferencia import MotorInferencia, marcar_etapa, BANDA_485_IDX
+from artefato_modelo import carregar_artefato, sha256_arquivo, ARTEFATO_PADRAO
+from agendador_lotes import AgendadorInferencia
+from log_estruturado import configurar_logging
+from eventos_sse import BarramentoEventos
+from armazenamento import ArmazenamentoAnalises, LIMITE_MAXIMO, LIMITE_PADRAO
+from estado_compartilhado import criar_estado, FilaComandosCheia, COMANDO_TTL_PADRAO_S
+from cache_resultados import CacheResultados
+from difusao_comandos import (nova_difusao, normalizar_tags, relatorio, resumir_resultado,
+                              selecionar_dispositivos, DIFUSAO_PRAZO_PADRAO_S)
+from metricas import RegistroMetricas, TIPO_CONTEUDO, LIMITES_COMANDO_S
+from formato_espectro import decodificar_espectro, TIPO_ESPECTRO_BINARIO
+from regras_anomalia import aplicar_regras_anomalia, descrever_regras, VIOLACOES_MAD_MINIMAS, LIMIAR_CONFIANCA
+from sessao_varredura import (nova_sessao, acumular, espectros_teste, decidir,
+                              VARREDURAS_MINIMAS, VARREDURAS_MAXIMAS, SESSAO_TENTATIVAS)
+import exportacao
 
 # ==================== CONFIGURAÇÃO ====================
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+# Logging: um registro por predição, formatado/escrito em thread de fundo.
+# LOG_DETALHADO=1 reativa o diagnóstico completo (índices, violações MAD...)
+# LOG_FORMATO=json emite JSON lines; LOG_ARQUIVO grava também em arquivo
+LOG_DETALHADO = os.environ.get('LOG_DETALHADO', '0') == '1'
+LOG_FORMATO = os.environ.get('LOG_FORMATO', 'texto')
+LOG_ARQUIVO = os.environ.get('LOG_ARQUIVO') or None
+
+configurar_logging(
+    nivel=logging.DEBUG if LOG_DETALHADO else logging.INFO,
+    formato=LOG_FORMATO,
+    arquivo=LOG_ARQUIVO
 )
 logger = logging.getLogger(__name__)
 
@@ -51,78 +77,274 @@ CORS(app)
 # ==================== VARIÁVEIS GLOBAIS ====================
 
 DEVICE_TIMEOUT = 10
-analysis_history = deque(maxlen=100)
-connected_devices = {}
-pending_commands = {}
-last_analysis = None
-analysis_lock = threading.Lock()
-
-# Componentes do modelo
-MODELOS = None
-modelo_especies = None
-detectores_anomalia = None
-limiares_mad = None
-scaler_bandas = None
-scaler_indices = None
-scaler_final = None
-pca = None
-bandas_cols = None
-indices_cols = None
+POLL_INTERVAL_MS = 2000
+
+# Dispositivo inativo há mais que isso sai do registro (verificado a cada
+# SSE_VERIFICACAO_DISPOSITIVOS_S pelo monitor, via prazos do registro)
+DEVICE_REMOCAO_S = 300
+
+# Long-poll: /esp32/poll com "wait" (s) fica aguardando um comando
+# até LONG_POLL_MAX_S em vez de responder 'status' imediatamente
+LONG_POLL_MAX_S = 30
+
+# Comandos: fila por dispositivo com prioridade e TTL (limites em
+# estado_compartilhado.py). O TTL pedido em /command/analyze é limitado
+# a COMANDO_TTL_MAX_S e a prioridade a ±COMANDO_PRIORIDADE_MAX
+COMANDO_TTL_MAX_S = 3600
+COMANDO_PRIORIDADE_MAX = 1000
+
+# Difusão (/command/broadcast): a coleta com "wait" reconsulta o estado
+# a cada DIFUSAO_INTERVALO_S até todos responderem ou o prazo acabar
+DIFUSAO_INTERVALO_S = 0.25
+MAX_LOTE = 256
+
+# Micro-lotes (MICRO_LOTE=1): requisições concorrentes de /esp32/result
+# são agrupadas por até MICRO_LOTE_JANELA_MS (ou MICRO_LOTE_MAX amostras)
+# e classificadas numa única chamada de prever_lote. Desligado por padrão:
+# sem requisições simultâneas a janela só soma latência
+MICRO_LOTE_ATIVO = os.environ.get('MICRO_LOTE', '0') == '1'
+MICRO_LOTE_JANELA_MS = float(os.environ.get('MICRO_LOTE_JANELA_MS', '5'))
+MICRO_LOTE_MAX = int(os.environ.get('MICRO_LOTE_MAX', '32'))
+
+# Server-Sent Events (/events): buffer máximo por cliente, intervalo
+# de verificação de expiração de dispositivos e intervalo mínimo entre
+# listas de dispositivos publicadas a partir dos polls
+SSE_MAX_EVENTOS_CLIENTE = 100
+SSE_VERIFICACAO_DISPOSITIVOS_S = 1.0
+SSE_INTERVALO_MIN_DISPOSITIVOS_S = 0.25
+
+# Modelo: artefato compilado (arrays NumPy, sem sklearn/pandas/joblib,
+# gerado por artefato_modelo.py) com fallback para o .pkl original
+MODELO_PKL = 'modelo_completo_sem_485nm.pkl'
+MODELO_COMPILADO = os.environ.get('MODELO_COMPILADO', ARTEFATO_PADRAO)
+
+# One-Class SVM: 'exata' (padrão), 'nystrom' ou 'rff' (custo fixo,
+# independente do nº de vetores de suporte; ver motor_inferencia.py)
+ANOMALIA_MODO = os.environ.get('ANOMALIA_MODO', 'exata')
+
+# Texto das regras de decisão, montado dos limiares em uso (regras_anomalia.py)
+DESCRICAO_REGRAS = descrever_regras()
+
+# Histórico persistente (SQLite/WAL) e retenção em dias
+BANCO_ANALISES = os.environ.get('BANCO_ANALISES', 'analises_graos.db')
+RETENCAO_DIAS = int(os.environ.get('RETENCAO_DIAS', '365'))
+
+# Estado de dispositivos/comandos: em memória (processo único) ou, com
+# ESTADO_COMPARTILHADO=arquivo.db, em SQLite compartilhado pelos workers
+# do host (gunicorn.conf.py define o padrão estado_servidor.db)
+ESTADO_COMPARTILHADO = os.environ.get('ESTADO_COMPARTILHADO') or None
+
+# Cache de resultados (opcional): espectros quase idênticos (bandas
+# arredondadas a CACHE_TOLERANCIA) reaproveitam a classificação sem
+# passar pelo modelo. A chave inclui a versão do modelo e o cache é
+# esvaziado a cada recarga
+CACHE_ATIVO = os.environ.get('CACHE_RESULTADOS', '0') == '1'
+CACHE_TOLERANCIA = float(os.environ.get('CACHE_TOLERANCIA', '1e-4'))
+CACHE_CAPACIDADE = int(os.environ.get('CACHE_CAPACIDADE', '10000'))
+CACHE_TTL_S = float(os.environ.get('CACHE_TTL_S', '3600'))
+
+armazenamento = ArmazenamentoAnalises(BANCO_ANALISES)
+estado = criar_estado(ESTADO_COMPARTILHADO, DEVICE_TIMEOUT)
+eventos = BarramentoEventos(max_eventos_cliente=SSE_MAX_EVENTOS_CLIENTE)
+cache = CacheResultados(CACHE_CAPACIDADE, CACHE_TOLERANCIA, CACHE_TTL_S) if CACHE_ATIVO else None
+
+# Modelo: snapshot imutável (MotorInferencia) trocado atomicamente.
+# Quem classifica lê 'motor' uma vez e usa essa referência até o fim,
+# então predições em andamento terminam no snapshot antigo
+motor = None
+modelo_carregado_em = None
+recarga_lock = threading.Lock()
+ultima_recarga = None
+
+# ==================== MÉTRICAS ====================
+# Tempo por etapa do pipeline (em micro-lote/lote: uma observação por
+# lote), latência por endpoint, esperas em fila/lock e contadores de
+# predições. Expostos em /metrics (Prometheus) e resumidos em /status.
+
+metricas = RegistroMetricas()
+metrica_etapas = metricas.histograma(
+    'graos_etapa_segundos', 'Duração de cada etapa da classificação', ('etapa',))
+metrica_requisicoes = metricas.histograma(
+    'graos_requisicao_segundos', 'Latência total por endpoint', ('endpoint',))
+metrica_esperas = metricas.histograma(
+    'graos_espera_segundos', 'Espera em fila ou lock antes de ser atendido', ('recurso',))
+metrica_predicoes = metricas.contador(
+    'graos_predicoes_total', 'Predições por espécie e status', ('especie', 'status'))
+metrica_predicoes_dispositivo = metricas.contador(
+    'graos_predicoes_dispositivo_total', 'Predições por dispositivo', ('device_id',))
+metrica_erros = metricas.contador(
+    'graos_erros_total', 'Requisições com erro por endpoint', ('endpoint',))
+metrica_comandos = metricas.contador(
+    'graos_comandos_total', 'Comandos por desfecho (enfileirado, rejeitado, concluido, duplicado, expirado)',
+    ('desfecho',))
+metrica_comando_resultado = metricas.histograma(
+    'graos_comando_resultado_segundos', 'Tempo entre o comando e o resultado correspondente',
+    limites=LIMITES_COMANDO_S)
+metrica_sessoes = metricas.histograma(
+    'graos_sessao_varreduras', 'Leituras por sessão de varredura até a decisão (estavel ou limite)',
+    ('motivo',), limites=tuple(range(1, VARREDURAS_MAXIMAS + 1)))
+
+
+metricas.medidor(
+    'graos_modelo_info', 'Modelo em serviço (versão e modo do One-Class SVM)',
+    lambda: {(motor.versao or '', motor.modo_anomalia): 1} if motor is not None else {},
+    ('versao', 'modo_anomalia'))
+metricas.medidor(
+    'graos_dispositivos_ativos', 'Dispositivos vistos há menos de DEVICE_TIMEOUT',
+    lambda: estado.contagem_ativos())
+metricas.medidor('graos_fila_micro_lote', 'Requisições aguardando o próximo micro-lote',
+                 lambda: agendador.estatisticas()['fila_atual'])
+metricas.medidor('graos_cache_acertos_total', 'Acertos do cache de resultados',
+                 lambda: cache.acertos if cache is not None else None, tipo='counter')
+metricas.medidor('graos_cache_faltas_total', 'Faltas do cache de resultados',
+                 lambda: cache.faltas if cache is not None else None, tipo='counter')
+
+
+def observar_etapas(tempos):
+    for etapa, duracao in tempos.items():
+        metrica_etapas.observar(duracao, etapa)
 
 
 # ==================== CARREGAMENTO DO MODELO ====================
 
-def carregar_modelo():
-    """Carrega modelo treinado"""
-    global MODELOS, modelo_especies, detectores_anomalia, limiares_mad
-    global scaler_bandas, scaler_indices, scaler_final, pca, bandas_cols, indices_cols
+def carregar_artefato_compilado():
+    """
+    Motor a partir do artefato compilado, se existir e corresponder ao .pkl
+    atual. Retorna None para cair no carregamento via joblib.
+    """
+    if not os.path.exists(MODELO_COMPILADO):
+        logger.info(f"💡 Artefato {MODELO_COMPILADO} ausente; gere com: python artefato_modelo.py")
+        return None
 
     try:
+        parametros, cabecalho = carregar_artefato(MODELO_COMPILADO)
+    except ValueError as e:
+        logger.error(f"❌ Artefato inválido ({e}); usando {MODELO_PKL}")
+        return None
+
+    origem = cabecalho.get('origem', {})
+    if os.path.exists(MODELO_PKL) and origem.get('sha256_pkl') != sha256_arquivo(MODELO_PKL):
+        logger.warning(f"⚠️ {MODELO_COMPILADO} foi gerado de outro {MODELO_PKL}; recompile o artefato")
+        return None
+
+    logger.info(f"📦 Artefato compilado v{cabecalho['versao_formato']} "
+                f"(sklearn {origem.get('versao_sklearn', '?')}, {origem.get('compilado_em', '?')})")
+    return MotorInferencia(parametros, versao=origem.get('sha256_pkl', cabecalho['sha256'])[:12],
+                           origem=MODELO_COMPILADO, modo_anomalia=ANOMALIA_MODO)
+
+
+def construir_motor():
+    """Lê o modelo do disco (artefato compilado ou .pkl) num snapshot novo"""
+    novo_motor = carregar_artefato_compilado()
+    if novo_motor is None:
         logger.info("📦 Carregando modelo_completo_sem_485nm.pkl...")
+        import joblib  # importa sklearn ao desserializar: só neste caminho
+        novo_motor = MotorInferencia.do_modelo(joblib.load(MODELO_PKL),
+                                               versao=sha256_arquivo(MODELO_PKL)[:12],
+                                               origem=MODELO_PKL, modo_anomalia=ANOMALIA_MODO)
+    return novo_motor
 
-        MODELOS = joblib.load('modelo_completo_sem_485nm.pkl')
-
-        modelo_especies = MODELOS['modelo_especies']
-        detectores_anomalia = MODELOS['detectores_anomalia']
-        limiares_mad = MODELOS['limiares_mad']
-        scaler_bandas = MODELOS['scaler_bandas']
-        scaler_indices = MODELOS['scaler_indices']
-        scaler_final = MODELOS['scaler_final']
-        pca = MODELOS['pca']
-        bandas_cols = MODELOS['bandas_cols']
-        indices_cols = MODELOS['indices_cols']
-
-        logger.info("✅ Modelo carregado!")
-        logger.info(f"🌾 Espécies: {modelo_especies.classes_}")
-        logger.info(f"📊 Bandas no modelo: {len(bandas_cols)}")
-        logger.info(f"📈 Índices: {list(indices_cols)}")
+
+def validar_motor(novo_motor):
+    """
+    Confere um snapshot antes de publicá-lo: formato de entrada compatível
+    com o ESP32 e predições finitas num lote de espectros sintéticos
+    """
+    if novo_motor.n_bandas != 17:
+        raise ValueError(f"Modelo espera {novo_motor.n_bandas} bandas (ESP32 envia 18 - r485 = 17)")
+    if list(novo_motor.indices_cols) != ['I1_NDVI', 'I2_Water', 'I3_Lipid', 'I4_Slope_Alt']:
+        raise ValueError(f"Índices incompatíveis: {novo_motor.indices_cols}")
+
+    espectros = np.vstack([
+        np.full(novo_motor.n_bandas, 0.5),
+        np.linspace(0.1, 1.0, novo_motor.n_bandas),
+        np.linspace(1.0, 0.1, novo_motor.n_bandas),
+    ])
+    saida = novo_motor.prever(espectros)
+    probabilidades = saida['probabilidades']
+    if not (np.all(np.isfinite(probabilidades)) and np.all(np.isfinite(saida['svm_score']))):
+        raise ValueError("Modelo produziu valores não finitos")
+    if not np.allclose(probabilidades.sum(axis=1), 1.0, atol=1e-6):
+        raise ValueError("Probabilidades não somam 1")
+
+
+def publicar_motor(novo_motor):
+    """Troca atômica do snapshot (uma atribuição de referência)"""
+    global motor, modelo_carregado_em
+    motor = novo_motor
+    modelo_carregado_em = datetime.now().isoformat()
+    if cache is not None:
+        cache.limpar()
+    eventos.publicar('status', status_modelo())
+
+
+def carregar_modelo():
+    """Carrega modelo treinado (artefato compilado ou .pkl)"""
+    try:
+        inicio = time.perf_counter()
+        novo_motor = construir_motor()
+        validar_motor(novo_motor)
+        publicar_motor(novo_motor)
+
+        logger.info(f"✅ Modelo {motor.versao} carregado de {motor.origem} "
+                    f"em {(time.perf_counter() - inicio) * 1000:.1f} ms")
+        logger.info(f"🌾 Espécies: {[str(c) for c in motor.classes]}")
+        logger.info(f"📊 Bandas no modelo: {motor.n_bandas}")
+        logger.info(f"📈 Índices: {list(motor.indices_cols)}")
         logger.info(f"⚠️ IMPORTANTE: ESP32 envia 18 bandas, servidor remove r485 automaticamente")
 
         return True
 
     except FileNotFoundError:
-        logger.error("❌ Arquivo 'modelo_completo_graos.pkl' não encontrado!")
+        logger.error(f"❌ Arquivo '{MODELO_PKL}' não encontrado!")
         return False
     except Exception as e:
         logger.error(f"❌ Erro ao carregar modelo: {e}")
         return False
 
 
-# ==================== FUNÇÕES DE CÁLCULO ====================
-
-def calcular_indices_novos(df):
+def recarregar_modelo():
     """
-    Índices espectrais SEM usar banda 485nm
-    Alinhados com modelo de produção
+    Recarga a quente (chamada com recarga_lock adquirido): carrega e valida
+    o novo modelo nesta thread e só então troca o snapshot. Falhas mantêm
+    o modelo atual em serviço.
     """
-    df = df.copy()
-    df['I1_NDVI'] = (df['r810'] - df['r680']) / (df['r810'] + df['r680'] + 1e-10)
-    df['I2_Water'] = df['r940'] / (df['r760'] + 1e-10)
-    df['I3_Lipid'] = df['r860'] / (df['r680'] + 1e-10)
-    df['I4_Slope_Alt'] = (df['r645'] - df['r535']) / 110.0
-    return df
+    global ultima_recarga
+
+    try:
+        inicio = time.perf_counter()
+        anterior = motor.versao if motor else None
+        logger.info("🔄 Recarregando modelo...")
+        try:
+            novo_motor = construir_motor()
+            validar_motor(novo_motor)
+            publicar_motor(novo_motor)
+            ultima_recarga = {
+                'status': 'ok',
+                'versao_anterior': anterior,
+                'versao': novo_motor.versao,
+                'origem': novo_motor.origem,
+            }
+            logger.info(f"✅ Modelo recarregado: {anterior} -> {novo_motor.versao}")
+        except Exception as e:
+            ultima_recarga = {'status': 'erro', 'erro': str(e), 'versao': anterior}
+            logger.error(f"❌ Recarga falhou, mantendo modelo {anterior}: {e}")
+        ultima_recarga['duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        ultima_recarga['timestamp'] = datetime.now().isoformat()
+    finally:
+        recarga_lock.release()
 
 
+def iniciar_recarga():
+    """Dispara recarregar_modelo em segundo plano; False se já houver uma em curso"""
+    if not recarga_lock.acquire(blocking=False):
+        return False
+    threading.Thread(target=recarregar_modelo, name='recarga-modelo', daemon=True).start()
+    return True
+
+
+# ==================== FUNÇÕES DE CÁLCULO ====================
+
 def remover_banda_485(spectrum_18_bandas):
     """
     Remove a banda 485nm (índice 3) do espectro de 18 bandas
@@ -136,14 +358,91 @@ def remover_banda_485(spectrum_18_bandas):
     if len(spectrum_18_bandas) != 18:
         raise ValueError(f"Esperado 18 bandas, recebido {len(spectrum_18_bandas)}")
 
-    # Remover índice 3 (banda 485nm)
-    spectrum_17_bandas = spectrum_18_bandas[:3] + spectrum_18_bandas[4:]
+    # Remover índice 3 (banda 485nm); corpo binário chega como array NumPy
+    if isinstance(spectrum_18_bandas, np.ndarray):
+        spectrum_17_bandas = np.delete(spectrum_18_bandas, BANDA_485_IDX)
+    else:
+        spectrum_17_bandas = spectrum_18_bandas[:3] + spectrum_18_bandas[4:]
 
-    logger.info(f"✂️ Banda 485nm removida: {spectrum_18_bandas[3]:.6f}")
+    logger.debug("✂️ Banda 485nm removida: %.6f", spectrum_18_bandas[3])
 
     return spectrum_17_bandas
 
 
+def montar_resultado(saida, i, timestamp, modelo):
+    """Monta o dicionário de resultado (formato da API) da amostra i"""
+    return {
+        'especie': str(saida['especie'][i]),
+        'confianca': round(float(saida['confianca'][i]) * 100, 1),
+        'status': str(saida['status'][i]),
+        'probabilidades': {
+            classe: round(float(prob) * 100, 1)
+            for classe, prob in zip(modelo.classes, saida['probabilidades'][i])
+        },
+        'indices': {
+            col: round(float(val), 4)
+            for col, val in zip(modelo.indices_cols, saida['indices'][i])
+        },
+        'detalhes_anomalia': {
+            'svm_score': round(float(saida['svm_score'][i]), 4),
+            'svm_detectou': bool(saida['anomalia_svm'][i]),
+            'mad_violacoes': int(saida['mad_violacoes'][i]),
+            'mad_detectou': bool(saida['anomalia_mad'][i]),
+            'confianca_baixa': bool(saida['confianca_baixa'][i]),
+            'logica_usada': DESCRICAO_REGRAS['logica']
+        },
+        'versao_modelo': modelo.versao,
+        'timestamp': timestamp
+    }
+
+
+def logar_diagnostico(saida, i, modelo):
+    """Log detalhado (DEBUG) de uma predição: índices, SVM, violações MAD"""
+    logger.debug("📊 Índices calculados:")
+    for idx_name, idx_value in zip(modelo.indices_cols, saida['indices'][i]):
+        logger.debug("   %s: %.4f", idx_name, idx_value)
+
+    logger.debug("🎯 Espécie predita: %s (%.1f%%)", saida['especie'][i], saida['confianca'][i] * 100)
+    logger.debug("🔍 One-Class SVM: decisão=%s, score=%.4f", saida['svm_decisao'][i], saida['svm_score'][i])
+    logger.debug("🔍 Regra MAD: violações=%s/4, limiar=%s", saida['mad_violacoes'][i], VIOLACOES_MAD_MINIMAS)
+    for idx_name, desvio, mad in zip(modelo.indices_cols, saida['mad_desvios'][i], saida['mad_limiares'][i]):
+        logger.debug("   %s: desvio=%.4f, limiar=%.4f %s", idx_name, desvio, mad,
+                     "❌ VIOLOU" if desvio > mad else "✅ OK")
+
+    logger.debug("🏁 Resultado anomalia: SVM=%s MAD=%s confiança baixa (%s)=%s status=%s",
+                 saida['anomalia_svm'][i], saida['anomalia_mad'][i], DESCRICAO_REGRAS['confianca'],
+                 saida['confianca_baixa'][i], saida['status'][i])
+
+
+def registrar_predicao(resultado, latencia_ms=None):
+    """
+    Registro único (estruturado) por predição
+
+    Formatação preguiçosa: mensagem e JSON são montados na thread do
+    listener de log. Predições ANORMAIS saem em nível WARNING.
+    """
+    detalhes = resultado.get('detalhes_anomalia', {})
+    dados = {
+        'evento': 'predicao',
+        'device_id': resultado.get('device_id'),
+        'especie': resultado.get('especie'),
+        'confianca': resultado.get('confianca'),
+        'status': resultado.get('status'),
+        'svm_score': detalhes.get('svm_score'),
+        'mad_violacoes': detalhes.get('mad_violacoes'),
+        'confianca_baixa': detalhes.get('confianca_baixa'),
+    }
+    if latencia_ms is not None:
+        dados['latencia_ms'] = round(latencia_ms, 3)
+
+    metrica_predicoes.incrementar(dados['especie'], dados['status'])
+    metrica_predicoes_dispositivo.incrementar(dados['device_id'])
+
+    nivel = logging.WARNING if resultado.get('status') == 'ANORMAL' else logging.INFO
+    logger.log(nivel, "🏁 Predição %s: %s (%.1f%%) - %s", dados['device_id'], dados['especie'],
+               dados['confianca'], dados['status'], extra={'dados': dados})
+
+
 def prever_amostra(spectrum_18_bandas):
     """
     Função de inferência principal
@@ -152,180 +451,580 @@ def prever_amostra(spectrum_18_bandas):
 
     AJUSTES DE ANOMALIA (VERSÃO CORRIGIDA):
     - Lógica AND em vez de OR (mais conservadora)
-    - Violações MAD >= 2 (ajustado de 3 para melhor detecção)
-    - Alerta de confiança < 60% (detecta misturas/contaminações)
+    - Violações MAD >= VIOLACOES_MAD_MINIMAS (ajustado de 3 para 2)
+    - Alerta de confiança < LIMIAR_CONFIANCA (detecta misturas/contaminações)
     """
     try:
         # VALIDAR ENTRADA DE 18 BANDAS
         if len(spectrum_18_bandas) != 18:
             raise ValueError(f"Espectro inválido: {len(spectrum_18_bandas)} bandas (esperado: 18)")
 
+        tempos = {}
+        t = time.perf_counter()
+
         # REMOVER BANDA 485nm (índice 3)
         spectrum = remover_banda_485(spectrum_18_bandas)
+        t = marcar_etapa(tempos, 'remover_485', t)
 
-        # Agora temos 17 bandas para o modelo
-        if len(spectrum) != len(bandas_cols):
-            raise ValueError(f"Erro: {len(spectrum)} bandas após remoção, modelo espera {len(bandas_cols)}")
-
-        # 1. Criar DataFrame com bandas (MESMA ORDEM DO TREINAMENTO)
-        bandas_dict = {bandas_cols[i]: spectrum[i] for i in range(len(bandas_cols))}
-        df_temp = pd.DataFrame([bandas_dict])
-
-        # 2. Calcular índices espectrais NOVOS
-        df_temp = calcular_indices_novos(df_temp)
-        indices_array = df_temp[indices_cols].values
-
-        # LOG dos índices calculados
-        logger.info(f"📊 Índices calculados:")
-        for idx_name, idx_value in zip(indices_cols, indices_array[0]):
-            logger.info(f"   {idx_name}: {idx_value:.4f}")
-
-        # 3. Processar bandas com PCA
-        bandas_array = np.array(spectrum).reshape(1, -1)
-        bandas_scaled = scaler_bandas.transform(bandas_array)
-        pca_array = pca.transform(bandas_scaled)
-
-        # 4. Combinar features (4 índices + 6 PCs)
-        X_completo = np.hstack([indices_array, pca_array[:, :6]])
-        X_completo_scaled = scaler_final.transform(X_completo)
-
-        # 5. Predição de espécie
-        especie_pred = modelo_especies.predict(X_completo_scaled)[0]
-        prob_especies = modelo_especies.predict_proba(X_completo_scaled)[0]
-        confianca = float(np.max(prob_especies))
-
-        logger.info(f"🎯 Espécie predita: {especie_pred} ({confianca * 100:.1f}%)")
-
-        # 6. Detecção de anomalia (LÓGICA AJUSTADA)
-        indices_scaled = scaler_indices.transform(indices_array)
-
-        # One-Class SVM
-        decisao_svm = detectores_anomalia[especie_pred].predict(indices_scaled)[0]
-        score_svm = detectores_anomalia[especie_pred].decision_function(indices_scaled)[0]
-        anomalia_svm = (decisao_svm == -1)
-
-        logger.info(f"🔍 One-Class SVM: decisão={decisao_svm}, score={score_svm:.4f}")
-
-        # Regra MAD (AJUSTADA: >= 2 violações para maior sensibilidade)
-        limiar = limiares_mad[especie_pred]
-        desvios = np.abs(indices_scaled[0] - limiar['medians'])
-        violacoes = np.sum(desvios > limiar['mads'])
-        anomalia_mad = (violacoes >= 2)  # ← MUDOU DE 3 PARA 2
-
-        logger.info(f"🔍 Regra MAD: violações={violacoes}/4, limiar=2")
-
-        # Log detalhado das violações
-        for i, (idx_name, desvio, mad) in enumerate(zip(indices_cols, desvios, limiar['mads'])):
-            violou = "❌ VIOLOU" if desvio > mad else "✅ OK"
-            logger.info(f"   {idx_name}: desvio={desvio:.4f}, limiar={mad:.4f} {violou}")
-
-        # Status final (LÓGICA AND: ambos devem concordar)
-        status = "ANORMAL" if (anomalia_svm and anomalia_mad) else "NORMAL"
-
-        # ⚠️ NOVO: Verificação adicional de confiança baixa
-        confianca_baixa = (confianca < 0.60)
-        if confianca_baixa and status == "NORMAL":
-            logger.warning(f"⚠️ ALERTA: Confiança baixa ({confianca * 100:.1f}%) pode indicar contaminação!")
-            status = "ANORMAL"  # Força status anormal se confiança < 60%
-
-        logger.info(f"🏁 Resultado anomalia:")
-        logger.info(f"   SVM detectou anomalia: {anomalia_svm}")
-        logger.info(f"   MAD detectou anomalia: {anomalia_mad}")
-        logger.info(f"   Confiança baixa (<60%): {confianca_baixa}")
-        logger.info(f"   Status final: {status}")
-
-        resultado = {
-            'especie': especie_pred,
-            'confianca': round(confianca * 100, 1),
-            'status': status,
-            'probabilidades': {
-                classe: round(float(prob) * 100, 1)
-                for classe, prob in zip(modelo_especies.classes_, prob_especies)
-            },
-            'indices': {
-                col: round(float(val), 4)
-                for col, val in zip(indices_cols, indices_array[0])
-            },
-            'detalhes_anomalia': {
-                'svm_score': round(float(score_svm), 4),
-                'svm_detectou': bool(anomalia_svm),
-                'mad_violacoes': int(violacoes),
-                'mad_detectou': bool(anomalia_mad),
-                'confianca_baixa': bool(confianca_baixa),
-                'logica_usada': 'AND + alerta confiança < 60%'
-            },
-            'timestamp': datetime.now().isoformat()
-        }
+        # Snapshot do modelo usado do início ao fim desta predição
+        modelo = motor
+        if modelo is None:
+            raise RuntimeError("Modelo não carregado")
 
-        logger.info(f"✅ Predição: {especie_pred} ({confianca * 100:.1f}%) - {status}")
+        # Agora temos 17 bandas para o modelo
+        if len(spectrum) != modelo.n_bandas:
+            raise ValueError(f"Erro: {len(spectrum)} bandas após remoção, modelo espera {modelo.n_bandas}")
+
+        chave = cache.chaves(spectrum, modelo.versao)[0] if cache is not None else None
+        resultado = cache.obter(chave) if chave is not None else None
+        if chave is not None:
+            t = marcar_etapa(tempos, 'cache', t)
+        if resultado is not None:
+            resultado['timestamp'] = datetime.now().isoformat()
+            observar_etapas(tempos)
+            return resultado
+
+        # 1-6. Índices + PCA + SVM + One-Class SVM + MAD pelo motor compilado
+        saida = modelo.prever(spectrum, tempos)
+        t = time.perf_counter()
+        saida = aplicar_regras_anomalia(saida)
+        t = marcar_etapa(tempos, 'regras', t)
+
+        resultado = montar_resultado(saida, 0, datetime.now().isoformat(), modelo)
+        if chave is not None:
+            cache.guardar(chave, resultado)
+        marcar_etapa(tempos, 'montar_resultado', t)
+        observar_etapas(tempos)
+
+        # Diagnóstico completo apenas com LOG_DETALHADO (nível DEBUG)
+        if logger.isEnabledFor(logging.DEBUG):
+            logar_diagnostico(saida, 0, modelo)
 
         return resultado
 
     except Exception as e:
-        logger.error(f"❌ Erro na predição: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.error("❌ Erro na predição: %s", e, exc_info=True)
         raise
 
 
+def prever_lote(espectros_18_bandas, consultar_cache=True):
+    """
+    Inferência em lote: matriz (N, 18) -> lista com N resultados
+
+    Mesmo pipeline de prever_amostra, mas cada etapa (remoção r485,
+    índices, PCA, SVM, One-Class SVM, MAD) roda uma única vez sobre
+    o lote inteiro. Com consultar_cache=False (micro-lotes, já
+    consultados em /esp32/result) os resultados só são guardados.
+    """
+    espectros = np.asarray(espectros_18_bandas, dtype=np.float64)
+    if espectros.ndim != 2 or espectros.shape[1] != 18:
+        raise ValueError(f"Lote inválido: forma {espectros.shape} (esperado: N x 18)")
+    if len(espectros) == 0:
+        return []
+
+    tempos = {}
+    t = time.perf_counter()
+
+    # Remover índice 3 (banda 485nm) de todas as amostras
+    bandas_17 = np.delete(espectros, BANDA_485_IDX, axis=1)
+    t = marcar_etapa(tempos, 'remover_485', t)
+
+    # Snapshot do modelo usado pelo lote inteiro
+    modelo = motor
+    if modelo is None:
+        raise RuntimeError("Modelo não carregado")
+
+    timestamp = datetime.now().isoformat()
+
+    # Acertos do cache saem prontos; só as faltas passam pelo modelo
+    if cache is not None:
+        chaves = cache.chaves(bandas_17, modelo.versao)
+        resultados = [cache.obter(chave) if consultar_cache else None for chave in chaves]
+        faltas = [i for i, resultado in enumerate(resultados) if resultado is None]
+        for resultado in resultados:
+            if resultado is not None:
+                resultado['timestamp'] = timestamp
+        t = marcar_etapa(tempos, 'cache', t)
+        if not faltas:
+            observar_etapas(tempos)
+            return resultados
+    else:
+        chaves = None
+        resultados = [None] * len(espectros)
+        faltas = list(range(len(espectros)))
+
+    saida = modelo.prever(bandas_17[faltas], tempos)
+    t = time.perf_counter()
+    saida = aplicar_regras_anomalia(saida)
+    t = marcar_etapa(tempos, 'regras', t)
+    for j, i in enumerate(faltas):
+        resultados[i] = montar_resultado(saida, j, timestamp, modelo)
+        if chaves is not None:
+            cache.guardar(chaves[i], resultados[i])
+    marcar_etapa(tempos, 'montar_resultado', t)
+    observar_etapas(tempos)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("📦 Lote classificado: %d amostras (%d pelo modelo), %d anormais",
+                     len(resultados), len(faltas), sum(r['status'] == 'ANORMAL' for r in resultados))
+        for j in range(len(faltas)):
+            logar_diagnostico(saida, j, modelo)
+
+    return resultados
+
+
+def resultado_em_cache(spectrum_18_bandas):
+    """Resultado do cache para o espectro (ou None), sem tocar o modelo"""
+    modelo = motor
+    if cache is None or modelo is None:
+        return None
+    inicio = time.perf_counter()
+    bandas_17 = remover_banda_485(spectrum_18_bandas)
+    resultado = cache.obter(cache.chaves(bandas_17, modelo.versao)[0])
+    if resultado is not None:
+        resultado['timestamp'] = datetime.now().isoformat()
+    metrica_etapas.observar(time.perf_counter() - inicio, 'cache')
+    return resultado
+
+
+def prever_micro_lote(espectros_18_bandas):
+    return prever_lote(espectros_18_bandas, consultar_cache=False)
+
+
+agendador = AgendadorInferencia(prever_micro_lote, janela_ms=MICRO_LOTE_JANELA_MS, max_lote=MICRO_LOTE_MAX,
+                                observar_espera=lambda espera: metrica_esperas.observar(espera, 'fila_micro_lote'))
+
+
+# ==================== VALIDAÇÃO DE ENTRADA ====================
+
+class EntradaInvalida(ValueError):
+    """Corpo ou parâmetro malformado enviado pelo cliente (responde 400)"""
+
+
+def ler_numero(valor, nome, tipo=float, padrao=0, minimo=None, maximo=None):
+    """
+    Parâmetro numérico do cliente (JSON ou query string): ausente vira
+    'padrao', fora de [minimo, maximo] é limitado. Texto não numérico,
+    booleano, NaN/infinito ou (tipo=int) número fracionário levantam
+    EntradaInvalida.
+    """
+    if valor is None or valor == '':
+        return padrao
+    invalido = EntradaInvalida(f"Parâmetro '{nome}' inválido: {str(valor)[:32]!r}")
+    if isinstance(valor, bool) or not isinstance(valor, (int, float, str)):
+        raise invalido
+    try:
+        numero = float(valor)
+    except ValueError:
+        raise invalido
+    if not math.isfinite(numero) or (tipo is int and not numero.is_integer()):
+        raise invalido
+    numero = tipo(numero)
+    if minimo is not None:
+        numero = max(numero, minimo)
+    if maximo is not None:
+        numero = min(numero, maximo)
+    return numero
+
+
+def ler_prioridade(data):
+    """Prioridade inteira do comando, limitada a ±COMANDO_PRIORIDADE_MAX"""
+    return ler_numero(data.get('prioridade'), 'prioridade', tipo=int, minimo=-COMANDO_PRIORIDADE_MAX,
+                      maximo=COMANDO_PRIORIDADE_MAX)
+
+
+def corpo_objeto(data):
+    """Corpo JSON que precisa ser um objeto (dict)"""
+    if not isinstance(data, dict):
+        raise EntradaInvalida('Corpo deve ser um objeto JSON')
+    return data
+
+
 # ==================== ENDPOINTS ESP32 ====================
 
-@app.route('/esp32/poll', methods=['POST'])
-def esp32_poll():
-    """ESP32 verifica comandos pendentes"""
+def dispositivo_ativo(device_info, now):
+    """Ativo se visto há menos de DEVICE_TIMEOUT ou parado em long-poll"""
+    return (device_info.get('aguardando_comando', False)
+            or (now - device_info['last_seen']).total_seconds() < DEVICE_TIMEOUT)
+
+
+def enfileirar_comando(device_id, command, prioridade=0, ttl_s=COMANDO_TTL_PADRAO_S):
+    """
+    Coloca o comando na fila do dispositivo e acorda o long-poll.
+    Retorna o registro com command_id (FilaComandosCheia se a fila está cheia)
+    """
     try:
-        data = request.json
-        device_id = data.get('device_id', 'unknown')
-        device_status = data.get('status', 'unknown')
-
-        connected_devices[device_id] = {
-            'id': device_id,
-            'ip': request.remote_addr,
-            'last_seen': datetime.now(),
-            'status': device_status,
-            'active': True
-        }
+        registro = estado.enfileirar_comando(device_id, command, prioridade, ttl_s)
+    except FilaComandosCheia:
+        metrica_comandos.incrementar('rejeitado')
+        raise
+    metrica_comandos.incrementar('enfileirado')
+    return registro
 
-        if device_id in pending_commands:
-            command = pending_commands.pop(device_id)
-            logger.info(f"📤 Enviando comando para {device_id}: {command['command']}")
-            return jsonify(command)
 
-        return jsonify({'command': 'status'})
+def retirar_comando(device_id, espera_s=0):
+    """
+    Entrega o próximo comando do dispositivo (maior prioridade primeiro),
+    aguardando até espera_s segundos por um novo comando (long-poll).
+    Retorna None se não houver.
+    """
+    return estado.retirar_comando(device_id, espera_s)
 
+
+def concluir_comando(command_id, device_id, resultado):
+    """
+    Associa o resultado ao comando devolvido pelo dispositivo: marca o
+    comando como concluído e mede o tempo comando -> resultado.
+    Resultado repetido do mesmo comando não é medido de novo.
+    """
+    if not command_id:
+        return
+    conclusao = estado.concluir_comando(str(command_id), device_id, resumir_resultado(resultado))
+    if conclusao is None:
+        logger.warning("⚠️ Resultado de %s com command_id desconhecido: %s", device_id, command_id)
+        return
+    resultado['command_id'] = conclusao['command_id']
+    if conclusao['duplicado']:
+        metrica_comandos.incrementar('duplicado')
+        logger.warning("⚠️ Resultado repetido do comando %s (%s)", command_id, device_id)
+        return
+    metrica_comandos.incrementar('concluido')
+    metrica_comando_resultado.observar(conclusao['latencia_s'])
+
+
+def registrar_poll(data, ip):
+    """
+    Registra o dispositivo que chegou em /esp32/poll (estacionado se
+    pediu "wait"). Retorna (device_id, device_info, espera_s)
+    """
+    data = corpo_objeto(data)
+    device_id = data.get('device_id', 'unknown')
+    espera_s = ler_numero(data.get('wait'), 'wait', minimo=0, maximo=LONG_POLL_MAX_S)
+
+    device_info = {
+        'id': device_id,
+        'ip': ip,
+        'last_seen': datetime.now(),
+        'status': data.get('status', 'unknown'),
+        'active': True,
+        'aguardando_comando': espera_s > 0,
+        'tags': normalizar_tags(data.get('tags'))
+    }
+    # Dashboard só é notificado quando algo visível muda
+    if estado.atualizar_dispositivo(device_id, device_info):
+        notificar_dispositivos()
+    return device_id, device_info, espera_s
+
+
+def resposta_poll(device_id, device_info, espera_s, command):
+    """Fim do poll: dispositivo deixa de estar estacionado; corpo da resposta"""
+    if espera_s > 0:
+        device_info['last_seen'] = datetime.now()
+        device_info['aguardando_comando'] = False
+        estado.atualizar_dispositivo(device_id, device_info)
+
+    # Long-poll: reconectar imediatamente; poll curto: intervalo padrão
+    poll_ms = 0 if espera_s > 0 else POLL_INTERVAL_MS
+
+    if command is not None:
+        logger.info("📤 Enviando comando para %s: %s (%s)", device_id, command['command'], command['command_id'])
+        return {**command, 'poll_ms': poll_ms}
+
+    return {'command': 'status', 'poll_ms': poll_ms}
+
+
+@app.route('/esp32/poll', methods=['POST'])
+def esp32_poll():
+    """
+    ESP32 verifica comandos pendentes
+
+    Com {"wait": segundos} a requisição fica estacionada até chegar um
+    comando ou expirar o tempo (long-poll). A resposta traz "poll_ms":
+    em quanto tempo o dispositivo deve consultar novamente.
+    """
+    try:
+        device_id, device_info, espera_s = registrar_poll(request.json, request.remote_addr)
+        command = retirar_comando(device_id, espera_s)
+        return jsonify(resposta_poll(device_id, device_info, espera_s, command))
+
+    except EntradaInvalida as e:
+        logger.warning("⚠️ /esp32/poll: %s", e)
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Erro em /esp32/poll: {e}")
+        logger.error("Erro em /esp32/poll: %s", e)
         return jsonify({'error': str(e)}), 500
 
 
+def salvar_resultados(resultados):
+    """
+    Última análise (estado compartilhado; em SQLite disputa o lock de
+    escrita com os outros workers) + histórico (só enfileira)
+    """
+    inicio = time.perf_counter()
+    estado.definir_ultima_analise(resultados[-1])
+    agora = time.perf_counter()
+    metrica_esperas.observar(agora - inicio, 'estado_compartilhado')
+    if len(resultados) == 1:
+        armazenamento.adicionar(resultados[0])
+    else:
+        armazenamento.adicionar_varios(resultados)
+    metrica_etapas.observar(time.perf_counter() - agora, 'historico')
+
+
+def ler_espectro(data):
+    """(device_id, spectrum) do corpo de /esp32/result; EntradaInvalida se inválido"""
+    data = corpo_objeto(data)
+    device_id = data.get('device_id', 'unknown')
+    spectrum = data.get('spectrum', [])
+
+    if not isinstance(spectrum, (list, np.ndarray)):
+        raise EntradaInvalida(f"Espectro inválido: esperado lista, recebido {type(spectrum).__name__}")
+    if len(spectrum) != 18:
+        raise EntradaInvalida(f"Espectro inválido: {len(spectrum)} bandas (esperado: 18)")
+
+    logger.debug("📊 Espectro recebido de %s - r680=%.6f, r810=%.6f, r940=%.6f",
+                 device_id, spectrum[10], spectrum[14], spectrum[17])
+    return device_id, spectrum
+
+
+def ler_corpo_resultado(tipo, corpo, ler_json):
+    """
+    Negocia o corpo de /esp32/result pelo Content-Type:
+    - TIPO_ESPECTRO_BINARIO: formato_espectro.py, bandas como visão NumPy
+    - demais: JSON, lido por ler_json()
+    Retorna (data, device_id, spectrum); data traz device_id e command_id.
+    Corpo fora do formato levanta EntradaInvalida (responde 400).
+    """
+    inicio = time.perf_counter()
+    if tipo == TIPO_ESPECTRO_BINARIO:
+        try:
+            device_id, command_id, spectrum = decodificar_espectro(corpo)
+        except ValueError as e:
+            raise EntradaInvalida(str(e)) from None
+        data = {'device_id': device_id, 'command_id': command_id, 'spectrum': spectrum}
+        metrica_etapas.observar(time.perf_counter() - inicio, 'binario')
+    else:
+        try:
+            data = ler_json()
+        except ValueError:
+            raise EntradaInvalida('Corpo JSON inválido') from None
+        metrica_etapas.observar(time.perf_counter() - inicio, 'json')
+    return (data, *ler_espectro(data))
+
+
+def finalizar_resultado(data, device_id, resultado, inicio, endpoint='/esp32/result'):
+    """Associa ao comando, salva, publica e mede o resultado de /esp32/result"""
+    resultado['device_id'] = device_id
+    concluir_comando(data.get('command_id'), device_id, resultado)
+
+    # Salvar no histórico
+    salvar_resultados([resultado])
+
+    eventos.publicar('analise', resultado)
+
+    latencia = time.perf_counter() - inicio
+    metrica_requisicoes.observar(latencia, endpoint)
+    registrar_predicao(resultado, latencia * 1000)
+    return resultado
+
+
 @app.route('/esp32/result', methods=['POST'])
 def esp32_result():
-    """Recebe espectro do ESP32 (18 bandas) e retorna classificação"""
-    global last_analysis
+    """Recebe espectro do ESP32 (18 bandas, JSON ou binário) e retorna classificação"""
+    try:
+        inicio = time.perf_counter()
+        data, device_id, spectrum = ler_corpo_resultado(request.mimetype, request.get_data(),
+                                                         lambda: request.get_json(silent=True))
+
+        # Realizar predição (remove r485 internamente); em modo micro-lote
+        # a requisição aguarda o lote em que foi agrupada. Acerto no cache
+        # responde sem esperar a janela do lote
+        if MICRO_LOTE_ATIVO:
+            resultado = resultado_em_cache(spectrum)
+            if resultado is None:
+                resultado = agendador.classificar(spectrum)
+        else:
+            resultado = prever_amostra(spectrum)
+
+        return jsonify(finalizar_resultado(data, device_id, resultado, inicio))
+
+    except EntradaInvalida as e:
+        logger.warning("⚠️ /esp32/result: %s", e)
+        return jsonify({'error': str(e), 'status': 'ERRO'}), 400
+    except Exception as e:
+        metrica_erros.incrementar('/esp32/result')
+        logger.error("❌ Erro em /esp32/result: %s", e, exc_info=True)
+        return jsonify({'error': str(e), 'status': 'ERRO'}), 500
+
+
+@app.route('/esp32/result_batch', methods=['POST'])
+def esp32_result_batch():
+    """
+    Recebe lote de espectros (gateway que acumula leituras de vários ESP32)
 
+    Corpo: {"amostras": [{"device_id": "...", "spectrum": [18 bandas],
+                          "command_id": "..." (opcional)}, ...]}
+    """
     try:
+        inicio_json = time.perf_counter()
         data = request.json
-        device_id = data.get('device_id', 'unknown')
-        spectrum = data.get('spectrum', [])
+        metrica_etapas.observar(time.perf_counter() - inicio_json, 'json')
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Corpo deve ser um objeto JSON com "amostras"', 'status': 'ERRO'}), 400
+        amostras = data.get('amostras', [])
+        device_padrao = data.get('device_id', 'unknown')
+
+        if not isinstance(amostras, list):
+            return jsonify({'error': '"amostras" deve ser uma lista', 'status': 'ERRO'}), 400
+        if not amostras:
+            return jsonify({'error': 'Lote vazio', 'status': 'ERRO'}), 400
+        if len(amostras) > MAX_LOTE:
+            return jsonify({'error': f'Lote excede {MAX_LOTE} amostras', 'status': 'ERRO'}), 413
+
+        for i, amostra in enumerate(amostras):
+            if not isinstance(amostra, dict):
+                return jsonify({
+                    'error': f'Amostra {i}: esperado objeto {{"spectrum": [...]}}, recebido {type(amostra).__name__}',
+                    'status': 'ERRO'
+                }), 400
+            spectrum = amostra.get('spectrum')
+            if not isinstance(spectrum, list) or len(spectrum) != 18:
+                bandas = len(spectrum) if isinstance(spectrum, list) else 0
+                return jsonify({
+                    'error': f"Amostra {i}: {bandas} bandas (esperado: 18)",
+                    'status': 'ERRO'
+                }), 400
+
+        inicio = time.perf_counter()
+
+        resultados = prever_lote([amostra['spectrum'] for amostra in amostras])
+        for amostra, resultado in zip(amostras, resultados):
+            resultado['device_id'] = amostra.get('device_id', device_padrao)
+            concluir_comando(amostra.get('command_id'), resultado['device_id'], resultado)
 
-        logger.info(f"📊 Espectro recebido de {device_id}")
-        logger.info(f"🔍 Valores-chave: r680={spectrum[10]:.6f}, r810={spectrum[14]:.6f}, r940={spectrum[17]:.6f}")
+        # Salvar no histórico
+        salvar_resultados(resultados)
 
-        # Realizar predição (função remove r485 internamente)
-        resultado = prever_amostra(spectrum)
-        resultado['device_id'] = device_id
+        eventos.publicar('analise', resultados[-1])
 
-        # Salvar no histórico
-        with analysis_lock:
-            last_analysis = resultado
-            analysis_history.append(resultado)
+        metrica_requisicoes.observar(time.perf_counter() - inicio_json, '/esp32/result_batch')
+        latencia_ms = (time.perf_counter() - inicio) * 1000 / len(resultados)
+        for resultado in resultados:
+            registrar_predicao(resultado, latencia_ms)
+
+        return jsonify({'total': len(resultados), 'resultados': resultados})
+
+    except Exception as e:
+        metrica_erros.incrementar('/esp32/result_batch')
+        logger.error("❌ Erro em /esp32/result_batch: %s", e, exc_info=True)
+        return jsonify({'error': str(e), 'status': 'ERRO'}), 500
+
+
+def classificar_sessao(sessao):
+    """
+    Reclassifica o espectro médio da sessão junto com os sorteios do teste
+    sequencial, num único lote do motor. Não usa o cache: os sorteios não
+    são leituras reais.
+
+    Retorna (resultado do espectro médio, concluir, motivo, concordancia)
+    """
+    modelo = motor
+    if modelo is None:
+        raise RuntimeError("Modelo não carregado")
+    tempos = {}
+    bandas_17 = np.delete(espectros_teste(sessao), BANDA_485_IDX, axis=1)
+    saida = aplicar_regras_anomalia(modelo.prever(bandas_17, tempos))
+    observar_etapas(tempos)
+    concluir, motivo, concordancia = decidir(sessao, saida['especie'], saida['status'])
+    return montar_resultado(saida, 0, datetime.now().isoformat(), modelo), concluir, motivo, concordancia
+
+
+@app.route('/esp32/scan', methods=['POST'])
+def esp32_scan_abrir():
+    """
+    Abre uma sessão de varredura (leituras repetidas da mesma amostra)
+
+    Corpo: {"device_id": "...", "command_id": "..." (opcional)}
+    """
+    try:
+        data = request.json or {}
+        sessao = nova_sessao(data.get('device_id', 'unknown'), data.get('command_id'), time.time())
+        estado.registrar_sessao(sessao)
+        logger.info("🔁 Sessão de varredura %s aberta por %s", sessao['session_id'], sessao['device_id'])
+        return jsonify({
+            'status': 'session_open',
+            'session_id': sessao['session_id'],
+            'varreduras_min': VARREDURAS_MINIMAS,
+            'varreduras_max': VARREDURAS_MAXIMAS,
+        })
+    except Exception as e:
+        metrica_erros.incrementar('/esp32/scan')
+        logger.error("❌ Erro em /esp32/scan: %s", e, exc_info=True)
+        return jsonify({'error': str(e), 'status': 'ERRO'}), 500
 
+
+@app.route('/esp32/scan/<session_id>', methods=['POST'])
+def esp32_scan(session_id):
+    """
+    Uma leitura da sessão (corpo igual ao de /esp32/result, JSON ou binário)
+
+    Responde a classificação do espectro médio até aqui; em "varredura"
+    vêm o nº de leituras, a concordância do teste sequencial e se a
+    sessão terminou. Na leitura que encerra a sessão o resultado é
+    gravado como uma análise comum (histórico, SSE, comando).
+    """
+    try:
+        inicio = time.perf_counter()
+
+        # Leituras simultâneas da mesma sessão: quem chegar com cópia velha
+        # refaz acúmulo e classificação sobre a versão gravada
+        for _ in range(SESSAO_TENTATIVAS):
+            sessao = estado.sessao(session_id)
+            if sessao is None:
+                return jsonify({'error': 'Sessão não encontrada ou expirada', 'status': 'ERRO'}), 404
+            if sessao['concluida']:
+                # Reenvio da última leitura (ex.: resposta perdida): mesma resposta
+                return jsonify(sessao['resposta'])
+
+            _, _, spectrum = ler_corpo_resultado(request.mimetype, request.get_data(),
+                                                 lambda: request.get_json(silent=True))
+            acumular(sessao, spectrum, time.time())
+            resultado, concluir, motivo, concordancia = classificar_sessao(sessao)
+            resultado['device_id'] = sessao['device_id']
+            resultado['varredura'] = {
+                'session_id': session_id,
+                'n': sessao['n'],
+                'concluida': concluir,
+                'motivo': motivo,
+                'concordancia': concordancia,
+            }
+            if concluir:
+                sessao['concluida'] = True
+                sessao['resposta'] = resultado
+            if estado.atualizar_sessao(sessao):
+                break
+        else:
+            return jsonify({'error': 'Sessão alterada por leituras simultâneas; reenvie', 'status': 'ERRO'}), 409
+
+        # Só a gravação que encerrou a sessão publica o resultado
+        if concluir:
+            finalizar_resultado({'command_id': sessao['command_id']}, sessao['device_id'], resultado, inicio,
+                                '/esp32/scan')
+            # Resposta dos reenvios com o command_id associado acima
+            sessao['resposta'] = resultado
+            estado.atualizar_sessao(sessao)
+            metrica_sessoes.observar(sessao['n'], motivo)
+            logger.info("🔁 Sessão %s concluída (%s) após %s leituras", session_id, motivo, sessao['n'])
+        else:
+            metrica_requisicoes.observar(time.perf_counter() - inicio, '/esp32/scan')
         return jsonify(resultado)
 
+    except EntradaInvalida as e:
+        logger.warning("⚠️ /esp32/scan: %s", e)
+        return jsonify({'error': str(e), 'status': 'ERRO'}), 400
     except Exception as e:
-        logger.error(f"❌ Erro em /esp32/result: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
+        metrica_erros.incrementar('/esp32/scan')
+        logger.error("❌ Erro em /esp32/scan: %s", e, exc_info=True)
         return jsonify({'error': str(e), 'status': 'ERRO'}), 500
 
 
@@ -603,45 +1302,56 @@ def home():
         let lastTimestamp = null;
         let isWaitingForResult = false;
 
+        function renderStatus(data) {
+            const badge = document.getElementById('status-badge');
+            if (data.modelo_carregado) {
+                badge.className = 'status-badge status-online';
+                badge.textContent = 'Online';
+                if (!isWaitingForResult) document.getElementById('analyze-btn').disabled = false;
+            } else {
+                badge.className = 'status-badge status-offline';
+                badge.textContent = 'Modelo não carregado';
+                document.getElementById('analyze-btn').disabled = true;
+            }
+        }
+
+        function renderDevices(devices) {
+            const container = document.getElementById('devices');
+            if (devices.length === 0) {
+                container.innerHTML = '<p style="color: #718096;">Nenhum dispositivo conectado</p>';
+                return;
+            }
+
+            container.innerHTML = devices.map(d => `
+                <div class="device-card ${d.active ? 'active' : ''}">
+                    <div style="font-weight: bold; margin-bottom: 5px;">
+                        ${d.active ? '🟢' : '🔴'} ${d.id.substring(0, 12)}
+                    </div>
+                    <div style="font-size: 0.85em; color: #718096;">
+                        ${d.ip}<br>
+                        ${d.status}
+                    </div>
+                </div>
+            `).join('');
+        }
+
         function updateStatus() {
-            fetch('/status')
-                .then(r => r.json())
-                .then(data => {
-                    const badge = document.getElementById('status-badge');
-                    if (data.modelo_carregado) {
-                        badge.className = 'status-badge status-online';
-                        badge.textContent = 'Online';
-                        document.getElementById('analyze-btn').disabled = false;
-                    } else {
-                        badge.className = 'status-badge status-offline';
-                        badge.textContent = 'Modelo não carregado';
-                        document.getElementById('analyze-btn').disabled = true;
-                    }
-                });
+            fetch('/status').then(r => r.json()).then(renderStatus);
         }
 
         function updateDevices() {
-            fetch('/devices')
-                .then(r => r.json())
-                .then(devices => {
-                    const container = document.getElementById('devices');
-                    if (devices.length === 0) {
-                        container.innerHTML = '<p style="color: #718096;">Nenhum dispositivo conectado</p>';
-                        return;
-                    }
+            fetch('/devices').then(r => r.json()).then(renderDevices);
+        }
 
-                    container.innerHTML = devices.map(d => `
-                        <div class="device-card ${d.active ? 'active' : ''}">
-                            <div style="font-weight: bold; margin-bottom: 5px;">
-                                ${d.active ? '🟢' : '🔴'} ${d.id.substring(0, 12)}
-                            </div>
-                            <div style="font-size: 0.85em; color: #718096;">
-                                ${d.ip}<br>
-                                ${d.status}
-                            </div>
-                        </div>
-                    `).join('');
-                });
+        function receberAnalise(data) {
+            if (!data.timestamp || data.timestamp === lastTimestamp) return;
+            lastTimestamp = data.timestamp;
+            displayResult(data);
+            if (isWaitingForResult) {
+                document.getElementById('analyze-btn').disabled = false;
+                document.getElementById('loading').classList.remove('active');
+                isWaitingForResult = false;
+            }
         }
 
         function analisarAmostra() {
@@ -661,9 +1371,10 @@ def home():
                     document.getElementById('analyze-btn').disabled = false;
                     document.getElementById('loading').classList.remove('active');
                     isWaitingForResult = false;
-                } else {
+                } else if (!window.EventSource) {
                     setTimeout(checkResult, 3000);
                 }
+                // Com SSE o resultado chega pelo evento 'analise'
             });
         }
 
@@ -674,11 +1385,7 @@ def home():
                 .then(r => r.json())
                 .then(data => {
                     if (data.timestamp && data.timestamp !== lastTimestamp) {
-                        lastTimestamp = data.timestamp;
-                        displayResult(data);
-                        document.getElementById('analyze-btn').disabled = false;
-                        document.getElementById('loading').classList.remove('active');
-                        isWaitingForResult = false;
+                        receberAnalise(data);
                     } else if (isWaitingForResult) {
                         setTimeout(checkResult, 2000);
                     }
@@ -761,128 +1468,417 @@ def home():
             card.scrollIntoView({behavior: 'smooth'});
         }
 
-        updateStatus();
-        updateDevices();
-        updateInterval = setInterval(() => {
+        if (window.EventSource) {
+            // Fluxo SSE: atualizações chegam quando acontecem, sem polling
+            const fonte = new EventSource('/events');
+            fonte.addEventListener('status', e => renderStatus(JSON.parse(e.data)));
+            fonte.addEventListener('dispositivos', e => renderDevices(JSON.parse(e.data)));
+            fonte.addEventListener('ultima_analise', e => {
+                lastTimestamp = JSON.parse(e.data).timestamp;
+            });
+            fonte.addEventListener('analise', e => receberAnalise(JSON.parse(e.data)));
+        } else {
+            // Navegadores sem EventSource: polling a cada 2 s
             updateStatus();
             updateDevices();
-        }, 2000);
+            updateInterval = setInterval(() => {
+                updateStatus();
+                updateDevices();
+            }, 2000);
+        }
     </script>
 </body>
 </html>
     """
 
 
+# ==================== EVENTOS (SSE) ====================
+
+_versao_dispositivos_publicada = None
+_dispositivos_publicados_em = 0.0
+
+
+def publicar_dispositivos():
+    """Publica a lista de dispositivos e memoriza a versão enviada"""
+    global _versao_dispositivos_publicada, _dispositivos_publicados_em
+    _versao_dispositivos_publicada = estado.versao_dispositivos()
+    _dispositivos_publicados_em = time.monotonic()
+    # Sem dashboard conectado não vale montar a lista (O(n) dispositivos)
+    if eventos.tem_assinantes():
+        eventos.publicar('dispositivos', listar_dispositivos())
+
+
+def notificar_dispositivos():
+    """
+    Mudança visível vinda de um poll: publica na hora, mas no máximo a cada
+    SSE_INTERVALO_MIN_DISPOSITIVOS_S. O restante fica para o monitor, que
+    publica quando a versão muda; assim uma frota conectando de uma vez não
+    custa uma lista completa por dispositivo.
+    """
+    if time.monotonic() - _dispositivos_publicados_em >= SSE_INTERVALO_MIN_DISPOSITIVOS_S:
+        publicar_dispositivos()
+
+
+def monitorar_dispositivos():
+    """
+    Acompanha o estado (possivelmente compartilhado com outros workers)
+    e publica no SSE deste processo:
+    - 'dispositivos' quando a lista muda (expiração, ou poll atendido
+      por outro worker); remove também os dispositivos inativos há mais
+      de DEVICE_REMOCAO_S
+    - 'analise' quando outro worker grava uma análise
+    e executa aqui as recargas de modelo pedidas em outro worker.
+    Também vence os prazos dos comandos (TTL / reentrega sem resultado).
+    """
+    global _recarga_vista
+    analise_vista = estado.marcadores()['analise']
+    while True:
+        try:
+            time.sleep(SSE_VERIFICACAO_DISPOSITIVOS_S)
+
+            # Expiração pelos prazos do registro (sem varrer todos os dispositivos)
+            for device_id in estado.expirar_dispositivos(DEVICE_REMOCAO_S):
+                logger.info("🗑️ Dispositivo removido (inativo): %s", device_id)
+
+            # TTL e espera por resultado dos comandos (heap/índice de prazos)
+            expirados = estado.expirar_comandos()
+            if expirados:
+                metrica_comandos.incrementar('expirado', valor=expirados)
+                logger.info("⌛ %s comandos expirados sem resultado", expirados)
+
+            if estado.versao_dispositivos() != _versao_dispositivos_publicada:
+                publicar_dispositivos()
+
+            marcadores = estado.marcadores()
+            if marcadores['analise'] != analise_vista:
+                analise_vista = marcadores['analise']
+                if analise_vista[1] != os.getpid():
+                    ultima = estado.ultima_analise()
+                    if ultima:
+                        eventos.publicar('analise', ultima)
+
+            if marcadores['recarga'] != _recarga_vista:
+                _recarga_vista = marcadores['recarga']
+                iniciar_recarga()
+        except Exception as e:
+            logger.error("Erro no monitor de dispositivos: %s", e)
+
+
+def eventos_iniciais():
+    """Snapshots enviados a cada cliente SSE ao conectar"""
+    ultima = estado.ultima_analise()
+    iniciais = [('status', status_modelo()), ('dispositivos', listar_dispositivos())]
+    if ultima:
+        iniciais.append(('ultima_analise', ultima))
+    return iniciais
+
+
+@app.route('/events', methods=['GET'])
+def stream_events():
+    """
+    Fluxo Server-Sent Events para o dashboard
+
+    Eventos: 'status' (modelo), 'dispositivos' (lista completa),
+    'analise' (cada nova análise). Snapshots são enviados ao conectar.
+    """
+    assinante = eventos.assinar()
+
+    return Response(
+        eventos.fluxo(assinante, eventos_iniciais()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/command/analyze', methods=['POST'])
 def send_analyze_command():
-    """Envia comando de análise para ESP32"""
+    """
+    Envia comando de análise para ESP32
+
+    Corpo: {"device_id": "..." | "auto", "prioridade": 0, "ttl_s": 60}.
+    A resposta traz o command_id, que o dispositivo devolve junto com o
+    resultado (acompanhar em GET /command/<command_id>).
+    """
     try:
-        data = request.json
+        data = corpo_objeto(request.get_json(silent=True) or {})
         device_id = data.get('device_id', 'auto')
+        prioridade = ler_prioridade(data)
+        ttl_s = ler_numero(data.get('ttl_s'), 'ttl_s', padrao=COMANDO_TTL_PADRAO_S, minimo=1,
+                           maximo=COMANDO_TTL_MAX_S)
 
         logger.info("🎯 Comando de análise solicitado")
 
         if device_id == 'auto':
-            if connected_devices:
-                now = datetime.now()
-                active_devices = [
-                    d for d in connected_devices.values()
-                    if (now - d['last_seen']).total_seconds() < DEVICE_TIMEOUT
-                ]
-
-                if active_devices:
-                    recent_device = max(active_devices, key=lambda x: x['last_seen'])
-                    device_id = recent_device['id']
-                else:
-                    return jsonify({'error': 'Nenhum dispositivo ativo'}), 404
-            else:
-                return jsonify({'error': 'Nenhum dispositivo conectado'}), 404
-
-        pending_commands[device_id] = {
-            'command': 'analyze',
-            'timestamp': datetime.now().isoformat()
-        }
+            recent_device = estado.dispositivo_recente_ativo()
+            if recent_device is None:
+                if not estado.estatisticas()['dispositivos']:
+                    return jsonify({'error': 'Nenhum dispositivo conectado'}), 404
+                return jsonify({'error': 'Nenhum dispositivo ativo'}), 404
+            device_id = recent_device['id']
+
+        try:
+            registro = enfileirar_comando(device_id, {
+                'command': 'analyze',
+                'timestamp': datetime.now().isoformat()
+            }, prioridade, ttl_s)
+        except FilaComandosCheia as e:
+            logger.warning("⚠️ Comando recusado: %s", e)
+            return jsonify({'error': str(e), 'device_id': device_id}), 429
 
-        logger.info(f"✅ Comando criado para: {device_id}")
+        logger.info("✅ Comando %s criado para: %s", registro['command_id'], device_id)
 
         return jsonify({
             'status': 'command_queued',
-            'device_id': device_id
+            'device_id': device_id,
+            'command_id': registro['command_id'],
+            'prioridade': registro['prioridade'],
+            'prazo': registro['prazo']
         })
 
+    except EntradaInvalida as e:
+        logger.warning("⚠️ /command/analyze: %s", e)
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Erro ao criar comando: {e}")
+        logger.error("Erro ao criar comando: %s", e)
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/devices', methods=['GET'])
-def get_devices():
-    """Lista dispositivos conectados"""
+@app.route('/command/broadcast', methods=['POST'])
+def broadcast_analyze_command():
+    """
+    Envia comando de análise para todos os dispositivos ativos
+
+    Corpo: {"tags": ["silo1"] (opcional: só dispositivos com todas as tags),
+            "prazo_s": 60, "prioridade": 0}.
+    Um comando por dispositivo, enfileirados de uma vez (sem thread por
+    dispositivo); o relatório é coletado em GET /command/broadcast/<id>.
+    """
     try:
-        now = datetime.now()
-        devices_list = []
+        data = corpo_objeto(request.get_json(silent=True) or {})
+        tags = normalizar_tags(data.get('tags'))
+        prioridade = ler_prioridade(data)
+        prazo_s = ler_numero(data.get('prazo_s'), 'prazo_s', padrao=DIFUSAO_PRAZO_PADRAO_S, minimo=1,
+                             maximo=COMANDO_TTL_MAX_S)
+
+        alvos = selecionar_dispositivos(estado.dispositivos_ativos(), tags)
+        if not alvos:
+            return jsonify({'error': 'Nenhum dispositivo ativo', 'tags': tags}), 404
+
+        difusao = nova_difusao(tags, prazo_s, time.time())
+        comando = {
+            'command': 'analyze',
+            'timestamp': datetime.now().isoformat(),
+            'broadcast_id': difusao['broadcast_id']
+        }
+        registros, rejeitados = estado.enfileirar_comandos(
+            [(device_id, comando, prioridade, prazo_s) for device_id in alvos])
+        difusao['comandos'] = {registro['device_id']: registro['command_id'] for registro in registros}
+        difusao['rejeitados'] = rejeitados
+        estado.registrar_difusao(difusao)
+
+        metrica_comandos.incrementar('enfileirado', valor=len(registros))
+        if rejeitados:
+            metrica_comandos.incrementar('rejeitado', valor=len(rejeitados))
+            logger.warning("⚠️ Difusão %s: fila cheia em %d dispositivos",
+                           difusao['broadcast_id'], len(rejeitados))
+        logger.info("📡 Difusão %s para %d dispositivos%s", difusao['broadcast_id'], len(registros),
+                    f" (tags: {', '.join(tags)})" if tags else '')
 
-        for device_id, device_info in connected_devices.items():
-            time_diff = (now - device_info['last_seen']).total_seconds()
-            device_info['active'] = time_diff < DEVICE_TIMEOUT
+        return jsonify({
+            'status': 'broadcast_queued',
+            'broadcast_id': difusao['broadcast_id'],
+            'dispositivos': len(registros),
+            'rejeitados': rejeitados,
+            'prazo': datetime.fromtimestamp(difusao['prazo']).isoformat()
+        })
+
+    except EntradaInvalida as e:
+        logger.warning("⚠️ /command/broadcast: %s", e)
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error("Erro ao criar difusão: %s", e)
+        return jsonify({'error': str(e)}), 500
 
-            device_data = device_info.copy()
-            device_data['last_seen'] = device_info['last_seen'].isoformat()
-            devices_list.append(device_data)
 
-        devices_list.sort(key=lambda x: x['last_seen'], reverse=True)
-        return jsonify(devices_list)
+@app.route('/command/broadcast/<broadcast_id>', methods=['GET'])
+def broadcast_report(broadcast_id):
+    """
+    Relatório da difusão: espécies, status, anomalias e atrasados
+
+    Com ?wait=segundos aguarda (até LONG_POLL_MAX_S) todos responderem
+    ou o prazo acabar; uma única requisição acompanha a frota inteira.
+    """
+    difusao = estado.difusao(broadcast_id)
+    if difusao is None:
+        return jsonify({'error': 'Difusão não encontrada'}), 404
+
+    espera_s = min(max(request.args.get('wait', 0, type=float), 0), LONG_POLL_MAX_S)
+    limite = time.monotonic() + espera_s
+    while True:
+        comandos = estado.comandos(list(difusao['comandos'].values()))
+        resumo = relatorio(difusao, comandos, time.time())
+        if resumo['estado'] != 'em_andamento' or time.monotonic() >= limite:
+            return jsonify(resumo)
+        time.sleep(min(DIFUSAO_INTERVALO_S, max(limite - time.monotonic(), 0)))
+
+
+@app.route('/command/<command_id>', methods=['GET'])
+def command_status(command_id):
+    """Estado de um comando: pendente, entregue, concluido ou expirado"""
+    registro = estado.comando(command_id)
+    if registro is None:
+        return jsonify({'error': 'Comando não encontrado'}), 404
+    return jsonify(registro)
+
+
+def listar_dispositivos():
+    """Snapshot serializável dos dispositivos (mais recente primeiro)"""
+    now = datetime.now()
+    devices_list = []
+
+    for device_info in estado.dispositivos().values():
+        device_data = device_info.copy()
+        device_data['active'] = dispositivo_ativo(device_info, now)
+        device_data['last_seen'] = device_info['last_seen'].isoformat()
+        devices_list.append(device_data)
+
+    devices_list.sort(key=lambda x: x['last_seen'], reverse=True)
+    return devices_list
+
+
+def status_modelo():
+    """Resumo do modelo carregado (usado por /status e pelo fluxo SSE)"""
+    modelo = motor
+    return {
+        'modelo_carregado': modelo is not None,
+        'versao_modelo': modelo.versao if modelo else None,
+        'modelo_origem': modelo.origem if modelo else None,
+        'modelo_carregado_em': modelo_carregado_em,
+        'modo_anomalia': modelo.modo_anomalia if modelo else None,
+        'especies_disponiveis': [str(c) for c in modelo.classes] if modelo else [],
+        'bandas_modelo': modelo.n_bandas if modelo else 0,
+        'indices_usados': list(modelo.indices_cols) if modelo else [],
+    }
+
+
+@app.route('/model/reload', methods=['POST'])
+def reload_model():
+    """
+    Recarrega o modelo a quente (artefato compilado ou .pkl do disco)
+
+    Carrega e valida em segundo plano; a troca só acontece se o novo
+    modelo passar na validação. Acompanhe por GET /model/reload ou /status.
+    """
+    global _recarga_vista
+    if not iniciar_recarga():
+        return jsonify({'status': 'em_andamento'}), 409
+    # Demais workers recarregam ao ver o pedido no estado compartilhado
+    _recarga_vista = estado.solicitar_recarga()
+    return jsonify({'status': 'iniciada', 'versao_atual': motor.versao if motor else None}), 202
+
+
+@app.route('/model/reload', methods=['GET'])
+def reload_status():
+    """Situação da última recarga do modelo"""
+    return jsonify({
+        'em_andamento': recarga_lock.locked(),
+        'versao_atual': motor.versao if motor else None,
+        'ultima_recarga': ultima_recarga,
+    })
+
+
+@app.route('/devices', methods=['GET'])
+def get_devices():
+    """Lista dispositivos conectados"""
+    try:
+        return jsonify(listar_dispositivos())
 
     except Exception as e:
-        logger.error(f"Erro ao listar dispositivos: {e}")
+        logger.error("Erro ao listar dispositivos: %s", e)
         return jsonify([])
 
 
 @app.route('/last_analysis', methods=['GET'])
 def get_last_analysis():
     """Retorna última análise"""
-    with analysis_lock:
-        if last_analysis:
-            return jsonify(last_analysis)
-    return jsonify({})
+    return jsonify(estado.ultima_analise() or {})
 
 
 @app.route('/history', methods=['GET'])
 def get_history():
-    """Retorna histórico de análises"""
+    """
+    Retorna histórico de análises (mais recentes primeiro)
+
+    Filtros: device_id, especie, status, desde, ate (ISO 8601)
+    Paginação: limit (padrão 100, até 1000) e cursor; o cursor da próxima
+    página vem no cabeçalho X-Proximo-Cursor (ausente na última página).
+    limit ou cursor que não são inteiros positivos respondem 400.
+    """
     try:
-        with analysis_lock:
-            history_list = list(analysis_history)
-        return jsonify(history_list[::-1])
+        limite = ler_numero(request.args.get('limit'), 'limit', tipo=int, padrao=LIMITE_PADRAO,
+                            minimo=1, maximo=LIMITE_MAXIMO)
+        cursor = ler_numero(request.args.get('cursor'), 'cursor', tipo=int, padrao=None)
+        if cursor is not None and cursor < 1:
+            raise EntradaInvalida(f"Parâmetro 'cursor' inválido: {cursor!r}")
+
+        analises, proximo_cursor = armazenamento.consultar(
+            limite=limite,
+            device_id=request.args.get('device_id'),
+            especie=request.args.get('especie'),
+            status=request.args.get('status'),
+            desde=request.args.get('desde'),
+            ate=request.args.get('ate'),
+            cursor=cursor
+        )
+        resposta = jsonify(analises)
+        if proximo_cursor is not None:
+            resposta.headers['X-Proximo-Cursor'] = str(proximo_cursor)
+        return resposta
+    except EntradaInvalida as e:
+        logger.warning("⚠️ /history: %s", e)
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logger.error(f"Erro ao buscar histórico: {e}")
-        return jsonify([])
+        logger.error("Erro ao buscar histórico: %s", e)
+        return jsonify({'error': str(e)}), 500
 
 
 @app.route('/status', methods=['GET'])
 def system_status():
     """Status do sistema"""
     try:
-        now = datetime.now()
-        active_devices = sum(
-            1 for d in connected_devices.values()
-            if (now - d['last_seen']).total_seconds() < DEVICE_TIMEOUT
-        )
+        active_devices = estado.contagem_ativos()
+
+        modelo = status_modelo()
 
         return jsonify({
             'status': 'online',
-            'modelo_carregado': MODELOS is not None,
-            'especies_disponiveis': list(modelo_especies.classes_) if MODELOS else [],
+            'modelo_carregado': modelo['modelo_carregado'],
+            'versao_modelo': modelo['versao_modelo'],
+            'especies_disponiveis': modelo['especies_disponiveis'],
             'devices_connected': active_devices,
-            'bandas_modelo': len(bandas_cols) if MODELOS else 0,
+            'bandas_modelo': modelo['bandas_modelo'],
             'bandas_esp32': 18,
-            'indices_usados': list(indices_cols) if MODELOS else [],
+            'indices_usados': modelo['indices_usados'],
             'config_anomalia': {
                 'logica': 'AND + alerta confiança',
-                'violacoes_mad_minimas': 2,
-                'limiar_confianca': 60,
+                'violacoes_mad_minimas': VIOLACOES_MAD_MINIMAS,
+                'limiar_confianca': round(LIMIAR_CONFIANCA * 100, 1),
                 'descricao': 'Mais sensível - detecta contaminações'
             },
+            'micro_lote': {
+                'ativo': MICRO_LOTE_ATIVO,
+                **agendador.estatisticas()
+            },
+            'eventos_sse': eventos.estatisticas(),
+            'cache_resultados': {'ativo': True, **cache.estatisticas()} if cache is not None else {'ativo': False},
+            'armazenamento': armazenamento.estatisticas(),
+            'estado': {'pid': os.getpid(), **estado.estatisticas()},
+            'ultima_recarga': ultima_recarga,
+            'latencia_ms': {
+                'etapas': metrica_etapas.resumo(),
+                'requisicoes': metrica_requisicoes.resumo(),
+                'esperas': metrica_esperas.resumo(),
+            },
             'timestamp': datetime.now().isoformat()
         })
 
@@ -892,120 +1888,157 @@ def system_status():
 
 @app.route('/export', methods=['GET'])
 def export_data():
-    """Exporta histórico em formato CSV"""
+    """
+    Exporta histórico em fluxo (memória constante, sem bloquear a ingestão)
+
+    formato: csv (padrão), csv.gz, npz (colunar NumPy) ou arrow (requer pyarrow)
+    Filtros: desde, ate (ISO 8601), device_id, especie, status
+
+    A exportação cobre um snapshot: análises gravadas depois do início
+    da requisição não entram no arquivo.
+    """
     try:
-        import csv
-        from io import StringIO
-        from flask import Response
-
-        output = StringIO()
-        writer = csv.writer(output)
-
-        writer.writerow([
-            'Timestamp', 'Device ID', 'Espécie', 'Confiança %', 'Status',
-            'I1_NDVI', 'I2_Water', 'I3_Lipid', 'I4_Slope_Alt',
-            'SVM Score', 'SVM Anomalia', 'MAD Violações', 'MAD Anomalia', 'Confiança Baixa'
-        ])
-
-        with analysis_lock:
-            for analysis in analysis_history:
-                indices = analysis.get('indices', {})
-                detalhes = analysis.get('detalhes_anomalia', {})
-
-                writer.writerow([
-                    analysis.get('timestamp', ''),
-                    analysis.get('device_id', ''),
-                    analysis.get('especie', ''),
-                    analysis.get('confianca', ''),
-                    analysis.get('status', ''),
-                    indices.get('I1_NDVI', ''),
-                    indices.get('I2_Water', ''),
-                    indices.get('I3_Lipid', ''),
-                    indices.get('I4_Slope_Alt', ''),
-                    detalhes.get('svm_score', ''),
-                    detalhes.get('svm_detectou', ''),
-                    detalhes.get('mad_violacoes', ''),
-                    detalhes.get('mad_detectou', ''),
-                    detalhes.get('confianca_baixa', '')
-                ])
-
-        output.seek(0)
+        formato = request.args.get('formato', 'csv')
+        if formato not in exportacao.FORMATOS:
+            return jsonify({'error': f"Formato inválido: {formato}",
+                            'formatos': list(exportacao.FORMATOS)}), 400
+        if formato == 'arrow' and not exportacao.arrow_disponivel():
+            return jsonify({'error': 'Formato arrow requer pyarrow instalado'}), 400
+
+        filtros = {
+            'desde': request.args.get('desde'),
+            'ate': request.args.get('ate'),
+            'device_id': request.args.get('device_id'),
+            'especie': request.args.get('especie'),
+            'status': request.args.get('status'),
+        }
+        analises = armazenamento.iterar(ate_id=armazenamento.ultimo_id(), **filtros)
+
+        mimetype, extensao = exportacao.FORMATOS[formato]
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         return Response(
-            output.getvalue(),
-            mimetype='text/csv',
+            exportacao.gerar(formato, analises),
+            mimetype=mimetype,
             headers={
-                'Content-Disposition': f'attachment; filename=analise_graos_{timestamp}.csv'
+                'Content-Disposition': f'attachment; filename=analise_graos_{timestamp}.{extensao}'
             }
         )
 
     except Exception as e:
-        logger.error(f"Erro ao exportar dados: {e}")
+        logger.error("Erro ao exportar dados: %s", e)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métricas deste processo no formato texto do Prometheus"""
+    return Response(metricas.renderizar(), content_type=TIPO_CONTEUDO)
+
+
+def descrever_svm(modelo):
+    """Descrição do One-Class SVM com o nu gravado no modelo (se conhecido)"""
+    nus = sorted(set(modelo.ocsvm_nu)) if modelo else []
+    if not nus:
+        return 'One-Class SVM com kernel RBF'
+    return f"One-Class SVM com kernel RBF e nu={', '.join(f'{nu:g}' for nu in nus)}"
+
+
 @app.route('/config', methods=['GET'])
 def get_config():
     """Retorna configuração atual do sistema"""
     try:
+        modelo = motor
         return jsonify({
-            'especies': list(modelo_especies.classes_) if MODELOS else [],
-            'bandas_espectrais': bandas_cols if MODELOS else [],
-            'indices_calculados': list(indices_cols) if MODELOS else [],
+            'especies': [str(c) for c in modelo.classes] if modelo else [],
+            'bandas_espectrais': modelo.bandas_cols if modelo else [],
+            'indices_calculados': list(modelo.indices_cols) if modelo else [],
             'deteccao_anomalia': {
                 'logica': 'AND + alerta confiança',
-                'violacoes_mad_minimas': 2,
-                'limiar_confianca': 60,
-                'descricao_mad': 'Median Absolute Deviation com fator 2.5',
-                'descricao_svm': 'One-Class SVM com kernel RBF e nu=0.05',
-                'descricao_confianca': 'Confiança < 60% indica possível contaminação'
+                'violacoes_mad_minimas': VIOLACOES_MAD_MINIMAS,
+                'limiar_confianca': round(LIMIAR_CONFIANCA * 100, 1),
+                'descricao_mad': f"Median Absolute Deviation por espécie: {DESCRICAO_REGRAS['mad']}",
+                'descricao_svm': descrever_svm(modelo),
+                'modo_svm': modelo.modo_anomalia if modelo else None,
+                'descricao_confianca': f"{DESCRICAO_REGRAS['confianca']} indica possível contaminação"
             },
             'pca': {
                 'componentes': 6,
-                'variancia_explicada': float(pca.explained_variance_ratio_.sum()) if MODELOS else 0
+                'variancia_explicada': modelo.variancia_explicada_pca if modelo else 0
             },
             'observacoes': {
                 'banda_removida': 'r485 (índice 3)',
                 'esp32_envia': '18 bandas',
                 'modelo_usa': '17 bandas',
                 'indices_novos': 'I1_NDVI, I2_Water, I3_Lipid, I4_Slope_Alt',
-                'versao': 'Corrigida - MAD=2, alerta confiança<60%'
+                'versao': f"Corrigida - MAD={VIOLACOES_MAD_MINIMAS}, alerta {DESCRICAO_REGRAS['confianca']}"
             }
         })
     except Exception as e:
-        logger.error(f"Erro ao obter configuração: {e}")
+        logger.error("Erro ao obter configuração: %s", e)
         return jsonify({'error': str(e)}), 500
 
 
 # ==================== LIMPEZA ====================
 
 def cleanup_old_data():
-    """Remove dispositivos inativos e comandos antigos"""
+    """Remove análises fora da retenção"""
     while True:
         try:
             time.sleep(60)
-            now = datetime.now()
 
-            devices_to_remove = []
-            for device_id, device_info in connected_devices.items():
-                if (now - device_info['last_seen']).total_seconds() > 300:
-                    devices_to_remove.append(device_id)
+            removidas = armazenamento.remover_antigos(RETENCAO_DIAS)
+            if removidas:
+                logger.info("🗑️ %s análises removidas (retenção de %s dias)", removidas, RETENCAO_DIAS)
 
-            for device_id in devices_to_remove:
-                del connected_devices[device_id]
-                logger.info(f"🗑️ Dispositivo removido (inativo): {device_id}")
+        except Exception as e:
+            logger.error("Erro na limpeza: %s", e)
 
-            commands_to_remove = []
-            for device_id, command in pending_commands.items():
-                cmd_time = datetime.fromisoformat(command['timestamp'])
-                if (now - cmd_time).total_seconds() > 60:
-                    commands_to_remove.append(device_id)
 
-            for device_id in commands_to_remove:
-                del pending_commands[device_id]
+# ==================== FÁBRICA / SERVIÇOS ====================
 
-        except Exception as e:
-            logger.error(f"Erro na limpeza: {e}")
+_servicos_pid = None
+_servicos_lock = threading.Lock()
+_recarga_vista = 0
+
+
+def iniciar_servicos():
+    """
+    Threads de fundo do processo (limpeza e monitor de estado/SSE).
+    Idempotente por processo: threads não sobrevivem a fork, então cada
+    worker inicia as suas (gunicorn.conf.py ou na primeira requisição).
+    """
+    global _servicos_pid, _recarga_vista
+    if _servicos_pid == os.getpid():
+        return
+    with _servicos_lock:
+        if _servicos_pid == os.getpid():
+            return
+        _servicos_pid = os.getpid()
+        _recarga_vista = estado.marcadores()['recarga']
+        threading.Thread(target=cleanup_old_data, name='limpeza', daemon=True).start()
+        threading.Thread(target=monitorar_dispositivos, name='monitor-estado', daemon=True).start()
+
+
+@app.before_request
+def _garantir_servicos():
+    iniciar_servicos()
+
+
+def criar_app():
+    """
+    Fábrica da aplicação para servidores WSGI multi-processo:
+
+    gunicorn -c gunicorn.conf.py "servidor_flask:criar_app()"
+
+    Com preload_app o modelo é carregado uma única vez no processo mestre
+    e os workers o herdam por copy-on-write; o estado de dispositivos e
+    comandos fica no SQLite compartilhado (ESTADO_COMPARTILHADO).
+    """
+    if motor is None and not carregar_modelo():
+        logger.error("⚠️ Servidor iniciará SEM modelo!")
+    if not estado.compartilhado:
+        logger.warning("⚠️ Estado em memória: use ESTADO_COMPARTILHADO com mais de um worker")
+    return app
 
 
 # ==================== MAIN ====================
@@ -1022,8 +2055,8 @@ if __name__ == '__main__':
     else:
         logger.info("\n✨ CONFIGURAÇÃO DE ANOMALIA (VERSÃO CORRIGIDA):")
         logger.info("   Lógica: AND (ambos métodos devem concordar)")
-        logger.info("   Violações MAD mínimas: 2 (ajustado de 3)")
-        logger.info("   Alerta de confiança baixa: < 60%")
+        logger.info("   Violações MAD mínimas: %s (ajustado de 3)", VIOLACOES_MAD_MINIMAS)
+        logger.info("   Alerta de confiança baixa: %s", DESCRICAO_REGRAS['confianca'])
         logger.info("   Resultado: Balanceado - detecta contaminações sem excesso de falsos positivos")
         logger.info("\n✂️ PROCESSAMENTO DE BANDAS:")
         logger.info("   ESP32 envia: 18 bandas")
@@ -1032,8 +2065,11 @@ if __name__ == '__main__':
         logger.info("\n📊 ÍNDICES ESPECTRAIS:")
         logger.info("   I1_NDVI, I2_Water, I3_Lipid, I4_Slope_Alt")
 
-    cleanup_thread = threading.Thread(target=cleanup_old_data, daemon=True)
-    cleanup_thread.start()
+    iniciar_servicos()
+
+    # kill -HUP <pid> recarrega o modelo a quente (mesmo que POST /model/reload)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda *_: iniciar_recarga())
 
     logger.info("\n" + "=" * 60)
     logger.info("🌐 Servidor Flask iniciando...")
@@ -1041,15 +2077,23 @@ if __name__ == '__main__':
     logger.info("   Local:  http://localhost:5000")
     logger.info("   Rede:   http://seu_ip_local:5000")
     logger.info("\n📡 Endpoints disponíveis:")
-    logger.info("   POST /esp32/poll        - ESP32 verifica comandos")
+    logger.info("   POST /esp32/poll        - ESP32 verifica comandos (long-poll com 'wait')")
     logger.info("   POST /esp32/result      - ESP32 envia espectro (18 bandas)")
+    logger.info("   POST /esp32/result_batch - Gateway envia lote de espectros")
+    logger.info("   POST /esp32/scan        - ESP32 abre sessão de varredura (leituras repetidas)")
+    logger.info("   POST /esp32/scan/<id>   - Leitura da sessão (para quando a decisão estabiliza)")
     logger.info("   POST /command/analyze   - Interface solicita análise")
+    logger.info("   GET  /command/<id>      - Estado de um comando")
+    logger.info("   POST /command/broadcast - Análise em todos os dispositivos ativos (ou por tags)")
+    logger.info("   GET  /command/broadcast/<id> - Relatório agregado da difusão")
     logger.info("   GET  /devices           - Lista dispositivos")
     logger.info("   GET  /last_analysis     - Última análise")
     logger.info("   GET  /history           - Histórico completo")
     logger.info("   GET  /status            - Status do sistema")
     logger.info("   GET  /config            - Configuração atual")
-    logger.info("   GET  /export            - Exportar CSV")
+    logger.info("   GET  /export            - Exportar histórico (csv, csv.gz, npz, arrow)")
+    logger.info("   GET  /events            - Fluxo SSE (dispositivos, status, análises)")
+    logger.info("   POST /model/reload      - Recarrega o modelo a quente (ou kill -HUP)")
     logger.info("=" * 60)
 
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
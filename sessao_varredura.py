@@ -0,0 +1,127 @@
+"""
+Sessões de Varredura com Parada Antecipada - Classificação de Grãos
+
+Em vez de uma única leitura após o aquecimento dos LEDs, o ESP32 envia
+leituras repetidas da mesma amostra numa sessão, e o servidor decide
+quando já há leituras suficientes:
+
+- Acumulação: média e variância das 18 bandas atualizadas a cada
+  leitura (Welford), sem guardar as leituras
+- Reclassificação: a cada leitura o espectro médio é classificado de
+  novo
+- Teste sequencial: SORTEIOS espectros são sorteados em torno da média,
+  com o erro padrão estimado (variância / n), e classificados em lote.
+  A sessão termina quando a espécie e o status (NORMAL/ANORMAL) do
+  espectro médio se repetem em pelo menos CONCORDANCIA_MINIMA dos
+  sorteios, ou seja, quando mais leituras dificilmente mudariam a
+  decisão. Amostras claras param em VARREDURAS_MINIMAS leituras;
+  ambíguas continuam até VARREDURAS_MAXIMAS
+
+Com poucas leituras a variância observada não é confiável: ela é
+combinada com um ruído a priori (RUIDO_PRIORI_REL do valor da banda)
+com peso de PESO_PRIORI leituras.
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import secrets
+
+import numpy as np
+
+VARREDURAS_MINIMAS = 2
+VARREDURAS_MAXIMAS = 10
+SORTEIOS = 64
+CONCORDANCIA_MINIMA = 0.95
+
+# Ruído a priori de uma leitura (fração do valor da banda) e seu peso,
+# em leituras equivalentes, na estimativa da variância
+RUIDO_PRIORI_REL = 0.01
+PESO_PRIORI = 2
+
+# Sessão sem leituras novas por esse tempo é descartada
+SESSAO_TTL_S = 120
+
+# Regravações de uma leitura que perdeu a corrida para outra da mesma sessão
+SESSAO_TENTATIVAS = 5
+
+N_BANDAS = 18
+
+
+def nova_sessao(device_id, command_id, agora):
+    return {
+        'session_id': secrets.token_hex(8),
+        'device_id': device_id,
+        'command_id': command_id,
+        'criado_em': agora,
+        'prazo': agora + SESSAO_TTL_S,
+        'n': 0,
+        'media': [0.0] * N_BANDAS,
+        'm2': [0.0] * N_BANDAS,
+        'concluida': False,
+        'resposta': None,
+        # Incrementada a cada gravação; ver atualizar_sessao no estado compartilhado
+        'versao': 0,
+    }
+
+
+def acumular(sessao, espectro, agora):
+    """Soma uma leitura à média/variância da sessão (Welford) e renova o prazo"""
+    x = np.asarray(espectro, dtype=np.float64)
+    if x.shape != (N_BANDAS,):
+        raise ValueError(f"Espectro inválido: {x.size} bandas (esperado: {N_BANDAS})")
+    if not np.all(np.isfinite(x)):
+        raise ValueError("Espectro com valores não finitos")
+    media = np.asarray(sessao['media'])
+    m2 = np.asarray(sessao['m2'])
+    n = sessao['n'] + 1
+    delta = x - media
+    media = media + delta / n
+    m2 = m2 + delta * (x - media)
+    sessao['n'] = n
+    sessao['media'] = media.tolist()
+    sessao['m2'] = m2.tolist()
+    sessao['prazo'] = agora + SESSAO_TTL_S
+    return sessao
+
+
+def erro_padrao(sessao):
+    """Erro padrão da média por banda (variância observada + ruído a priori)"""
+    n = sessao['n']
+    media = np.asarray(sessao['media'])
+    variancia_priori = (RUIDO_PRIORI_REL * np.abs(media)) ** 2
+    variancia = ((np.asarray(sessao['m2']) + PESO_PRIORI * variancia_priori)
+                 / (max(n - 1, 0) + PESO_PRIORI))
+    return np.sqrt(variancia / max(n, 1))
+
+
+def espectros_teste(sessao, sorteios=SORTEIOS, rng=None):
+    """
+    Matriz (1 + sorteios, 18): o espectro médio na linha 0 e os sorteios
+    em torno dele (normal com o erro padrão de cada banda)
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    media = np.asarray(sessao['media'])
+    ruido = rng.standard_normal((sorteios, N_BANDAS)) * erro_padrao(sessao)
+    return np.vstack([media, media + ruido])
+
+
+def decidir(sessao, especies, status):
+    """
+    Teste sequencial sobre as decisões de espectros_teste()
+
+    especies, status: arrays com a decisão de cada linha (0 = média)
+    Retorna (concluir, motivo, concordancia) com motivo 'estavel',
+    'limite' ou None (continuar).
+    """
+    especies = np.asarray(especies)
+    status = np.asarray(status)
+    concordancia = {
+        'especie': round(float(np.mean(especies[1:] == especies[0])), 3),
+        'status': round(float(np.mean(status[1:] == status[0])), 3),
+    }
+    n = sessao['n']
+    if n >= VARREDURAS_MINIMAS and min(concordancia.values()) >= CONCORDANCIA_MINIMA:
+        return True, 'estavel', concordancia
+    if n >= VARREDURAS_MAXIMAS:
+        return True, 'limite', concordancia
+    return False, None, concordancia
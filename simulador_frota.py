@@ -0,0 +1,419 @@
+"""
+Simulador de Frota ESP32 - Classificação de Grãos
+
+Milhares de ESP32 virtuais num único processo asyncio, cada um com a
+máquina de estados de inferencia_espectral_um_modelo_pkl.ino:
+
+- aguardando: long-poll em /esp32/poll ("wait"), reconectando conforme
+  o "poll_ms" devolvido; fora dele, poll curto a cada POLL_INTERVAL
+- coletando: ao receber "analyze", aquece os LEDs (--aquecimento-ms) e
+  faz a leitura (--leitura-ms); o loop continua consultando o servidor
+  entre os estados, como no firmware
+- processando: POST do espectro de 18 bandas em /esp32/result (JSON ou
+  binário) com o command_id; com --varredura, sessão em /esp32/scan até
+  o servidor decidir
+- exibindo: resultado no "display" por --exibicao-ms
+
+Espectros: uma linha sorteada da tabela de coleta por análise, com ruído
+por leitura e deriva do sensor (ganho por banda em passeio aleatório a
+cada análise), limitados a [0, 1] como a calibração do firmware.
+
+Um gerador envia comandos /command/analyze a dispositivos sorteados
+(processo de Poisson, --taxa por segundo) e mede, por comando, a
+latência de ponta a ponta comando -> resultado, além da entrega
+(comando -> poll), da resposta do servidor ao resultado e do acerto
+de espécie.
+
+Uso:
+python simulador_frota.py --url http://127.0.0.1:5000 --dispositivos 2000 --taxa 20 --duracao 60
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from benchmark import ARQUIVO_DADOS, COLUNAS_BANDAS
+from formato_espectro import codificar_espectro, TIPO_ESPECTRO_BINARIO
+from teste_carga import ConexaoHTTP, consultar_conectados
+
+# Mesmos tempos do firmware (ms)
+POLL_INTERVAL_MS = 2000
+LONG_POLL_WAIT_S = 25
+WARMUP_TIME_MS = 5000
+SESSION_WARMUP_TIME_MS = 2000
+DISPLAY_TIME_MS = 5000
+LOOP_DELAY_MS = 100
+LEITURA_MS = 300
+
+ERROS_REDE = (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError)
+
+
+# ==================== ESPECTROS ====================
+
+class GeradorEspectros:
+    """Linhas da tabela de coleta com ruído por leitura e deriva por dispositivo"""
+
+    def __init__(self, caminho, ruido, deriva, semente):
+        tabela = pd.read_csv(caminho)
+        self.espectros = tabela[COLUNAS_BANDAS].to_numpy(dtype=np.float64)
+        self.especies = tabela['grain'].to_numpy()
+        self.ruido = ruido
+        self.deriva = deriva
+        self.rng = np.random.default_rng(semente)
+
+    def novo_ganho(self):
+        return np.ones(len(COLUNAS_BANDAS))
+
+    def derivar(self, ganho):
+        """Um passo do passeio aleatório do ganho (uma análise)"""
+        return ganho * np.exp(self.rng.normal(0, self.deriva, len(ganho)))
+
+    def amostra(self):
+        """(índice da linha, espécie) da amostra colocada no sensor"""
+        i = int(self.rng.integers(len(self.espectros)))
+        return i, self.especies[i]
+
+    def leitura(self, i, ganho):
+        espectro = self.espectros[i] * ganho * (1 + self.rng.normal(0, self.ruido, len(ganho)))
+        return np.clip(espectro, 0.0, 1.0).astype(np.float32)
+
+
+# ==================== DISPOSITIVO VIRTUAL ====================
+
+class Medicoes:
+    """Instantes por command_id e contadores de toda a frota"""
+
+    def __init__(self):
+        self.enviados = {}
+        self.entregas = {}
+        self.resultados = {}
+        self.respostas_servidor = []
+        self.acertos = Counter()
+        self.analises = Counter()
+        self.varreduras = []
+        self.erros = Counter()
+        self.polls = 0
+        self.sobrescritos = 0
+
+
+class DispositivoVirtual:
+    """Máquina de estados do firmware (loop + switch) sobre uma conexão keep-alive"""
+
+    def __init__(self, indice, host, porta, gerador, medicoes, args):
+        self.device_id = f'SIM{indice:05d}'
+        self.conexao = ConexaoHTTP(host, porta)
+        self.gerador = gerador
+        self.medicoes = medicoes
+        self.args = args
+        self.estado = 'waiting'
+        self.command_id = ''
+        self.ganho = gerador.novo_ganho()
+        self.amostra = None
+        self.espectro = None
+        self.ultimo_poll = -float('inf')
+        self.proximo_poll_s = 0.0
+
+    async def executar(self, atraso):
+        await asyncio.sleep(atraso)
+        try:
+            while True:
+                agora = time.monotonic()
+                if agora - self.ultimo_poll >= self.proximo_poll_s:
+                    await self.consultar_comandos()
+                    self.ultimo_poll = time.monotonic()
+
+                if self.estado == 'collecting':
+                    await self.coletar()
+                elif self.estado == 'processing':
+                    await self.enviar_resultado()
+                elif self.estado == 'displaying':
+                    await asyncio.sleep(self.args.exibicao_ms / 1000)
+                    self.estado = 'waiting'
+
+                # Parado em 'waiting' o loop do firmware só faz algo no próximo poll
+                espera = LOOP_DELAY_MS / 1000
+                if self.estado == 'waiting':
+                    espera = max(espera, self.ultimo_poll + self.proximo_poll_s - time.monotonic())
+                await asyncio.sleep(espera)
+        finally:
+            self.conexao.fechar()
+
+    async def consultar_comandos(self):
+        corpo = {'device_id': self.device_id, 'status': self.estado}
+        long_poll = self.estado == 'waiting'
+        if long_poll:
+            corpo['wait'] = self.args.espera
+        try:
+            status, resposta = await self.conexao.requisitar('POST', '/esp32/poll', corpo,
+                                                             timeout=(self.args.espera if long_poll else 0) + 5)
+            if status != 200:
+                raise ConnectionError(f'poll HTTP {status}')
+        except ERROS_REDE as e:
+            self.medicoes.erros[f'poll: {type(e).__name__}'] += 1
+            self.proximo_poll_s = POLL_INTERVAL_MS / 1000
+            return
+        self.medicoes.polls += 1
+        self.proximo_poll_s = resposta.get('poll_ms', POLL_INTERVAL_MS) / 1000
+        if resposta.get('command') == 'analyze':
+            # Como no firmware, um comando recebido durante a análise substitui
+            # o atual; o substituído só volta pela reentrega do servidor
+            if self.command_id:
+                self.medicoes.sobrescritos += 1
+            self.command_id = resposta.get('command_id') or ''
+            if self.command_id:
+                self.medicoes.entregas.setdefault(self.command_id, time.perf_counter())
+            self.estado = 'collecting'
+
+    async def coletar(self):
+        self.amostra = self.gerador.amostra()
+        self.ganho = self.gerador.derivar(self.ganho)
+        if self.args.varredura:
+            await self.sessao_varredura()
+            self.estado = 'displaying'
+            return
+        await asyncio.sleep((self.args.aquecimento_ms + self.args.leitura_ms) / 1000)
+        self.espectro = self.gerador.leitura(self.amostra[0], self.ganho)
+        self.estado = 'processing'
+
+    async def postar_espectro(self, caminho):
+        """POST do espectro atual (binário ou JSON); (status, resposta, duração)"""
+        if self.args.binario:
+            corpo = codificar_espectro(self.device_id, self.espectro, self.command_id)
+        else:
+            corpo = {'device_id': self.device_id, 'spectrum': self.espectro.tolist()}
+            if self.command_id:
+                corpo['command_id'] = self.command_id
+        inicio = time.perf_counter()
+        status, resposta = await self.conexao.requisitar('POST', caminho, corpo, timeout=30,
+                                                         tipo=TIPO_ESPECTRO_BINARIO)
+        return status, resposta, time.perf_counter() - inicio
+
+    def registrar_resultado(self, resposta, duracao):
+        self.medicoes.respostas_servidor.append(duracao)
+        especie = self.amostra[1]
+        self.medicoes.analises[especie] += 1
+        self.medicoes.acertos[especie] += resposta.get('especie') == especie
+        if self.command_id:
+            self.medicoes.resultados.setdefault(self.command_id, time.perf_counter())
+
+    async def enviar_resultado(self):
+        try:
+            status, resposta, duracao = await self.postar_espectro('/esp32/result')
+            if status != 200:
+                raise ConnectionError(f'result HTTP {status}')
+            self.registrar_resultado(resposta, duracao)
+        except ERROS_REDE as e:
+            self.medicoes.erros[f'result: {type(e).__name__}'] += 1
+        # Sem resposta o servidor reentrega o comando (mesmo command_id)
+        self.command_id = ''
+        self.estado = 'displaying'
+
+    async def sessao_varredura(self):
+        try:
+            status, resposta = await self.conexao.requisitar(
+                'POST', '/esp32/scan', {'device_id': self.device_id, 'command_id': self.command_id or None},
+                timeout=30)
+            if status != 200:
+                raise ConnectionError(f'scan HTTP {status}')
+            caminho = f"/esp32/scan/{resposta['session_id']}"
+            maximo = resposta.get('varreduras_max', 10)
+            await asyncio.sleep(self.args.aquecimento_ms / 1000)
+            for n in range(1, maximo + 1):
+                await asyncio.sleep(self.args.leitura_ms / 1000)
+                self.espectro = self.gerador.leitura(self.amostra[0], self.ganho)
+                status, resposta, duracao = await self.postar_espectro(caminho)
+                if status != 200:
+                    raise ConnectionError(f'scan HTTP {status}')
+                if resposta.get('varredura', {}).get('concluida'):
+                    self.registrar_resultado(resposta, duracao)
+                    self.medicoes.varreduras.append(n)
+                    break
+        except (*ERROS_REDE, KeyError) as e:
+            self.medicoes.erros[f'scan: {type(e).__name__}'] += 1
+        self.command_id = ''
+
+
+# ==================== GERADOR DE COMANDOS ====================
+
+async def gerar_comandos(host, porta, dispositivos, medicoes, args):
+    """Comandos /command/analyze em instantes de Poisson (--taxa/s) por --duracao s"""
+    conexoes = asyncio.Queue()
+    for _ in range(args.conexoes_controle):
+        conexoes.put_nowait(ConexaoHTTP(host, porta))
+    pendentes = set()
+
+    async def enviar(device_id):
+        conexao = await conexoes.get()
+        inicio = time.perf_counter()
+        try:
+            status, resposta = await conexao.requisitar('POST', '/command/analyze', {'device_id': device_id},
+                                                        timeout=10)
+            if status != 200:
+                raise ConnectionError(f'analyze HTTP {status}')
+            medicoes.enviados[resposta['command_id']] = inicio
+        except (*ERROS_REDE, KeyError) as e:
+            medicoes.erros[f'analyze: {type(e).__name__}'] += 1
+        finally:
+            conexoes.put_nowait(conexao)
+
+    fim = time.monotonic() + args.duracao
+    while time.monotonic() < fim:
+        await asyncio.sleep(random.expovariate(args.taxa))
+        tarefa = asyncio.create_task(enviar(random.choice(dispositivos).device_id))
+        pendentes.add(tarefa)
+        tarefa.add_done_callback(pendentes.discard)
+    await asyncio.gather(*pendentes, return_exceptions=True)
+    while not conexoes.empty():
+        conexoes.get_nowait().fechar()
+
+
+# ==================== RELATÓRIO ====================
+
+def distribuicao(valores):
+    """Percentis em ms de uma lista de durações em segundos"""
+    if not valores:
+        return {'n': 0}
+    ms = np.asarray(valores) * 1000
+    return {
+        'n': len(ms),
+        'media_ms': round(float(ms.mean()), 1),
+        **{f'p{p}_ms': round(float(np.percentile(ms, p)), 1) for p in (50, 90, 95, 99)},
+        'max_ms': round(float(ms.max()), 1),
+    }
+
+
+def relatorio(medicoes, args, conectados, duracao_total):
+    enviados = medicoes.enviados
+    ponta_a_ponta = [medicoes.resultados[c] - t0 for c, t0 in enviados.items() if c in medicoes.resultados]
+    entrega = [medicoes.entregas[c] - t0 for c, t0 in enviados.items() if c in medicoes.entregas]
+    analises = sum(medicoes.analises.values())
+    return {
+        'meta': {
+            'data': datetime.now().isoformat(),
+            'url': args.url,
+            'dispositivos': args.dispositivos,
+            'taxa_comandos_s': args.taxa,
+            'duracao_s': args.duracao,
+            'aquecimento_ms': args.aquecimento_ms,
+            'leitura_ms': args.leitura_ms,
+            'exibicao_ms': args.exibicao_ms,
+            'formato': 'binario' if args.binario else 'json',
+            'varredura': args.varredura,
+            'ruido': args.ruido,
+            'deriva': args.deriva,
+        },
+        'conectados_status': conectados,
+        'comandos_enviados': len(enviados),
+        'comandos_concluidos': len(ponta_a_ponta),
+        'comandos_sem_resultado': len(enviados) - len(ponta_a_ponta),
+        'comandos_sobrescritos': medicoes.sobrescritos,
+        'resultados_s': round(len(ponta_a_ponta) / duracao_total, 2),
+        'polls': medicoes.polls,
+        'latencia_ponta_a_ponta': distribuicao(ponta_a_ponta),
+        'latencia_entrega': distribuicao(entrega),
+        'latencia_resposta_resultado': distribuicao(medicoes.respostas_servidor),
+        'varreduras_por_sessao': (round(float(np.mean(medicoes.varreduras)), 2)
+                                  if medicoes.varreduras else None),
+        'acerto_especie': round(sum(medicoes.acertos.values()) / analises, 4) if analises else None,
+        'acerto_por_especie': {e: round(medicoes.acertos[e] / n, 4) for e, n in sorted(medicoes.analises.items())},
+        'erros': dict(medicoes.erros),
+    }
+
+
+def imprimir(resultado):
+    print(f"📊 {resultado['comandos_concluidos']}/{resultado['comandos_enviados']} comandos concluídos "
+          f"({resultado['resultados_s']} resultados/s), {resultado['polls']} polls, "
+          f"status={resultado['conectados_status']} conectados")
+    for nome in ('latencia_ponta_a_ponta', 'latencia_entrega', 'latencia_resposta_resultado'):
+        d = resultado[nome]
+        if d['n']:
+            print(f"   {nome:<28} p50 {d['p50_ms']:>8} ms  p90 {d['p90_ms']:>8} ms  "
+                  f"p99 {d['p99_ms']:>8} ms  max {d['max_ms']:>8} ms  (n={d['n']})")
+    if resultado['comandos_sobrescritos']:
+        print(f"   ⚠️ {resultado['comandos_sobrescritos']} comandos substituídos por outro durante a análise "
+              f"(concluídos só após a reentrega)")
+    if resultado['varreduras_por_sessao'] is not None:
+        print(f"   🔁 {resultado['varreduras_por_sessao']} leituras por sessão")
+    print(f"   🎯 acerto de espécie: {resultado['acerto_especie']} {resultado['acerto_por_especie']}")
+    if resultado['erros']:
+        print(f"   ❌ erros: {resultado['erros']}")
+
+
+# ==================== EXECUÇÃO ====================
+
+async def simular(args):
+    partes = urlsplit(args.url)
+    host, porta = partes.hostname, partes.port or 80
+    random.seed(args.semente)
+    gerador = GeradorEspectros(args.dados, args.ruido, args.deriva, args.semente)
+    medicoes = Medicoes()
+
+    dispositivos = [DispositivoVirtual(i, host, porta, gerador, medicoes, args) for i in range(args.dispositivos)]
+    tarefas = [asyncio.create_task(d.executar(args.rampa * i / len(dispositivos)))
+               for i, d in enumerate(dispositivos)]
+    print(f"🚀 {len(dispositivos)} dispositivos virtuais conectando em {args.rampa} s")
+    await asyncio.sleep(args.rampa + 1)
+    conectados = await consultar_conectados(host, porta)
+
+    print(f"📤 Comandos a {args.taxa}/s por {args.duracao} s")
+    inicio = time.monotonic()
+    await gerar_comandos(host, porta, dispositivos, medicoes, args)
+
+    # Drenagem: espera os comandos em curso terminarem (ou o prazo)
+    limite = time.monotonic() + args.drenagem
+    while time.monotonic() < limite and not set(medicoes.enviados) <= set(medicoes.resultados):
+        await asyncio.sleep(0.5)
+    duracao_total = time.monotonic() - inicio
+
+    for tarefa in tarefas:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas, return_exceptions=True)
+    return relatorio(medicoes, args, conectados, duracao_total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulador de frota ESP32 (carga e latência comando -> resultado)')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--dispositivos', type=int, default=100)
+    parser.add_argument('--taxa', type=float, default=2.0, help='comandos /command/analyze por segundo')
+    parser.add_argument('--duracao', type=float, default=60, help='tempo gerando comandos (s)')
+    parser.add_argument('--drenagem', type=float, default=60, help='espera máxima pelos comandos em curso (s)')
+    parser.add_argument('--rampa', type=float, default=5.0, help='tempo para conectar todos (s)')
+    parser.add_argument('--aquecimento-ms', type=int,
+                        help=f'aquecimento dos LEDs (padrão: {WARMUP_TIME_MS}, ou '
+                             f'{SESSION_WARMUP_TIME_MS} com --varredura)')
+    parser.add_argument('--leitura-ms', type=int, default=LEITURA_MS, help='duração de uma leitura do sensor')
+    parser.add_argument('--exibicao-ms', type=int, default=DISPLAY_TIME_MS, help='resultado no display')
+    parser.add_argument('--espera', type=float, default=LONG_POLL_WAIT_S, help='"wait" do long-poll (s)')
+    parser.add_argument('--binario', action='store_true', help='espectro no formato binário')
+    parser.add_argument('--varredura', action='store_true', help='sessões de varredura (/esp32/scan)')
+    parser.add_argument('--ruido', type=float, default=0.01, help='ruído relativo por leitura')
+    parser.add_argument('--deriva', type=float, default=0.002, help='deriva relativa do ganho por análise')
+    parser.add_argument('--conexoes-controle', type=int, default=8, help='conexões do gerador de comandos')
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--dados', default=ARQUIVO_DADOS)
+    parser.add_argument('--saida', default='simulador_frota_resultado.json')
+    args = parser.parse_args()
+    if args.aquecimento_ms is None:
+        args.aquecimento_ms = SESSION_WARMUP_TIME_MS if args.varredura else WARMUP_TIME_MS
+
+    resultado = asyncio.run(simular(args))
+    imprimir(resultado)
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"💾 Resultado gravado em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
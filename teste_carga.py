@@ -0,0 +1,384 @@
+"""
+Teste de Carga: Dispositivos Conectados por Modo de Serviço - Classificação de Grãos
+
+Simula N ESP32 estacionados em long-poll (/esp32/poll com "wait") contra
+cada modo de serviço e mede quantos dispositivos o nó sustenta:
+
+- flask:    servidor de desenvolvimento do Flask (uma thread por requisição)
+- gunicorn: gunicorn.conf.py (gthread: WORKERS x THREADS threads)
+- async:    servidor_async.py (uma corrotina por conexão)
+
+Em cada nível os N dispositivos conectam (rampa de --rampa s), ficam em
+long-poll e respondem aos comandos com um espectro da tabela de coleta.
+Em seguida --sondas comandos /command/analyze vão para dispositivos
+sorteados e mede-se o tempo até o comando chegar ao dispositivo
+(entrega) e até o resultado ser aceito. O nível é sustentado se não há
+erros de conexão e pelo menos 99% das sondas são entregues em até
+--prazo s. Cada nível usa um servidor novo (porta livre, banco temporário).
+
+Uso:
+python teste_carga.py --modos async,gunicorn,flask --dispositivos 50,200,1000,2000
+python teste_carga.py --url http://host:5000 --dispositivos 100,500   (servidor já no ar)
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from benchmark import carregar_espectros, ARQUIVO_DADOS
+
+ESPERA_LONG_POLL_S = 20
+PRAZO_ENTREGA_S = 2.0
+ENTREGA_MINIMA = 0.99
+TIMEOUT_INICIO_SERVIDOR_S = 90
+
+# Servidor de cada modo; BIND, BANCO_ANALISES e ESTADO_COMPARTILHADO vêm do ambiente
+COMANDOS_SERVIDOR = {
+    'flask': [sys.executable, '-c',
+              "import os, servidor_flask as s; s.carregar_modelo(); s.iniciar_servicos(); "
+              "h, _, p = os.environ['BIND'].rpartition(':'); s.app.run(host=h, port=int(p), threaded=True)"],
+    'gunicorn': ['gunicorn', '-c', 'gunicorn.conf.py', 'servidor_flask:criar_app()'],
+    'async': [sys.executable, 'servidor_async.py'],
+}
+
+
+# ==================== CLIENTE HTTP ====================
+
+class ConexaoHTTP:
+    """Conexão keep-alive mínima (um dispositivo = uma conexão)"""
+
+    def __init__(self, host, porta):
+        self.host = host
+        self.porta = porta
+        self.leitor = None
+        self.escritor = None
+
+    async def requisitar(self, metodo, caminho, corpo=None, timeout=ESPERA_LONG_POLL_S + 10,
+                         tipo='application/json'):
+        """corpo: objeto enviado como JSON, ou bytes enviados como estão (com 'tipo')"""
+        try:
+            return await asyncio.wait_for(self._requisitar(metodo, caminho, corpo, tipo), timeout)
+        except BaseException:
+            self.fechar()
+            raise
+
+    async def _requisitar(self, metodo, caminho, corpo, tipo):
+        if self.escritor is None:
+            self.leitor, self.escritor = await asyncio.open_connection(self.host, self.porta)
+        if isinstance(corpo, bytes):
+            dados = corpo
+        else:
+            dados = json.dumps(corpo).encode() if corpo is not None else b''
+            tipo = 'application/json'
+        self.escritor.write(f'{metodo} {caminho} HTTP/1.1\r\nHost: {self.host}\r\n'
+                            f'Content-Type: {tipo}\r\nContent-Length: {len(dados)}\r\n\r\n'.encode() + dados)
+        await self.escritor.drain()
+
+        linha = await self.leitor.readline()
+        if not linha:
+            raise ConnectionError('conexão fechada pelo servidor')
+        status = int(linha.split()[1])
+        cabecalhos = {}
+        while True:
+            linha = await self.leitor.readline()
+            if linha in (b'\r\n', b'\n', b''):
+                break
+            nome, _, valor = linha.decode('latin-1').partition(':')
+            cabecalhos[nome.strip().lower()] = valor.strip()
+        if 'content-length' in cabecalhos:
+            resposta = await self.leitor.readexactly(int(cabecalhos['content-length']))
+        else:
+            resposta = await self.leitor.read()
+            self.fechar()
+        if cabecalhos.get('connection', '').lower() == 'close':
+            self.fechar()
+        return status, json.loads(resposta) if resposta else None
+
+    def fechar(self):
+        if self.escritor is not None:
+            self.escritor.close()
+            self.escritor = None
+
+
+# ==================== FROTA SIMULADA ====================
+
+class Frota:
+    """N dispositivos em long-poll; registra entregas e resultados por command_id"""
+
+    def __init__(self, host, porta, n, espectros, espera_s):
+        self.host = host
+        self.porta = porta
+        self.n = n
+        self.espectros = espectros
+        self.espera_s = espera_s
+        self.entregas = {}
+        self.resultados = {}
+        self.polls = 0
+        self.erros = 0
+
+    @staticmethod
+    def device_id(i):
+        return f'CARGA_{i:05d}'
+
+    async def dispositivo(self, i, atraso):
+        await asyncio.sleep(atraso)
+        conexao = ConexaoHTTP(self.host, self.porta)
+        device_id = self.device_id(i)
+        try:
+            while True:
+                try:
+                    status, resposta = await conexao.requisitar(
+                        'POST', '/esp32/poll', {'device_id': device_id, 'status': 'ready', 'wait': self.espera_s})
+                    if status != 200:
+                        raise ConnectionError(f'poll HTTP {status}')
+                    self.polls += 1
+                    if resposta.get('command') != 'analyze':
+                        continue
+                    command_id = resposta.get('command_id')
+                    self.entregas[command_id] = time.perf_counter()
+                    espectro = self.espectros[random.randrange(len(self.espectros))].tolist()
+                    status, _ = await conexao.requisitar(
+                        'POST', '/esp32/result', {'device_id': device_id, 'spectrum': espectro, 'command_id': command_id})
+                    if status != 200:
+                        raise ConnectionError(f'result HTTP {status}')
+                    self.resultados[command_id] = time.perf_counter()
+                except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    self.erros += 1
+                    await asyncio.sleep(1)
+        finally:
+            conexao.fechar()
+
+
+def percentil(valores, p):
+    return round(float(np.percentile(valores, p)) * 1000, 1) if valores else None
+
+
+async def sondar(frota, k, prazo_s):
+    """Envia k comandos a dispositivos sorteados; mede entrega e resultado"""
+    controle = ConexaoHTTP(frota.host, frota.porta)
+    enviados = {}
+    falhas_envio = 0
+    for i in random.sample(range(frota.n), min(k, frota.n)):
+        inicio = time.perf_counter()
+        try:
+            status, resposta = await controle.requisitar(
+                'POST', '/command/analyze', {'device_id': frota.device_id(i)}, timeout=prazo_s)
+            if status != 200:
+                raise ConnectionError(f'HTTP {status}')
+            enviados[resposta['command_id']] = inicio
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, KeyError):
+            falhas_envio += 1
+    controle.fechar()
+    await asyncio.sleep(prazo_s)
+
+    entregas = [frota.entregas[c] - t0 for c, t0 in enviados.items() if c in frota.entregas]
+    resultados = [frota.resultados[c] - t0 for c, t0 in enviados.items() if c in frota.resultados]
+    no_prazo = sum(1 for d in entregas if d <= prazo_s)
+    return {
+        'sondas': min(k, frota.n),
+        'falhas_envio': falhas_envio,
+        'entregues_no_prazo': no_prazo,
+        'taxa_entrega': round(no_prazo / min(k, frota.n), 4),
+        'entrega_p50_ms': percentil(entregas, 50),
+        'entrega_p95_ms': percentil(entregas, 95),
+        'resultado_p50_ms': percentil(resultados, 50),
+        'resultado_p95_ms': percentil(resultados, 95),
+    }
+
+
+async def consultar_conectados(host, porta):
+    """devices_connected de /status (None se o servidor não responder a tempo)"""
+    conexao = ConexaoHTTP(host, porta)
+    try:
+        status, resposta = await conexao.requisitar('GET', '/status', timeout=5)
+        return resposta.get('devices_connected') if status == 200 else None
+    except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+        return None
+    finally:
+        conexao.fechar()
+
+
+async def medir_nivel(host, porta, n, espectros, args):
+    frota = Frota(host, porta, n, espectros, args.espera)
+    tarefas = [asyncio.create_task(frota.dispositivo(i, args.rampa * i / n)) for i in range(n)]
+    await asyncio.sleep(args.rampa + 1)
+
+    conectados = await consultar_conectados(host, porta)
+    sondas = await sondar(frota, args.sondas, args.prazo)
+    erros = frota.erros
+
+    for tarefa in tarefas:
+        tarefa.cancel()
+    await asyncio.gather(*tarefas, return_exceptions=True)
+
+    sustentado = (erros == 0 and sondas['falhas_envio'] == 0 and sondas['taxa_entrega'] >= ENTREGA_MINIMA)
+    return {'dispositivos': n, 'conectados_status': conectados, 'erros_conexao': erros,
+            'polls': frota.polls, **sondas, 'sustentado': sustentado}
+
+
+# ==================== SERVIDOR ====================
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def recursos(pid):
+    """RSS (MB) e threads do processo e de seus filhos (workers), via /proc"""
+    rss_kb, threads = 0, 0
+    pendentes = [pid]
+    while pendentes:
+        atual = pendentes.pop()
+        try:
+            with open(f'/proc/{atual}/status') as f:
+                for linha in f:
+                    if linha.startswith('VmRSS:'):
+                        rss_kb += int(linha.split()[1])
+                    elif linha.startswith('Threads:'):
+                        threads += int(linha.split()[1])
+            for tarefa in os.listdir(f'/proc/{atual}/task'):
+                with open(f'/proc/{atual}/task/{tarefa}/children') as f:
+                    pendentes.extend(int(filho) for filho in f.read().split())
+        except OSError:
+            continue
+    return {'rss_mb': round(rss_kb / 1024, 1), 'threads': threads}
+
+
+def iniciar_servidor(modo, porta, diretorio):
+    ambiente = dict(os.environ, BIND=f'127.0.0.1:{porta}',
+                    BANCO_ANALISES=os.path.join(diretorio, f'{modo}_{porta}.db'))
+    if modo == 'gunicorn':
+        ambiente['ESTADO_COMPARTILHADO'] = os.path.join(diretorio, f'estado_{porta}.db')
+    else:
+        ambiente.pop('ESTADO_COMPARTILHADO', None)
+    log = open(os.path.join(diretorio, f'{modo}_{porta}.log'), 'w')
+    processo = subprocess.Popen(COMANDOS_SERVIDOR[modo], env=ambiente, stdout=log, stderr=subprocess.STDOUT)
+
+    limite = time.monotonic() + TIMEOUT_INICIO_SERVIDOR_S
+    while time.monotonic() < limite:
+        if processo.poll() is not None:
+            raise RuntimeError(f'servidor {modo} terminou ao iniciar (ver {log.name})')
+        if asyncio.run(consultar_conectados('127.0.0.1', porta)) is not None:
+            return processo
+        time.sleep(0.5)
+    processo.kill()
+    raise RuntimeError(f'servidor {modo} não respondeu em {TIMEOUT_INICIO_SERVIDOR_S} s')
+
+
+def parar_servidor(processo):
+    processo.terminate()
+    try:
+        processo.wait(10)
+    except subprocess.TimeoutExpired:
+        processo.kill()
+        processo.wait()
+
+
+# ==================== EXECUÇÃO ====================
+
+def imprimir(modo, nivel):
+    marcador = "✅" if nivel['sustentado'] else "❌"
+    extra = f", {nivel['rss_mb']} MB, {nivel['threads']} threads" if 'rss_mb' in nivel else ''
+    print(f"   {marcador} {modo:<9} {nivel['dispositivos']:>5} dispositivos: "
+          f"status={nivel['conectados_status']}, erros={nivel['erros_conexao']}, "
+          f"entrega {nivel['entregues_no_prazo']}/{nivel['sondas']} no prazo "
+          f"(p50 {nivel['entrega_p50_ms']} ms, p95 {nivel['entrega_p95_ms']} ms){extra}")
+
+
+def rodar(args):
+    random.seed(0)
+    espectros = carregar_espectros(args.dados, perturbacoes=5)
+    niveis = [int(n) for n in args.dispositivos.split(',')]
+    resultado = {
+        'meta': {
+            'data': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'espera_long_poll_s': args.espera,
+            'prazo_entrega_s': args.prazo,
+            'sondas': args.sondas,
+            'rampa_s': args.rampa,
+        },
+        'modos': {},
+    }
+
+    if args.url:
+        partes = urlsplit(args.url)
+        alvos = [('url', partes.hostname, partes.port or 80)]
+    else:
+        alvos = [(modo, '127.0.0.1', None) for modo in args.modos.split(',')]
+
+    with tempfile.TemporaryDirectory(prefix='carga_') as diretorio:
+        for modo, host, porta in alvos:
+            print(f"🚀 Modo {modo}")
+            medidos = []
+            for n in niveis:
+                processo = None
+                if modo != 'url':
+                    porta = porta_livre()
+                    processo = iniciar_servidor(modo, porta, diretorio)
+                try:
+                    nivel = asyncio.run(medir_nivel(host, porta, n, espectros, args))
+                    if processo is not None:
+                        nivel.update(recursos(processo.pid))
+                finally:
+                    if processo is not None:
+                        parar_servidor(processo)
+                    else:
+                        # Long-polls antigos ainda ocupam o servidor externo
+                        time.sleep(args.espera)
+                imprimir(modo, nivel)
+                medidos.append(nivel)
+                if not nivel['sustentado'] and not args.todos:
+                    break
+            sustentados = [nivel['dispositivos'] for nivel in medidos if nivel['sustentado']]
+            resultado['modos'][modo] = {
+                'max_sustentado': max(sustentados) if sustentados else 0,
+                'niveis': medidos,
+            }
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga: dispositivos conectados por modo de serviço')
+    parser.add_argument('--modos', default='async,gunicorn,flask', help='modos a iniciar (flask, gunicorn, async)')
+    parser.add_argument('--url', help='servidor já em execução (ignora --modos)')
+    parser.add_argument('--dispositivos', default='50,200,500,1000,2000', help='níveis de carga')
+    parser.add_argument('--espera', type=float, default=ESPERA_LONG_POLL_S, help='"wait" do long-poll (s)')
+    parser.add_argument('--rampa', type=float, default=3.0, help='tempo para conectar todos (s)')
+    parser.add_argument('--sondas', type=int, default=50, help='comandos de teste por nível')
+    parser.add_argument('--prazo', type=float, default=PRAZO_ENTREGA_S, help='prazo de entrega da sonda (s)')
+    parser.add_argument('--todos', action='store_true', help='mede todos os níveis mesmo após uma falha')
+    parser.add_argument('--dados', default=ARQUIVO_DADOS)
+    parser.add_argument('--saida', default='teste_carga_resultado.json')
+    args = parser.parse_args()
+
+    resultado = rodar(args)
+
+    print("📊 Máximo sustentado:")
+    for modo, dados in resultado['modos'].items():
+        print(f"   {modo:<9} {dados['max_sustentado']} dispositivos")
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, ensure_ascii=False, indent=2)
+    print(f"💾 Resultado gravado em {args.saida}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Agendador de micro-lotes (agendador_lotes.py): agrupamento, ordem dos
+resultados e falhas que não podem travar a thread de trabalho
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agendador_lotes import AgendadorInferencia  # noqa: E402
+
+TIMEOUT_S = 5
+
+
+def dobrar(espectros):
+    return [2 * x for x in espectros]
+
+
+class TestAgendador(unittest.TestCase):
+
+    def test_resultado_de_cada_requisicao(self):
+        agendador = AgendadorInferencia(dobrar, janela_ms=1)
+        self.assertEqual(agendador.classificar(21, timeout=TIMEOUT_S), 42)
+
+    def test_requisicoes_concorrentes_agrupadas_na_ordem(self):
+        lotes = []
+
+        def funcao(espectros):
+            lotes.append(len(espectros))
+            return dobrar(espectros)
+
+        agendador = AgendadorInferencia(funcao, janela_ms=200, max_lote=8)
+        futuros = [agendador.submeter(i) for i in range(8)]
+        self.assertEqual([f.result(TIMEOUT_S) for f in futuros], [2 * i for i in range(8)])
+        self.assertEqual(lotes, [8])
+        estatisticas = agendador.estatisticas()
+        self.assertEqual((estatisticas['lotes'], estatisticas['amostras']), (1, 8))
+
+    def test_espectro_invalido_isolado_do_lote(self):
+        def funcao(espectros):
+            if any(x < 0 for x in espectros):
+                raise ValueError('espectro inválido')
+            return dobrar(espectros)
+
+        agendador = AgendadorInferencia(funcao, janela_ms=200, max_lote=3)
+        futuros = [agendador.submeter(x) for x in (1, -1, 2)]
+        self.assertEqual(futuros[0].result(TIMEOUT_S), 2)
+        with self.assertRaises(ValueError):
+            futuros[1].result(TIMEOUT_S)
+        self.assertEqual(futuros[2].result(TIMEOUT_S), 4)
+        self.assertEqual(agendador.estatisticas()['falhas_lote'], 1)
+
+    def test_menos_resultados_que_entradas(self):
+        agendador = AgendadorInferencia(lambda espectros: dobrar(espectros)[:1], janela_ms=200, max_lote=2)
+        futuros = [agendador.submeter(x) for x in (1, 2)]
+        # Nenhum Future fica sem resposta (antes o zip descartava o segundo)
+        for futuro in futuros:
+            futuro.exception(TIMEOUT_S)
+        self.assertTrue(all(f.done() for f in futuros))
+
+    def test_falha_ao_observar_espera_nao_mata_a_thread(self):
+        def observar(espera):
+            raise RuntimeError('métrica quebrada')
+
+        agendador = AgendadorInferencia(dobrar, janela_ms=1, observar_espera=observar)
+        self.assertEqual(agendador.classificar(1, timeout=TIMEOUT_S), 2)
+        self.assertEqual(agendador.classificar(2, timeout=TIMEOUT_S), 4)
+
+    def test_erro_inesperado_falha_o_lote_e_a_thread_continua(self):
+        agendador = AgendadorInferencia(dobrar, janela_ms=1)
+        original = agendador._executar
+        chamadas = []
+
+        def executar(lote):
+            chamadas.append(len(lote))
+            if len(chamadas) == 1:
+                raise RuntimeError('falha interna')
+            original(lote)
+
+        agendador._executar = executar
+        with self.assertLogs('agendador_lotes', 'ERROR'):
+            with self.assertRaises(RuntimeError):
+                agendador.classificar(1, timeout=TIMEOUT_S)
+        self.assertEqual(agendador.classificar(3, timeout=TIMEOUT_S), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
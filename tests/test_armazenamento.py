@@ -0,0 +1,96 @@
+"""
+Histórico persistente (armazenamento.py): paginação por cursor, filtros,
+snapshot da exportação e total mantido sem COUNT(*)
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from armazenamento import ArmazenamentoAnalises, LIMITE_MAXIMO  # noqa: E402
+
+
+def _analise(n, device_id='D1', especie='soja', timestamp='2099-01-01T00:00:00'):
+    return {'n': n, 'device_id': device_id, 'especie': especie, 'status': 'ok', 'timestamp': timestamp}
+
+
+class TestArmazenamento(unittest.TestCase):
+
+    def setUp(self):
+        self.caminho = os.path.join(tempfile.mkdtemp(), 'analises_teste.db')
+        self.banco = ArmazenamentoAnalises(self.caminho, intervalo_ms=1)
+
+    def gravar(self, analises):
+        self.banco.adicionar_varios(analises)
+        self.banco.flush()
+
+    def test_paginas_cobrem_tudo_sem_repetir(self):
+        self.gravar([_analise(n) for n in range(25)])
+        vistos, cursor, paginas = [], None, 0
+        while True:
+            analises, cursor = self.banco.consultar(limite=10, cursor=cursor)
+            vistos += [a['n'] for a in analises]
+            paginas += 1
+            if cursor is None:
+                break
+        self.assertEqual(paginas, 3)
+        self.assertEqual(vistos, list(range(24, -1, -1)))
+
+    def test_ultima_pagina_exata_sem_cursor(self):
+        self.gravar([_analise(n) for n in range(10)])
+        analises, cursor = self.banco.consultar(limite=10)
+        self.assertEqual(len(analises), 10)
+        self.assertIsNone(cursor)
+
+    def test_cursor_com_filtro(self):
+        self.gravar([_analise(n, device_id='D1' if n % 2 else 'D2') for n in range(10)])
+        primeira, cursor = self.banco.consultar(limite=3, device_id='D1')
+        segunda, fim = self.banco.consultar(limite=3, device_id='D1', cursor=cursor)
+        self.assertEqual([a['n'] for a in primeira + segunda], [9, 7, 5, 3, 1])
+        self.assertIsNone(fim)
+
+    def test_limite_fora_da_faixa(self):
+        self.gravar([_analise(n) for n in range(3)])
+        self.assertEqual(len(self.banco.consultar(limite=0)[0]), 1)
+        self.assertEqual(len(self.banco.consultar(limite=LIMITE_MAXIMO * 10)[0]), 3)
+
+    def test_iterar_respeita_snapshot(self):
+        self.gravar([_analise(n) for n in range(5)])
+        ate_id = self.banco.ultimo_id()
+        self.gravar([_analise(n) for n in range(5, 8)])
+        self.assertEqual([a['n'] for a in self.banco.iterar(tamanho_bloco=2, ate_id=ate_id)], list(range(5)))
+
+    def test_contagem_acompanha_gravacao_e_retencao(self):
+        self.assertEqual(self.banco.contar(), 0)
+        self.gravar([_analise(n, timestamp='2000-01-01T00:00:00') for n in range(4)] +
+                    [_analise(n) for n in range(4, 7)])
+        self.assertEqual(self.banco.contar(), 7)
+        self.assertEqual(self.banco.remover_antigos(30), 4)
+        self.assertEqual(self.banco.contar(), 3)
+        self.assertEqual(self.banco.estatisticas()['analises'], 3)
+        # Outra instância (outro worker) lê o mesmo total
+        self.assertEqual(ArmazenamentoAnalises(self.caminho).contar(), 3)
+
+    def test_contagem_semeada_em_banco_antigo(self):
+        self.gravar([_analise(n) for n in range(6)])
+        conn = sqlite3.connect(self.caminho)
+        conn.executescript('DROP TRIGGER analises_inseridas; DROP TRIGGER analises_removidas; '
+                           'DROP TABLE contagem_analises;')
+        conn.close()
+        banco = ArmazenamentoAnalises(self.caminho, intervalo_ms=1)
+        self.assertEqual(banco.contar(), 6)
+        banco.adicionar(_analise(6))
+        banco.flush()
+        self.assertEqual(banco.contar(), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Cache de resultados (cache_resultados.py): quantização das chaves,
+expiração por TTL, remoção LRU e cópias independentes
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache_resultados import CacheResultados  # noqa: E402
+
+BANDAS = np.linspace(0.1, 0.9, 17)
+RESULTADO = {'especie': 'soja', 'confianca': 97.5, 'indices': {'I1_NDVI': 0.4},
+             'timestamp': '2099-01-01T00:00:00', 'device_id': 'D1'}
+
+
+class TestChaves(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CacheResultados(tolerancia=1e-3)
+
+    def chave(self, bandas, versao='v1'):
+        return self.cache.chaves(bandas, versao)[0]
+
+    def test_mesma_chave_dentro_da_tolerancia(self):
+        self.assertEqual(self.chave(BANDAS), self.chave(BANDAS + 4e-4))
+        self.assertEqual(self.chave(BANDAS), self.chave(BANDAS - 4e-4))
+
+    def test_chave_diferente_alem_da_tolerancia(self):
+        outra = BANDAS.copy()
+        outra[16] += 1e-3
+        self.assertNotEqual(self.chave(BANDAS), self.chave(outra))
+
+    def test_versao_do_modelo_na_chave(self):
+        self.assertNotEqual(self.chave(BANDAS, 'v1'), self.chave(BANDAS, 'v2'))
+
+    def test_nao_finitos_sem_chave(self):
+        invalidas = BANDAS.copy()
+        invalidas[3] = np.nan
+        chaves = self.cache.chaves(np.vstack([BANDAS, invalidas, np.full(17, np.inf)]), 'v1')
+        self.assertIsNotNone(chaves[0])
+        self.assertEqual(chaves[1:], [None, None])
+        self.cache.guardar(None, RESULTADO)
+        self.assertIsNone(self.cache.obter(None))
+        self.assertEqual(self.cache.estatisticas()['entradas'], 0)
+
+    def test_lote_igual_a_individual(self):
+        lote = np.vstack([BANDAS, BANDAS * 0.5])
+        self.assertEqual(self.cache.chaves(lote, 'v1'), [self.chave(BANDAS), self.chave(BANDAS * 0.5)])
+
+
+class TestEntradas(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CacheResultados(capacidade=2, tolerancia=1e-4, ttl_s=10)
+        self.chaves = self.cache.chaves(np.vstack([BANDAS, BANDAS * 0.5, BANDAS * 0.25]), 'v1')
+
+    def test_copia_sem_timestamp_e_device(self):
+        self.cache.guardar(self.chaves[0], RESULTADO)
+        guardado = self.cache.obter(self.chaves[0])
+        self.assertNotIn('timestamp', guardado)
+        self.assertNotIn('device_id', guardado)
+        guardado['indices']['I1_NDVI'] = -1
+        self.assertEqual(self.cache.obter(self.chaves[0])['indices']['I1_NDVI'], 0.4)
+        self.assertEqual(RESULTADO['device_id'], 'D1')
+
+    def test_expira_pelo_ttl(self):
+        with mock.patch('cache_resultados.time.monotonic', return_value=1000.0):
+            self.cache.guardar(self.chaves[0], RESULTADO)
+        with mock.patch('cache_resultados.time.monotonic', return_value=1009.0):
+            self.assertIsNotNone(self.cache.obter(self.chaves[0]))
+        with mock.patch('cache_resultados.time.monotonic', return_value=1011.0):
+            self.assertIsNone(self.cache.obter(self.chaves[0]))
+        estatisticas = self.cache.estatisticas()
+        self.assertEqual((estatisticas['expiradas'], estatisticas['entradas']), (1, 0))
+
+    def test_remove_o_menos_usado(self):
+        self.cache.guardar(self.chaves[0], RESULTADO)
+        self.cache.guardar(self.chaves[1], RESULTADO)
+        self.cache.obter(self.chaves[0])
+        self.cache.guardar(self.chaves[2], RESULTADO)
+        self.assertIsNotNone(self.cache.obter(self.chaves[0]))
+        self.assertIsNone(self.cache.obter(self.chaves[1]))
+        self.assertIsNotNone(self.cache.obter(self.chaves[2]))
+        self.assertEqual(self.cache.estatisticas()['removidas_lru'], 1)
+
+    def test_limpar_e_contadores(self):
+        self.cache.guardar(self.chaves[0], RESULTADO)
+        self.cache.obter(self.chaves[0])
+        self.cache.obter(self.chaves[1])
+        self.cache.limpar()
+        self.assertIsNone(self.cache.obter(self.chaves[0]))
+        estatisticas = self.cache.estatisticas()
+        self.assertEqual((estatisticas['acertos'], estatisticas['faltas']), (1, 2))
+        self.assertEqual(estatisticas['taxa_acerto'], round(1 / 3, 4))
+        self.assertEqual((estatisticas['invalidacoes'], estatisticas['entradas']), (1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
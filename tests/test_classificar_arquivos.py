@@ -0,0 +1,95 @@
+"""
+Classificação em lote (classificar_arquivos.py): validação das colunas
+das entradas e leitura em blocos, antes de carregar o modelo
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import gzip
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from classificar_arquivos import BANDAS, colunas_extras, ler_blocos  # noqa: E402
+
+
+class TestColunas(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+
+    def arquivo(self, nome, colunas, linhas=(), comprimir=False):
+        caminho = os.path.join(self.pasta, nome)
+        texto = '\n'.join([','.join(colunas)] + [','.join(linha) for linha in linhas]) + '\n'
+        with (gzip.open(caminho, 'wt') if comprimir else open(caminho, 'w')) as destino:
+            destino.write(texto)
+        return caminho
+
+    def linha(self, extras, valor='0.5'):
+        return list(extras) + [valor] * len(BANDAS)
+
+    def test_extras_na_ordem_da_primeira_entrada(self):
+        a = self.arquivo('a.csv', ['sample', 'grain'] + BANDAS)
+        b = self.arquivo('b.csv.gz', BANDAS + ['grain', 'sample'], comprimir=True)
+        self.assertEqual(colunas_extras([a, b]), ['sample', 'grain'])
+
+    def test_sem_extras(self):
+        self.assertEqual(colunas_extras([self.arquivo('a.csv', BANDAS)]), [])
+
+    def test_banda_ausente(self):
+        caminho = self.arquivo('a.csv', ['sample'] + BANDAS[:3] + BANDAS[4:])
+        with self.assertRaises(ValueError) as contexto:
+            colunas_extras([caminho])
+        self.assertIn('band_485', str(contexto.exception))
+        self.assertIn('a.csv', str(contexto.exception))
+
+    def test_entradas_com_colunas_diferentes(self):
+        a = self.arquivo('a.csv', ['sample'] + BANDAS)
+        b = self.arquivo('b.csv', ['sample', 'grain'] + BANDAS)
+        with self.assertRaises(ValueError) as contexto:
+            colunas_extras([a, b])
+        self.assertIn('b.csv', str(contexto.exception))
+        self.assertIn('a.csv', str(contexto.exception))
+
+    def test_blocos_numeracao_e_texto(self):
+        linhas = [self.linha(['007']) for _ in range(4)] + [self.linha(['x'], valor='abc')]
+        caminho = self.arquivo('a.csv', ['sample'] + BANDAS, linhas)
+        blocos = list(ler_blocos([caminho], tamanho_bloco=2))
+        self.assertEqual(len(blocos), 3)
+        entrada = {c: np.concatenate([b[0][c] for b in blocos]) for c in blocos[0][0]}
+        bandas = np.vstack([b[1] for b in blocos])
+        self.assertNotIn('arquivo', entrada)
+        self.assertEqual(entrada['linha'].tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(entrada['sample'].tolist()[0], '007')
+        self.assertEqual(bandas.shape, (5, 18))
+        self.assertTrue(np.all(np.isnan(bandas[4])))
+
+    def test_coluna_arquivo_com_varias_entradas(self):
+        a = self.arquivo('a.csv', BANDAS, [self.linha([])])
+        b = self.arquivo('b.csv', BANDAS, [self.linha([]), self.linha([])])
+        entradas = [entrada for entrada, _ in ler_blocos([a, b])]
+        self.assertEqual([e['arquivo'].tolist() for e in entradas], [['a.csv'], ['b.csv', 'b.csv']])
+        self.assertEqual(entradas[1]['linha'].tolist(), [1, 2])
+
+    def test_cli_recusa_antes_de_carregar_o_modelo(self):
+        a = self.arquivo('a.csv', ['sample'] + BANDAS)
+        b = self.arquivo('b.csv', ['grain'] + BANDAS)
+        processo = subprocess.run([sys.executable, os.path.join(RAIZ, 'classificar_arquivos.py'), a, b,
+                                   '-o', os.path.join(self.pasta, 'saida.csv')],
+                                  capture_output=True, text=True, timeout=60)
+        self.assertEqual(processo.returncode, 2)
+        self.assertIn('diferentes', processo.stderr)
+        self.assertNotIn('Modelo', processo.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+Difusão de comandos (difusao_comandos.py): seleção por tags e relatório
+agregado da frota, inclusive sobre a fila real do estado em memória
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from difusao_comandos import (nova_difusao, normalizar_tags, relatorio, resumir_resultado,  # noqa: E402
+                              selecionar_dispositivos)
+from estado_compartilhado import EstadoMemoria  # noqa: E402
+
+AGORA = 1_900_000_000.0
+
+
+def _registro(estado, resultado=None, entregas=1):
+    return {'estado': estado, 'entregas': entregas, 'resultado': resultado}
+
+
+class TestSelecao(unittest.TestCase):
+
+    def test_normalizar_tags(self):
+        self.assertEqual(normalizar_tags(' silo2, silo1,,silo2 '), ['silo1', 'silo2'])
+        self.assertEqual(normalizar_tags(['b', 'a', 'a', ' ']), ['a', 'b'])
+        self.assertEqual(normalizar_tags(None), [])
+        self.assertEqual(normalizar_tags([1, 2]), ['1', '2'])
+
+    def test_todas_as_tags_pedidas(self):
+        dispositivos = [{'id': 'C', 'tags': ['silo1', 'norte']}, {'id': 'A', 'tags': ['silo1']},
+                        {'id': 'B', 'tags': None}]
+        self.assertEqual(selecionar_dispositivos(dispositivos, []), ['A', 'B', 'C'])
+        self.assertEqual(selecionar_dispositivos(dispositivos, ['silo1']), ['A', 'C'])
+        self.assertEqual(selecionar_dispositivos(dispositivos, ['silo1', 'norte']), ['C'])
+        self.assertEqual(selecionar_dispositivos(dispositivos, ['sul']), [])
+
+    def test_resumo_so_campos_do_relatorio(self):
+        resumo = resumir_resultado({'especie': 'soja', 'confianca': 90.0, 'status': 'NORMAL',
+                                    'timestamp': 't', 'indices': {'I1_NDVI': 0.1}})
+        self.assertEqual(set(resumo), {'especie', 'confianca', 'status', 'timestamp'})
+
+
+class TestRelatorio(unittest.TestCase):
+
+    def setUp(self):
+        self.difusao = nova_difusao(['silo1'], 60, AGORA)
+        self.difusao['comandos'] = {'D1': 'c1', 'D2': 'c2', 'D3': 'c3', 'D4': 'c4'}
+
+    def test_agregacao_com_atrasados(self):
+        comandos = {
+            'c1': _registro('concluido', {'especie': 'soja', 'status': 'NORMAL', 'confianca': 90.0}),
+            'c2': _registro('concluido', {'especie': 'soja', 'status': 'ANORMAL', 'confianca': 60.0}),
+            'c3': _registro('entregue', entregas=2),
+        }
+        resumo = relatorio(self.difusao, comandos, AGORA + 10)
+        self.assertEqual(resumo['estado'], 'em_andamento')
+        self.assertEqual((resumo['dispositivos'], resumo['concluidos']), (4, 2))
+        self.assertEqual(resumo['especies'], {'soja': 2})
+        self.assertEqual(resumo['status'], {'NORMAL': 1, 'ANORMAL': 1})
+        self.assertEqual(resumo['anomalias'], 1)
+        self.assertEqual(resumo['confianca_media'], 75.0)
+        self.assertEqual([(a['device_id'], a['estado'], a['entregas']) for a in resumo['atrasados']],
+                         [('D3', 'entregue', 2), ('D4', 'desconhecido', 0)])
+
+    def test_prazo_esgotado(self):
+        self.assertEqual(relatorio(self.difusao, {}, AGORA + 60)['estado'], 'prazo_esgotado')
+
+    def test_completo_mesmo_antes_do_prazo(self):
+        comandos = {c: _registro('concluido', {'especie': 'milho'}) for c in ('c1', 'c2', 'c3', 'c4')}
+        resumo = relatorio(self.difusao, comandos, AGORA + 1)
+        self.assertEqual(resumo['estado'], 'completo')
+        self.assertEqual(resumo['atrasados'], [])
+        self.assertIsNone(resumo['confianca_media'])
+        self.assertEqual(resumo['anomalias'], 0)
+
+    def test_concluido_sem_resultado(self):
+        resumo = relatorio(self.difusao, {'c1': _registro('concluido')}, AGORA)
+        self.assertEqual(resumo['resultados']['D1'], {})
+        self.assertEqual(resumo['especies'], {})
+
+
+class TestDifusaoNoEstado(unittest.TestCase):
+    """Caminho completo: enfileirar, entregar, concluir e relatar"""
+
+    def test_frota(self):
+        estado = EstadoMemoria(max_comandos=1)
+        estado.enfileirar_comando('D3', {'command': 'status'})
+        difusao = nova_difusao([], 30, AGORA)
+        registros, rejeitados = estado.enfileirar_comandos(
+            [(d, {'command': 'analyze', 'broadcast_id': difusao['broadcast_id']}, 0, 30) for d in ('D1', 'D2', 'D3')])
+        difusao['comandos'] = {r['device_id']: r['command_id'] for r in registros}
+        difusao['rejeitados'] = rejeitados
+        self.assertEqual(rejeitados, ['D3'])
+
+        entregue = estado.retirar_comando('D1')
+        self.assertEqual(entregue['broadcast_id'], difusao['broadcast_id'])
+        estado.concluir_comando(entregue['command_id'], 'D1',
+                                resumir_resultado({'especie': 'soja', 'status': 'NORMAL', 'confianca': 88.0}))
+
+        resumo = relatorio(difusao, estado.comandos(list(difusao['comandos'].values())), AGORA + 1)
+        self.assertEqual((resumo['dispositivos'], resumo['concluidos']), (2, 1))
+        self.assertEqual(resumo['especies'], {'soja': 1})
+        self.assertEqual(resumo['rejeitados'], ['D3'])
+        self.assertEqual([(a['device_id'], a['estado']) for a in resumo['atrasados']], [('D2', 'pendente')])
+
+
+if __name__ == '__main__':
+    unittest.main()
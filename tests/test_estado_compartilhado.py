@@ -0,0 +1,204 @@
+"""
+Estado compartilhado (estado_compartilhado.py) nos dois backends: fila
+de comandos (prioridade, TTL, confirmação), long-poll e gravação
+condicional de sessões de varredura (atualizar_sessao)
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import estado_compartilhado  # noqa: E402
+from estado_compartilhado import EstadoMemoria, EstadoSQLite, FilaComandosCheia  # noqa: E402
+from sessao_varredura import nova_sessao  # noqa: E402
+
+
+class _TestesSessao:
+
+    def criar_estado(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.estado = self.criar_estado()
+        self.sessao = nova_sessao('D1', None, time.time())
+        self.estado.registrar_sessao(self.sessao)
+
+    def test_copia_atual_grava_e_incrementa_versao(self):
+        copia = self.estado.sessao(self.sessao['session_id'])
+        copia['n'] = 1
+        self.assertTrue(self.estado.atualizar_sessao(copia))
+        gravada = self.estado.sessao(self.sessao['session_id'])
+        self.assertEqual((gravada['n'], gravada['versao']), (1, 1))
+
+    def test_copia_velha_rejeitada(self):
+        primeira = self.estado.sessao(self.sessao['session_id'])
+        segunda = self.estado.sessao(self.sessao['session_id'])
+        primeira['n'] = 1
+        segunda['n'] = 1
+        self.assertTrue(self.estado.atualizar_sessao(primeira))
+        self.assertFalse(self.estado.atualizar_sessao(segunda))
+        self.assertEqual(self.estado.sessao(self.sessao['session_id'])['versao'], 1)
+
+    def test_sessao_inexistente(self):
+        self.assertFalse(self.estado.atualizar_sessao(nova_sessao('D2', None, time.time())))
+
+    def test_incrementos_simultaneos_sem_perda(self):
+        session_id = self.sessao['session_id']
+
+        def incrementar():
+            for _ in range(50):
+                while True:
+                    copia = self.estado.sessao(session_id)
+                    copia['n'] += 1
+                    if self.estado.atualizar_sessao(copia):
+                        break
+
+        threads = [threading.Thread(target=incrementar) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.estado.sessao(session_id)['n'], 200)
+
+
+class _TestesFilaComandos:
+
+    def criar_estado(self, **opcoes):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.estado = self.criar_estado()
+
+    def enfileirar(self, nome, **opcoes):
+        return self.estado.enfileirar_comando('D1', {'command': nome}, **opcoes)['command_id']
+
+    def test_maior_prioridade_primeiro_e_ordem_de_chegada(self):
+        self.enfileirar('a')
+        self.enfileirar('b', prioridade=5)
+        self.enfileirar('c')
+        self.enfileirar('d', prioridade=-1)
+        entregues = [self.estado.retirar_comando('D1')['command'] for _ in range(4)]
+        self.assertEqual(entregues, ['b', 'a', 'c', 'd'])
+        self.assertIsNone(self.estado.retirar_comando('D1'))
+
+    def test_fila_cheia(self):
+        self.estado = self.criar_estado(max_comandos=2)
+        self.enfileirar('a')
+        self.enfileirar('b')
+        with self.assertRaises(FilaComandosCheia):
+            self.enfileirar('c')
+        self.assertEqual(self.estado.estatisticas()['comandos'], {'pendente': 2})
+
+    def test_ttl_vencido_nao_e_entregue(self):
+        command_id = self.enfileirar('a', ttl_s=0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.estado.retirar_comando('D1'))
+        self.assertEqual(self.estado.expirar_comandos(), 1)
+        self.assertEqual(self.estado.comando(command_id)['estado'], 'expirado')
+
+    def test_confirmacao_conclui_uma_vez(self):
+        command_id = self.enfileirar('a')
+        self.assertEqual(self.estado.retirar_comando('D1')['command_id'], command_id)
+        self.assertEqual(self.estado.comando(command_id)['estado'], 'entregue')
+
+        self.assertIsNone(self.estado.concluir_comando(command_id, 'D2', {'species': 'x'}))
+        primeira = self.estado.concluir_comando(command_id, 'D1', {'species': 'x'})
+        self.assertFalse(primeira['duplicado'])
+        self.assertEqual(primeira['estado'], 'concluido')
+        self.assertTrue(self.estado.concluir_comando(command_id, 'D1', {'species': 'y'})['duplicado'])
+        self.assertEqual(self.estado.comando(command_id)['resultado'], {'species': 'x'})
+        self.assertIsNone(self.estado.concluir_comando('inexistente', 'D1'))
+
+    def test_sem_confirmacao_volta_para_a_fila(self):
+        command_id = self.enfileirar('a')
+        with mock.patch.object(estado_compartilhado, 'COMANDO_TIMEOUT_ACK_S', 0.05):
+            self.estado.retirar_comando('D1')
+            time.sleep(0.1)
+            self.estado.expirar_comandos()
+            self.assertEqual(self.estado.retirar_comando('D1')['command_id'], command_id)
+        registro = self.estado.comando(command_id)
+        self.assertEqual((registro['estado'], registro['entregas']), ('entregue', 2))
+
+
+class _TestesLongPoll:
+
+    def criar_estado(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.estado = self.criar_estado()
+
+    def test_sem_espera_responde_na_hora(self):
+        inicio = time.monotonic()
+        self.assertIsNone(self.estado.retirar_comando('D1', 0))
+        self.assertLess(time.monotonic() - inicio, 0.1)
+
+    def test_comando_ja_na_fila_sem_esperar(self):
+        registro = self.estado.enfileirar_comando('D1', {'command': 'analyze'})
+        comando = self.estado.retirar_comando('D1', 5)
+        self.assertEqual(comando['command_id'], registro['command_id'])
+
+    def test_comando_enfileirado_acorda_a_espera(self):
+        temporizador = threading.Timer(0.1, self.estado.enfileirar_comando, ('D1', {'command': 'analyze'}))
+        inicio = time.monotonic()
+        temporizador.start()
+        comando = self.estado.retirar_comando('D1', 5)
+        temporizador.join()
+        self.assertIsNotNone(comando)
+        self.assertEqual(comando['command'], 'analyze')
+        self.assertLess(time.monotonic() - inicio, 2)
+
+    def test_espera_expira_sem_comando(self):
+        inicio = time.monotonic()
+        self.assertIsNone(self.estado.retirar_comando('D1', 0.2))
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.19)
+
+    def test_comando_de_outro_dispositivo_nao_entrega(self):
+        self.estado.enfileirar_comando('D2', {'command': 'analyze'})
+        self.assertIsNone(self.estado.retirar_comando('D1', 0.1))
+
+
+def _memoria(**opcoes):
+    return EstadoMemoria(**opcoes)
+
+
+def _sqlite(**opcoes):
+    return EstadoSQLite(os.path.join(tempfile.mkdtemp(), 'estado_teste.db'), **opcoes)
+
+
+class TestFilaComandosMemoria(_TestesFilaComandos, unittest.TestCase):
+    criar_estado = staticmethod(_memoria)
+
+
+class TestFilaComandosSQLite(_TestesFilaComandos, unittest.TestCase):
+    criar_estado = staticmethod(_sqlite)
+
+
+class TestLongPollMemoria(_TestesLongPoll, unittest.TestCase):
+    criar_estado = staticmethod(_memoria)
+
+
+class TestLongPollSQLite(_TestesLongPoll, unittest.TestCase):
+    criar_estado = staticmethod(_sqlite)
+
+
+class TestSessaoMemoria(_TestesSessao, unittest.TestCase):
+    criar_estado = staticmethod(_memoria)
+
+
+class TestSessaoSQLite(_TestesSessao, unittest.TestCase):
+    criar_estado = staticmethod(_sqlite)
+
+
+if __name__ == '__main__':
+    unittest.main()
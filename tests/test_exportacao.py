@@ -0,0 +1,140 @@
+"""
+Exportação em fluxo (exportacao.py): CSV, CSV gzip, NPZ colunar e Arrow
+produzem o mesmo conteúdo, bloco a bloco
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import csv
+import gzip
+import io
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import exportacao  # noqa: E402
+from exportacao import COLUNAS  # noqa: E402
+
+
+def _analise(n):
+    analise = {
+        'timestamp': f'2099-01-01T00:00:{n % 60:02d}',
+        'device_id': f'D{n % 3}',
+        'especie': ('soja', 'milho', 'Ação')[n % 3],
+        'confianca': 50.0 + n,
+        'status': 'ok',
+        'indices': {'I1_NDVI': 0.1 * n, 'I2_Water': 0.2, 'I3_Lipid': 0.3, 'I4_Slope_Alt': -0.4},
+        'detalhes_anomalia': {'svm_score': -0.5 * n, 'svm_detectou': n % 2 == 0, 'mad_violacoes': n % 5,
+                              'mad_detectou': False, 'confianca_baixa': n % 4 == 0},
+    }
+    if n == 3:
+        # Análise antiga, sem índices nem detalhes de anomalia
+        del analise['indices'], analise['detalhes_anomalia']
+    return analise
+
+
+ANALISES = [_analise(n) for n in range(7)]
+
+
+def _npz_colunas(dados):
+    """{coluna: array} concatenando os blocos do .npz"""
+    arquivo = np.load(io.BytesIO(dados))
+    blocos = sorted({nome.split('/')[0] for nome in arquivo.files})
+    return {c[1]: np.concatenate([arquivo[f'{b}/{c[1]}'] for b in blocos]) for c in COLUNAS}
+
+
+class TestCSV(unittest.TestCase):
+
+    def test_cabecalho_e_linhas(self):
+        linhas = list(csv.reader(io.StringIO(b''.join(exportacao.gerar('csv', ANALISES)).decode('utf-8'))))
+        self.assertEqual(linhas[0], [c[0] for c in COLUNAS])
+        self.assertEqual(len(linhas), len(ANALISES) + 1)
+        self.assertEqual(linhas[3][:3], ['2099-01-01T00:00:02', 'D2', 'Ação'])
+        # Campos ausentes ficam vazios
+        self.assertEqual(linhas[4][5:], [''] * (len(COLUNAS) - 5))
+
+    def test_fluxo_em_blocos(self):
+        partes = list(exportacao.gerar_csv(ANALISES, tamanho_bloco=2))
+        self.assertEqual(len(partes), 4)
+        self.assertEqual(b''.join(partes), b''.join(exportacao.gerar('csv', ANALISES)))
+
+    def test_gzip_igual_ao_csv(self):
+        comprimido = b''.join(exportacao.gerar_csv(ANALISES, comprimir=True, tamanho_bloco=2))
+        self.assertEqual(gzip.decompress(comprimido), b''.join(exportacao.gerar('csv', ANALISES)))
+
+    def test_sem_analises_so_cabecalho(self):
+        dados = b''.join(exportacao.gerar('csv', []))
+        self.assertEqual(dados.decode('utf-8').strip(), ','.join(c[0] for c in COLUNAS))
+
+    def test_membros_gzip_concatenados(self):
+        blocos = [{'a': np.arange(3), 'b': np.array(['x', 'y', 'z'])},
+                  {'a': np.arange(3, 5), 'b': np.array(['w', 'v'])}]
+        primeiro = b''.join(exportacao.gerar_csv_colunas(blocos[:1], comprimir=True))
+        segundo = b''.join(exportacao.gerar_csv_colunas(blocos[1:], comprimir=True, cabecalho=False))
+        self.assertEqual(gzip.decompress(primeiro + segundo).decode('utf-8').split(),
+                         ['a,b', '0,x', '1,y', '2,z', '3,w', '4,v'])
+
+
+class TestNPZ(unittest.TestCase):
+
+    def test_colunas_e_tipos(self):
+        colunas = _npz_colunas(b''.join(exportacao.gerar_npz(ANALISES, tamanho_bloco=3)))
+        for _, nome, _, dtype in COLUNAS:
+            self.assertEqual(len(colunas[nome]), len(ANALISES), nome)
+            if dtype is not str:
+                self.assertEqual(colunas[nome].dtype, np.dtype(dtype), nome)
+        np.testing.assert_array_equal(colunas['confianca'], [50.0 + n for n in range(7)])
+        self.assertEqual(colunas['especie'].tolist()[:3], ['soja', 'milho', 'Ação'])
+
+    def test_ausentes_viram_nan_ou_zero(self):
+        colunas = _npz_colunas(b''.join(exportacao.gerar('npz', ANALISES)))
+        self.assertTrue(np.isnan(colunas['I1_NDVI'][3]))
+        self.assertEqual(colunas['mad_violacoes'][3], 0)
+        self.assertFalse(colunas['svm_detectou'][3])
+
+    def test_blocos_como_grupos(self):
+        arquivo = np.load(io.BytesIO(b''.join(exportacao.gerar_npz(ANALISES, tamanho_bloco=3))))
+        self.assertEqual(sorted({nome.split('/')[0] for nome in arquivo.files}),
+                         ['bloco_00000', 'bloco_00001', 'bloco_00002'])
+
+    def test_sem_analises(self):
+        self.assertEqual(np.load(io.BytesIO(b''.join(exportacao.gerar('npz', [])))).files, [])
+
+
+@unittest.skipUnless(exportacao.arrow_disponivel(), 'pyarrow não instalado')
+class TestArrow(unittest.TestCase):
+
+    def test_igual_ao_npz(self):
+        import pyarrow as pa
+
+        tabela = pa.ipc.open_stream(b''.join(exportacao.gerar_arrow(ANALISES, tamanho_bloco=3))).read_all()
+        self.assertEqual(tabela.num_rows, len(ANALISES))
+        colunas = _npz_colunas(b''.join(exportacao.gerar('npz', ANALISES)))
+        for _, nome, _, _ in COLUNAS:
+            np.testing.assert_array_equal(tabela.column(nome).to_numpy(zero_copy_only=False), colunas[nome])
+
+
+class TestFormatos(unittest.TestCase):
+
+    def test_formato_desconhecido(self):
+        with self.assertRaises(ValueError):
+            exportacao.gerar('xlsx', ANALISES)
+        with self.assertRaises(ValueError):
+            exportacao.gerar_colunas('xlsx', [])
+
+    def test_todos_os_formatos_tem_gerador(self):
+        for formato in exportacao.FORMATOS:
+            if formato == 'arrow' and not exportacao.arrow_disponivel():
+                continue
+            with self.subTest(formato=formato):
+                self.assertTrue(b''.join(exportacao.gerar(formato, ANALISES)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Formato binário de espectro (formato_espectro.py): ida e volta, visão sem
+cópia e corpos malformados
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from formato_espectro import (codificar_espectro, decodificar_espectro, CABECALHO,  # noqa: E402
+                              TIPO_BANDA, VERSAO_FORMATO)
+
+ESPECTRO = [0.33, 0.18, 0.21, 0.25, 0.27, 0.29, 0.31, 0.33, 0.35,
+            0.37, 0.39, 0.41, 0.43, 0.45, 0.47, 0.49, 0.51, 0.53]
+
+
+class TestIdaEVolta(unittest.TestCase):
+
+    def test_com_command_id(self):
+        corpo = codificar_espectro('ESP32_001', ESPECTRO, '9f2c4b1a7d3e5f60')
+        device_id, command_id, espectro = decodificar_espectro(corpo)
+        self.assertEqual((device_id, command_id), ('ESP32_001', '9f2c4b1a7d3e5f60'))
+        np.testing.assert_array_equal(espectro, np.asarray(ESPECTRO, dtype=TIPO_BANDA))
+
+    def test_sem_command_id(self):
+        self.assertIsNone(decodificar_espectro(codificar_espectro('ESP32_001', ESPECTRO))[1])
+
+    def test_device_id_utf8(self):
+        self.assertEqual(decodificar_espectro(codificar_espectro('Silo-Ação', ESPECTRO))[0], 'Silo-Ação')
+
+    def test_tamanho_do_corpo(self):
+        corpo = codificar_espectro('ESP32_000001', ESPECTRO, 'a' * 16)
+        self.assertEqual(len(corpo), CABECALHO.size + 18 * 4 + 12 + 16)
+        self.assertEqual(len(corpo), 108)
+
+    def test_visao_sem_copia_somente_leitura(self):
+        corpo = codificar_espectro('ESP32_001', ESPECTRO)
+        espectro = decodificar_espectro(corpo)[2]
+        self.assertFalse(espectro.flags.writeable)
+        self.assertFalse(espectro.flags.owndata)
+
+    def test_identificadores_grandes_demais(self):
+        with self.assertRaises(ValueError):
+            codificar_espectro('x' * 256, ESPECTRO)
+        with self.assertRaises(ValueError):
+            codificar_espectro('ESP32_001', [0.0] * 256)
+
+
+class TestCorpoMalformado(unittest.TestCase):
+
+    def assertInvalido(self, corpo, trecho):
+        with self.assertRaises(ValueError) as contexto:
+            decodificar_espectro(corpo)
+        self.assertIn(trecho, str(contexto.exception))
+
+    def test_curto(self):
+        self.assertInvalido(b'ES\x01\x12', 'curto')
+        self.assertInvalido(b'', 'curto')
+
+    def test_sem_assinatura(self):
+        corpo = codificar_espectro('ESP32_001', ESPECTRO)
+        self.assertInvalido(b'XX' + corpo[2:], 'assinatura')
+
+    def test_versao_desconhecida(self):
+        corpo = codificar_espectro('ESP32_001', ESPECTRO)
+        self.assertInvalido(corpo[:2] + bytes([VERSAO_FORMATO + 1]) + corpo[3:], 'Versão')
+
+    def test_tamanho_diferente_do_cabecalho(self):
+        corpo = codificar_espectro('ESP32_001', ESPECTRO)
+        self.assertInvalido(corpo[:-1], 'esperado')
+        self.assertInvalido(corpo + b'\x00', 'esperado')
+
+    def test_device_id_nao_utf8(self):
+        corpo = codificar_espectro('ESP32_001', ESPECTRO)
+        with self.assertRaises(ValueError):
+            decodificar_espectro(corpo[:-1] + b'\xff')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Paridade do motor compilado (motor_inferencia.py) com o caminho sklearn
+do modelo em produção, sobre a tabela de coleta
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import csv
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import joblib  # noqa: E402
+
+from artefato_modelo import salvar_artefato, carregar_artefato  # noqa: E402
+from motor_inferencia import (MotorInferencia, compilar_parametros, verificar_paridade,  # noqa: E402
+                              BANDA_485_IDX)
+
+MODELO_PKL = os.path.join(RAIZ, 'modelo_completo_sem_485nm.pkl')
+TABELA_COLETA = os.path.join(RAIZ, 'tabela_coleta_dados_espectrais_4_amostras.csv')
+
+# Tolerâncias de verificar_paridade (mesmas do __main__ de motor_inferencia.py)
+TOLERANCIA_PROB = 1e-9
+TOLERANCIA_SVM_SCORE = 1e-12
+
+
+def carregar_bandas_17():
+    with open(TABELA_COLETA, newline='') as f:
+        leitor = csv.DictReader(f)
+        colunas = [c for c in leitor.fieldnames if c.startswith('band_')]
+        espectros = np.array([[float(linha[c]) for c in colunas] for linha in leitor])
+    return np.delete(espectros, BANDA_485_IDX, axis=1)
+
+
+class TestParidadeSklearn(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.modelos = joblib.load(MODELO_PKL)
+        cls.motor = MotorInferencia.do_modelo(cls.modelos)
+        cls.bandas_17 = carregar_bandas_17()
+
+    def assertParidade(self, resultado):
+        self.assertEqual(resultado['especie_igual'], 1.0)
+        self.assertLess(resultado['max_diff_prob'], TOLERANCIA_PROB)
+        self.assertLess(resultado['max_diff_svm_score'], TOLERANCIA_SVM_SCORE)
+
+    def test_tabela_de_coleta(self):
+        resultado = verificar_paridade(self.modelos, self.bandas_17, motor=self.motor)
+        self.assertEqual(resultado['amostras'], 48)
+        self.assertParidade(resultado)
+
+    def test_tabela_com_ruido(self):
+        # 10 cópias com ruído multiplicativo de 5%: fora dos pontos de treino
+        ruido = self.bandas_17 * np.random.default_rng(0).normal(1.0, 0.05, size=(10,) + self.bandas_17.shape)
+        self.assertParidade(verificar_paridade(self.modelos, ruido.reshape(-1, self.bandas_17.shape[1]),
+                                               motor=self.motor))
+
+    def test_artefato_compilado_igual_ao_motor(self):
+        caminho = os.path.join(tempfile.mkdtemp(), 'modelo_teste.bin')
+        salvar_artefato(caminho, compilar_parametros(self.modelos), {'arquivo_pkl': 'teste'})
+        parametros, _ = carregar_artefato(caminho)
+        esperado = self.motor.prever(self.bandas_17)
+        obtido = MotorInferencia(parametros).prever(self.bandas_17)
+        np.testing.assert_array_equal(obtido['especie'], esperado['especie'])
+        np.testing.assert_array_equal(obtido['probabilidades'], esperado['probabilidades'])
+        np.testing.assert_array_equal(obtido['svm_score'], esperado['svm_score'])
+
+
+if __name__ == '__main__':
+    unittest.main()
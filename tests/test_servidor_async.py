@@ -0,0 +1,191 @@
+"""
+Entrada HTTP malformada no servidor assíncrono (servidor_async.py)
+
+Cada caso é respondido com o status de erro e a conexão fechada, sem
+exceção escapando da tarefa da conexão. Também: acesso ao estado SQLite
+num pool próprio, fora do pool da ponte WSGI.
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault('BANCO_ANALISES', os.path.join(tempfile.mkdtemp(), 'analises_teste.db'))
+
+import servidor_async  # noqa: E402
+from servidor_async import ErroHTTP, ServidorAssincrono, ler_requisicao, MAX_CABECALHOS, MAX_CORPO_BYTES  # noqa: E402
+
+
+class _EscritorFalso:
+    def __init__(self):
+        self.dados = b''
+
+    def write(self, dados):
+        self.dados += dados
+
+
+async def _ler(bruto, limite=2 ** 16):
+    leitor = asyncio.StreamReader(limit=limite)
+    leitor.feed_data(bruto)
+    leitor.feed_eof()
+    escritor = _EscritorFalso()
+    return await ler_requisicao(leitor, escritor, '127.0.0.1'), escritor
+
+
+class TestLerRequisicao(unittest.IsolatedAsyncioTestCase):
+
+    async def assertErroHTTP(self, bruto, status, **opcoes):
+        with self.assertRaises(ErroHTTP) as ctx:
+            await _ler(bruto, **opcoes)
+        self.assertEqual(ctx.exception.status, status)
+
+    async def test_requisicao_valida(self):
+        req, _ = await _ler(b'POST /esp32/poll HTTP/1.1\r\nContent-Length: 2\r\nX-A: 1\r\nX-A: 2\r\n\r\n{}')
+        self.assertEqual((req.metodo, req.caminho, req.corpo), ('POST', '/esp32/poll', b'{}'))
+        self.assertEqual(req.cabecalhos['x-a'], '1, 2')
+
+    async def test_sem_content_length_corpo_vazio(self):
+        req, _ = await _ler(b'GET /status HTTP/1.1\r\nHost: x\r\n\r\n')
+        self.assertEqual(req.corpo, b'')
+
+    async def test_conexao_fechada(self):
+        req, _ = await _ler(b'')
+        self.assertIsNone(req)
+
+    async def test_linha_de_requisicao_invalida(self):
+        for linha in (b'LIXO\r\n\r\n', b'GET /\r\n\r\n', b'GET / HTTP/1.1 extra\r\n\r\n',
+                      b'GET / FTP/1.0\r\n\r\n', b'G3T / HTTP/1.1\r\n\r\n'):
+            with self.subTest(linha=linha):
+                await self.assertErroHTTP(linha, 400)
+
+    async def test_content_length_invalido(self):
+        for valor in (b'abc', b'-1', b'+5', b'1.5', b'5, 5', b'\xc2\xb2'):
+            with self.subTest(valor=valor):
+                await self.assertErroHTTP(b'POST / HTTP/1.1\r\nContent-Length: ' + valor + b'\r\n\r\n', 400)
+
+    async def test_content_length_grande_demais(self):
+        await self.assertErroHTTP(
+            f'POST / HTTP/1.1\r\nContent-Length: {MAX_CORPO_BYTES + 1}\r\n\r\n'.encode(), 413)
+
+    async def test_corpo_menor_que_content_length(self):
+        with self.assertRaises(asyncio.IncompleteReadError):
+            await _ler(b'POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\n{}')
+
+    async def test_cabecalhos_demais(self):
+        cabecalhos = b''.join(b'X-%d: 1\r\n' % i for i in range(MAX_CABECALHOS + 1))
+        await self.assertErroHTTP(b'GET / HTTP/1.1\r\n' + cabecalhos + b'\r\n', 431)
+
+    async def test_cabecalho_sem_dois_pontos(self):
+        await self.assertErroHTTP(b'GET / HTTP/1.1\r\nsem separador\r\n\r\n', 400)
+
+    async def test_linhas_longas_demais(self):
+        await self.assertErroHTTP(b'GET /' + b'a' * 200 + b' HTTP/1.1\r\n\r\n', 414, limite=64)
+        await self.assertErroHTTP(b'GET / HTTP/1.1\r\nX: ' + b'a' * 200 + b'\r\n\r\n', 431, limite=64)
+
+    async def test_corpo_chunked(self):
+        await self.assertErroHTTP(
+            b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n2\r\n{}\r\n0\r\n\r\n', 411)
+
+    async def test_expect_100_continue(self):
+        req, escritor = await _ler(b'POST / HTTP/1.1\r\nContent-Length: 2\r\nExpect: 100-continue\r\n\r\n{}')
+        self.assertEqual(escritor.dados, b'HTTP/1.1 100 Continue\r\n\r\n')
+        self.assertEqual(req.corpo, b'{}')
+
+
+class TestConexao(unittest.IsolatedAsyncioTestCase):
+    """Servidor real numa porta efêmera: status respondido e conexão fechada"""
+
+    async def asyncSetUp(self):
+        self.servidor = ServidorAssincrono(threads_bloqueantes=2, threads_inferencia=1)
+        self.tcp = await self.servidor.iniciar('127.0.0.1', 0)
+        self.porta = self.tcp.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.tcp.close()
+        await self.tcp.wait_closed()
+        self.servidor.encerrar()
+
+    async def trocar(self, bruto):
+        leitor, escritor = await asyncio.open_connection('127.0.0.1', self.porta)
+        escritor.write(bruto)
+        await escritor.drain()
+        resposta = await asyncio.wait_for(leitor.read(), 5)
+        escritor.close()
+        return resposta
+
+    async def test_content_length_invalido_responde_400(self):
+        resposta = await self.trocar(b'POST /esp32/result HTTP/1.1\r\nContent-Length: abc\r\n\r\n')
+        self.assertTrue(resposta.startswith(b'HTTP/1.1 400 '), resposta)
+        self.assertIn(b'Connection: close', resposta)
+
+    async def test_poll_com_wait_invalido_responde_400(self):
+        corpo = b'{"device_id": "A1", "wait": "abc"}'
+        cabecalho = (b'POST /esp32/poll HTTP/1.1\r\nConnection: close\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: %d\r\n\r\n' % len(corpo))
+        resposta = await self.trocar(cabecalho + corpo)
+        self.assertTrue(resposta.startswith(b'HTTP/1.1 400 '), resposta)
+        self.assertIn(b"'wait'", resposta)
+
+    async def test_resultado_binario_malformado_responde_400(self):
+        corpo = b'ES\x01\x12'
+        cabecalho = (b'POST /esp32/result HTTP/1.1\r\nConnection: close\r\n'
+                     b'Content-Type: application/vnd.graos.espectro\r\nContent-Length: %d\r\n\r\n' % len(corpo))
+        resposta = await self.trocar(cabecalho + corpo)
+        self.assertTrue(resposta.startswith(b'HTTP/1.1 400 '), resposta)
+        self.assertIn(b'curto', resposta)
+
+    async def test_cabecalhos_demais_responde_431(self):
+        cabecalhos = b''.join(b'X-%d: 1\r\n' % i for i in range(MAX_CABECALHOS + 1))
+        resposta = await self.trocar(b'GET /status HTTP/1.1\r\n' + cabecalhos + b'\r\n')
+        self.assertTrue(resposta.startswith(b'HTTP/1.1 431 '), resposta)
+
+    async def test_erro_inesperado_responde_500(self):
+        async def falhar(req, escritor):
+            raise RuntimeError('falha de teste')
+        self.servidor.rotas[('GET', '/falha')] = falhar
+        with self.assertLogs(servidor_async.logger, 'ERROR'):
+            resposta = await self.trocar(b'GET /falha HTTP/1.1\r\n\r\n')
+        self.assertTrue(resposta.startswith(b'HTTP/1.1 500 '), resposta)
+
+
+
+class TestPoolEstado(unittest.IsolatedAsyncioTestCase):
+    """Estado SQLite não espera na fila da ponte WSGI"""
+
+    async def asyncSetUp(self):
+        self.servidor = ServidorAssincrono(threads_bloqueantes=1, threads_inferencia=1, threads_estado=1)
+        self.servidor._loop = asyncio.get_running_loop()
+
+    async def asyncTearDown(self):
+        self.servidor.encerrar()
+
+    async def test_estado_sqlite_com_pool_wsgi_ocupado(self):
+        liberar = threading.Event()
+        ocupado = asyncio.ensure_future(self.servidor.bloqueante(liberar.wait, 5))
+        try:
+            with mock.patch.object(servidor_async.base.estado, 'compartilhado', True):
+                nome = await asyncio.wait_for(self.servidor.estado_io(lambda: threading.current_thread().name), 2)
+            self.assertTrue(nome.startswith('async-estado'), nome)
+            self.assertFalse(ocupado.done())
+        finally:
+            liberar.set()
+            await ocupado
+
+    async def test_estado_em_memoria_direto_no_loop(self):
+        with mock.patch.object(servidor_async.base.estado, 'compartilhado', False):
+            nome = await self.servidor.estado_io(lambda: threading.current_thread().name)
+        self.assertEqual(nome, threading.current_thread().name)
+
+
+if __name__ == '__main__':
+    unittest.main()
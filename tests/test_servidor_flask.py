@@ -0,0 +1,167 @@
+"""
+Validação de entrada dos endpoints do servidor Flask (servidor_flask.py):
+corpo ou parâmetro malformado responde 400 com mensagem, nunca 500
+
+Uso: python -m pytest tests/
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault('BANCO_ANALISES', os.path.join(tempfile.mkdtemp(), 'analises_teste.db'))
+
+import servidor_flask  # noqa: E402
+from formato_espectro import codificar_espectro, TIPO_ESPECTRO_BINARIO  # noqa: E402
+
+ESPECTRO = [0.33, 0.18, 0.21, 0.25, 0.27, 0.29, 0.31, 0.33, 0.35,
+            0.37, 0.39, 0.41, 0.43, 0.45, 0.47, 0.49, 0.51, 0.53]
+
+
+def setUpModule():
+    servidor_flask.MODELO_PKL = os.path.join(RAIZ, servidor_flask.MODELO_PKL)
+    servidor_flask.MODELO_COMPILADO = os.path.join(RAIZ, servidor_flask.MODELO_COMPILADO)
+    if servidor_flask.motor is None:
+        servidor_flask.carregar_modelo()
+
+
+class TestEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.cliente = servidor_flask.app.test_client()
+
+    def assertErro400(self, resposta, trecho=None):
+        self.assertEqual(resposta.status_code, 400, resposta.get_data(as_text=True))
+        corpo = resposta.get_json()
+        self.assertIn('error', corpo)
+        if trecho:
+            self.assertIn(trecho, corpo['error'])
+
+
+class TestResultBatch(TestEndpoints):
+
+    def test_lote_valido(self):
+        resposta = self.cliente.post('/esp32/result_batch', json={'amostras': [{'spectrum': ESPECTRO}] * 2})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.get_json()['total'], 2)
+
+    def test_amostra_que_nao_e_objeto(self):
+        resposta = self.cliente.post('/esp32/result_batch', json={'amostras': [ESPECTRO]})
+        self.assertErro400(resposta, 'Amostra 0')
+
+    def test_corpo_e_amostras_de_tipo_errado(self):
+        self.assertErro400(self.cliente.post('/esp32/result_batch', json=[ESPECTRO]))
+        self.assertErro400(self.cliente.post('/esp32/result_batch', json={'amostras': 'x'}))
+
+    def test_espectro_de_tamanho_errado(self):
+        resposta = self.cliente.post('/esp32/result_batch',
+                                     json={'amostras': [{'spectrum': ESPECTRO}, {'spectrum': 5}]})
+        self.assertErro400(resposta, 'Amostra 1')
+
+
+
+class TestPoll(TestEndpoints):
+
+    def test_wait_invalido(self):
+        for wait in ('abc', [1], {'s': 1}, True, 'nan'):
+            with self.subTest(wait=wait):
+                resposta = self.cliente.post('/esp32/poll', json={'device_id': 'P1', 'wait': wait})
+                self.assertErro400(resposta, 'wait')
+
+    def test_corpo_que_nao_e_objeto(self):
+        self.assertErro400(self.cliente.post('/esp32/poll', json=['P1']))
+
+    def test_wait_limitado_ao_maximo(self):
+        self.assertEqual(servidor_flask.registrar_poll({'device_id': 'P2', 'wait': 1e9}, '127.0.0.1')[2],
+                         servidor_flask.LONG_POLL_MAX_S)
+        self.assertEqual(servidor_flask.registrar_poll({'device_id': 'P2', 'wait': -5}, '127.0.0.1')[2], 0)
+        self.assertEqual(servidor_flask.registrar_poll({'device_id': 'P2', 'wait': '0.5'}, '127.0.0.1')[2], 0.5)
+
+    def test_long_poll_recebe_comando(self):
+        fila = self.cliente.post('/command/analyze', json={'device_id': 'P3'}).get_json()
+        resposta = self.cliente.post('/esp32/poll', json={'device_id': 'P3', 'wait': 1})
+        self.assertEqual(resposta.status_code, 200)
+        corpo = resposta.get_json()
+        self.assertEqual((corpo['command_id'], corpo['poll_ms']), (fila['command_id'], 0))
+
+    def test_poll_curto_sem_comando(self):
+        corpo = self.cliente.post('/esp32/poll', json={'device_id': 'P4'}).get_json()
+        self.assertEqual(corpo, {'command': 'status', 'poll_ms': servidor_flask.POLL_INTERVAL_MS})
+
+
+
+class TestComandos(TestEndpoints):
+
+    def test_parametros_invalidos(self):
+        for campo, valor in (('prioridade', 'alta'), ('prioridade', 1.5), ('ttl_s', 'abc'), ('ttl_s', [60])):
+            with self.subTest(campo=campo, valor=valor):
+                resposta = self.cliente.post('/command/analyze', json={'device_id': 'C1', campo: valor})
+                self.assertErro400(resposta, campo)
+        self.assertErro400(self.cliente.post('/command/analyze', json=['C1']))
+        self.assertErro400(self.cliente.post('/command/broadcast', json={'prazo_s': 'nan'}), 'prazo_s')
+        self.assertErro400(self.cliente.post('/command/broadcast', json={'prioridade': True}), 'prioridade')
+
+    def test_limites_aplicados(self):
+        corpo = self.cliente.post('/command/analyze', json={
+            'device_id': 'C2', 'prioridade': 10 ** 30, 'ttl_s': 10 ** 9}).get_json()
+        self.assertEqual(corpo['prioridade'], servidor_flask.COMANDO_PRIORIDADE_MAX)
+        registro = self.cliente.get(f"/command/{corpo['command_id']}").get_json()
+        self.assertEqual(registro['ttl_s'], servidor_flask.COMANDO_TTL_MAX_S)
+
+
+
+class TestHistorico(TestEndpoints):
+
+    def test_limit_e_cursor_invalidos(self):
+        for parametros in ('limit=abc', 'limit=1.5', 'cursor=abc', 'cursor=0', 'cursor=-3'):
+            with self.subTest(parametros=parametros):
+                resposta = self.cliente.get(f'/history?{parametros}')
+                self.assertErro400(resposta, parametros.split('=')[0])
+
+    def test_paginacao_pelo_cabecalho(self):
+        servidor_flask.armazenamento.adicionar_varios([{'device_id': 'H1', 'n': n, 'timestamp': '2099-01-01T00:00:00'}
+                                                       for n in range(5)])
+        servidor_flask.armazenamento.flush()
+        vistos, cursor = [], ''
+        while cursor is not None:
+            resposta = self.cliente.get(f'/history?device_id=H1&limit=2&cursor={cursor}')
+            self.assertEqual(resposta.status_code, 200)
+            vistos += [a['n'] for a in resposta.get_json()]
+            cursor = resposta.headers.get('X-Proximo-Cursor')
+        self.assertEqual(vistos, [4, 3, 2, 1, 0])
+
+
+
+class TestResultado(TestEndpoints):
+
+    def enviar_binario(self, corpo):
+        return self.cliente.post('/esp32/result', data=corpo, content_type=TIPO_ESPECTRO_BINARIO)
+
+    def test_binario_valido(self):
+        resposta = self.enviar_binario(codificar_espectro('B1', ESPECTRO))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.get_json()['device_id'], 'B1')
+
+    def test_binario_malformado_sem_traceback(self):
+        corpo = codificar_espectro('B1', ESPECTRO)
+        for invalido in (b'ES\x01\x12', b'XX' + corpo[2:], corpo[:-1]):
+            with self.subTest(corpo=invalido[:8]):
+                with self.assertLogs(servidor_flask.logger, 'WARNING') as logs:
+                    self.assertErro400(self.enviar_binario(invalido))
+                self.assertTrue(all(registro.levelname == 'WARNING' and registro.exc_info is None
+                                    for registro in logs.records))
+
+    def test_json_malformado(self):
+        self.assertErro400(self.cliente.post('/esp32/result', data='{"spectrum": [', content_type='application/json'))
+        self.assertErro400(self.cliente.post('/esp32/result', json=[ESPECTRO]))
+        self.assertErro400(self.cliente.post('/esp32/result', json={'spectrum': 'abc'}), 'lista')
+        self.assertErro400(self.cliente.post('/esp32/result', json={'spectrum': ESPECTRO[:17]}), '17 bandas')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,348 @@
+"""
+Treinamento do Modelo com Validação LOSO - Classificação de Grãos
+
+Reconstrói o modelo_completo_sem_485nm.pkl a partir da tabela de coleta
+(band_410 ... band_940, grain, sample): mesmo dicionário de objetos
+sklearn que construir_motor() e compilar_parametros() esperam, com as
+mesmas chaves e na mesma ordem.
+
+Pipeline (ajustar_modelo):
+- 17 bandas (sem r485) -> scaler_bandas -> PCA completo (17
+  componentes; o modelo usa os N_COMPONENTES_PCA primeiros)
+- índices espectrais (calcular_indices_novos) -> scaler_indices
+- [índices | componentes] -> scaler_final -> SVC linear (C=SVM_C,
+  probabilidades de Platt, random_state=SEMENTE)
+- por espécie, sobre os índices padronizados: One-Class SVM RBF
+  (nu=OCSVM_NU, gamma='auto') e limiares MAD = FATOR_MAD x MAD
+
+Validação Leave-One-Subject-Out: o sujeito é a amostra física (grain,
+sample), então cada fold exclui todas as repetições de uma amostra. O
+modelo de cada fold avalia as amostras excluídas pelo MotorInferencia e
+pelas regras de regras_anomalia.py, o mesmo caminho do servidor. Como
+todas as amostras da coleta são limpas, todo ANORMAL é falso positivo.
+
+- Folds em paralelo num ProcessPoolExecutor (--processos)
+- scaler_bandas, PCA e scaler_indices de cada fold ficam em cache em
+  disco (CACHE_PADRAO), chaveados pelo SHA-256 das bandas de treino:
+  repetir a validação ou variar só o SVM/detectores reaproveita os
+  ajustes. O modelo final é sempre ajustado do zero
+- Relatório determinístico (JSON com chaves ordenadas, sem datas nem
+  tempos): o mesmo dataset gera byte a byte o mesmo relatório e o mesmo
+  .pkl
+
+Uso:
+python treinar_modelo.py [tabela.csv] [-o modelo.pkl] [--processos N]
+python treinar_modelo.py --comparar modelo_completo_sem_485nm.pkl
+
+Para colocar em serviço: copie o .pkl para modelo_completo_sem_485nm.pkl,
+recompile o artefato (python artefato_modelo.py) e recarregue o servidor
+(POST /model/reload ou kill -HUP).
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC, OneClassSVM
+
+from artefato_modelo import sha256_arquivo
+from motor_inferencia import MotorInferencia, calcular_indices_novos, compilar_parametros, N_COMPONENTES_PCA
+from regras_anomalia import aplicar_regras_anomalia, VIOLACOES_MAD_MINIMAS, LIMIAR_CONFIANCA
+
+TABELA_PADRAO = 'tabela_coleta_dados_espectrais_4_amostras.csv'
+MODELO_PKL = 'modelo_completo_sem_485nm.pkl'
+SAIDA_PADRAO = 'modelo_treinado_sem_485nm.pkl'
+RELATORIO_PADRAO = 'relatorio_treino.json'
+CACHE_PADRAO = 'cache_treino'
+
+BANDAS_COLS = ['r410', 'r435', 'r460', 'r510', 'r535', 'r560', 'r585', 'r610', 'r645',
+               'r680', 'r705', 'r730', 'r760', 'r810', 'r860', 'r900', 'r940']
+INDICES_COLS = ['I1_NDVI', 'I2_Water', 'I3_Lipid', 'I4_Slope_Alt']
+
+SVM_C = 1.0
+OCSVM_NU = 0.05
+FATOR_MAD = 2.5
+SEMENTE = 42
+
+# Muda quando o conteúdo do cache de pré-processamento muda
+VERSAO_CACHE = 1
+
+
+# ==================== DATASET ====================
+
+def carregar_dataset(caminho=TABELA_PADRAO):
+    """
+    (bandas (N, 17), índices (N, 4), espécies (N,), sujeitos (N,)) da
+    tabela de coleta, na ordem do arquivo. Sujeito: 'grain/sample'.
+    """
+    df = pd.read_csv(caminho)
+    df = df.rename(columns={c: 'r' + c[len('band_'):] for c in df.columns if c.startswith('band_')})
+    faltando = [c for c in BANDAS_COLS + ['grain', 'sample'] if c not in df.columns]
+    if faltando:
+        raise ValueError(f"{caminho}: colunas ausentes {faltando}")
+
+    bandas = df[BANDAS_COLS].to_numpy(dtype=np.float64)
+    indices = calcular_indices_novos(df)[INDICES_COLS].to_numpy(dtype=np.float64)
+    especies = df['grain'].to_numpy(dtype=object)
+    sujeitos = (df['grain'].astype(str) + '/' + df['sample'].astype(str)).to_numpy(dtype=object)
+    return bandas, indices, especies, sujeitos
+
+
+# ==================== AJUSTE ====================
+
+def _chave_cache(bandas):
+    h = hashlib.sha256()
+    h.update(f"{VERSAO_CACHE}|{sklearn.__version__}|{bandas.shape}|".encode())
+    h.update(np.ascontiguousarray(bandas).tobytes())
+    return h.hexdigest()
+
+
+def ajustar_preprocessamento(bandas, indices, cache_dir=None):
+    """
+    scaler_bandas, pca e scaler_indices ajustados nas amostras de treino.
+    Com cache_dir, reaproveita o ajuste já salvo para as mesmas bandas
+    (os índices derivam delas).
+    """
+    caminho = None
+    if cache_dir:
+        caminho = os.path.join(cache_dir, _chave_cache(bandas)[:32] + '.joblib')
+        if os.path.exists(caminho):
+            try:
+                return joblib.load(caminho)
+            except Exception:
+                pass  # arquivo corrompido/incompatível: reajusta
+
+    scaler_bandas = StandardScaler().fit(bandas)
+    ajustes = {
+        'scaler_bandas': scaler_bandas,
+        'pca': PCA(n_components=bandas.shape[1]).fit(scaler_bandas.transform(bandas)),
+        'scaler_indices': StandardScaler().fit(indices),
+    }
+
+    if caminho:
+        os.makedirs(cache_dir, exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        joblib.dump(ajustes, temporario)
+        os.replace(temporario, caminho)  # folds paralelos podem gravar a mesma chave
+    return ajustes
+
+
+def ajustar_classificador(indices, componentes, especies, c=SVM_C):
+    """scaler_final e SVC linear sobre [índices | componentes]"""
+    final = np.hstack([indices, componentes])
+    scaler_final = StandardScaler().fit(final)
+    modelo_especies = SVC(kernel='linear', C=c, probability=True, random_state=SEMENTE)
+    modelo_especies.fit(scaler_final.transform(final), especies)
+    return scaler_final, modelo_especies
+
+
+def ajustar_detectores(indices_scaled, especies, classes, nu=OCSVM_NU, fator_mad=FATOR_MAD):
+    """One-Class SVM e limiares MAD de cada espécie (índices padronizados)"""
+    detectores, limiares = {}, {}
+    for especie in classes:
+        amostras = indices_scaled[especies == especie]
+        detectores[especie] = OneClassSVM(kernel='rbf', nu=nu, gamma='auto').fit(amostras)
+        medianas = np.median(amostras, axis=0)
+        limiares[especie] = {
+            'medians': medianas,
+            'mads': fator_mad * np.median(np.abs(amostras - medianas), axis=0),
+        }
+    return detectores, limiares
+
+
+def ajustar_modelo(bandas, indices, especies, cache_dir=None, n_componentes=N_COMPONENTES_PCA):
+    """Dicionário do modelo (mesmas chaves do modelo_completo_sem_485nm.pkl)"""
+    ajustes = ajustar_preprocessamento(bandas, indices, cache_dir)
+    scaler_bandas, pca, scaler_indices = ajustes['scaler_bandas'], ajustes['pca'], ajustes['scaler_indices']
+
+    componentes = pca.transform(scaler_bandas.transform(bandas))[:, :n_componentes]
+    scaler_final, modelo_especies = ajustar_classificador(indices, componentes, especies)
+    detectores, limiares = ajustar_detectores(scaler_indices.transform(indices), especies,
+                                              modelo_especies.classes_)
+
+    return {
+        'modelo_especies': modelo_especies,
+        'detectores_anomalia': detectores,
+        'limiares_mad': limiares,
+        'scaler_bandas': scaler_bandas,
+        'scaler_indices': scaler_indices,
+        'scaler_final': scaler_final,
+        'pca': pca,
+        'bandas_cols': list(BANDAS_COLS),
+        'indices_cols': list(INDICES_COLS),
+    }
+
+
+# ==================== VALIDAÇÃO LOSO ====================
+
+def avaliar_fold(dados, sujeito, cache_dir=None):
+    """Treina sem o sujeito e avalia as amostras dele pelo motor compilado"""
+    bandas, indices, especies, sujeitos = dados
+    teste = sujeitos == sujeito
+    modelos = ajustar_modelo(bandas[~teste], indices[~teste], especies[~teste], cache_dir)
+    saida = aplicar_regras_anomalia(MotorInferencia.do_modelo(modelos).prever(bandas[teste]))
+    return {
+        'sujeito': sujeito,
+        'real': [str(e) for e in especies[teste]],
+        'predita': [str(e) for e in saida['especie']],
+        'status': [str(s) for s in saida['status']],
+    }
+
+
+def validar_loso(dados, processos=1, cache_dir=None):
+    """Resultados por fold (um por sujeito), na ordem dos sujeitos"""
+    folds = sorted(set(dados[3]))
+    if processos <= 1:
+        return [avaliar_fold(dados, s, cache_dir) for s in folds]
+    with ProcessPoolExecutor(min(processos, len(folds))) as pool:
+        return list(pool.map(avaliar_fold, [dados] * len(folds), folds, [cache_dir] * len(folds)))
+
+
+def resumir_loso(resultados, classes):
+    """Acurácia (média ± desvio por fold e global), falsos positivos e matriz de confusão"""
+    acuracias = [np.mean(np.array(r['real']) == np.array(r['predita'])) for r in resultados]
+    real = np.concatenate([r['real'] for r in resultados])
+    predita = np.concatenate([r['predita'] for r in resultados])
+    anormal = np.concatenate([r['status'] for r in resultados]) == 'ANORMAL'
+    return {
+        'folds': len(resultados),
+        'acuracia_media': round(float(np.mean(acuracias)), 4),
+        'acuracia_desvio': round(float(np.std(acuracias)), 4),
+        'acuracia_global': round(float(np.mean(real == predita)), 4),
+        'taxa_falsos_positivos': round(float(np.mean(anormal)), 4),
+        'matriz_confusao': {
+            c: {p: int(np.sum((real == c) & (predita == p))) for p in classes} for c in classes
+        },
+        'por_fold': [
+            {
+                'sujeito': r['sujeito'],
+                'amostras': len(r['real']),
+                'acertos': int(np.sum(np.array(r['real']) == np.array(r['predita']))),
+                'falsos_positivos': int(np.sum(np.array(r['status']) == 'ANORMAL')),
+            }
+            for r in resultados
+        ],
+    }
+
+
+# ==================== RELATÓRIO ====================
+
+def montar_relatorio(caminho_tabela, dados, modelos, loso):
+    bandas, _, especies, sujeitos = dados
+    classes = [str(c) for c in modelos['modelo_especies'].classes_]
+    return {
+        'dataset': {
+            'arquivo': os.path.basename(caminho_tabela),
+            'sha256': sha256_arquivo(caminho_tabela),
+            'amostras': len(bandas),
+            'sujeitos': len(set(sujeitos)),
+            'por_especie': {c: int(np.sum(especies == c)) for c in classes},
+        },
+        'parametros': {
+            'n_componentes_pca': N_COMPONENTES_PCA,
+            'svm_c': SVM_C,
+            'ocsvm_nu': OCSVM_NU,
+            'fator_mad': FATOR_MAD,
+            'violacoes_mad_minimas': VIOLACOES_MAD_MINIMAS,
+            'limiar_confianca': LIMIAR_CONFIANCA,
+            'semente': SEMENTE,
+            'versao_sklearn': sklearn.__version__,
+        },
+        'modelo': {
+            'classes': classes,
+            'variancia_explicada_pca': round(float(
+                np.sum(modelos['pca'].explained_variance_ratio_[:N_COMPONENTES_PCA])), 4),
+            'vetores_suporte_svm': int(np.sum(modelos['modelo_especies'].n_support_)),
+            'vetores_suporte_ocsvm': {c: int(modelos['detectores_anomalia'][c].n_support_[0]) for c in classes},
+        },
+        'loso': loso,
+    }
+
+
+def comparar_modelos(modelos, caminho_referencia, bandas):
+    """
+    Maior diferença absoluta entre os parâmetros compilados e entre as
+    probabilidades dos dois modelos nas bandas do dataset
+    """
+    referencia = joblib.load(caminho_referencia)
+    novo, antigo = compilar_parametros(modelos), compilar_parametros(referencia)
+    diferencas = {}
+    for chave, valor in novo.items():
+        if isinstance(valor, np.ndarray) and valor.dtype.kind == 'f':
+            if valor.shape != antigo[chave].shape:
+                diferencas[chave] = float('inf')
+            else:
+                diferencas[chave] = float(np.max(np.abs(valor - antigo[chave]), initial=0.0))
+        elif not np.array_equal(np.asarray(valor), np.asarray(antigo[chave])):
+            diferencas[chave] = f"{valor} != {antigo[chave]}"
+    saida_nova = MotorInferencia(novo).prever(bandas)
+    saida_antiga = MotorInferencia(antigo).prever(bandas)
+    diferencas['predicoes'] = float(np.max(np.abs(saida_nova['probabilidades'] - saida_antiga['probabilidades'])))
+    return diferencas
+
+
+# ==================== EXECUÇÃO ====================
+
+def main():
+    parser = argparse.ArgumentParser(description='Treino do modelo de grãos com validação LOSO')
+    parser.add_argument('tabela', nargs='?', default=TABELA_PADRAO)
+    parser.add_argument('-o', '--saida', default=SAIDA_PADRAO, help='modelo .pkl gerado')
+    parser.add_argument('--relatorio', default=RELATORIO_PADRAO)
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1, help='folds LOSO em paralelo')
+    parser.add_argument('--cache', default=CACHE_PADRAO, help="diretório do cache de scaler/PCA ('' desativa)")
+    parser.add_argument('--comparar', help='.pkl de referência (ex.: modelo_completo_sem_485nm.pkl)')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    dados = carregar_dataset(args.tabela)
+    print(f"📊 {len(dados[0])} espectros, {len(set(dados[3]))} sujeitos ({args.tabela})")
+
+    resultados = validar_loso(dados, args.processos, args.cache or None)
+    t_loso = time.perf_counter() - inicio
+    # Modelo final sempre ajustado do zero: objetos lidos do cache
+    # serializam com outro layout e o .pkl deixaria de ser reprodutível
+    modelos = ajustar_modelo(dados[0], dados[1], dados[2])
+    classes = [str(c) for c in modelos['modelo_especies'].classes_]
+    relatorio = montar_relatorio(args.tabela, dados, modelos, resumir_loso(resultados, classes))
+
+    temporario = args.saida + '.parcial'
+    joblib.dump(modelos, temporario)
+    os.replace(temporario, args.saida)
+    with open(args.relatorio, 'w', encoding='utf-8') as f:
+        json.dump(relatorio, f, indent=2, ensure_ascii=False, sort_keys=True)
+        f.write('\n')
+
+    loso = relatorio['loso']
+    print(f"🔁 LOSO ({loso['folds']} folds, {args.processos} processo(s)): "
+          f"acurácia {loso['acuracia_media'] * 100:.1f}% (±{loso['acuracia_desvio'] * 100:.1f}%), "
+          f"falsos positivos {loso['taxa_falsos_positivos'] * 100:.1f}%  [{t_loso:.2f} s]")
+    for fold in loso['por_fold']:
+        if fold['acertos'] < fold['amostras'] or fold['falsos_positivos']:
+            print(f"   {fold['sujeito']:<16} {fold['acertos']}/{fold['amostras']} acertos, "
+                  f"{fold['falsos_positivos']} falso(s) positivo(s)")
+    print(f"📈 Variância explicada (PCA {N_COMPONENTES_PCA}): {relatorio['modelo']['variancia_explicada_pca'] * 100:.1f}%")
+    print(f"💾 Modelo: {args.saida} (sha256 {sha256_arquivo(args.saida)[:12]}), relatório: {args.relatorio}")
+
+    if args.comparar:
+        diferencas = comparar_modelos(modelos, args.comparar, dados[0])
+        for chave, valor in diferencas.items():
+            print(f"   {chave}: {valor}")
+        iguais = all(isinstance(v, float) and v < 1e-9 for v in diferencas.values())
+        print(f"{'✅' if iguais else '⚠️'} Comparação com {args.comparar}: "
+              f"{'equivalente' if iguais else 'diferente'}")
+    print(f"⏱️ Total: {time.perf_counter() - inicio:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""
+Varredura de Hiperparâmetros com Validação LOSO - Classificação de Grãos
+
+Avalia grades das escolhas fixas do pipeline sob Leave-One-Subject-Out
+(mesmos folds de treinar_modelo.py) e monta a fronteira de Pareto entre
+acurácia e taxa de falsos positivos:
+
+- nº de componentes do PCA (N_COMPONENTES_PCA = 6)
+- C do SVC linear (SVM_C = 1.0)
+- nu dos One-Class SVM (OCSVM_NU = 0.05)
+- violações MAD mínimas (VIOLACOES_MAD_MINIMAS = 2)
+- limiar de confiança (LIMIAR_CONFIANCA = 0.60)
+
+Nada é reajustado do zero a cada ponto da grade:
+
+- Por fold, scaler das bandas, uma decomposição PCA completa (17
+  componentes) e scaler dos índices são ajustados uma vez (com o cache
+  em disco de treinar_modelo.py) e os índices/componentes das amostras
+  de treino e teste ficam pré-calculados. Cada nº de componentes é um
+  recorte das mesmas colunas.
+- O SVC depende só de (componentes, C); os detectores só de nu. Eles
+  são ajustados em tarefas separadas, em paralelo, e cada amostra de
+  teste recebe a decisão do One-Class SVM e as violações MAD de todas
+  as espécies.
+- Violações mínimas e limiar de confiança não exigem ajuste: cada
+  combinação aplica regras_anomalia.aplicar_regras_anomalia sobre as
+  saídas já calculadas.
+
+Com a coleta atual todas as amostras são limpas: a tabela mede o custo
+(falsos positivos) de cada configuração, não a sensibilidade a
+contaminações reais.
+
+Uso:
+python varredura_hiperparametros.py [tabela.csv] --pca 3,4,5,6,7,8 --c 0.1,1,10 \\
+    --nu 0.01,0.05,0.1 --violacoes 1,2,3,4 --confianca 0.4,0.5,0.6,0.7
+
+Criado por Uender Carlos Barbosa - Email: u.carlos3@gmail.com
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from motor_inferencia import N_COMPONENTES_PCA
+from regras_anomalia import aplicar_regras_anomalia, VIOLACOES_MAD_MINIMAS, LIMIAR_CONFIANCA
+from treinar_modelo import (carregar_dataset, ajustar_preprocessamento, ajustar_classificador,
+                            ajustar_detectores, TABELA_PADRAO, CACHE_PADRAO, SVM_C, OCSVM_NU)
+
+SAIDA_PADRAO = 'varredura_resultado.json'
+
+GRADE_PADRAO = {
+    'pca': [3, 4, 5, 6, 7, 8],
+    'c': [0.1, 1.0, 10.0],
+    'nu': [0.01, 0.05, 0.1],
+    'violacoes': [1, 2, 3, 4],
+    'confianca': [0.4, 0.5, 0.6, 0.7],
+}
+
+PRODUCAO = {
+    'pca': N_COMPONENTES_PCA,
+    'c': SVM_C,
+    'nu': OCSVM_NU,
+    'violacoes': VIOLACOES_MAD_MINIMAS,
+    'confianca': LIMIAR_CONFIANCA,
+}
+
+# Folds pré-calculados do processo (inicializador do pool)
+_folds = None
+
+
+# ==================== PRÉ-CÁLCULO POR FOLD ====================
+
+def preparar_folds(dados, cache_dir=None):
+    """
+    Uma entrada por sujeito com as features de treino e teste já
+    transformadas: índices brutos e padronizados e os 17 componentes
+    """
+    bandas, indices, especies, sujeitos = dados
+    folds = []
+    for sujeito in sorted(set(sujeitos)):
+        teste = sujeitos == sujeito
+        treino = ~teste
+        ajustes = ajustar_preprocessamento(bandas[treino], indices[treino], cache_dir)
+
+        def transformar(mascara):
+            return {
+                'indices': indices[mascara],
+                'indices_scaled': ajustes['scaler_indices'].transform(indices[mascara]),
+                'componentes': ajustes['pca'].transform(ajustes['scaler_bandas'].transform(bandas[mascara])),
+                'especies': especies[mascara],
+            }
+
+        folds.append({'sujeito': sujeito, 'treino': transformar(treino), 'teste': transformar(teste)})
+    return folds
+
+
+def _iniciar_processo(folds):
+    global _folds
+    _folds = folds
+
+
+# ==================== TAREFAS ====================
+
+def avaliar_classificador(n_componentes, c, classes):
+    """
+    SVC de cada fold com (n_componentes, c): espécie predita (índice em
+    classes) e probabilidades das amostras de teste, folds concatenados
+    """
+    preditas, probabilidades = [], []
+    for fold in _folds:
+        treino, teste = fold['treino'], fold['teste']
+        scaler_final, svm = ajustar_classificador(treino['indices'], treino['componentes'][:, :n_componentes],
+                                                  treino['especies'], c)
+        final = scaler_final.transform(np.hstack([teste['indices'], teste['componentes'][:, :n_componentes]]))
+        preditas.append(np.searchsorted(classes, svm.predict(final).astype(str)))
+        probabilidades.append(svm.predict_proba(final))
+    return np.concatenate(preditas), np.concatenate(probabilidades)
+
+
+def avaliar_detectores(nu, classes):
+    """
+    Detectores de cada fold com nu: decisão do One-Class SVM e violações
+    MAD de cada amostra de teste contra cada espécie (N, k)
+    """
+    decisoes, violacoes = [], []
+    for fold in _folds:
+        treino, teste = fold['treino'], fold['teste']
+        detectores, limiares = ajustar_detectores(treino['indices_scaled'], treino['especies'].astype(str),
+                                                  classes, nu)
+        x = teste['indices_scaled']
+        decisoes.append(np.column_stack([detectores[e].predict(x) for e in classes]))
+        violacoes.append(np.column_stack([
+            np.sum(np.abs(x - limiares[e]['medians']) > limiares[e]['mads'], axis=1) for e in classes
+        ]))
+    return np.concatenate(decisoes), np.concatenate(violacoes)
+
+
+def executar_tarefa(tarefa, classes):
+    if tarefa[0] == 'classificador':
+        return avaliar_classificador(tarefa[1], tarefa[2], classes)
+    return avaliar_detectores(tarefa[1], classes)
+
+
+# ==================== VARREDURA ====================
+
+def varrer(dados, grade, processos=1, cache_dir=None):
+    """Métricas LOSO de todos os pontos da grade (na ordem da grade)"""
+    folds = preparar_folds(dados, cache_dir)
+    classes = np.array(sorted({str(e) for e in dados[2]}))
+    real = np.searchsorted(classes, np.concatenate([f['teste']['especies'] for f in folds]).astype(str))
+
+    tarefas = ([('classificador', n, c) for n, c in itertools.product(grade['pca'], grade['c'])]
+               + [('detectores', nu) for nu in grade['nu']])
+    if processos <= 1:
+        _iniciar_processo(folds)
+        saidas = [executar_tarefa(t, classes) for t in tarefas]
+    else:
+        with ProcessPoolExecutor(min(processos, len(tarefas)), initializer=_iniciar_processo,
+                                 initargs=(folds,)) as pool:
+            saidas = list(pool.map(executar_tarefa, tarefas, [classes] * len(tarefas)))
+    resultados = dict(zip(tarefas, saidas))
+
+    linhas = np.arange(len(real))
+    pontos = []
+    for n, c, nu in itertools.product(grade['pca'], grade['c'], grade['nu']):
+        predita, probabilidades = resultados[('classificador', n, c)]
+        decisoes, violacoes = resultados[('detectores', nu)]
+        saida = {
+            'probabilidades': probabilidades,
+            'svm_decisao': decisoes[linhas, predita],
+            'mad_violacoes': violacoes[linhas, predita],
+        }
+        acuracia = round(float(np.mean(predita == real)), 4)
+        for minimo, limiar in itertools.product(grade['violacoes'], grade['confianca']):
+            status = aplicar_regras_anomalia(dict(saida), minimo, limiar)['status']
+            pontos.append({
+                'pca': n, 'c': c, 'nu': nu, 'violacoes': minimo, 'confianca': limiar,
+                'acuracia': acuracia,
+                'taxa_falsos_positivos': round(float(np.mean(status == 'ANORMAL')), 4),
+            })
+    return pontos
+
+
+def fronteira_pareto(pontos):
+    """
+    Pontos não dominados (maior acurácia, menor taxa de falsos
+    positivos), um por par de métricas: o primeiro da grade com elas.
+    Retorna (ponto, nº de configurações empatadas) por taxa crescente.
+    """
+    empates = {}
+    for ponto in pontos:
+        chave = (ponto['taxa_falsos_positivos'], -ponto['acuracia'])
+        if chave not in empates:
+            empates[chave] = [ponto, 0]
+        empates[chave][1] += 1
+
+    fronteira, melhor_acuracia = [], -1.0
+    for chave in sorted(empates):
+        ponto, n = empates[chave]
+        if ponto['acuracia'] > melhor_acuracia:
+            fronteira.append((ponto, n))
+            melhor_acuracia = ponto['acuracia']
+    return fronteira
+
+
+def imprimir(fronteira, producao):
+    print(f"{'FP %':>6} {'Acur. %':>8} {'PCA':>4} {'C':>6} {'nu':>5} {'MAD≥':>5} {'Conf.':>6} {'empates':>8}")
+    for ponto, n in fronteira:
+        print(f"{ponto['taxa_falsos_positivos'] * 100:>6.1f} {ponto['acuracia'] * 100:>8.1f} "
+              f"{ponto['pca']:>4} {ponto['c']:>6g} {ponto['nu']:>5g} {ponto['violacoes']:>5} "
+              f"{ponto['confianca']:>6g} {n:>8}")
+    if producao is not None:
+        print(f"🏭 Produção (PCA {producao['pca']}, C {producao['c']:g}, nu {producao['nu']:g}, "
+              f"MAD≥{producao['violacoes']}, conf. {producao['confianca']:g}): "
+              f"acurácia {producao['acuracia'] * 100:.1f}%, "
+              f"falsos positivos {producao['taxa_falsos_positivos'] * 100:.1f}%")
+
+
+# ==================== EXECUÇÃO ====================
+
+def _lista(tipo):
+    return lambda texto: [tipo(v) for v in texto.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Varredura de hiperparâmetros sob LOSO (fronteira de Pareto)')
+    parser.add_argument('tabela', nargs='?', default=TABELA_PADRAO)
+    parser.add_argument('--pca', type=_lista(int), default=GRADE_PADRAO['pca'], help='nº de componentes')
+    parser.add_argument('--c', type=_lista(float), default=GRADE_PADRAO['c'], help='C do SVC linear')
+    parser.add_argument('--nu', type=_lista(float), default=GRADE_PADRAO['nu'], help='nu do One-Class SVM')
+    parser.add_argument('--violacoes', type=_lista(int), default=GRADE_PADRAO['violacoes'],
+                        help='violações MAD mínimas')
+    parser.add_argument('--confianca', type=_lista(float), default=GRADE_PADRAO['confianca'],
+                        help='limiar de confiança (0-1)')
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--cache', default=CACHE_PADRAO, help="cache de scaler/PCA por fold ('' desativa)")
+    parser.add_argument('--saida', default=SAIDA_PADRAO)
+    args = parser.parse_args()
+
+    grade = {chave: getattr(args, chave) for chave in GRADE_PADRAO}
+    if max(grade['pca']) > 17 or min(grade['pca']) < 1:
+        parser.error("--pca: valores entre 1 e 17")
+
+    inicio = time.perf_counter()
+    dados = carregar_dataset(args.tabela)
+    n_pontos = int(np.prod([len(v) for v in grade.values()]))
+    print(f"🔎 {n_pontos} configurações x {len(set(dados[3]))} folds LOSO ({len(dados[0])} espectros), "
+          f"{args.processos} processo(s)")
+
+    pontos = varrer(dados, grade, args.processos, args.cache or None)
+    fronteira = fronteira_pareto(pontos)
+    producao = next((p for p in pontos if all(p[k] == v for k, v in PRODUCAO.items())), None)
+
+    print(f"📈 Fronteira de Pareto ({len(fronteira)} pontos):")
+    imprimir(fronteira, producao)
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump({
+            'tabela': os.path.basename(args.tabela),
+            'grade': grade,
+            'producao': producao,
+            'pareto': [dict(ponto, empates=n) for ponto, n in fronteira],
+            'pontos': pontos,
+        }, f, indent=1, ensure_ascii=False, sort_keys=True)
+        f.write('\n')
+    print(f"💾 {len(pontos)} pontos gravados em {args.saida}")
+    print(f"⏱️ Total: {time.perf_counter() - inicio:.1f} s")
+
+
+if __name__ == '__main__':
+    main()